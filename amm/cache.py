@@ -0,0 +1,35 @@
+# amm/cache.py
+"""
+Cache condivisa tra i processi server.
+
+Presenze e ambiti di autorizzazione sono tenuti in cache: con più
+processi (gunicorn, comandi periodici) sono coerenti solo se tutti
+leggono e scrivono la stessa cache. CACHES in amm/settings.py usa una
+cache condivisa fuori dall'ambiente locale; qui il controllo usato dal
+codice e il system check che avvisa quando in produzione resta una cache
+del singolo processo.
+"""
+from django.conf import settings
+from django.core.checks import Warning, register
+
+BACKEND_LOCALI = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+def cache_condivisa(alias='default'):
+    """True se la cache è visibile a tutti i processi (non LocMemCache né DummyCache)"""
+    return settings.CACHES[alias]['BACKEND'] not in BACKEND_LOCALI
+
+
+@register()
+def controlla_cache_condivisa(app_configs, **kwargs):
+    if settings.DEBUG or cache_condivisa():
+        return []
+    return [Warning(
+        'La cache predefinita è locale al processo.',
+        hint='Con più processi server presenze e ambiti di autorizzazione divergono: '
+             'configurare in CACHES una cache condivisa (database o Redis).',
+        id='amm.W001',
+    )]
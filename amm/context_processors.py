@@ -1,67 +1,86 @@
 # amm/context_processors.py
-from datetime import datetime
-import locale
+import logging
+
 from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
+
+logger = logging.getLogger(__name__)
+
+# Nomi italiani di giorni e mesi: evitano locale.setlocale, che è globale
+# al processo e non thread-safe
+GIORNI_SETTIMANA = (
+    'lunedì', 'martedì', 'mercoledì', 'giovedì', 'venerdì', 'sabato', 'domenica',
+)
+MESI = (
+    'gennaio', 'febbraio', 'marzo', 'aprile', 'maggio', 'giugno',
+    'luglio', 'agosto', 'settembre', 'ottobre', 'novembre', 'dicembre',
+)
+
+
+def giorno_italiano(value):
+    """Restituisce il nome italiano del giorno della settimana"""
+    return GIORNI_SETTIMANA[value.weekday()]
+
+
+def data_italiana(value):
+    """Formatta una data come '20 aprile 2025'"""
+    return f"{value.day:02d} {MESI[value.month - 1]} {value.year}"
+
 
 def datetime_info(request):
     """
-    Fornisce informazioni su data e ora correnti in formato italiano
+    Fornisce informazioni su data e ora correnti in formato italiano.
+    I valori sono calcolati solo se il template li usa.
     """
-    # Imposta locale italiano
-    try:
-        locale.setlocale(locale.LC_TIME, 'it_IT.UTF-8')
-    except:
-        try:
-            locale.setlocale(locale.LC_TIME, 'it_IT')
-        except:
-            pass
-    
-    now = datetime.now()
+    now = SimpleLazyObject(timezone.localtime)
     return {
-        'today_day': now.strftime('%A'),
-        'today_date': now.strftime('%d %B %Y'),
-        'current_time': now.strftime('%H:%M:%S'),
+        'today_day': SimpleLazyObject(lambda: giorno_italiano(now)),
+        'today_date': SimpleLazyObject(lambda: data_italiana(now)),
+        'current_time': SimpleLazyObject(lambda: now.strftime('%H:%M:%S')),
         # Aggiungiamo anche questi per compatibilità con il sistema
-        'ora_corrente': now.strftime("%H:%M"),
-        'data_corrente': now.strftime("%d/%m/%Y"),
-        'datetime_corrente': timezone.now(),
+        'ora_corrente': SimpleLazyObject(lambda: now.strftime("%H:%M")),
+        'data_corrente': SimpleLazyObject(lambda: now.strftime("%d/%m/%Y")),
+        'datetime_corrente': SimpleLazyObject(timezone.now),
     }
 
+
+def _messaggi_non_letti(request):
+    if not request.user.is_authenticated:
+        return 0
+    try:
+        from home.models import Messaggio
+        return Messaggio.conta_non_letti(request.user)
+    except Exception as e:
+        # Log l'errore ma non bloccare il rendering della pagina
+        logger.error(f"Errore nel caricamento messaggi: {e}")
+        return 0
+
+
+def _messaggi_recenti(request):
+    if not request.user.is_authenticated:
+        return []
+    try:
+        from home.models import Messaggio
+        return list(
+            Messaggio.objects.filter(destinatario=request.user)
+            .select_related('mittente')
+            .order_by('-data_invio')[:5]
+        )
+    except Exception as e:
+        logger.error(f"Errore nel caricamento messaggi: {e}")
+        return []
+
+
 def messages_processor(request):
     """
-    Fornisce i messaggi non letti per la navbar
+    Fornisce i messaggi non letti per la navbar.
+    Le query partono solo se il template usa le variabili; il conteggio
+    dei non letti è letto dalla cache per utente.
     """
-    context = {
-        'messaggi_non_letti': 0,
-        'messaggi_recenti': []
+    return {
+        'messaggi_non_letti': SimpleLazyObject(lambda: _messaggi_non_letti(request)),
+        'messaggi_recenti': SimpleLazyObject(lambda: _messaggi_recenti(request)),
     }
-    
-    if request.user.is_authenticated:
-        try:
-            from home.models import Messaggio
-            
-            # Messaggi non letti
-            messaggi_non_letti = Messaggio.objects.filter(
-                destinatario=request.user,
-                letto=False
-            ).count()
-            
-            # Messaggi recenti (ultimi 5)
-            messaggi_recenti = Messaggio.objects.filter(
-                destinatario=request.user
-            ).order_by('-data_invio')[:5]
-            
-            context.update({
-                'messaggi_non_letti': messaggi_non_letti,
-                'messaggi_recenti': messaggi_recenti,
-            })
-        except Exception as e:
-            # Log l'errore ma non bloccare il rendering della pagina
-            import logging
-            logger = logging.getLogger(__name__)
-            logger.error(f"Errore nel caricamento messaggi: {e}")
-    
-    return context
 
 # Funzione alternativa per compatibilità
 def datetime_context(request):
@@ -70,4 +89,4 @@ def datetime_context(request):
 
 def messaggi_context(request):
     """Alias per messages_processor"""
-    return messages_processor(request)
\ No newline at end of file
+    return messages_processor(request)
@@ -4,6 +4,7 @@ Django settings for amm project.
 
 from pathlib import Path
 import os
+import tempfile
 from django.contrib.messages import constants as messages
 from dotenv import load_dotenv
 
@@ -68,12 +69,17 @@ CRISPY_TEMPLATE_PACK = "bootstrap5"
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'home.metriche.MetricheMiddleware',
+    'home.profilatore.ProfilatoreMiddleware',
+    'home.query_ripetute.QueryRipetuteMiddleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'dipendenti.presenza.PresenzaMiddleware',
+    'dipendenti.autorizzazioni.AutorizzazioniMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'simple_history.middleware.HistoryRequestMiddleware',
@@ -126,6 +132,31 @@ else:
         }
     }
 
+# Cache: in locale quella del processo, altrimenti condivisa tra i processi
+# server (presenze e ambiti di autorizzazione, vedi amm/cache.py).
+# Con REDIS_URL si usa Redis (richiede il pacchetto redis), altrimenti una
+# tabella del database da creare con `python manage.py createcachetable`.
+if ENVIRONMENT == "local":
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+elif os.getenv("REDIS_URL"):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv("REDIS_URL"),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'cache_condivisa',
+        }
+    }
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -211,6 +242,24 @@ EMAIL_HOST_PASSWORD = os.getenv("EMAIL_HOST_PASSWORD")
 DEFAULT_FROM_EMAIL = os.getenv("DEFAULT_FROM_EMAIL", EMAIL_HOST_USER)
 SERVER_EMAIL = os.getenv("SERVER_EMAIL", EMAIL_HOST_USER)
 
+# Eventi anagrafica: consegna dopo il commit in un thread di background;
+# True per consegnarli nel thread della richiesta (debug)
+ANAGRAFICA_EVENTI_SINCRONI = os.getenv("ANAGRAFICA_EVENTI_SINCRONI", "False") == "True"
+
+# Metriche per vista su /metrics: file dei worker gunicorn e token dello scraper
+METRICHE_DIR = os.getenv("METRICHE_DIR", os.path.join(tempfile.gettempdir(), "amm-metriche"))
+METRICHE_TOKEN = os.getenv("METRICHE_TOKEN", "")
+
+# Profilazione a campione: frazione delle richieste profilate (0 = disattivata),
+# soglia in secondi oltre la quale il profilo è salvato, profili conservati
+PROFILATORE_CAMPIONAMENTO = float(os.getenv("PROFILATORE_CAMPIONAMENTO", "0"))
+PROFILATORE_SOGLIA = float(os.getenv("PROFILATORE_SOGLIA", "2"))
+PROFILATORE_DIR = os.getenv("PROFILATORE_DIR", os.path.join(tempfile.gettempdir(), "amm-profili"))
+PROFILATORE_MASSIMO = int(os.getenv("PROFILATORE_MASSIMO", "50"))
+
+# Warning nel log quando una richiesta ripete la stessa query almeno N volte (0 = disattivato)
+QUERY_RIPETUTE_SOGLIA = int(os.getenv("QUERY_RIPETUTE_SOGLIA", "5" if DEBUG else "0"))
+
 CORS_ALLOW_ALL_ORIGINS = False
 CORS_ALLOWED_ORIGINS = os.getenv("CORS_ALLOWED_ORIGINS", "http://localhost:8000,http://127.0.0.1:8000").split(",")
 
@@ -5,6 +5,7 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.shortcuts import redirect
 from django.contrib.auth.decorators import login_required
+from home.metriche import metriche
 
 # Vista per la root che reindirizza alla landing page
 def home_redirect(request):
@@ -21,6 +22,9 @@ urlpatterns = [
     # Root URL - reindirizza alla landing page o dashboard
     path('', home_redirect, name='home_redirect'),
     
+    # Metriche Prometheus (staff o token METRICHE_TOKEN)
+    path('metrics', metriche, name='metriche'),
+    
     # App URLs
     path('home/', include('home.urls')),  # App home (dashboard, chat, ecc.)
     path('dipendenti/', include('dipendenti.urls')),  # App dipendenti (login, gestione utenti)
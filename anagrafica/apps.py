@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class AnagraficaConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'anagrafica'
+
+    def ready(self):
+        """Importa i segnali quando l'app è pronta"""
+        import anagrafica.signals
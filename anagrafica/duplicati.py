@@ -0,0 +1,317 @@
+# anagrafica/duplicati.py
+"""
+Ricerca di clienti e fornitori duplicati.
+
+I record vengono normalizzati (nome senza forma giuridica, indirizzo con
+abbreviazioni espanse, P.IVA/CF/telefono ridotti alla forma canonica) e
+raggruppati per chiavi di blocco: P.IVA, CF, chiave fonetica del nome,
+CAP + iniziali del nome. Solo le coppie nello stesso blocco vengono
+confrontate, così il costo cresce con la dimensione dei blocchi e non
+con il quadrato dei record. I blocchi troppo grandi sono confrontati a
+finestra scorrevole sui nomi ordinati.
+
+Le coppie sopra soglia finiscono nella coda di revisione
+(PossibileDuplicato), ordinata per punteggio.
+"""
+import logging
+import re
+import unicodedata
+from collections import defaultdict
+from difflib import SequenceMatcher
+
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Cliente, Fornitore, PossibileDuplicato
+from .validators import normalizza_partita_iva, normalizza_codice_fiscale
+
+logger = logging.getLogger('anagrafica_operations')
+
+MODELLI = {
+    'cliente': Cliente,
+    'fornitore': Fornitore,
+}
+
+FORME_GIURIDICHE = {
+    'srl', 'srls', 'spa', 'snc', 'sas', 'sapa', 'scarl', 'scrl', 'ss', 'sc',
+    'coop', 'cooperativa', 'soc', 'societa', 'ditta', 'di', 'e', 'c', 'f', 'lli', 'flli',
+}
+ABBREVIAZIONI_INDIRIZZO = {
+    'v': 'via', 'vle': 'viale', 'pza': 'piazza', 'pzza': 'piazza', 'p': 'piazza',
+    'cso': 'corso', 'c': 'corso', 'str': 'strada', 'loc': 'localita', 'fraz': 'frazione',
+}
+
+# Sostituzioni fonetiche (ordine rilevante): grafie diverse dello stesso suono
+FONETICA = [
+    ('ch', 'k'), ('gh', 'g'), ('ph', 'f'), ('gl', 'l'), ('gn', 'n'),
+    ('c', 'k'), ('q', 'k'), ('x', 'ks'), ('y', 'i'), ('j', 'i'), ('w', 'v'), ('z', 's'), ('h', ''),
+]
+
+
+def normalizza_testo(valore):
+    """Minuscolo, senza accenti, punteggiatura e spazi superflui; 's.r.l.' diventa 'srl', 'v.le' 'vle'"""
+    valore = unicodedata.normalize('NFKD', valore or '')
+    valore = ''.join(c for c in valore if not unicodedata.combining(c)).lower()
+    valore = re.sub(r'(?<=\w)\.(?=\w)', '', valore)
+    return ' '.join(re.sub(r'[^a-z0-9]+', ' ', valore).split())
+
+
+def normalizza_nome(valore):
+    """Nome o ragione sociale senza forma giuridica"""
+    parole = [p for p in normalizza_testo(valore).split() if p not in FORME_GIURIDICHE]
+    return ' '.join(parole) or normalizza_testo(valore)
+
+
+def normalizza_indirizzo(valore):
+    return ' '.join(ABBREVIAZIONI_INDIRIZZO.get(p, p) for p in normalizza_testo(valore).split())
+
+
+def normalizza_telefono(valore):
+    cifre = re.sub(r'\D', '', valore or '')
+    return cifre[-9:] if len(cifre) >= 6 else ''
+
+
+def chiave_fonetica(nome_normalizzato, lunghezza=6):
+    """
+    Chiave fonetica semplificata per l'italiano: grafie equivalenti unificate,
+    doppie ridotte, vocali eliminate dopo la prima lettera.
+    """
+    testo = nome_normalizzato.replace(' ', '')
+    if not testo:
+        return ''
+    for grafia, suono in FONETICA:
+        testo = testo.replace(grafia, suono)
+    testo = re.sub(r'(.)\1+', r'\1', testo)
+    return (testo[0] + re.sub(r'[aeiou]', '', testo[1:]))[:lunghezza]
+
+
+def similarita(a, b):
+    """Similarità 0-1 tra due stringhe normalizzate, indipendente dall'ordine delle parole"""
+    if not a or not b:
+        return 0.0
+    if a == b:
+        return 1.0
+    diretta = SequenceMatcher(None, a, b).ratio()
+    ordinata = SequenceMatcher(None, ' '.join(sorted(a.split())), ' '.join(sorted(b.split()))).ratio()
+    return max(diretta, ordinata)
+
+
+class RicercaDuplicati:
+    """
+    Ricerca dei duplicati per un tipo di entità ('cliente' o 'fornitore').
+
+    Uso:
+        ricerca = RicercaDuplicati('cliente', soglia=0.85).esegui()
+        ricerca.confronti, ricerca.trovati
+    """
+
+    SOGLIA = 0.85
+    # Oltre questa dimensione un blocco è confrontato a finestra scorrevole
+    MAX_BLOCCO = 50
+    FINESTRA = 10
+
+    CAMPI = ('pk', 'nome', 'indirizzo', 'cap', 'partita_iva', 'codice_fiscale', 'email', 'telefono')
+
+    def __init__(self, tipo_entita, soglia=None):
+        if tipo_entita not in MODELLI:
+            raise ValueError(f"Tipo entità non gestito: {tipo_entita}")
+        self.tipo_entita = tipo_entita
+        self.model = MODELLI[tipo_entita]
+        self.soglia = soglia if soglia is not None else self.SOGLIA
+        self.confronti = 0
+        self.trovati = 0
+
+    def esegui(self, salva=True):
+        record = self._carica()
+        coppie = {}
+        for indici in self._blocchi(record):
+            for i, j in self._coppie_blocco(indici, record):
+                self.confronti += 1
+                a, b = record[i], record[j]
+                chiave = (a['pk'], b['pk']) if a['pk'] < b['pk'] else (b['pk'], a['pk'])
+                if chiave in coppie:
+                    continue
+                punteggio, motivo = self.punteggio(a, b)
+                if punteggio >= self.soglia:
+                    coppie[chiave] = (punteggio, motivo)
+
+        self.trovati = len(coppie)
+        self.coppie = coppie
+        if salva:
+            self._salva(coppie)
+        logger.info(
+            f"DUPLICATI {self.tipo_entita}: {len(record)} record, "
+            f"{self.confronti} confronti, {self.trovati} possibili duplicati"
+        )
+        return self
+
+    def _carica(self):
+        """Una sola query; i valori normalizzati sono calcolati una volta per record"""
+        record = []
+        for valori in self.model.objects.values_list(*self.CAMPI).iterator(chunk_size=5000):
+            dati = dict(zip(self.CAMPI, valori))
+            nome = normalizza_nome(dati['nome'])
+            record.append({
+                'pk': dati['pk'],
+                'nome': nome,
+                'indirizzo': normalizza_indirizzo(dati['indirizzo']),
+                'cap': (dati['cap'] or '').strip(),
+                'partita_iva': normalizza_partita_iva(dati['partita_iva']),
+                'codice_fiscale': normalizza_codice_fiscale(dati['codice_fiscale']),
+                'email': (dati['email'] or '').strip().lower(),
+                'telefono': normalizza_telefono(dati['telefono']),
+                'fonetica': chiave_fonetica(nome),
+            })
+        return record
+
+    def _blocchi(self, record):
+        blocchi = defaultdict(list)
+        for indice, r in enumerate(record):
+            if r['partita_iva']:
+                blocchi[('piva', r['partita_iva'])].append(indice)
+            if r['codice_fiscale']:
+                blocchi[('cf', r['codice_fiscale'])].append(indice)
+            if r['fonetica']:
+                blocchi[('fonetica', r['fonetica'])].append(indice)
+            if r['cap'] and r['nome']:
+                blocchi[('cap', r['cap'], r['nome'][:3])].append(indice)
+        return (indici for indici in blocchi.values() if len(indici) > 1)
+
+    def _coppie_blocco(self, indici, record):
+        if len(indici) <= self.MAX_BLOCCO:
+            for posizione, i in enumerate(indici):
+                for j in indici[posizione + 1:]:
+                    yield i, j
+            return
+        ordinati = sorted(indici, key=lambda indice: record[indice]['nome'])
+        for posizione, i in enumerate(ordinati):
+            for j in ordinati[posizione + 1:posizione + 1 + self.FINESTRA]:
+                yield i, j
+
+    def punteggio(self, a, b):
+        """
+        Punteggio 0-1 della coppia e motivi della somiglianza.
+        Le coppie senza identificativi in comune e con nomi che non possono
+        raggiungere la soglia sono scartate con un limite superiore economico
+        (quick_ratio), senza calcolare la similarità completa.
+        """
+        motivi = []
+        bonus = 0.0
+        minimo = 0.0
+        if a['partita_iva'] and a['partita_iva'] == b['partita_iva']:
+            minimo = 0.95
+            motivi.append('stessa P.IVA')
+        if a['codice_fiscale'] and a['codice_fiscale'] == b['codice_fiscale']:
+            minimo = 0.95
+            motivi.append('stesso CF')
+        if a['email'] and a['email'] == b['email']:
+            bonus += 0.1
+            motivi.append('stessa email')
+        if a['telefono'] and a['telefono'] == b['telefono']:
+            bonus += 0.1
+            motivi.append('stesso telefono')
+
+        con_indirizzo = bool(a['indirizzo'] and b['indirizzo'])
+        if not minimo:
+            # quick_ratio non dipende dall'ordine delle parole: vale per entrambe le varianti
+            limite = SequenceMatcher(None, a['nome'], b['nome']).quick_ratio()
+            if con_indirizzo:
+                limite = 0.75 * limite + 0.25
+            if limite + bonus < self.soglia:
+                return 0.0, ''
+
+        nome = similarita(a['nome'], b['nome'])
+        if con_indirizzo:
+            punteggio = 0.75 * nome + 0.25 * similarita(a['indirizzo'], b['indirizzo'])
+        else:
+            punteggio = nome
+        if nome >= 0.8:
+            motivi.insert(0, f'nome simile ({nome:.0%})')
+
+        punteggio = max(punteggio, minimo) + bonus
+        return round(min(punteggio, 1.0), 4), ', '.join(motivi)
+
+    def _salva(self, coppie):
+        """
+        Sostituisce le coppie ancora da verificare; quelle già scartate
+        restano e, grazie al vincolo unico, non vengono riproposte.
+        """
+        with transaction.atomic():
+            PossibileDuplicato.objects.filter(
+                tipo_entita=self.tipo_entita, stato='da_verificare'
+            ).delete()
+            PossibileDuplicato.objects.bulk_create([
+                PossibileDuplicato(
+                    tipo_entita=self.tipo_entita, id_a=id_a, id_b=id_b,
+                    punteggio=punteggio, motivo=motivo[:200],
+                )
+                for (id_a, id_b), (punteggio, motivo) in coppie.items()
+            ], batch_size=1000, ignore_conflicts=True)
+
+
+# Campi che l'unione non copia dal duplicato
+CAMPI_ESCLUSI_UNIONE = {'id', 'created_at', 'updated_at', 'attivo', 'note', 'hash_sincronizzazione'}
+
+
+def relazioni_non_gestite(model):
+    """
+    Relazioni di `model` che unisci() non sa spostare: uno-a-uno e
+    molti-a-molti (le righe del duplicato andrebbero perse) e uno-a-molti
+    verso modelli con storico (l'update in blocco non lo registra).
+    """
+    relazioni = [f.name for f in model._meta.many_to_many]
+    for relazione in model._meta.related_objects:
+        storico = hasattr(relazione.related_model, 'history')
+        if not relazione.one_to_many or storico:
+            relazioni.append(f'{relazione.related_model._meta.label}.{relazione.field.name}')
+    return relazioni
+
+
+def unisci(principale, duplicato):
+    """
+    Unisce `duplicato` in `principale`: i campi vuoti del principale sono
+    completati con quelli del duplicato (compreso il rappresentante), tutte
+    le righe collegate al duplicato (es. ordini del fornitore) vengono
+    spostate sul principale e il duplicato viene eliminato.
+
+    Le righe collegate sono spostate con un update in blocco, senza segnali
+    né storico: se il modello ha relazioni che così andrebbero perse o non
+    registrate (vedi relazioni_non_gestite) l'unione è rifiutata.
+    """
+    model = type(principale)
+    if type(duplicato) is not model or principale.pk == duplicato.pk:
+        raise ValueError('Si possono unire solo due record distinti dello stesso tipo')
+    non_gestite = relazioni_non_gestite(model)
+    if non_gestite:
+        raise ValueError(f"Unione non supportata per le relazioni: {', '.join(non_gestite)}")
+    tipo_entita = model._meta.model_name
+    duplicato_pk = duplicato.pk
+
+    with transaction.atomic():
+        for campo in model._meta.concrete_fields:
+            if campo.name in CAMPI_ESCLUSI_UNIONE:
+                continue
+            if getattr(principale, campo.attname) in (None, '') and getattr(duplicato, campo.attname) not in (None, ''):
+                setattr(principale, campo.attname, getattr(duplicato, campo.attname))
+        if duplicato.note:
+            principale.note = '\n'.join(filter(None, [principale.note, duplicato.note]))
+
+        for relazione in model._meta.related_objects:
+            relazione.related_model._base_manager.filter(
+                **{relazione.field.name: duplicato}
+            ).update(**{relazione.field.name: principale})
+
+        principale.save()
+
+        coppie = PossibileDuplicato.objects.filter(tipo_entita=tipo_entita)
+        coppie.filter(
+            id_a=min(principale.pk, duplicato_pk), id_b=max(principale.pk, duplicato_pk)
+        ).update(stato='unito')
+        coppie.filter(stato='da_verificare').filter(
+            Q(id_a=duplicato_pk) | Q(id_b=duplicato_pk)
+        ).delete()
+
+        duplicato.delete()
+
+    logger.info(f"MERGED {model.__name__}: {duplicato_pk} -> {principale.pk}")
+    return principale
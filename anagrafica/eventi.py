@@ -0,0 +1,174 @@
+# anagrafica/eventi.py
+"""
+Bus eventi di dominio in-process.
+
+I segnali dei modelli pubblicano eventi leggeri (nome + dati) invece di
+fare subito il lavoro costoso (mail, log, query di controllo). Gli eventi
+pubblicati durante una transazione vengono raccolti in un lotto e
+consegnati solo dopo il commit, tutti insieme, a un worker in background:
+se la transazione viene annullata il lotto viene scartato.
+
+I ricevitori si registrano per nome evento; quelli dichiarati a lotti
+(`lotti=True`) ricevono in una sola chiamata la lista di tutti gli eventi
+del lotto, così 1000 salvataggi nella stessa transazione producono una
+notifica e una scrittura di log, non mille.
+
+Uso:
+    @ricevitore('cliente_creato', lotti=True)
+    def notifica(eventi):
+        ...
+
+    pubblica('cliente_creato', pk=cliente.pk, nome=cliente.nome)
+
+Con ANAGRAFICA_EVENTI_SINCRONI = True (test, sviluppo) i lotti sono
+consegnati nel thread che ha fatto il commit. Nei test con
+captureOnCommitCallbacks gli eventi da verificare vanno pubblicati in un
+blocco atomic interno: quelli del setUp appartengono a un lotto già
+registrato fuori dalla cattura.
+"""
+import logging
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+logger = logging.getLogger('anagrafica_eventi')
+
+_ricevitori = defaultdict(list)
+_locale = threading.local()
+_worker = None
+_worker_lock = threading.Lock()
+
+
+class Evento:
+    """Evento di dominio: nome e dati serializzabili (niente istanze di modello)"""
+
+    __slots__ = ('nome', 'dati')
+
+    def __init__(self, nome, dati):
+        self.nome = nome
+        self.dati = dati
+
+    def __getitem__(self, chiave):
+        return self.dati[chiave]
+
+    def get(self, chiave, default=None):
+        return self.dati.get(chiave, default)
+
+    def __repr__(self):
+        return f'<Evento {self.nome} {self.dati}>'
+
+
+def ricevitore(nome, lotti=False):
+    """
+    Registra una funzione come ricevitore dell'evento `nome`.
+    Con lotti=True la funzione riceve la lista degli eventi del lotto,
+    altrimenti viene chiamata una volta per evento.
+    """
+    def decoratore(funzione):
+        _ricevitori[nome].append((funzione, lotti))
+        return funzione
+    return decoratore
+
+
+class _Lotto:
+    """Eventi pubblicati nello stesso blocco atomic, in attesa del commit"""
+
+    def __init__(self, connessione, chiave):
+        self.eventi = []
+        self.chiave = chiave
+        # Django sostituisce run_on_commit a ogni commit, rollback o rollback
+        # di savepoint: finché la lista è la stessa, il lotto è ancora valido.
+        self.coda = connessione.run_on_commit
+        transaction.on_commit(self.invia, using=connessione.alias)
+
+    def in_attesa(self, connessione):
+        return self.coda is connessione.run_on_commit
+
+    def invia(self):
+        # on_commit gira nel thread della transazione: il lotto esce dal registro locale
+        lotti = getattr(_locale, 'lotti', {})
+        if lotti.get(self.chiave) is self:
+            del lotti[self.chiave]
+        consegna(self.eventi)
+
+
+def pubblica(nome, /, using=None, **dati):
+    """
+    Pubblica un evento. Dentro una transazione viene accodato al lotto
+    corrente e consegnato dopo il commit; in autocommit parte subito.
+    """
+    evento = Evento(nome, dati)
+    connessione = connections[using or DEFAULT_DB_ALIAS]
+    if not connessione.in_atomic_block:
+        consegna([evento])
+        return
+
+    lotti = getattr(_locale, 'lotti', None)
+    if lotti is None:
+        lotti = _locale.lotti = {}
+    # Gli id dei savepoint crescono sempre: i lotti annullati dal rollback non
+    # verrebbero più ritrovati e resterebbero nel thread per sempre
+    for chiave, lotto in list(lotti.items()):
+        if not lotto.in_attesa(connections[chiave[0]]):
+            del lotti[chiave]
+    chiave = (connessione.alias, tuple(connessione.savepoint_ids))
+    lotto = lotti.get(chiave)
+    if lotto is None:
+        lotto = lotti[chiave] = _Lotto(connessione, chiave)
+    lotto.eventi.append(evento)
+
+
+def consegna(eventi):
+    """Passa un lotto di eventi ai ricevitori, nel worker o subito se sincrono"""
+    if not eventi:
+        return
+    if getattr(settings, 'ANAGRAFICA_EVENTI_SINCRONI', False):
+        _esegui(eventi)
+    else:
+        _get_worker().submit(_esegui_nel_worker, list(eventi))
+
+
+def _get_worker():
+    """
+    Un solo thread: i lotti vengono consegnati nell'ordine dei commit.
+    All'uscita dell'interprete l'executor completa i lotti già accodati.
+    """
+    global _worker
+    if _worker is None:
+        with _worker_lock:
+            if _worker is None:
+                _worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix='anagrafica-eventi')
+    return _worker
+
+
+def _esegui(eventi):
+    per_nome = defaultdict(list)
+    for evento in eventi:
+        per_nome[evento.nome].append(evento)
+
+    for nome, gruppo in per_nome.items():
+        for funzione, lotti in _ricevitori.get(nome, ()):
+            chiamate = [gruppo] if lotti else gruppo
+            for argomento in chiamate:
+                try:
+                    funzione(argomento)
+                except Exception:
+                    logger.exception(f"Errore nel ricevitore {funzione.__name__} per l'evento {nome}")
+
+
+def _esegui_nel_worker(eventi):
+    try:
+        _esegui(eventi)
+    finally:
+        # Le connessioni aperte dal worker non devono restare appese
+        connections.close_all()
+
+
+def attendi():
+    """Attende che il worker abbia consegnato i lotti già accodati"""
+    if _worker is not None:
+        _worker.submit(lambda: None).result()
+
@@ -6,7 +6,11 @@ from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Layout, Fieldset, Row, Column, Submit, Div, HTML
 from crispy_forms.bootstrap import TabHolder, Tab
 from .models import Rappresentante, Cliente, Fornitore
-import re
+from .validators import (
+    codice_fiscale_valido, iban_valido, normalizza_codice_fiscale, normalizza_iban, normalizza_partita_iva,
+    partita_iva_valida,
+)
+from dipendenti.autorizzazioni import per_utente
 
 
 class RappresentanteForm(forms.ModelForm):
@@ -45,16 +49,16 @@ class RappresentanteForm(forms.ModelForm):
     def clean_partita_iva(self):
         piva = self.cleaned_data.get('partita_iva', '')
         if piva:
-            piva = piva.replace(' ', '').upper()
-            if not self._validate_partita_iva(piva):
+            piva = normalizza_partita_iva(piva)
+            if not partita_iva_valida(piva):
                 raise ValidationError('Partita IVA non valida. Formato: IT + 11 cifre')
         return piva
     
     def clean_codice_fiscale(self):
         cf = self.cleaned_data.get('codice_fiscale', '')
         if cf:
-            cf = cf.replace(' ', '').upper()
-            if not self._validate_codice_fiscale(cf):
+            cf = normalizza_codice_fiscale(cf)
+            if not codice_fiscale_valido(cf):
                 raise ValidationError('Codice Fiscale non valido')
         return cf
     
@@ -64,33 +68,6 @@ class RappresentanteForm(forms.ModelForm):
             raise ValidationError('La percentuale deve essere tra 0 e 100')
         return perc
     
-    def _validate_partita_iva(self, piva):
-        """Validazione Partita IVA italiana"""
-        if not piva.startswith('IT'):
-            return False
-        numbers = piva[2:]
-        if len(numbers) != 11 or not numbers.isdigit():
-            return False
-        
-        # Calcolo checksum per P.IVA italiana
-        odd_chars = [int(numbers[i]) for i in range(0, 10, 2)]
-        even_chars = [int(numbers[i]) for i in range(1, 10, 2)]
-        
-        total = sum(odd_chars)
-        for char in even_chars:
-            doubled = char * 2
-            total += doubled // 10 + doubled % 10
-        
-        check_digit = (10 - (total % 10)) % 10
-        return check_digit == int(numbers[10])
-    
-    def _validate_codice_fiscale(self, cf):
-        """Validazione Codice Fiscale"""
-        # Pattern per persone fisiche (16 caratteri)
-        pattern_persona = r'^[A-Z]{6}\d{2}[A-Z]\d{2}[A-Z]\d{3}[A-Z]$'
-        # Pattern per aziende (11 cifre)
-        pattern_azienda = r'^\d{11}$'
-        return bool(re.match(pattern_persona, cf) or re.match(pattern_azienda, cf))
 
 
 class ClienteForm(forms.ModelForm):
@@ -115,9 +92,10 @@ class ClienteForm(forms.ModelForm):
         super().__init__(*args, **kwargs)
         
         # Se l'utente è un rappresentante, nascondi il campo rappresentante e impostalo automaticamente
-        if user and hasattr(user, 'rappresentante') and not user.is_staff:
+        autorizzazioni = per_utente(user) if user else None
+        if autorizzazioni and autorizzazioni.limitato_ai_propri_clienti:
             self.fields['rappresentante'].widget = forms.HiddenInput()
-            self.fields['rappresentante'].initial = user.rappresentante
+            self.fields['rappresentante'].initial = autorizzazioni.rappresentante_id
         
         # Migliora i widget e placeholder
         self.fields['nome'].widget.attrs.update({'class': 'form-control'})
@@ -181,16 +159,16 @@ class ClienteForm(forms.ModelForm):
     def clean_partita_iva(self):
         piva = self.cleaned_data.get('partita_iva', '')
         if piva:
-            piva = piva.replace(' ', '').upper()
-            if not self._validate_partita_iva(piva):
+            piva = normalizza_partita_iva(piva)
+            if not partita_iva_valida(piva):
                 raise ValidationError('Partita IVA non valida. Formato: IT + 11 cifre')
         return piva
     
     def clean_codice_fiscale(self):
         cf = self.cleaned_data.get('codice_fiscale', '')
         if cf:
-            cf = cf.replace(' ', '').upper()
-            if not self._validate_codice_fiscale(cf):
+            cf = normalizza_codice_fiscale(cf)
+            if not codice_fiscale_valido(cf):
                 raise ValidationError('Codice Fiscale non valido')
         return cf
     
@@ -200,31 +178,6 @@ class ClienteForm(forms.ModelForm):
             raise ValidationError('Il limite di credito non può essere negativo')
         return limite
     
-    def _validate_partita_iva(self, piva):
-        """Validazione Partita IVA italiana con checksum"""
-        if not piva.startswith('IT'):
-            return False
-        numbers = piva[2:]
-        if len(numbers) != 11 or not numbers.isdigit():
-            return False
-        
-        # Calcolo checksum
-        odd_chars = [int(numbers[i]) for i in range(0, 10, 2)]
-        even_chars = [int(numbers[i]) for i in range(1, 10, 2)]
-        
-        total = sum(odd_chars)
-        for char in even_chars:
-            doubled = char * 2
-            total += doubled // 10 + doubled % 10
-        
-        check_digit = (10 - (total % 10)) % 10
-        return check_digit == int(numbers[10])
-    
-    def _validate_codice_fiscale(self, cf):
-        """Validazione Codice Fiscale"""
-        pattern_persona = r'^[A-Z]{6}\d{2}[A-Z]\d{2}[A-Z]\d{3}[A-Z]$'
-        pattern_azienda = r'^\d{11}$'
-        return bool(re.match(pattern_persona, cf) or re.match(pattern_azienda, cf))
 
 
 class FornitoreForm(forms.ModelForm):
@@ -291,64 +244,27 @@ class FornitoreForm(forms.ModelForm):
     def clean_partita_iva(self):
         piva = self.cleaned_data.get('partita_iva', '')
         if piva:
-            piva = piva.replace(' ', '').upper()
-            if not self._validate_partita_iva(piva):
+            piva = normalizza_partita_iva(piva)
+            if not partita_iva_valida(piva):
                 raise ValidationError('Partita IVA non valida. Formato: IT + 11 cifre')
         return piva
     
     def clean_codice_fiscale(self):
         cf = self.cleaned_data.get('codice_fiscale', '')
         if cf:
-            cf = cf.replace(' ', '').upper()
-            if not self._validate_codice_fiscale(cf):
+            cf = normalizza_codice_fiscale(cf)
+            if not codice_fiscale_valido(cf):
                 raise ValidationError('Codice Fiscale non valido')
         return cf
     
     def clean_iban(self):
         iban = self.cleaned_data.get('iban', '')
         if iban:
-            iban = iban.replace(' ', '').upper()
-            if not self._validate_iban(iban):
+            iban = normalizza_iban(iban)
+            if not iban_valido(iban):
                 raise ValidationError('IBAN non valido. Formato: IT + 25 caratteri')
         return iban
     
-    def _validate_partita_iva(self, piva):
-        """Validazione Partita IVA italiana"""
-        if not piva.startswith('IT'):
-            return False
-        numbers = piva[2:]
-        if len(numbers) != 11 or not numbers.isdigit():
-            return False
-        
-        # Calcolo checksum
-        odd_chars = [int(numbers[i]) for i in range(0, 10, 2)]
-        even_chars = [int(numbers[i]) for i in range(1, 10, 2)]
-        
-        total = sum(odd_chars)
-        for char in even_chars:
-            doubled = char * 2
-            total += doubled // 10 + doubled % 10
-        
-        check_digit = (10 - (total % 10)) % 10
-        return check_digit == int(numbers[10])
-    
-    def _validate_codice_fiscale(self, cf):
-        """Validazione Codice Fiscale"""
-        pattern_persona = r'^[A-Z]{6}\d{2}[A-Z]\d{2}[A-Z]\d{3}[A-Z]$'
-        pattern_azienda = r'^\d{11}$'
-        return bool(re.match(pattern_persona, cf) or re.match(pattern_azienda, cf))
-    
-    def _validate_iban(self, iban):
-        """Validazione IBAN italiana semplificata"""
-        if not iban.startswith('IT'):
-            return False
-        if len(iban) != 27:  # IBAN italiano: IT + 25 caratteri
-            return False
-        # Verifica che dopo IT ci siano numeri e lettere nel formato corretto
-        code_part = iban[2:]
-        if not re.match(r'^\d{2}[A-Z]\d{5}\d{10}[A-Z0-9]{12}$', code_part):
-            return False
-        return True
 
 
 class AnagraficaSearchForm(forms.Form):
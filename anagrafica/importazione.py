@@ -0,0 +1,530 @@
+# anagrafica/importazione.py
+"""
+Importazione massiva dell'anagrafica da file CSV.
+
+Il file caricato viene decodificato a blocchi (mai letto per intero in
+memoria), le righe valide sono inserite con bulk_create a lotti dentro
+una transazione e le righe scartate finiscono in un report CSV
+scaricabile. Per ogni cliente inserito viene pubblicato lo stesso evento
+del salvataggio singolo: dopo il commit i ricevitori lo elaborano a lotti,
+con una sola mail di riepilogo per rappresentante.
+
+La sincronizzazione dei fornitori confronta invece l'hash di ogni riga
+con quello salvato all'ultima sincronizzazione e scrive solo le righe
+nuove o modificate.
+"""
+import codecs
+import csv
+import hashlib
+import io
+import logging
+import os
+import uuid
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.validators import validate_email
+from django.db import transaction
+from django.utils import timezone
+
+from dipendenti.autorizzazioni import invalida_rappresentanti
+
+from .eventi import pubblica
+from .models import Rappresentante, Cliente, Fornitore, IdentificativoFiscale
+from .signals import dati_evento
+from .validators import (
+    normalizza_partita_iva, normalizza_codice_fiscale, normalizza_iban,
+    partita_iva_valida, codice_fiscale_valido, iban_valido,
+)
+
+logger = logging.getLogger('anagrafica_operations')
+
+# Byte letti all'inizio del file per rilevare encoding e separatore
+DIMENSIONE_CAMPIONE = 64 * 1024
+CARTELLA_REPORT = 'anagrafica/import'
+
+
+class ErroreImportazione(Exception):
+    """Il file non è leggibile o non rispetta il tracciato"""
+
+
+def rileva_encoding(campione):
+    """UTF-8 (con o senza BOM) se il campione è decodificabile, altrimenti Windows-1252"""
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(campione, final=False)
+    except UnicodeDecodeError:
+        return 'cp1252'
+    return 'utf-8-sig'
+
+
+def _chiave(valore):
+    """Chiave di confronto: spazi compattati e senza distinzione maiuscole/minuscole"""
+    return ' '.join((valore or '').split()).casefold()
+
+
+def leggi_csv(file, alias=None):
+    """
+    Restituisce un generatore di (numero_riga, dati) sul file caricato.
+    Encoding e separatore (',' o ';') sono rilevati una sola volta su un
+    campione iniziale, poi il file è decodificato a blocchi.
+    Le intestazioni sono normalizzate e tradotte tramite `alias`.
+    """
+    alias = alias or {}
+    file.seek(0)
+    campione = file.read(DIMENSIONE_CAMPIONE)
+    if not campione:
+        raise ErroreImportazione('Il file è vuoto')
+
+    encoding = rileva_encoding(campione)
+    intestazione = campione.decode(encoding, errors='ignore').splitlines()[0]
+    separatore = ';' if intestazione.count(';') > intestazione.count(',') else ','
+    file.seek(0)
+    return _righe_csv(file, encoding, separatore, alias)
+
+
+def _righe_csv(file, encoding, separatore, alias):
+    testo = io.TextIOWrapper(file, encoding=encoding, newline='')
+    try:
+        reader = csv.DictReader(testo, delimiter=separatore)
+        if not reader.fieldnames:
+            raise ErroreImportazione('Intestazione del file mancante')
+        reader.fieldnames = [
+            alias.get(_chiave(nome).replace(' ', '_'), _chiave(nome).replace(' ', '_'))
+            for nome in reader.fieldnames
+        ]
+        for riga in reader:
+            yield reader.line_num, {k: (v or '').strip() for k, v in riga.items() if k}
+    except UnicodeDecodeError:
+        raise ErroreImportazione(
+            f'Codifica del file non valida ({encoding}): salvare il file in UTF-8'
+        )
+    finally:
+        # Il file caricato resta aperto: lo chiude Django a fine richiesta
+        testo.detach()
+
+
+def converti_decimale(valore):
+    """Importo in formato italiano ('1.234,56') o con il punto decimale ('1234.56')"""
+    if ',' in valore:
+        valore = valore.replace('.', '').replace(',', '.')
+    return Decimal(valore).quantize(Decimal('0.01'))
+
+
+class ReportErrori:
+    """
+    Raccoglie le righe scartate o importate con avvisi e le salva come CSV
+    nello storage. Il report riporta i dati originali accanto all'esito,
+    così può essere corretto e reimportato.
+    """
+
+    def __init__(self, prefisso, campi):
+        self.prefisso = prefisso
+        self.campi = campi
+        self.righe = 0
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer, delimiter=';')
+        self.writer.writerow(['riga', 'esito', 'messaggi'] + campi)
+
+    def aggiungi(self, numero, esito, messaggi, dati):
+        self.writer.writerow(
+            [numero, esito, ' | '.join(messaggi)] + [dati.get(campo, '') for campo in self.campi]
+        )
+        self.righe += 1
+
+    def salva(self):
+        """Salva il report e ne restituisce il nome file, None se non ci sono righe"""
+        if not self.righe:
+            return None
+        nome = f'{self.prefisso}_{timezone.now():%Y%m%d_%H%M%S}_{uuid.uuid4().hex[:8]}.csv'
+        percorso = default_storage.save(
+            f'{CARTELLA_REPORT}/{nome}',
+            ContentFile(self.buffer.getvalue().encode('utf-8-sig'))
+        )
+        return os.path.basename(percorso)
+
+
+def percorso_report(nome):
+    """Percorso nello storage di un report; None se il nome non è accettabile"""
+    if not nome or os.path.basename(nome) != nome or not nome.endswith('.csv'):
+        return None
+    return f'{CARTELLA_REPORT}/{nome}'
+
+
+class ImportazioneBase:
+    """
+    Parti comuni alle importazioni da CSV: tracciato, dimensione dei lotti
+    e controlli di formato che non richiedono query.
+    """
+
+    model = None
+    BATCH_SIZE = 1000
+    CAMPI = []
+    # Intestazioni dei vecchi tracciati e varianti comuni
+    ALIAS = {
+        'ragione_sociale': 'nome',
+        'città': 'citta',
+        'pagamento': 'tipo_pagamento',
+        'p.iva': 'partita_iva',
+        'piva': 'partita_iva',
+        'cf': 'codice_fiscale',
+    }
+
+    def __init__(self, batch_size=None):
+        self.batch_size = batch_size or self.BATCH_SIZE
+        self.scartati = 0
+        self.report = None
+        self._lunghezze = {
+            campo.name: campo.max_length
+            for campo in self.model._meta.get_fields()
+            if getattr(campo, 'max_length', None) and campo.name in self.CAMPI
+        }
+
+    @staticmethod
+    def _scelte(choices):
+        """Codici e etichette di una lista choices, riconosciuti senza distinzione di maiuscole"""
+        scelte = {}
+        for codice, etichetta in choices:
+            scelte[_chiave(codice)] = codice
+            scelte[_chiave(etichetta)] = codice
+        return scelte
+
+    def _valida_obbligatori(self, dati, campi, errori):
+        for campo in campi:
+            if not dati.get(campo):
+                errori.append(f'Campo {campo} obbligatorio')
+
+    def _valida_email(self, dati, campi, errori):
+        for campo in campi:
+            if dati.get(campo):
+                try:
+                    validate_email(dati[campo])
+                except ValidationError:
+                    errori.append(f'{campo} non valida')
+
+    def _valida_scelta(self, dati, campo, scelte, default, errori):
+        if not dati.get(campo):
+            return default
+        valore = scelte.get(_chiave(dati[campo]))
+        if not valore:
+            errori.append(f"{campo} '{dati[campo]}' non riconosciuto")
+        return valore
+
+    def _valida_lunghezze(self, valori, errori):
+        for campo, lunghezza in self._lunghezze.items():
+            if len(valori.get(campo) or '') > lunghezza:
+                errori.append(f'{campo} supera {lunghezza} caratteri')
+
+
+class ImportazioneClienti(ImportazioneBase):
+    """
+    Importazione massiva dei clienti da CSV.
+
+    Uso:
+        importazione = ImportazioneClienti(utente=request.user).esegui(file)
+        importazione.importati, importazione.scartati, importazione.report
+    """
+
+    model = Cliente
+
+    CAMPI = [
+        'nome', 'indirizzo', 'citta', 'cap', 'telefono', 'email',
+        'partita_iva', 'codice_fiscale', 'codice_univoco', 'pec',
+        'tipo_pagamento', 'limite_credito', 'zona', 'note', 'rappresentante',
+    ]
+    ALIAS = {**ImportazioneBase.ALIAS, 'sdi': 'codice_univoco'}
+
+    def __init__(self, utente=None, batch_size=None):
+        super().__init__(batch_size)
+        self.utente = utente
+        self.importati = 0
+        self.avvisi = 0
+        self._pagamenti = self._scelte(Cliente.TIPO_PAGAMENTO_CHOICES)
+        self._rappresentanti = set()
+
+    def esegui(self, file):
+        rappresentanti = self._carica_rappresentanti()
+        self._piva_presenti, self._cf_presenti = self._carica_identificativi()
+        report = ReportErrori('errori_clienti', self.CAMPI)
+
+        with transaction.atomic():
+            batch = []
+            for numero, dati in leggi_csv(file, self.ALIAS):
+                cliente, errori, avvisi = self._prepara(dati, rappresentanti)
+                if errori:
+                    self.scartati += 1
+                    report.aggiungi(numero, 'errore', errori, dati)
+                    continue
+                if avvisi:
+                    self.avvisi += 1
+                    report.aggiungi(numero, 'avviso', avvisi, dati)
+
+                batch.append(cliente)
+                if len(batch) >= self.batch_size:
+                    self._inserisci(batch)
+                    batch = []
+            self._inserisci(batch)
+            transaction.on_commit(self._notifica)
+            # bulk_create non invia post_save: l'ambito di autorizzazione dei
+            # rappresentanti con nuovi clienti va invalidato qui, dopo il commit
+            transaction.on_commit(lambda: invalida_rappresentanti(*self._rappresentanti))
+
+        self.report = report.salva()
+        return self
+
+    def _carica_rappresentanti(self):
+        """
+        Una sola query per tutti i rappresentanti attivi, indicizzati per
+        nome, nome e cognome, nome del dipendente e username.
+        I nomi che corrispondono a più rappresentanti restano ambigui (None).
+        """
+        mappa = {}
+        for rappresentante in Rappresentante.objects.filter(attivo=True).select_related('dipendente'):
+            dipendente = rappresentante.dipendente
+            chiavi = {
+                _chiave(rappresentante.nome),
+                _chiave(f'{rappresentante.nome} {rappresentante.cognome}'),
+                _chiave(f'{rappresentante.cognome} {rappresentante.nome}'),
+                _chiave(f'{dipendente.first_name} {dipendente.last_name}'),
+                _chiave(dipendente.username),
+            }
+            for chiave in chiavi - {''}:
+                if chiave in mappa and mappa[chiave] != rappresentante:
+                    mappa[chiave] = None
+                else:
+                    mappa[chiave] = rappresentante
+        return mappa
+
+    def _carica_identificativi(self):
+        """P.IVA e CF già presenti, per scartare i duplicati senza query per riga"""
+        piva, cf = set(), set()
+        for partita_iva, codice_fiscale in Cliente.objects.values_list('partita_iva', 'codice_fiscale'):
+            if partita_iva:
+                piva.add(normalizza_partita_iva(partita_iva))
+            if codice_fiscale:
+                cf.add(normalizza_codice_fiscale(codice_fiscale))
+        return piva, cf
+
+    def _prepara(self, dati, rappresentanti):
+        """Valida e normalizza una riga: restituisce (cliente, errori, avvisi)"""
+        errori, avvisi = [], []
+
+        self._valida_obbligatori(dati, ('nome', 'telefono', 'email'), errori)
+        self._valida_email(dati, ('email', 'pec'), errori)
+
+        piva = normalizza_partita_iva(dati.get('partita_iva'))
+        cf = normalizza_codice_fiscale(dati.get('codice_fiscale'))
+        if not piva and not cf:
+            errori.append('Specificare almeno Partita IVA o Codice Fiscale')
+        if piva:
+            if not partita_iva_valida(piva):
+                errori.append('Partita IVA non valida')
+            elif piva in self._piva_presenti:
+                errori.append('Partita IVA già presente')
+        if cf:
+            if not codice_fiscale_valido(cf):
+                errori.append('Codice Fiscale non valido')
+            elif cf in self._cf_presenti:
+                errori.append('Codice Fiscale già presente')
+
+        tipo_pagamento = self._valida_scelta(dati, 'tipo_pagamento', self._pagamenti, 'immediato', errori)
+
+        limite_credito = Decimal('0.00')
+        if dati.get('limite_credito'):
+            try:
+                limite_credito = converti_decimale(dati['limite_credito'])
+                if abs(limite_credito) >= 10 ** 8:
+                    raise InvalidOperation
+            except InvalidOperation:
+                errori.append('Limite credito non valido')
+
+        rappresentante = None
+        if dati.get('rappresentante'):
+            rappresentante = rappresentanti.get(_chiave(dati['rappresentante']))
+            if rappresentante is None:
+                stato = 'ambiguo' if _chiave(dati['rappresentante']) in rappresentanti else 'non trovato'
+                avvisi.append(f"Rappresentante '{dati['rappresentante']}' {stato}: cliente non assegnato")
+
+        valori = {campo: dati.get(campo, '') for campo in (
+            'nome', 'indirizzo', 'citta', 'cap', 'telefono', 'email',
+            'codice_univoco', 'pec', 'zona', 'note',
+        )}
+        valori.update(partita_iva=piva, codice_fiscale=cf)
+        self._valida_lunghezze(valori, errori)
+
+        if errori:
+            return None, errori, avvisi
+
+        if piva:
+            self._piva_presenti.add(piva)
+        if cf:
+            self._cf_presenti.add(cf)
+
+        cliente = Cliente(
+            rappresentante=rappresentante,
+            tipo_pagamento=tipo_pagamento,
+            limite_credito=limite_credito,
+            **valori
+        )
+        return cliente, errori, avvisi
+
+    def _inserisci(self, batch):
+        if not batch:
+            return
+        Cliente.objects.bulk_create(batch)
+        # bulk_create non invia post_save: il registro fiscale va allineato qui
+        IdentificativoFiscale.objects.registra_nuovi(batch)
+        self._rappresentanti.update(cliente.rappresentante_id for cliente in batch)
+        self.importati += len(batch)
+        # Stessi eventi del salvataggio singolo: i ricevitori a lotti ne fanno
+        # una mail per rappresentante e una sola scrittura di log
+        for cliente in batch:
+            pubblica('cliente_salvato', **dati_evento(cliente, True))
+
+    def _notifica(self):
+        logger.info(
+            f"IMPORTED Cliente: {self.importati} importati, {self.scartati} scartati "
+            f"({self.utente or 'sistema'})"
+        )
+
+
+class SincronizzazioneFornitori(ImportazioneBase):
+    """
+    Sincronizzazione dell'anagrafica fornitori con un file master.
+
+    Le righe sono abbinate ai fornitori esistenti tramite la partita IVA
+    normalizzata; per ogni riga si calcola un hash del contenuto e lo si
+    confronta con quello salvato in Fornitore.hash_sincronizzazione, così
+    solo le righe nuove o cambiate generano scritture (bulk_create e
+    bulk_update a lotti). Con dry_run=True si ottiene il conteggio senza
+    scrivere nulla.
+
+    Uso:
+        sync = SincronizzazioneFornitori(dry_run=True).esegui(file)
+        sync.inseriti, sync.aggiornati, sync.invariati, sync.scartati
+    """
+
+    model = Fornitore
+    CAMPI = [
+        'nome', 'indirizzo', 'citta', 'cap', 'telefono', 'email',
+        'partita_iva', 'codice_fiscale', 'iban', 'categoria', 'tipo_pagamento',
+        'referente_nome', 'referente_telefono', 'referente_email', 'note',
+    ]
+
+    def __init__(self, dry_run=False, batch_size=None):
+        super().__init__(batch_size)
+        self.dry_run = dry_run
+        self.inseriti = 0
+        self.aggiornati = 0
+        self.invariati = 0
+        self._categorie = self._scelte(Fornitore.CATEGORIA_CHOICES)
+        self._pagamenti = self._scelte(Fornitore.TIPO_PAGAMENTO_CHOICES)
+
+    @classmethod
+    def calcola_hash(cls, valori):
+        """Hash SHA-256 dei valori normalizzati, nell'ordine del tracciato"""
+        contenuto = '\x1f'.join(str(valori.get(campo, '')) for campo in cls.CAMPI)
+        return hashlib.sha256(contenuto.encode('utf-8')).hexdigest()
+
+    def esegui(self, file):
+        esistenti = self._carica_esistenti()
+        visti = set()
+        report = ReportErrori('errori_fornitori', self.CAMPI)
+
+        with transaction.atomic():
+            nuovi, modificati = [], []
+            for numero, dati in leggi_csv(file, self.ALIAS):
+                valori, errori = self._prepara(dati)
+                if not errori and valori['partita_iva'] in visti:
+                    errori.append('Partita IVA ripetuta nel file')
+                if errori:
+                    self.scartati += 1
+                    report.aggiungi(numero, 'errore', errori, dati)
+                    continue
+
+                visti.add(valori['partita_iva'])
+                impronta = self.calcola_hash(valori)
+                esistente = esistenti.get(valori['partita_iva'])
+                if esistente is None:
+                    nuovi.append(Fornitore(hash_sincronizzazione=impronta, **valori))
+                elif esistente[1] == impronta:
+                    self.invariati += 1
+                else:
+                    modificati.append(Fornitore(pk=esistente[0], hash_sincronizzazione=impronta, **valori))
+
+                if len(nuovi) >= self.batch_size:
+                    self._inserisci(nuovi)
+                    nuovi = []
+                if len(modificati) >= self.batch_size:
+                    self._aggiorna(modificati)
+                    modificati = []
+
+            self._inserisci(nuovi)
+            self._aggiorna(modificati)
+
+        self.report = report.salva()
+        logger.info(
+            f"SYNC Fornitore{' (dry-run)' if self.dry_run else ''}: "
+            f"{self.inseriti} inseriti, {self.aggiornati} aggiornati, "
+            f"{self.invariati} invariati, {self.scartati} scartati"
+        )
+        return self
+
+    def _carica_esistenti(self):
+        """
+        Una sola query per pk e hash di tutti i fornitori, indicizzati per
+        partita IVA normalizzata. In caso di doppioni vale il fornitore più vecchio.
+        """
+        esistenti = {}
+        righe = Fornitore.objects.order_by('pk').values_list('pk', 'partita_iva', 'hash_sincronizzazione')
+        for pk, partita_iva, impronta in righe.iterator(chunk_size=5000):
+            esistenti.setdefault(normalizza_partita_iva(partita_iva), (pk, impronta))
+        return esistenti
+
+    def _prepara(self, dati):
+        """Valida e normalizza una riga: restituisce (valori, errori)"""
+        errori = []
+        self._valida_obbligatori(dati, ('nome', 'telefono', 'email', 'partita_iva'), errori)
+        self._valida_email(dati, ('email', 'referente_email'), errori)
+
+        valori = {campo: dati.get(campo, '') for campo in self.CAMPI}
+        valori.update(
+            partita_iva=normalizza_partita_iva(dati.get('partita_iva')),
+            codice_fiscale=normalizza_codice_fiscale(dati.get('codice_fiscale')),
+            iban=normalizza_iban(dati.get('iban')),
+            categoria=self._valida_scelta(dati, 'categoria', self._categorie, 'altri', errori),
+            tipo_pagamento=self._valida_scelta(dati, 'tipo_pagamento', self._pagamenti, '30_giorni', errori),
+        )
+
+        if valori['partita_iva'] and not partita_iva_valida(valori['partita_iva']):
+            errori.append('Partita IVA non valida')
+        if valori['codice_fiscale'] and not codice_fiscale_valido(valori['codice_fiscale']):
+            errori.append('Codice Fiscale non valido')
+        if valori['iban'] and not iban_valido(valori['iban']):
+            errori.append('IBAN non valido')
+        self._valida_lunghezze(valori, errori)
+
+        return valori, errori
+
+    def _inserisci(self, fornitori):
+        if not fornitori:
+            return
+        if not self.dry_run:
+            Fornitore.objects.bulk_create(fornitori)
+            IdentificativoFiscale.objects.registra_nuovi(fornitori)
+        self.inseriti += len(fornitori)
+
+    def _aggiorna(self, fornitori):
+        if not fornitori:
+            return
+        if not self.dry_run:
+            # bulk_update non gestisce auto_now: updated_at va impostato a mano
+            adesso = timezone.now()
+            for fornitore in fornitori:
+                fornitore.updated_at = adesso
+            Fornitore.objects.bulk_update(
+                fornitori, self.CAMPI + ['hash_sincronizzazione', 'updated_at']
+            )
+            IdentificativoFiscale.objects.sincronizza(fornitori)
+        self.aggiornati += len(fornitori)
@@ -0,0 +1,39 @@
+# anagrafica/management/commands/report_pdf_anagrafica.py
+import shutil
+
+from django.core.management.base import BaseCommand, CommandError
+
+from anagrafica.report_pdf import REPORT, genera_in_storage, genera_su_file_temporaneo, percorso_report
+
+
+class Command(BaseCommand):
+    help = 'Genera il report PDF di rappresentanti, clienti o fornitori'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'tipo',
+            choices=list(REPORT),
+            help='Anagrafica del report'
+        )
+        parser.add_argument(
+            '--output',
+            help='File PDF da scrivere (default: nome standard del report)'
+        )
+        parser.add_argument(
+            '--elaborazione',
+            help='Nome del report in background: il file va nello storage e lo stato nel database'
+        )
+
+    def handle(self, *args, **options):
+        tipo = options['tipo']
+        if options['elaborazione']:
+            if percorso_report(options['elaborazione']) is None:
+                raise CommandError(f'Nome di report non valido: {options["elaborazione"]}')
+            genera_in_storage(tipo, options['elaborazione'])
+            self.stdout.write(self.style.SUCCESS(f'✅ Report {options["elaborazione"]} generato'))
+            return
+
+        output = options['output'] or REPORT[tipo].nome_file
+        with genera_su_file_temporaneo(tipo) as sorgente, open(output, 'wb') as destinazione:
+            shutil.copyfileobj(sorgente, destinazione)
+        self.stdout.write(self.style.SUCCESS(f'✅ Report salvato in {output}'))
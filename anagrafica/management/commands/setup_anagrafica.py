@@ -1,8 +1,7 @@
 # anagrafica/management/commands/setup_anagrafica.py
 from django.core.management.base import BaseCommand
-from django.contrib.auth.models import Group, Permission
-from django.contrib.contenttypes.models import ContentType
 from anagrafica.models import Rappresentante, Cliente, Fornitore
+from dipendenti.ruoli import RUOLI_ANAGRAFICA, SincronizzazioneRuoli
 
 
 class Command(BaseCommand):
@@ -28,50 +27,16 @@ class Command(BaseCommand):
         self.stdout.write(self.style.SUCCESS('Configurazione completata!'))
     
     def create_permission_groups(self):
-        """Crea i gruppi di permessi per l'anagrafica"""
+        """Aggiunge ai gruppi dell'anagrafica i permessi mancanti della specifica in dipendenti/ruoli.py"""
         self.stdout.write('Creazione gruppi di permessi...')
-        
-        # Gruppo Gestori Anagrafica
-        gestori_group, created = Group.objects.get_or_create(name='Gestori Anagrafica')
-        if created:
-            # Permessi per rappresentanti
-            content_type_repr = ContentType.objects.get_for_model(Rappresentante)
-            repr_permissions = Permission.objects.filter(content_type=content_type_repr)
-            gestori_group.permissions.add(*repr_permissions)
-            
-            # Permessi per clienti
-            content_type_cliente = ContentType.objects.get_for_model(Cliente)
-            cliente_permissions = Permission.objects.filter(content_type=content_type_cliente)
-            gestori_group.permissions.add(*cliente_permissions)
-            
-            # Permessi per fornitori
-            content_type_fornitore = ContentType.objects.get_for_model(Fornitore)
-            fornitore_permissions = Permission.objects.filter(content_type=content_type_fornitore)
-            gestori_group.permissions.add(*fornitore_permissions)
-            
-            self.stdout.write(f'✓ Gruppo "{gestori_group.name}" creato')
-        else:
-            self.stdout.write(f'✓ Gruppo "{gestori_group.name}" già esistente')
-        
-        # Gruppo Rappresentanti
-        rappresentanti_group, created = Group.objects.get_or_create(name='Rappresentanti')
-        if created:
-            # Solo permessi di visualizzazione e modifica per i propri clienti
-            content_type_cliente = ContentType.objects.get_for_model(Cliente)
-            client_perms = ['view_cliente', 'add_cliente', 'change_cliente']
-            for perm_name in client_perms:
-                try:
-                    permission = Permission.objects.get(
-                        codename=perm_name,
-                        content_type=content_type_cliente
-                    )
-                    rappresentanti_group.permissions.add(permission)
-                except Permission.DoesNotExist:
-                    pass
-            
-            self.stdout.write(f'✓ Gruppo "{rappresentanti_group.name}" creato')
-        else:
-            self.stdout.write(f'✓ Gruppo "{rappresentanti_group.name}" già esistente')
+
+        sync = SincronizzazioneRuoli(gruppi=RUOLI_ANAGRAFICA, rimuovi=False).esegui()
+        for group_name in RUOLI_ANAGRAFICA:
+            if group_name in sync.gruppi_creati:
+                self.stdout.write(f'✓ Gruppo "{group_name}" creato')
+            else:
+                self.stdout.write(f'✓ Gruppo "{group_name}" già esistente')
+        self.stdout.write(f'Permessi aggiunti: {sync.aggiunti}')
     
     def create_sample_data(self):
         """Crea dati di esempio per test"""
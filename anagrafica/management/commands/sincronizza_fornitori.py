@@ -0,0 +1,46 @@
+# anagrafica/management/commands/sincronizza_fornitori.py
+from django.core.management.base import BaseCommand, CommandError
+
+from anagrafica.importazione import SincronizzazioneFornitori, ErroreImportazione
+
+
+class Command(BaseCommand):
+    help = 'Sincronizza i fornitori con un file master CSV, scrivendo solo le righe nuove o modificate'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', type=str, help='Path al file CSV dei fornitori')
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Mostra cosa verrebbe inserito/aggiornato senza salvare'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=SincronizzazioneFornitori.BATCH_SIZE,
+            help='Righe per ogni bulk_create/bulk_update'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['file'], 'rb') as file:
+                sincronizzazione = SincronizzazioneFornitori(
+                    dry_run=options['dry_run'],
+                    batch_size=options['batch_size'],
+                ).esegui(file)
+        except FileNotFoundError:
+            raise CommandError(f"File non trovato: {options['file']}")
+        except ErroreImportazione as e:
+            raise CommandError(str(e))
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING('DRY RUN - Nessuna modifica salvata'))
+
+        self.stdout.write(f'Inseriti: {sincronizzazione.inseriti}')
+        self.stdout.write(f'Aggiornati: {sincronizzazione.aggiornati}')
+        self.stdout.write(f'Invariati: {sincronizzazione.invariati}')
+        if sincronizzazione.scartati:
+            self.stdout.write(self.style.ERROR(
+                f'Scartati: {sincronizzazione.scartati} (report: {sincronizzazione.report})'
+            ))
+        self.stdout.write(self.style.SUCCESS('Sincronizzazione completata'))
@@ -0,0 +1,49 @@
+# anagrafica/management/commands/trova_duplicati.py
+import time
+
+from django.core.management.base import BaseCommand
+
+from anagrafica.duplicati import RicercaDuplicati, MODELLI
+
+
+class Command(BaseCommand):
+    help = 'Cerca clienti e fornitori duplicati e aggiorna la coda di revisione'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tipo',
+            choices=list(MODELLI),
+            help='Tipo di anagrafica da analizzare (default: tutti)'
+        )
+        parser.add_argument(
+            '--soglia',
+            type=float,
+            default=RicercaDuplicati.SOGLIA,
+            help='Punteggio minimo (0-1) per proporre una coppia'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Mostra le coppie trovate senza aggiornare la coda'
+        )
+
+    def handle(self, *args, **options):
+        tipi = [options['tipo']] if options['tipo'] else list(MODELLI)
+
+        for tipo in tipi:
+            inizio = time.monotonic()
+            ricerca = RicercaDuplicati(tipo, soglia=options['soglia']).esegui(
+                salva=not options['dry_run']
+            )
+            self.stdout.write(
+                f'{tipo}: {ricerca.confronti} confronti, {ricerca.trovati} possibili duplicati '
+                f'({time.monotonic() - inizio:.1f}s)'
+            )
+            if options['dry_run']:
+                migliori = sorted(ricerca.coppie.items(), key=lambda c: -c[1][0])[:20]
+                for (id_a, id_b), (punteggio, motivo) in migliori:
+                    self.stdout.write(f'  {id_a} / {id_b}: {punteggio:.2f} {motivo}')
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING('DRY RUN - Coda di revisione non modificata'))
+        self.stdout.write(self.style.SUCCESS('Ricerca duplicati completata'))
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.21 on 2026-10-19 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('anagrafica', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fornitore',
+            name='hash_sincronizzazione',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 4.2.21 on 2026-10-19 11:40
+
+from django.db import migrations, models
+
+from anagrafica.validators import normalizza_partita_iva, normalizza_codice_fiscale
+
+
+def popola_registro(apps, schema_editor):
+    """Registra gli identificativi fiscali già presenti in anagrafica"""
+    IdentificativoFiscale = apps.get_model('anagrafica', 'IdentificativoFiscale')
+    normalizzatori = {
+        'partita_iva': normalizza_partita_iva,
+        'codice_fiscale': normalizza_codice_fiscale,
+    }
+
+    righe = []
+    for tipo_entita in ('rappresentante', 'cliente', 'fornitore'):
+        modello = apps.get_model('anagrafica', tipo_entita)
+        for pk, partita_iva, codice_fiscale in modello.objects.values_list(
+            'pk', 'partita_iva', 'codice_fiscale'
+        ).iterator():
+            valori = {'partita_iva': partita_iva, 'codice_fiscale': codice_fiscale}
+            for tipo, normalizza in normalizzatori.items():
+                valore = normalizza(valori[tipo])
+                if valore:
+                    righe.append(IdentificativoFiscale(
+                        tipo=tipo, valore=valore, tipo_entita=tipo_entita, id_entita=pk
+                    ))
+
+    IdentificativoFiscale.objects.bulk_create(righe, batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('anagrafica', '0003_fornitore_hash_sincronizzazione'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdentificativoFiscale',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('partita_iva', 'Partita IVA'), ('codice_fiscale', 'Codice Fiscale')], max_length=20)),
+                ('valore', models.CharField(max_length=20)),
+                ('tipo_entita', models.CharField(choices=[('rappresentante', 'Rappresentante'), ('cliente', 'Cliente'), ('fornitore', 'Fornitore')], max_length=20)),
+                ('id_entita', models.PositiveBigIntegerField()),
+            ],
+            options={
+                'verbose_name': 'Identificativo Fiscale',
+                'verbose_name_plural': 'Identificativi Fiscali',
+                'indexes': [models.Index(fields=['tipo_entita', 'id_entita'], name='anagrafica_ident_entita_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='identificativofiscale',
+            constraint=models.UniqueConstraint(fields=('tipo', 'valore', 'tipo_entita', 'id_entita'), name='anagrafica_identificativo_unico'),
+        ),
+        migrations.RunPython(popola_registro, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.21 on 2026-10-19 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('anagrafica', '0004_identificativofiscale'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PossibileDuplicato',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo_entita', models.CharField(choices=[('cliente', 'Cliente'), ('fornitore', 'Fornitore')], max_length=20)),
+                ('id_a', models.PositiveBigIntegerField()),
+                ('id_b', models.PositiveBigIntegerField()),
+                ('punteggio', models.FloatField(help_text='Somiglianza 0-1')),
+                ('motivo', models.CharField(blank=True, max_length=200)),
+                ('stato', models.CharField(choices=[('da_verificare', 'Da verificare'), ('unito', 'Unito'), ('scartato', 'Non è un duplicato')], default='da_verificare', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Possibile Duplicato',
+                'verbose_name_plural': 'Possibili Duplicati',
+                'ordering': ['-punteggio'],
+                'indexes': [models.Index(fields=['tipo_entita', 'stato', '-punteggio'], name='anagrafica_dup_coda_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='possibileduplicato',
+            constraint=models.UniqueConstraint(fields=('tipo_entita', 'id_a', 'id_b'), name='anagrafica_duplicato_unico'),
+        ),
+    ]
@@ -1,12 +1,17 @@
 # anagrafica/models.py
 
-from django.db import models
+from django.db import models, transaction
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.contrib.auth.models import Group
 from django.contrib.auth import get_user_model
 from django.utils.translation import gettext_lazy as _
 from django.urls import reverse
-import re
+
+from .validators import (
+    codice_fiscale_valido, iban_valido, normalizza_codice_fiscale, normalizza_iban, normalizza_partita_iva,
+    partita_iva_valida,
+)
 
 User = get_user_model()
 
@@ -66,48 +71,20 @@ class Rappresentante(models.Model):
         """Validazioni personalizzate"""
         # Validazione P.IVA
         if self.partita_iva:
-            self.partita_iva = self.partita_iva.replace(' ', '').upper()
-            if not self._validate_partita_iva(self.partita_iva):
+            self.partita_iva = normalizza_partita_iva(self.partita_iva)
+            if not partita_iva_valida(self.partita_iva):
                 raise ValidationError({
                     'partita_iva': 'Partita IVA non valida'
                 })
         
         # Validazione CF
         if self.codice_fiscale:
-            self.codice_fiscale = self.codice_fiscale.replace(' ', '').upper()
-            if not self._validate_codice_fiscale(self.codice_fiscale):
+            self.codice_fiscale = normalizza_codice_fiscale(self.codice_fiscale)
+            if not codice_fiscale_valido(self.codice_fiscale):
                 raise ValidationError({
                     'codice_fiscale': 'Codice Fiscale non valido'
                 })
     
-    def _validate_partita_iva(self, piva):
-        """Validazione Partita IVA italiana"""
-        if not piva.startswith('IT'):
-            return False
-        numbers = piva[2:]
-        if len(numbers) != 11 or not numbers.isdigit():
-            return False
-        
-        # Calcolo checksum
-        odd_chars = [int(numbers[i]) for i in range(0, 10, 2)]
-        even_chars = [int(numbers[i]) for i in range(1, 10, 2)]
-        
-        total = sum(odd_chars)
-        for char in even_chars:
-            doubled = char * 2
-            total += doubled // 10 + doubled % 10
-        
-        check_digit = (10 - (total % 10)) % 10
-        return check_digit == int(numbers[10])
-    
-    def _validate_codice_fiscale(self, cf):
-        """Validazione Codice Fiscale"""
-        # Pattern per persone fisiche (16 caratteri)
-        pattern_persona = r'^[A-Z]{6}\d{2}[A-Z]\d{2}[A-Z]\d{3}[A-Z]$'
-        # Pattern per aziende (11 cifre)
-        pattern_azienda = r'^\d{11}$'
-        
-        return bool(re.match(pattern_persona, cf) or re.match(pattern_azienda, cf))
 
 
 class Cliente(models.Model):
@@ -191,45 +168,20 @@ class Cliente(models.Model):
         
         # Validazione P.IVA
         if self.partita_iva:
-            self.partita_iva = self.partita_iva.replace(' ', '').upper()
-            if not self._validate_partita_iva(self.partita_iva):
+            self.partita_iva = normalizza_partita_iva(self.partita_iva)
+            if not partita_iva_valida(self.partita_iva):
                 raise ValidationError({
                     'partita_iva': 'Partita IVA non valida'
                 })
         
         # Validazione CF
         if self.codice_fiscale:
-            self.codice_fiscale = self.codice_fiscale.replace(' ', '').upper()
-            if not self._validate_codice_fiscale(self.codice_fiscale):
+            self.codice_fiscale = normalizza_codice_fiscale(self.codice_fiscale)
+            if not codice_fiscale_valido(self.codice_fiscale):
                 raise ValidationError({
                     'codice_fiscale': 'Codice Fiscale non valido'
                 })
     
-    def _validate_partita_iva(self, piva):
-        """Validazione Partita IVA italiana"""
-        if not piva.startswith('IT'):
-            return False
-        numbers = piva[2:]
-        if len(numbers) != 11 or not numbers.isdigit():
-            return False
-        
-        # Calcolo checksum
-        odd_chars = [int(numbers[i]) for i in range(0, 10, 2)]
-        even_chars = [int(numbers[i]) for i in range(1, 10, 2)]
-        
-        total = sum(odd_chars)
-        for char in even_chars:
-            doubled = char * 2
-            total += doubled // 10 + doubled % 10
-        
-        check_digit = (10 - (total % 10)) % 10
-        return check_digit == int(numbers[10])
-    
-    def _validate_codice_fiscale(self, cf):
-        """Validazione Codice Fiscale"""
-        pattern_persona = r'^[A-Z]{6}\d{2}[A-Z]\d{2}[A-Z]\d{3}[A-Z]$'
-        pattern_azienda = r'^\d{11}$'
-        return bool(re.match(pattern_persona, cf) or re.match(pattern_azienda, cf))
 
 
 class Fornitore(models.Model):
@@ -289,6 +241,9 @@ class Fornitore(models.Model):
     attivo = models.BooleanField(default=True)
     note = models.TextField(blank=True)
     
+    # Hash della riga dell'ultima sincronizzazione da file (vedi importazione.py)
+    hash_sincronizzazione = models.CharField(max_length=64, blank=True, default='', editable=False)
+    
     # Timestamp
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -308,58 +263,242 @@ class Fornitore(models.Model):
         """Validazioni personalizzate"""
         # Validazione P.IVA
         if self.partita_iva:
-            self.partita_iva = self.partita_iva.replace(' ', '').upper()
-            if not self._validate_partita_iva(self.partita_iva):
+            self.partita_iva = normalizza_partita_iva(self.partita_iva)
+            if not partita_iva_valida(self.partita_iva):
                 raise ValidationError({
                     'partita_iva': 'Partita IVA non valida'
                 })
         
         # Validazione CF
         if self.codice_fiscale:
-            self.codice_fiscale = self.codice_fiscale.replace(' ', '').upper()
-            if not self._validate_codice_fiscale(self.codice_fiscale):
+            self.codice_fiscale = normalizza_codice_fiscale(self.codice_fiscale)
+            if not codice_fiscale_valido(self.codice_fiscale):
                 raise ValidationError({
                     'codice_fiscale': 'Codice Fiscale non valido'
                 })
         
         # Validazione IBAN
         if self.iban:
-            self.iban = self.iban.replace(' ', '').upper()
-            if not self._validate_iban(self.iban):
+            self.iban = normalizza_iban(self.iban)
+            if not iban_valido(self.iban):
                 raise ValidationError({
                     'iban': 'IBAN non valido'
                 })
     
-    def _validate_partita_iva(self, piva):
-        """Validazione Partita IVA italiana"""
-        if not piva.startswith('IT'):
-            return False
-        numbers = piva[2:]
-        if len(numbers) != 11 or not numbers.isdigit():
-            return False
-        
-        # Calcolo checksum
-        odd_chars = [int(numbers[i]) for i in range(0, 10, 2)]
-        even_chars = [int(numbers[i]) for i in range(1, 10, 2)]
-        
-        total = sum(odd_chars)
-        for char in even_chars:
-            doubled = char * 2
-            total += doubled // 10 + doubled % 10
-        
-        check_digit = (10 - (total % 10)) % 10
-        return check_digit == int(numbers[10])
-    
-    def _validate_codice_fiscale(self, cf):
-        """Validazione Codice Fiscale"""
-        pattern_persona = r'^[A-Z]{6}\d{2}[A-Z]\d{2}[A-Z]\d{3}[A-Z]$'
-        pattern_azienda = r'^\d{11}$'
-        return bool(re.match(pattern_persona, cf) or re.match(pattern_azienda, cf))
-    
-    def _validate_iban(self, iban):
-        """Validazione IBAN italiana base"""
-        if not iban.startswith('IT'):
-            return False
-        if len(iban) != 27:  # IBAN italiano: IT + 25 caratteri
-            return False
-        return True
\ No newline at end of file
+
+
+class IdentificativoFiscaleManager(models.Manager):
+    """Sincronizzazione del registro e ricerche con cache a breve scadenza"""
+
+    CACHE_KEY = 'anagrafica:identificativo:{}:{}'
+    CACHE_TIMEOUT = 60
+    # Valori per query IN, sotto il limite di parametri di SQLite
+    DIMENSIONE_BLOCCO = 500
+
+    NORMALIZZATORI = {
+        'partita_iva': normalizza_partita_iva,
+        'codice_fiscale': normalizza_codice_fiscale,
+    }
+
+    def _chiave_cache(self, tipo, valore):
+        return self.CACHE_KEY.format(tipo, valore)
+
+    def identificativi(self, istanza):
+        """Coppie (tipo, valore normalizzato) non vuote di un rappresentante, cliente o fornitore"""
+        coppie = set()
+        for tipo, normalizza in self.NORMALIZZATORI.items():
+            valore = normalizza(getattr(istanza, tipo, ''))
+            if valore:
+                coppie.add((tipo, valore))
+        return coppie
+
+    def sincronizza(self, istanze):
+        """
+        Allinea il registro ai dati di una lista di istanze dello stesso modello.
+        Se gli identificativi non sono cambiati basta la query di lettura.
+        """
+        istanze = [istanza for istanza in istanze if istanza.pk is not None]
+        if not istanze:
+            return
+        tipo_entita = istanze[0]._meta.model_name
+        ids = [istanza.pk for istanza in istanze]
+
+        attuali = {}
+        for tipo, valore, id_entita in self.filter(
+            tipo_entita=tipo_entita, id_entita__in=ids
+        ).values_list('tipo', 'valore', 'id_entita'):
+            attuali.setdefault(id_entita, set()).add((tipo, valore))
+
+        da_rimuovere, nuovi, modificati = [], [], set()
+        for istanza in istanze:
+            vecchi = attuali.get(istanza.pk, set())
+            correnti = self.identificativi(istanza)
+            if vecchi == correnti:
+                continue
+            da_rimuovere.append(istanza.pk)
+            modificati |= vecchi | correnti
+            nuovi.extend(
+                self.model(tipo=tipo, valore=valore, tipo_entita=tipo_entita, id_entita=istanza.pk)
+                for tipo, valore in correnti
+            )
+
+        if not da_rimuovere:
+            return
+        with transaction.atomic():
+            self.filter(tipo_entita=tipo_entita, id_entita__in=da_rimuovere).delete()
+            self.bulk_create(nuovi, ignore_conflicts=True)
+        cache.delete_many([self._chiave_cache(tipo, valore) for tipo, valore in modificati])
+
+    def registra_nuovi(self, istanze):
+        """Registra gli identificativi di istanze appena create (es. da bulk_create), con un solo INSERT"""
+        nuovi = [
+            self.model(tipo=tipo, valore=valore, tipo_entita=istanza._meta.model_name, id_entita=istanza.pk)
+            for istanza in istanze if istanza.pk is not None
+            for tipo, valore in self.identificativi(istanza)
+        ]
+        self.bulk_create(nuovi, ignore_conflicts=True)
+        cache.delete_many([self._chiave_cache(riga.tipo, riga.valore) for riga in nuovi])
+
+    def rimuovi(self, tipo_entita, ids):
+        """Elimina dal registro gli identificativi delle entità cancellate"""
+        righe = self.filter(tipo_entita=tipo_entita, id_entita__in=ids)
+        chiavi = [self._chiave_cache(tipo, valore) for tipo, valore in righe.values_list('tipo', 'valore')]
+        righe.delete()
+        cache.delete_many(chiavi)
+
+    def cerca_molti(self, tipo, valori):
+        """
+        Restituisce {valore: [(tipo_entita, id_entita), ...]} per valori già
+        normalizzati. I valori in cache non vanno al database, gli altri sono
+        cercati a blocchi sull'indice (tipo, valore).
+        """
+        valori = set(valori)
+        chiavi = {self._chiave_cache(tipo, valore): valore for valore in valori}
+        trovati = {
+            chiavi[chiave]: [tuple(entita) for entita in risultato]
+            for chiave, risultato in cache.get_many(list(chiavi)).items()
+        }
+
+        mancanti = [valore for valore in valori if valore not in trovati]
+        for inizio in range(0, len(mancanti), self.DIMENSIONE_BLOCCO):
+            blocco = {valore: [] for valore in mancanti[inizio:inizio + self.DIMENSIONE_BLOCCO]}
+            for valore, tipo_entita, id_entita in self.filter(
+                tipo=tipo, valore__in=list(blocco)
+            ).values_list('valore', 'tipo_entita', 'id_entita'):
+                blocco[valore].append((tipo_entita, id_entita))
+            cache.set_many(
+                {self._chiave_cache(tipo, valore): entita for valore, entita in blocco.items()},
+                self.CACHE_TIMEOUT
+            )
+            trovati.update(blocco)
+        return trovati
+
+    def cerca(self, tipo, valore):
+        return self.cerca_molti(tipo, [valore])[valore]
+
+
+class IdentificativoFiscale(models.Model):
+    """
+    Registro normalizzato di P.IVA e codici fiscali di rappresentanti,
+    clienti e fornitori, mantenuto dai segnali. Permette di verificare i
+    duplicati con una sola ricerca indicizzata.
+    """
+
+    TIPO_CHOICES = [
+        ('partita_iva', 'Partita IVA'),
+        ('codice_fiscale', 'Codice Fiscale'),
+    ]
+
+    TIPO_ENTITA_CHOICES = [
+        ('rappresentante', 'Rappresentante'),
+        ('cliente', 'Cliente'),
+        ('fornitore', 'Fornitore'),
+    ]
+
+    tipo = models.CharField(max_length=20, choices=TIPO_CHOICES)
+    valore = models.CharField(max_length=20)
+    tipo_entita = models.CharField(max_length=20, choices=TIPO_ENTITA_CHOICES)
+    id_entita = models.PositiveBigIntegerField()
+
+    objects = IdentificativoFiscaleManager()
+
+    class Meta:
+        verbose_name = "Identificativo Fiscale"
+        verbose_name_plural = "Identificativi Fiscali"
+        constraints = [
+            # L'indice unico serve anche le ricerche per (tipo, valore)
+            models.UniqueConstraint(
+                fields=['tipo', 'valore', 'tipo_entita', 'id_entita'],
+                name='anagrafica_identificativo_unico'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['tipo_entita', 'id_entita'], name='anagrafica_ident_entita_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} {self.valore} ({self.tipo_entita} #{self.id_entita})"
+
+
+class PossibileDuplicato(models.Model):
+    """
+    Coda di revisione dei possibili duplicati tra clienti o tra fornitori,
+    alimentata dal comando trova_duplicati (id_a < id_b).
+    """
+
+    TIPO_ENTITA_CHOICES = [
+        ('cliente', 'Cliente'),
+        ('fornitore', 'Fornitore'),
+    ]
+
+    STATO_CHOICES = [
+        ('da_verificare', 'Da verificare'),
+        ('unito', 'Unito'),
+        ('scartato', 'Non è un duplicato'),
+    ]
+
+    tipo_entita = models.CharField(max_length=20, choices=TIPO_ENTITA_CHOICES)
+    id_a = models.PositiveBigIntegerField()
+    id_b = models.PositiveBigIntegerField()
+    punteggio = models.FloatField(help_text="Somiglianza 0-1")
+    motivo = models.CharField(max_length=200, blank=True)
+    stato = models.CharField(max_length=20, choices=STATO_CHOICES, default='da_verificare')
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Possibile Duplicato"
+        verbose_name_plural = "Possibili Duplicati"
+        ordering = ['-punteggio']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['tipo_entita', 'id_a', 'id_b'],
+                name='anagrafica_duplicato_unico'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['tipo_entita', 'stato', '-punteggio'], name='anagrafica_dup_coda_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_tipo_entita_display()} {self.id_a} / {self.id_b} ({self.punteggio:.0%})"
+
+    @classmethod
+    def con_record(cls, coppie):
+        """
+        Associa a ogni coppia i due record (attributi record_a, record_b)
+        con una query per tipo di entità.
+        """
+        modelli = {'cliente': Cliente, 'fornitore': Fornitore}
+        ids = {}
+        for coppia in coppie:
+            ids.setdefault(coppia.tipo_entita, set()).update((coppia.id_a, coppia.id_b))
+        record = {
+            tipo: modelli[tipo].objects.in_bulk(list(valori))
+            for tipo, valori in ids.items()
+        }
+        for coppia in coppie:
+            coppia.record_a = record[coppia.tipo_entita].get(coppia.id_a)
+            coppia.record_b = record[coppia.tipo_entita].get(coppia.id_b)
+        return coppie
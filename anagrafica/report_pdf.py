@@ -0,0 +1,305 @@
+# anagrafica/report_pdf.py
+"""
+Report PDF dell'anagrafica generati in streaming.
+
+Le righe arrivano dal database con iterator() e vengono impaginate a
+blocchi di una pagina: ogni blocco è una LongTable con l'intestazione
+ripetuta, larghezze di colonna e altezze di riga fissate in anticipo
+(reportlab non deve misurare le celle) e lo stesso TableStyle condiviso.
+I blocchi sono prodotti man mano che reportlab li consuma, quindi in
+memoria c'è una sola pagina di righe alla volta e il tempo cresce in modo
+lineare con il numero di righe, senza lo split ripetuto di un'unica
+tabella enorme.
+
+In background il report è generato dal comando report_pdf_anagrafica in
+un processo separato e lo stato è un'Elaborazione nel database (vedi
+home.elaborazioni), condivisa da tutti i processi server.
+
+Uso:
+    ReportClienti().genera(file)            # file binario aperto in scrittura
+    nome = avvia_in_background('clienti')   # poi stato_report(nome)
+"""
+import logging
+import re
+import tempfile
+import uuid
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db.models import Count
+from django.utils import timezone
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.platypus import SimpleDocTemplate, LongTable, TableStyle, Paragraph, Spacer
+
+from home import elaborazioni
+
+from .models import Rappresentante, Cliente, Fornitore
+
+logger = logging.getLogger('anagrafica_operations')
+
+CARTELLA_REPORT = 'anagrafica/report'
+
+
+class _FlowableInStreaming(list):
+    """
+    Lista di flowable che si ricarica dal generatore quando si svuota.
+    SimpleDocTemplate.build() consuma la lista dalla testa (len, [0], del [0])
+    e rimette in testa le parti divise: basta rifornirla in __len__.
+    """
+
+    def __init__(self, sorgente):
+        super().__init__()
+        self._sorgente = sorgente
+
+    def __len__(self):
+        if not super().__len__() and self._sorgente is not None:
+            prossimo = next(self._sorgente, None)
+            if prossimo is None:
+                self._sorgente = None
+            else:
+                self.append(prossimo)
+        return super().__len__()
+
+
+class ReportPDFBase:
+    """
+    Report tabellare a blocchi di pagina.
+
+    Le sottoclassi definiscono titolo, COLONNE (intestazione, frazione della
+    larghezza utile) e righe(), un generatore di liste di stringhe.
+    """
+
+    titolo = ''
+    nome_file = 'report.pdf'
+    COLONNE = []
+
+    DIMENSIONE_FONT = 8
+    DIMENSIONE_FONT_INTESTAZIONE = 9
+    ALTEZZA_RIGA = 13
+    ALTEZZA_INTESTAZIONE = 18
+    CHUNK_QUERY = 2000
+
+    STILE_TABELLA = TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), DIMENSIONE_FONT_INTESTAZIONE),
+        ('FONTSIZE', (0, 1), (-1, -1), DIMENSIONE_FONT),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ('TOPPADDING', (0, 0), (-1, -1), 1),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 2),
+        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.beige]),
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
+    ])
+
+    def __init__(self, pagesize=A4):
+        self.pagesize = pagesize
+        self.righe_scritte = 0
+        self._avanzamento = None
+
+    def queryset(self):
+        raise NotImplementedError
+
+    def righe(self):
+        raise NotImplementedError
+
+    def genera(self, file, avanzamento=None):
+        """
+        Scrive il PDF su `file` (path o file binario) e restituisce il numero
+        di righe; `avanzamento(righe)` è chiamata dopo ogni pagina di righe
+        """
+        self._avanzamento = avanzamento
+        doc = SimpleDocTemplate(
+            file, pagesize=self.pagesize, title=self.titolo,
+            leftMargin=30, rightMargin=30, topMargin=30, bottomMargin=40,
+        )
+        larghezze = [doc.width * frazione for _, frazione in self.COLONNE]
+        # Caratteri che stanno in ogni colonna: il testo più lungo viene troncato
+        # invece di essere misurato e mandato a capo
+        self._max_caratteri = [
+            max(int((larghezza - 8) / (self.DIMENSIONE_FONT * 0.55)), 3) for larghezza in larghezze
+        ]
+        righe_per_pagina = max(int((doc.height - self.ALTEZZA_INTESTAZIONE) / self.ALTEZZA_RIGA) - 1, 1)
+
+        doc.build(
+            _FlowableInStreaming(self._flowable(larghezze, righe_per_pagina)),
+            onFirstPage=self._piede_pagina,
+            onLaterPages=self._piede_pagina,
+        )
+        return self.righe_scritte
+
+    def _flowable(self, larghezze, righe_per_pagina):
+        styles = getSampleStyleSheet()
+        title_style = ParagraphStyle(
+            'TitleStyle',
+            parent=styles['Heading1'],
+            alignment=1,  # Centrato
+            spaceAfter=12,
+        )
+        yield Paragraph(self.titolo, title_style)
+        yield Paragraph(f"Generato il {timezone.localtime():%d/%m/%Y %H:%M}", styles['Normal'])
+        yield Spacer(1, 12)
+
+        intestazione = [intestazione for intestazione, _ in self.COLONNE]
+        blocco = []
+        for riga in self.righe():
+            blocco.append([self._tronca(valore, i) for i, valore in enumerate(riga)])
+            if len(blocco) == righe_per_pagina:
+                yield self._tabella(intestazione, blocco, larghezze)
+                blocco = []
+        if blocco or not self.righe_scritte:
+            yield self._tabella(intestazione, blocco, larghezze)
+
+    def _tabella(self, intestazione, blocco, larghezze):
+        self.righe_scritte += len(blocco)
+        if self._avanzamento:
+            self._avanzamento(self.righe_scritte)
+        return LongTable(
+            [intestazione] + blocco,
+            colWidths=larghezze,
+            rowHeights=[self.ALTEZZA_INTESTAZIONE] + [self.ALTEZZA_RIGA] * len(blocco),
+            repeatRows=1,
+            style=self.STILE_TABELLA,
+        )
+
+    def _tronca(self, valore, colonna):
+        testo = ' '.join(str(valore if valore is not None else '').split()) or '-'
+        massimo = self._max_caratteri[colonna]
+        return testo if len(testo) <= massimo else testo[:massimo - 1] + '…'
+
+    def _piede_pagina(self, canvas, doc):
+        canvas.saveState()
+        canvas.setFont('Helvetica', 8)
+        canvas.drawRightString(doc.pagesize[0] - doc.rightMargin, 20, f"{self.titolo} - Pagina {doc.page}")
+        canvas.restoreState()
+
+
+class ReportRappresentanti(ReportPDFBase):
+    titolo = 'Report Rappresentanti'
+    nome_file = 'rappresentanti_report.pdf'
+    COLONNE = [
+        ('Nome', 0.22), ('Città', 0.14), ('Email', 0.25),
+        ('Telefono', 0.13), ('Zona', 0.16), ('Clienti', 0.10),
+    ]
+
+    def queryset(self):
+        return Rappresentante.objects.filter(attivo=True).annotate(
+            clienti_count=Count('clienti')
+        ).order_by('cognome', 'nome')
+
+    def righe(self):
+        for nome, cognome, citta, email, telefono, zona, clienti in self.queryset().values_list(
+            'nome', 'cognome', 'citta', 'email', 'telefono', 'zona_competenza', 'clienti_count'
+        ).iterator(chunk_size=self.CHUNK_QUERY):
+            yield [f'{nome} {cognome}', citta, email, telefono, zona, clienti]
+
+
+class ReportClienti(ReportPDFBase):
+    titolo = 'Report Clienti'
+    nome_file = 'clienti_report.pdf'
+    COLONNE = [
+        ('Ragione Sociale', 0.28), ('Città', 0.15), ('Email', 0.25),
+        ('Rappresentante', 0.18), ('Pagamento', 0.14),
+    ]
+
+    def queryset(self):
+        return Cliente.objects.filter(attivo=True).order_by('nome')
+
+    def righe(self):
+        pagamenti = dict(Cliente.TIPO_PAGAMENTO_CHOICES)
+        for nome, citta, email, rappresentante_nome, rappresentante_cognome, pagamento in self.queryset().values_list(
+            'nome', 'citta', 'email', 'rappresentante__nome', 'rappresentante__cognome', 'tipo_pagamento'
+        ).iterator(chunk_size=self.CHUNK_QUERY):
+            rappresentante = f"{rappresentante_nome or ''} {rappresentante_cognome or ''}".strip()
+            yield [nome, citta, email, rappresentante, pagamenti.get(pagamento, pagamento)]
+
+
+class ReportFornitori(ReportPDFBase):
+    titolo = 'Report Fornitori'
+    nome_file = 'fornitori_report.pdf'
+    COLONNE = [
+        ('Ragione Sociale', 0.30), ('Città', 0.15), ('Email', 0.25),
+        ('Categoria', 0.15), ('Pagamento', 0.15),
+    ]
+
+    def queryset(self):
+        return Fornitore.objects.filter(attivo=True).order_by('nome')
+
+    def righe(self):
+        categorie = dict(Fornitore._meta.get_field('categoria').flatchoices)
+        pagamenti = dict(Fornitore._meta.get_field('tipo_pagamento').flatchoices)
+        for nome, citta, email, categoria, pagamento in self.queryset().values_list(
+            'nome', 'citta', 'email', 'categoria', 'tipo_pagamento'
+        ).iterator(chunk_size=self.CHUNK_QUERY):
+            yield [nome, citta, email, categorie.get(categoria, categoria), pagamenti.get(pagamento, pagamento)]
+
+
+REPORT = {
+    'rappresentanti': ReportRappresentanti,
+    'clienti': ReportClienti,
+    'fornitori': ReportFornitori,
+}
+
+
+def genera_su_file_temporaneo(tipo):
+    """Genera il report in un file temporaneo riavvolto, pronto per FileResponse"""
+    file = tempfile.TemporaryFile(suffix='.pdf')
+    try:
+        REPORT[tipo]().genera(file)
+    except Exception:
+        file.close()
+        raise
+    file.seek(0)
+    return file
+
+
+# ========== GENERAZIONE IN BACKGROUND ==========
+
+def percorso_report(nome):
+    """Path nello storage di un report generato in background, se il nome è valido"""
+    if not re.fullmatch(r'(rappresentanti|clienti|fornitori)_[0-9a-f]{32}\.pdf', nome):
+        return None
+    return f'{CARTELLA_REPORT}/{nome}'
+
+
+def genera_in_storage(tipo, nome):
+    """
+    Genera il report e lo salva nello storage con il nome indicato,
+    aggiornando l'avanzamento a ogni pagina. L'elaborazione passa a
+    'pronto' solo a salvataggio concluso: il download controlla lo stato,
+    non la presenza del file.
+    """
+    try:
+        report = REPORT[tipo]()
+        totale = report.queryset().count()
+        with tempfile.TemporaryFile(suffix='.pdf') as file:
+            report.genera(file, lambda righe: elaborazioni.avanzamento(nome, righe, totale))
+            file.seek(0)
+            default_storage.save(percorso_report(nome), File(file, name=nome))
+    except Exception:
+        logger.exception(f"Errore generazione report {tipo} ({nome})")
+        elaborazioni.fallita(nome)
+        raise
+    elaborazioni.completa(nome, completati=report.righe_scritte, totale=report.righe_scritte)
+
+
+def avvia_in_background(tipo):
+    """
+    Registra l'elaborazione, avvia il comando report_pdf_anagrafica in un
+    processo separato e restituisce il nome del file da scaricare
+    """
+    if tipo not in REPORT:
+        raise ValueError(f"Report non gestito: {tipo}")
+    nome = f'{tipo}_{uuid.uuid4().hex}.pdf'
+    elaborazioni.avvia(nome, percorso_report(nome), 'report_pdf_anagrafica', tipo, '--elaborazione', nome)
+    return nome
+
+
+def stato_report(nome):
+    """'pronto', 'in_corso', 'errore' o None se il report non esiste"""
+    if percorso_report(nome) is None:
+        return None
+    stato = elaborazioni.stato(nome)
+    return stato and stato['stato']
@@ -1,4 +1,6 @@
-from django.db.models.signals import post_save, pre_delete
+import logging
+
+from django.db.models.signals import post_save, post_delete, pre_delete
 from django.dispatch import receiver
 from django.core.mail import send_mail
 from django.contrib.auth import get_user_model
@@ -6,85 +8,152 @@ from django.conf import settings
 from django.utils.translation import gettext_lazy as _
 from django.contrib import messages
 from django.contrib.auth.signals import user_logged_in
-from .models import Rappresentante, Cliente, Fornitore
+from .eventi import pubblica, ricevitore
+from .models import Rappresentante, Cliente, Fornitore, IdentificativoFiscale
 
 
 User = get_user_model()
+logger = logging.getLogger('anagrafica_operations')
+
+
+# Campi copiati negli eventi di salvataggio: i ricevitori girano dopo il
+# commit, in un altro thread, e non devono dipendere dall'istanza
+CAMPI_EVENTO = {
+    Rappresentante: ('nome', 'cognome', 'email', 'telefono', 'zona_competenza', 'dipendente_id'),
+    Cliente: ('nome', 'citta', 'email', 'telefono', 'zona', 'rappresentante_id'),
+    Fornitore: ('nome',),
+}
+
+# Nomi massimi elencati in una mail di riepilogo
+MAX_NOMI_RIEPILOGO = 20
+
+
+def dati_evento(instance, created):
+    dati = {campo: getattr(instance, campo) for campo in CAMPI_EVENTO[type(instance)]}
+    dati.update(pk=instance.pk, creato=created)
+    return dati
 
 
 @receiver(post_save, sender=Rappresentante)
-def handle_rappresentante_created(sender, instance, created, **kwargs):
+@receiver(post_save, sender=Cliente)
+@receiver(post_save, sender=Fornitore)
+def pubblica_salvataggio(sender, instance, created, raw=False, **kwargs):
     """
-    Gestisce la creazione di un nuovo rappresentante
+    Pubblica l'evento '<modello>_salvato': notifiche, log e controlli
+    sulle zone sono fatti dai ricevitori sotto, a lotti, dopo il commit
     """
-    if created:
-        # Notifica agli amministratori la creazione di un nuovo rappresentante
-        admin_users = User.objects.filter(is_staff=True, email__isnull=False)
-        admin_emails = [user.email for user in admin_users if user.email]
-        
-        if admin_emails and hasattr(settings, 'EMAIL_HOST_USER'):
-            subject = f'Nuovo Rappresentante Creato: {instance.nome}'
-            message = f"""
+    if raw:
+        return
+    pubblica(f'{sender._meta.model_name}_salvato', **dati_evento(instance, created))
+
+
+def _elenco_nomi(nomi):
+    elenco = '\n'.join(f'- {nome}' for nome in nomi[:MAX_NOMI_RIEPILOGO])
+    if len(nomi) > MAX_NOMI_RIEPILOGO:
+        elenco += f'\n... e altri {len(nomi) - MAX_NOMI_RIEPILOGO}'
+    return elenco
+
+
+@ricevitore('rappresentante_salvato', lotti=True)
+def handle_rappresentante_created(eventi):
+    """
+    Notifica agli amministratori i nuovi rappresentanti: una sola mail
+    per lotto, qualunque sia il numero di rappresentanti creati
+    """
+    nuovi = [evento for evento in eventi if evento['creato']]
+    if not nuovi or not getattr(settings, 'EMAIL_HOST_USER', None):
+        return
+
+    admin_emails = list(
+        User.objects.filter(is_staff=True).exclude(email='').values_list('email', flat=True)
+    )
+    if not admin_emails:
+        return
+
+    utenti = User.objects.in_bulk([evento['dipendente_id'] for evento in nuovi])
+    if len(nuovi) == 1:
+        evento = nuovi[0]
+        utente = utenti.get(evento['dipendente_id'])
+        subject = f"Nuovo Rappresentante Creato: {evento['nome']}"
+        message = f"""
             Un nuovo rappresentante è stato creato nel sistema:
             
-            Nome: {instance.nome}
-            Ragione Sociale: {instance.ragione_sociale}
-            Email: {instance.email}
-            Telefono: {instance.telefono}
-            Zona: {instance.zona or 'Non specificata'}
+            Nome: {evento['nome']} {evento['cognome']}
+            Email: {evento['email']}
+            Telefono: {evento['telefono']}
+            Zona: {evento['zona_competenza'] or 'Non specificata'}
             
-            Utente associato: {instance.user.get_full_name() if instance.user else 'Nessuno'}
+            Utente associato: {utente and (utente.get_full_name() or utente.username)}
             
             Per visualizzare i dettagli, accedere al sistema di gestione.
             """
-            
-            try:
-                send_mail(
-                    subject,
-                    message,
-                    settings.EMAIL_HOST_USER,
-                    admin_emails,
-                    fail_silently=True,
-                )
-            except Exception as e:
-                print(f"Errore invio email: {e}")
+    else:
+        nomi = [f"{evento['nome']} {evento['cognome']}".strip() for evento in nuovi]
+        subject = f'Nuovi Rappresentanti Creati: {len(nuovi)}'
+        message = (
+            f'Sono stati creati {len(nuovi)} nuovi rappresentanti:\n\n{_elenco_nomi(nomi)}\n\n'
+            'Per visualizzare i dettagli, accedere al sistema di gestione.'
+        )
 
+    try:
+        send_mail(subject, message, settings.EMAIL_HOST_USER, admin_emails, fail_silently=True)
+    except Exception as e:
+        logger.error(f"Errore invio email nuovi rappresentanti: {e}")
 
-@receiver(post_save, sender=Cliente)
-def handle_cliente_created(sender, instance, created, **kwargs):
+
+@ricevitore('cliente_salvato', lotti=True)
+def handle_cliente_created(eventi):
     """
-    Gestisce la creazione/modifica di un cliente
+    Notifica ai rappresentanti i nuovi clienti assegnati: una mail per
+    rappresentante con tutti i clienti del lotto
     """
-    if created and instance.rappresentante:
-        # Notifica al rappresentante la creazione di un nuovo cliente
-        if (instance.rappresentante.user and 
-            instance.rappresentante.user.email and 
-            hasattr(settings, 'EMAIL_HOST_USER')):
-            
-            subject = f'Nuovo Cliente Assegnato: {instance.ragione_sociale}'
+    if not getattr(settings, 'EMAIL_HOST_USER', None):
+        return
+
+    per_rappresentante = {}
+    for evento in eventi:
+        if evento['creato'] and evento['rappresentante_id']:
+            per_rappresentante.setdefault(evento['rappresentante_id'], []).append(evento)
+    if not per_rappresentante:
+        return
+
+    rappresentanti = Rappresentante.objects.select_related('dipendente').in_bulk(list(per_rappresentante))
+    for rappresentante_id, clienti in per_rappresentante.items():
+        rappresentante = rappresentanti.get(rappresentante_id)
+        if rappresentante is None:
+            continue
+        email = rappresentante.email or rappresentante.dipendente.email
+        if not email:
+            continue
+
+        if len(clienti) == 1:
+            cliente = clienti[0]
+            subject = f"Nuovo Cliente Assegnato: {cliente['nome']}"
             message = f"""
-            Ciao {instance.rappresentante.nome},
+            Ciao {rappresentante.nome},
             
             Ti è stato assegnato un nuovo cliente:
             
-            Ragione Sociale: {instance.ragione_sociale}
-            Città: {instance.città}
-            Email: {instance.email}
-            Telefono: {instance.telefono}
+            Ragione Sociale: {cliente['nome']}
+            Città: {cliente['citta']}
+            Email: {cliente['email']}
+            Telefono: {cliente['telefono']}
             
             Puoi visualizzare i dettagli accedendo al sistema.
             """
-            
-            try:
-                send_mail(
-                    subject,
-                    message,
-                    settings.EMAIL_HOST_USER,
-                    [instance.rappresentante.user.email],
-                    fail_silently=True,
-                )
-            except Exception:
-                pass
+        else:
+            subject = f'Nuovi clienti assegnati: {len(clienti)}'
+            message = (
+                f'Ciao {rappresentante.nome or rappresentante},\n\n'
+                f'Ti sono stati assegnati {len(clienti)} nuovi clienti:\n\n'
+                f"{_elenco_nomi([cliente['nome'] for cliente in clienti])}\n\n"
+                'Puoi visualizzare i dettagli accedendo al sistema.'
+            )
+
+        try:
+            send_mail(subject, message, settings.EMAIL_HOST_USER, [email], fail_silently=True)
+        except Exception as e:
+            logger.error(f"Errore invio notifica clienti a {email}: {e}")
 
 
 @receiver(pre_delete, sender=Rappresentante)
@@ -106,7 +175,7 @@ def check_rappresentante_profile(sender, user, request, **kwargs):
     Controlla se un rappresentante ha completato il suo profilo al login
     """
     try:
-        rappresentante = Rappresentante.objects.get(user=user)
+        rappresentante = Rappresentante.objects.get(dipendente=user)
         
         # Lista dei campi da verificare
         required_fields = ['partita_iva', 'codice_fiscale', 'telefono', 'email']
@@ -126,68 +195,125 @@ def check_rappresentante_profile(sender, user, request, **kwargs):
         pass
 
 
-# Segnali per logging delle operazioni
-@receiver(post_save, sender=Cliente)
-@receiver(post_save, sender=Fornitore)
-@receiver(post_save, sender=Rappresentante)
-def log_anagrafica_operations(sender, instance, created, **kwargs):
+# Logging delle operazioni
+class FileHandlerALotti(logging.FileHandler):
+    """FileHandler che scrive un intero lotto di record con un solo flush"""
+
+    def emit_lotto(self, records):
+        self.acquire()
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(''.join(self.format(record) + self.terminator for record in records))
+            self.flush()
+        finally:
+            self.release()
+
+
+def _logger_operazioni():
+    """Il logger di audit, con il file handler installato una sola volta"""
+    log_file = getattr(settings, 'ANAGRAFICA_LOG_FILE', None)
+    if not log_file:
+        return None, None
+    operazioni = logging.getLogger('anagrafica_operations')
+    for handler in operazioni.handlers:
+        if isinstance(handler, FileHandlerALotti):
+            return operazioni, handler
+    handler = FileHandlerALotti(log_file, delay=True)
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    operazioni.addHandler(handler)
+    operazioni.setLevel(logging.INFO)
+    return operazioni, handler
+
+
+@ricevitore('rappresentante_salvato', lotti=True)
+@ricevitore('cliente_salvato', lotti=True)
+@ricevitore('fornitore_salvato', lotti=True)
+def log_anagrafica_operations(eventi):
     """
-    Registra le operazioni sull'anagrafica per audit
+    Registra le operazioni sull'anagrafica per audit: tutte le righe del
+    lotto in una sola scrittura
     """
-    if hasattr(settings, 'ANAGRAFICA_LOG_FILE'):
-        import logging
-        import os
-        
-        # Configurazione del logger
-        logger = logging.getLogger('anagrafica_operations')
-        if not logger.handlers:
-            handler = logging.FileHandler(settings.ANAGRAFICA_LOG_FILE)
-            formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-            handler.setFormatter(formatter)
-            logger.addHandler(handler)
-            logger.setLevel(logging.INFO)
-        
-        # Log dell'operazione
-        operation = 'CREATED' if created else 'UPDATED'
-        model_name = sender.__name__
-        
-        if hasattr(instance, 'nome'):
-            identifier = instance.nome
-        elif hasattr(instance, 'ragione_sociale'):
-            identifier = instance.ragione_sociale
+    operazioni, handler = _logger_operazioni()
+    if operazioni is None:
+        return
+
+    model_name = eventi[0].nome.split('_')[0].capitalize()
+    records = [
+        operazioni.makeRecord(
+            operazioni.name, logging.INFO, __file__, 0,
+            f"{'CREATED' if evento['creato'] else 'UPDATED'} {model_name}: {evento['nome'] or evento['pk']}",
+            None, None,
+        )
+        for evento in eventi
+    ]
+    handler.emit_lotto(records)
+
+
+# Sincronizzazione zone
+@ricevitore('rappresentante_salvato', lotti=True)
+def sync_cliente_zone(eventi):
+    """
+    Sincronizza la zona dai clienti quando viene modificata sul rappresentante:
+    un solo UPDATE per zona, qualunque sia il numero di rappresentanti
+    """
+    zone = {}
+    for evento in eventi:
+        if not evento['creato'] and evento['zona_competenza']:
+            zone[evento['pk']] = evento['zona_competenza']
         else:
-            identifier = str(instance.id)
-        
-        logger.info(f"{operation} {model_name}: {identifier}")
+            zone.pop(evento['pk'], None)
 
+    per_zona = {}
+    max_length = Cliente._meta.get_field('zona').max_length
+    for rappresentante_id, zona in zone.items():
+        per_zona.setdefault(zona[:max_length], []).append(rappresentante_id)
+    for zona, rappresentanti in per_zona.items():
+        # Aggiorna la zona dei clienti del rappresentante se non specificata
+        Cliente.objects.filter(rappresentante_id__in=rappresentanti, zona='').update(zona=zona)
 
-# Segnali per sincronizzazione zone
-@receiver(post_save, sender=Rappresentante)
-def sync_cliente_zone(sender, instance, **kwargs):
+
+# Validazioni aggiuntive
+@ricevitore('cliente_salvato', lotti=True)
+def validate_cliente_rappresentante_zone(eventi):
     """
-    Sincronizza la zona dai clienti quando viene modificata sul rappresentante
+    Valida che cliente e rappresentante siano nella stessa zona, con una
+    sola query per tutti i rappresentanti del lotto
     """
-    if not kwargs.get('created', False) and instance.zona:
-        # Aggiorna la zona di tutti i clienti del rappresentante se non specificata
-        instance.clienti.filter(zona__isnull=True).update(zona=instance.zona)
+    da_verificare = [evento for evento in eventi if evento['rappresentante_id'] and evento['zona']]
+    if not da_verificare:
+        return
+
+    rappresentanti = Rappresentante.objects.exclude(zona_competenza='').in_bulk(
+        {evento['rappresentante_id'] for evento in da_verificare}
+    )
+    avvisi = logging.getLogger('anagrafica_warnings')
+    for evento in da_verificare:
+        rappresentante = rappresentanti.get(evento['rappresentante_id'])
+        if rappresentante and rappresentante.zona_competenza != evento['zona']:
+            avvisi.warning(
+                f"Cliente {evento['nome']} in zona {evento['zona']} "
+                f"assegnato a rappresentante {rappresentante} "
+                f"in zona {rappresentante.zona_competenza}"
+            )
 
 
-# Segnali per validazioni aggiuntive
+# Registro identificativi fiscali
+@receiver(post_save, sender=Rappresentante)
 @receiver(post_save, sender=Cliente)
-def validate_cliente_rappresentante_zone(sender, instance, **kwargs):
+@receiver(post_save, sender=Fornitore)
+def sincronizza_registro_fiscale(sender, instance, **kwargs):
     """
-    Valida che cliente e rappresentante siano nella stessa zona
+    Mantiene allineato il registro di P.IVA e CF usato dalle validazioni
     """
-    if (instance.rappresentante and 
-        instance.rappresentante.zona and 
-        instance.zona and 
-        instance.rappresentante.zona != instance.zona):
-        
-        # Log del warning
-        import logging
-        logger = logging.getLogger('anagrafica_warnings')
-        logger.warning(
-            f"Cliente {instance.ragione_sociale} in zona {instance.zona} "
-            f"assegnato a rappresentante {instance.rappresentante.nome} "
-            f"in zona {instance.rappresentante.zona}"
-        )
\ No newline at end of file
+    IdentificativoFiscale.objects.sincronizza([instance])
+
+
+@receiver(post_delete, sender=Rappresentante)
+@receiver(post_delete, sender=Cliente)
+@receiver(post_delete, sender=Fornitore)
+def rimuovi_registro_fiscale(sender, instance, **kwargs):
+    """
+    Rimuove dal registro gli identificativi dell'entità eliminata
+    """
+    IdentificativoFiscale.objects.rimuovi(sender._meta.model_name, [instance.pk])
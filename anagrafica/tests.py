@@ -7,7 +7,9 @@ from django.contrib.auth.models import Group
 from django.test.utils import override_settings
 from django.core.management import call_command
 
+from dipendenti import presenza
 from dipendenti.models import Dipendente
+from home.query_ripetute import BudgetQueryMixin
 from .models import Rappresentante, Cliente, Fornitore
 from .forms import RappresentanteForm, ClienteForm, FornitoreForm
 
@@ -442,5 +444,740 @@ class AnagraficaSignalTests(TestCase):
         self.assertIn('Nuovo Rappresentante', mail.outbox[0].subject)
 
 
+
+class MediaTemporaneaMixin:
+    """I report di importazione vengono salvati in una MEDIA_ROOT temporanea"""
+
+    def setUp(self):
+        import shutil
+        import tempfile
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        media_root = override_settings(MEDIA_ROOT=media)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        super().setUp()
+
+
+@override_settings(
+    EMAIL_HOST_USER='noreply@test.com',
+    EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+    ANAGRAFICA_EVENTI_SINCRONI=True,
+)
+class ImportClientiTests(MediaTemporaneaMixin, TestCase):
+    """Test per l'importazione massiva dei clienti"""
+
+    def setUp(self):
+        super().setUp()
+        self.staff = User.objects.create_user(username='staff', password='testpass123', is_staff=True)
+        dipendente = User.objects.create_user(
+            username='mrossi', first_name='Mario', last_name='Rossi', email='mario@test.com'
+        )
+        self.rappresentante = Rappresentante.objects.create(dipendente=dipendente, nome='Mario', cognome='Rossi')
+
+    def _file(self, contenuto, encoding='utf-8'):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        return SimpleUploadedFile('clienti.csv', contenuto.encode(encoding), content_type='text/csv')
+
+    def test_importazione_con_scarti_e_report(self):
+        from django.core import mail
+        from .importazione import ImportazioneClienti, percorso_report
+        from django.core.files.storage import default_storage
+
+        Cliente.objects.create(nome='Esistente', telefono='1', email='e@test.com', partita_iva='IT11111111115')
+        contenuto = (
+            "ragione_sociale;città;telefono;email;partita_iva;codice_fiscale;pagamento;limite_credito;rappresentante\n"
+            "Bar Centrale;Milano;021;bar@test.com;01234567897;;30 giorni;1.500,50;mario rossi\n"
+            "Pizzeria Da Gino;Como;031;gino@test.com;;RSSMRA80A01F205Z;;;\n"
+            "Duplicato;Lodi;037;dup@test.com;IT11111111115;;;;\n"
+            "Senza Email;Pavia;038;;12345678903;;;;\n"
+            "P.IVA errata;Monza;039;x@test.com;12345678900;;;;\n"
+            "Rappresentante ignoto;Varese;033;v@test.com;09876543217;;;;Luigi\n"
+        )
+
+        # 2 letture, 2 lotti da bulk_create + registro fiscale, savepoint
+        with self.assertNumQueries(8):
+            importazione = ImportazioneClienti(batch_size=2).esegui(self._file(contenuto))
+
+        self.assertEqual(importazione.importati, 3)
+        self.assertEqual(importazione.scartati, 3)
+        self.assertEqual(importazione.avvisi, 1)
+
+        bar = Cliente.objects.get(nome='Bar Centrale')
+        self.assertEqual(bar.partita_iva, 'IT01234567897')
+        self.assertEqual(bar.citta, 'Milano')
+        self.assertEqual(bar.tipo_pagamento, '30_giorni')
+        self.assertEqual(str(bar.limite_credito), '1500.50')
+        self.assertEqual(bar.rappresentante, self.rappresentante)
+        self.assertIsNone(Cliente.objects.get(nome='Rappresentante ignoto').rappresentante)
+
+        with default_storage.open(percorso_report(importazione.report)) as report:
+            righe = report.read().decode('utf-8-sig').splitlines()
+        self.assertEqual(len(righe), 5)
+        self.assertIn('Partita IVA già presente', righe[1])
+        self.assertIn('Campo email obbligatorio', righe[2])
+
+        # Una sola mail di riepilogo, inviata al commit
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_riepilogo_dopo_commit(self):
+        from django.core import mail
+        from .importazione import ImportazioneClienti
+
+        contenuto = (
+            "nome,telefono,email,partita_iva,rappresentante\n"
+            "Cliente Uno,1,uno@test.com,01234567897,mrossi\n"
+            "Cliente Due,2,due@test.com,12345678903,mrossi\n"
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            ImportazioneClienti().esegui(self._file(contenuto))
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['mario@test.com'])
+        self.assertIn('Cliente Due', mail.outbox[0].body)
+
+    def test_file_windows_1252(self):
+        from .importazione import ImportazioneClienti
+
+        contenuto = "nome;città;telefono;email;partita_iva\nCaffè Società;Forlì;1;c@test.com;01234567897\n"
+        importazione = ImportazioneClienti().esegui(self._file(contenuto, encoding='cp1252'))
+
+        self.assertEqual(importazione.importati, 1)
+        self.assertEqual(Cliente.objects.get().citta, 'Forlì')
+
+    def test_vista_import_e_download_report(self):
+        self.client.login(username='staff', password='testpass123')
+        contenuto = "nome,telefono,email,partita_iva\nSenza P.IVA valida,1,a@test.com,123\n"
+        response = self.client.post(
+            reverse('anagrafica:import_clienti'), {'file': self._file(contenuto)}
+        )
+        self.assertEqual(response.status_code, 200)
+        importazione = response.context['importazione']
+        self.assertEqual(importazione.scartati, 1)
+
+        response = self.client.get(reverse('anagrafica:import_report', args=[importazione.report]))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Partita IVA non valida', b''.join(response.streaming_content))
+
+        response = self.client.get(reverse('anagrafica:import_report', args=['..secret.txt']))
+        self.assertEqual(response.status_code, 404)
+
+
+
+class SincronizzazioneFornitoriTests(MediaTemporaneaMixin, TestCase):
+    """Test per la sincronizzazione fornitori con rilevamento modifiche"""
+
+    INTESTAZIONE = "nome;telefono;email;partita_iva;iban;categoria\n"
+    RIGHE = [
+        "Alfa Srl;02 111;alfa@test.com;01234567897;IT60X0542811101000000123456;Servizi\n",
+        "Beta Spa;02 222;beta@test.com;IT12345678903;;\n",
+        "Gamma Snc;02 333;gamma@test.com;09876543217;;materie_prime\n",
+    ]
+
+    def _file(self, righe):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        contenuto = self.INTESTAZIONE + ''.join(righe)
+        return SimpleUploadedFile('fornitori.csv', contenuto.encode('utf-8'))
+
+    def _sincronizza(self, righe, **kwargs):
+        from .importazione import SincronizzazioneFornitori
+        return SincronizzazioneFornitori(**kwargs).esegui(self._file(righe))
+
+    def test_inserimento_e_risincronizzazione_invariata(self):
+        sync = self._sincronizza(self.RIGHE)
+        self.assertEqual((sync.inseriti, sync.aggiornati, sync.invariati), (3, 0, 0))
+        alfa = Fornitore.objects.get(partita_iva='IT01234567897')
+        self.assertEqual(alfa.categoria, 'servizi')
+        self.assertEqual(alfa.tipo_pagamento, '30_giorni')
+        self.assertEqual(len(alfa.hash_sincronizzazione), 64)
+
+        # Stesso file: una sola query di lettura, nessuna scrittura
+        with self.assertNumQueries(3):
+            sync = self._sincronizza(self.RIGHE)
+        self.assertEqual((sync.inseriti, sync.aggiornati, sync.invariati), (0, 0, 3))
+
+    def test_aggiorna_solo_righe_modificate(self):
+        self._sincronizza(self.RIGHE)
+        beta = Fornitore.objects.get(partita_iva='IT12345678903')
+
+        righe = list(self.RIGHE)
+        righe[1] = "Beta Spa;02 999;beta@test.com;12345678903;;\n"
+        righe.append("Delta Srl;02 444;delta@test.com;11111111115;;\n")
+        sync = self._sincronizza(righe)
+
+        self.assertEqual((sync.inseriti, sync.aggiornati, sync.invariati), (1, 1, 2))
+        beta.refresh_from_db()
+        self.assertEqual(beta.telefono, '02 999')
+        self.assertEqual(Fornitore.objects.count(), 4)
+
+    def test_dry_run_non_scrive(self):
+        self._sincronizza(self.RIGHE[:1])
+        righe = ["Alfa Srl;02 000;alfa@test.com;01234567897;;\n"] + self.RIGHE[1:]
+
+        sync = self._sincronizza(righe, dry_run=True)
+
+        self.assertEqual((sync.inseriti, sync.aggiornati, sync.invariati), (2, 1, 0))
+        self.assertEqual(Fornitore.objects.count(), 1)
+        self.assertEqual(Fornitore.objects.get().telefono, '02 111')
+
+    def test_righe_scartate(self):
+        righe = self.RIGHE[:1] + [
+            "Alfa bis;02 555;alfa2@test.com;01234567897;;\n",
+            "IBAN errato;02 666;iban@test.com;12345678903;IT00X0000000000000000000000;\n",
+            "Categoria ignota;02 777;cat@test.com;09876543217;;vini\n",
+        ]
+        sync = self._sincronizza(righe, dry_run=True)
+
+        self.assertEqual(sync.inseriti, 1)
+        self.assertEqual(sync.scartati, 3)
+
+    def test_vista_sincronizzazione_dry_run(self):
+        User.objects.create_user(username='staff', password='testpass123', is_staff=True)
+        self.client.login(username='staff', password='testpass123')
+
+        response = self.client.post(
+            reverse('anagrafica:import_fornitori'), {'file': self._file(self.RIGHE), 'dry_run': '1'}
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['sincronizzazione'].inseriti, 3)
+        self.assertContains(response, 'Simulazione')
+        self.assertFalse(Fornitore.objects.exists())
+
+    def test_comando_sincronizza_fornitori(self):
+        import os
+        import tempfile
+        from io import StringIO
+
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False, encoding='utf-8') as file:
+            file.write(self.INTESTAZIONE + ''.join(self.RIGHE))
+        self.addCleanup(os.remove, file.name)
+
+        out = StringIO()
+        call_command('sincronizza_fornitori', file.name, '--dry-run', stdout=out)
+        self.assertIn('Inseriti: 3', out.getvalue())
+        self.assertEqual(Fornitore.objects.count(), 0)
+
+        call_command('sincronizza_fornitori', file.name, stdout=StringIO())
+        self.assertEqual(Fornitore.objects.count(), 3)
+
+
+
+class RegistroFiscaleTests(TestCase):
+    """Test per il registro degli identificativi fiscali e le validazioni AJAX"""
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.user = User.objects.create_user(username='operatore', password='testpass123')
+        self.client.login(username='operatore', password='testpass123')
+        # Presenza già registrata: le richieste misurate non la riscrivono nel database
+        presenza.heartbeat(self.user.pk)
+
+    def _registro(self):
+        from .models import IdentificativoFiscale
+        return set(IdentificativoFiscale.objects.values_list('tipo', 'valore', 'tipo_entita', 'id_entita'))
+
+    def test_registro_sincronizzato_dai_segnali(self):
+        cliente = Cliente.objects.create(
+            nome='Bar Sport', telefono='1', email='bar@test.com',
+            partita_iva='01234567897', codice_fiscale='rssmra80a01f205z'
+        )
+        self.assertEqual(self._registro(), {
+            ('partita_iva', 'IT01234567897', 'cliente', cliente.pk),
+            ('codice_fiscale', 'RSSMRA80A01F205Z', 'cliente', cliente.pk),
+        })
+
+        cliente.partita_iva = 'IT12345678903'
+        cliente.codice_fiscale = ''
+        cliente.save()
+        self.assertEqual(self._registro(), {('partita_iva', 'IT12345678903', 'cliente', cliente.pk)})
+
+        cliente.delete()
+        self.assertEqual(self._registro(), set())
+
+    def test_validate_partita_iva_una_query_e_cache(self):
+        fornitore = Fornitore.objects.create(
+            nome='Alfa', telefono='1', email='alfa@test.com', partita_iva='IT01234567897'
+        )
+        url = reverse('anagrafica:validate_partita_iva')
+
+        # Sessione e utente + una sola ricerca nel registro
+        with self.assertNumQueries(3):
+            response = self.client.get(url, {'partita_iva': '01234567897', 'tipo': 'fornitore'})
+        self.assertFalse(response.json()['valid'])
+        self.assertEqual(response.json()['message'], 'Partita IVA già esistente')
+
+        with self.assertNumQueries(2):
+            response = self.client.get(url, {
+                'partita_iva': 'IT01234567897', 'tipo': 'fornitore', 'exclude_id': fornitore.pk
+            })
+        self.assertTrue(response.json()['valid'])
+
+        response = self.client.get(url, {'partita_iva': '12345678900'})
+        self.assertEqual(response.json()['message'], 'Partita IVA non valida (checksum errato)')
+
+        # La modifica invalida la cache
+        fornitore.partita_iva = 'IT12345678903'
+        fornitore.save()
+        response = self.client.get(url, {'partita_iva': '01234567897'})
+        self.assertTrue(response.json()['valid'])
+
+    def test_validate_codice_fiscale(self):
+        Cliente.objects.create(nome='Mario', telefono='1', email='m@test.com', codice_fiscale='RSSMRA80A01F205Z')
+        url = reverse('anagrafica:validate_codice_fiscale')
+
+        response = self.client.get(url, {'codice_fiscale': 'rssmra80a01f205z'})
+        self.assertEqual(response.json()['message'], 'Codice fiscale già esistente')
+
+        response = self.client.get(url, {'codice_fiscale': 'RSSMRA80A01F205'})
+        self.assertEqual(response.json()['message'], 'Codice fiscale deve essere di 11 o 16 caratteri')
+
+    def test_clean_dei_modelli_con_le_regole_delle_importazioni(self):
+        fornitore = Fornitore(
+            nome='Alfa', partita_iva='012 345 678 97', codice_fiscale='rssmra80a01f205z',
+            iban='it60 x054 2811 1010 0000 0123 456',
+        )
+        fornitore.clean()
+        self.assertEqual(
+            (fornitore.partita_iva, fornitore.codice_fiscale, fornitore.iban),
+            ('IT01234567897', 'RSSMRA80A01F205Z', 'IT60X0542811101000000123456'),
+        )
+
+        # Stesso controllo mod 97 della sincronizzazione fornitori
+        fornitore.iban = 'IT00X0000000000000000000000'
+        with self.assertRaises(ValidationError) as errore:
+            fornitore.clean()
+        self.assertIn('iban', errore.exception.message_dict)
+        with self.assertRaises(ValidationError):
+            Cliente(nome='Beta', partita_iva='12345678900').clean()
+
+    def test_validazione_batch(self):
+        import json
+        Cliente.objects.create(nome='Uno', telefono='1', email='u@test.com', partita_iva='IT01234567897')
+        partite_iva = ['01234567897', '12345678903', '12345678900', ''] + [
+            f'{n:011d}' for n in range(2000)
+        ]
+
+        # Sessione e utente + una query per le P.IVA e una per i CF
+        with self.assertNumQueries(4):
+            response = self.client.post(
+                reverse('anagrafica:validate_identificativi_batch'),
+                json.dumps({'partite_iva': partite_iva, 'codici_fiscali': ['RSSMRA80A01F205Z']}),
+                content_type='application/json'
+            )
+
+        esiti = response.json()['partite_iva']
+        self.assertEqual(esiti['01234567897']['duplicati'], [{'tipo': 'cliente', 'id': Cliente.objects.get().pk}])
+        self.assertTrue(esiti['12345678903']['valid'])
+        self.assertFalse(esiti['12345678900']['valid'])
+        self.assertEqual(esiti['']['message'], 'Partita IVA vuota')
+        self.assertTrue(response.json()['codici_fiscali']['RSSMRA80A01F205Z']['valid'])
+
+    def test_validazione_batch_limite(self):
+        import json
+        response = self.client.post(
+            reverse('anagrafica:validate_identificativi_batch'),
+            json.dumps({'partite_iva': ['1'] * 10001}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+
+class DuplicatiTests(TestCase):
+    """Test per la ricerca e l'unione dei duplicati"""
+
+    def _cliente(self, nome, **kwargs):
+        dati = {'telefono': '', 'email': 'info@test.com'}
+        dati.update(kwargs)
+        return Cliente.objects.create(nome=nome, **dati)
+
+    def test_normalizzazione_e_chiave_fonetica(self):
+        from .duplicati import normalizza_nome, normalizza_indirizzo, chiave_fonetica
+
+        self.assertEqual(normalizza_nome('Caffè Rossi S.r.l.'), 'caffe rossi')
+        self.assertEqual(normalizza_nome('F.lli Bianchi & C. snc'), 'bianchi')
+        self.assertEqual(normalizza_indirizzo('V.le Monza, 12'), 'viale monza 12')
+        self.assertEqual(chiave_fonetica('chiosco'), chiave_fonetica('kiosko'))
+
+    def test_trova_coppie_simili_con_blocchi(self):
+        from .duplicati import RicercaDuplicati
+        from .models import PossibileDuplicato
+
+        a = self._cliente('Bar Centrale S.r.l.', cap='20100', indirizzo='Via Roma 1')
+        b = self._cliente('Bar Centrale srl', cap='20100', indirizzo='V. Roma 1')
+        c = self._cliente('Pizzeria Napoli', cap='80100', partita_iva='IT01234567897')
+        d = self._cliente('Pizzeria Da Totò', cap='80121', partita_iva='01234567897')
+        self._cliente('Ferramenta Verdi', cap='10100')
+
+        ricerca = RicercaDuplicati('cliente').esegui()
+
+        coppie = {(p.id_a, p.id_b): p for p in PossibileDuplicato.objects.all()}
+        self.assertEqual(set(coppie), {(a.pk, b.pk), (c.pk, d.pk)})
+        self.assertIn('stessa P.IVA', coppie[(c.pk, d.pk)].motivo)
+        # Solo le coppie che condividono un blocco vengono confrontate
+        self.assertLess(ricerca.confronti, 10)
+
+    def test_coppia_scartata_non_riproposta(self):
+        from .duplicati import RicercaDuplicati
+        from .models import PossibileDuplicato
+
+        self._cliente('Bar Centrale', cap='20100')
+        self._cliente('Bar Centrale', cap='20100')
+        RicercaDuplicati('cliente').esegui()
+        PossibileDuplicato.objects.update(stato='scartato')
+
+        RicercaDuplicati('cliente').esegui()
+
+        self.assertEqual(PossibileDuplicato.objects.count(), 1)
+        self.assertFalse(PossibileDuplicato.objects.filter(stato='da_verificare').exists())
+
+    def test_unione_sposta_rappresentante_e_completa_campi(self):
+        from .duplicati import RicercaDuplicati
+        from .models import PossibileDuplicato
+
+        dipendente = User.objects.create_user(username='rappr')
+        rappresentante = Rappresentante.objects.create(dipendente=dipendente, nome='Mario')
+        principale = self._cliente('Bar Centrale', cap='20100')
+        duplicato = self._cliente(
+            'Bar Centrale srl', cap='20100', rappresentante=rappresentante,
+            indirizzo='Via Roma 1', note='Cliente storico'
+        )
+        RicercaDuplicati('cliente').esegui()
+        coppia = PossibileDuplicato.objects.get()
+
+        staff = User.objects.create_user(username='staff', password='testpass123', is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.get(reverse('anagrafica:duplicati'))
+        self.assertContains(response, 'Bar Centrale srl')
+
+        response = self.client.post(
+            reverse('anagrafica:unisci_duplicato', args=[coppia.pk]), {'principale': 'a'}
+        )
+        self.assertEqual(response.status_code, 302)
+
+        principale.refresh_from_db()
+        self.assertEqual(principale.rappresentante, rappresentante)
+        self.assertEqual(principale.indirizzo, 'Via Roma 1')
+        self.assertEqual(principale.note, 'Cliente storico')
+        self.assertFalse(Cliente.objects.filter(pk=duplicato.pk).exists())
+        coppia.refresh_from_db()
+        self.assertEqual(coppia.stato, 'unito')
+
+    def test_unione_registra_il_duplicato_e_rifiuta_relazioni_non_gestite(self):
+        from unittest import mock
+        from .duplicati import relazioni_non_gestite, unisci
+
+        # Se compare una relazione che l'unione perderebbe, unisci() va esteso
+        self.assertEqual(relazioni_non_gestite(Cliente), [])
+        self.assertEqual(relazioni_non_gestite(Fornitore), [])
+
+        principale = self._cliente('Bar Centrale', cap='20100')
+        duplicato = self._cliente('Bar Centrale srl', cap='20100')
+        duplicato_pk = duplicato.pk
+        with mock.patch('anagrafica.duplicati.relazioni_non_gestite', return_value=['ordini.Sconto.clienti']):
+            with self.assertRaisesMessage(ValueError, 'ordini.Sconto.clienti'):
+                unisci(principale, duplicato)
+        self.assertTrue(Cliente.objects.filter(pk=duplicato_pk).exists())
+
+        with self.assertLogs('anagrafica_operations', 'INFO') as log:
+            unisci(principale, duplicato)
+        self.assertIn(f'MERGED Cliente: {duplicato_pk} -> {principale.pk}', log.output[-1])
+
+    def test_comando_trova_duplicati_dry_run(self):
+        from io import StringIO
+        from .models import PossibileDuplicato
+
+        self._cliente('Bar Centrale', cap='20100')
+        self._cliente('Bar Centrale', cap='20100')
+        out = StringIO()
+        call_command('trova_duplicati', '--tipo', 'cliente', '--dry-run', stdout=out)
+
+        self.assertIn('1 possibili duplicati', out.getvalue())
+        self.assertFalse(PossibileDuplicato.objects.exists())
+
+
+@override_settings(
+    EMAIL_HOST_USER='noreply@test.com',
+    EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+    ANAGRAFICA_EVENTI_SINCRONI=True,
+)
+class EventiTests(TestCase):
+    """Test per il bus eventi e i ricevitori a lotti"""
+
+    def setUp(self):
+        dipendente = User.objects.create_user(username='mrossi', email='mario@test.com')
+        self.rappresentante = Rappresentante.objects.create(dipendente=dipendente, nome='Mario')
+
+    def _registra(self, nome, lotti=True):
+        from . import eventi
+        chiamate = []
+        funzione = eventi.ricevitore(nome, lotti=lotti)(chiamate.append)
+        self.addCleanup(eventi._ricevitori[nome].remove, (funzione, lotti))
+        return chiamate
+
+    def _cliente(self, nome, **kwargs):
+        return Cliente.objects.create(nome=nome, telefono='1', email='c@test.com', **kwargs)
+
+    def test_lotto_consegnato_una_volta_dopo_il_commit(self):
+        from django.db import transaction
+        from .eventi import pubblica
+
+        lotti = self._registra('test_evento')
+        singoli = self._registra('test_evento', lotti=False)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with transaction.atomic():
+                for numero in range(1000):
+                    pubblica('test_evento', numero=numero)
+                self.assertEqual(lotti, [])
+
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(len(lotti), 1)
+        self.assertEqual([evento['numero'] for evento in lotti[0]], list(range(1000)))
+        self.assertEqual(len(singoli), 1000)
+
+    def test_eventi_annullati_con_il_rollback(self):
+        from django.db import transaction
+        from .eventi import pubblica
+
+        lotti = self._registra('test_evento')
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                pubblica('test_evento', numero=1)
+                try:
+                    with transaction.atomic():
+                        pubblica('test_evento', numero=2)
+                        raise ValueError
+                except ValueError:
+                    pass
+                pubblica('test_evento', numero=3)
+
+        self.assertEqual([evento['numero'] for lotto in lotti for evento in lotto], [1, 3])
+
+    def test_lotti_chiusi_escono_dal_registro_del_thread(self):
+        from django.db import transaction
+        from . import eventi
+
+        lotti = self._registra('test_evento')
+        registro = getattr(eventi._locale, 'lotti', {})
+        prima = len(registro)
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                for numero in range(100):
+                    try:
+                        with transaction.atomic():
+                            eventi.pubblica('test_evento', numero=numero)
+                            if numero % 2:
+                                raise ValueError
+                    except ValueError:
+                        pass
+
+        self.assertEqual([evento['numero'] for lotto in lotti for evento in lotto], list(range(0, 100, 2)))
+        # Consegnati o annullati: nessuno resta nel registro locale
+        self.assertLessEqual(len(eventi._locale.lotti), prima)
+
+    @override_settings(ANAGRAFICA_EVENTI_SINCRONI=False)
+    def test_consegna_nel_worker(self):
+        import threading
+        from .eventi import Evento, attendi, consegna
+
+        thread = []
+        from . import eventi
+        funzione = eventi.ricevitore('test_evento', lotti=True)(
+            lambda lotto: thread.append(threading.current_thread().name)
+        )
+        self.addCleanup(eventi._ricevitori['test_evento'].remove, (funzione, True))
+
+        consegna([Evento('test_evento', {})])
+        attendi()
+        self.assertEqual(len(thread), 1)
+        self.assertTrue(thread[0].startswith('anagrafica-eventi'))
+
+    def test_una_notifica_e_una_scrittura_di_log_per_lotto(self):
+        import logging
+        import os
+        import shutil
+        import tempfile
+        from unittest import mock
+        from django.core import mail
+        from django.db import transaction
+        from .signals import FileHandlerALotti
+
+        cartella = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cartella, ignore_errors=True)
+        log_file = os.path.join(cartella, 'anagrafica.log')
+        with override_settings(ANAGRAFICA_LOG_FILE=log_file), \
+                mock.patch.object(FileHandlerALotti, 'flush', autospec=True) as flush:
+            with self.captureOnCommitCallbacks(execute=True):
+                with transaction.atomic():
+                    for numero in range(50):
+                        self._cliente(f'Cliente {numero}', rappresentante=self.rappresentante)
+
+            self.assertEqual(flush.call_count, 1)
+
+        operazioni = logging.getLogger('anagrafica_operations')
+        for handler in list(operazioni.handlers):
+            if isinstance(handler, FileHandlerALotti):
+                handler.close()
+                operazioni.removeHandler(handler)
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].subject, 'Nuovi clienti assegnati: 50')
+        self.assertIn('... e altri 30', mail.outbox[0].body)
+        with open(log_file) as log:
+            self.assertEqual(len(log.read().splitlines()), 50)
+
+    def test_sincronizzazione_zone_a_lotti(self):
+        senza_zona = self._cliente('Senza zona', rappresentante=self.rappresentante)
+        con_zona = self._cliente('Con zona', rappresentante=self.rappresentante, zona='Sud')
+
+        from django.db import transaction
+
+        self.rappresentante.zona_competenza = 'Nord'
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self.rappresentante.save()
+
+        senza_zona.refresh_from_db()
+        con_zona.refresh_from_db()
+        self.assertEqual(senza_zona.zona, 'Nord')
+        self.assertEqual(con_zona.zona, 'Sud')
+
+
+class ReportPDFTests(MediaTemporaneaMixin, TestCase):
+    """Test per i report PDF in streaming"""
+
+    def setUp(self):
+        super().setUp()
+        self.staff = User.objects.create_user(username='staff', password='testpass123', is_staff=True)
+        Cliente.objects.bulk_create([
+            Cliente(nome=f'Cliente {numero:03d}', telefono='1', email=f'c{numero}@test.com', citta='Milano')
+            for numero in range(130)
+        ])
+
+    def _pagine(self, contenuto):
+        import re
+        return len(re.findall(rb'/Type /Page\b(?!s)', contenuto))
+
+    def test_report_a_blocchi_con_una_query(self):
+        import io
+        from .report_pdf import ReportClienti
+
+        file = io.BytesIO()
+        report = ReportClienti()
+        with self.assertNumQueries(1):
+            righe = report.genera(file)
+
+        self.assertEqual(righe, 130)
+        self.assertTrue(file.getvalue().startswith(b'%PDF'))
+        self.assertEqual(self._pagine(file.getvalue()), 3)
+
+    def test_testo_lungo_troncato(self):
+        from .report_pdf import ReportFornitori
+
+        report = ReportFornitori()
+        report._max_caratteri = [10]
+        self.assertEqual(report._tronca('Fornitore con un nome molto lungo', 0), 'Fornitor' + 'e…')
+        self.assertEqual(report._tronca(None, 0), '-')
+
+    def test_viste_report(self):
+        self.client.login(username='staff', password='testpass123')
+        for nome in ('rappresentanti_pdf', 'clienti_pdf', 'fornitori_pdf'):
+            response = self.client.get(reverse(f'anagrafica:{nome}'))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'application/pdf')
+            self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+
+    def test_download_report_in_background(self):
+        import io
+        from unittest import mock
+        from home.models import Elaborazione
+
+        self.client.login(username='staff', password='testpass123')
+        with mock.patch('home.elaborazioni.subprocess.Popen') as popen:
+            popen.return_value.pid = 4321
+            response = self.client.get(reverse('anagrafica:clienti_pdf') + '?background=1')
+        self.assertEqual(response.status_code, 202)
+        url = response.json()['url']
+        nome = url.rstrip('/').rsplit('/', 1)[-1]
+        self.assertEqual(popen.call_args.args[0][-4:], ['report_pdf_anagrafica', 'clienti', '--elaborazione', nome])
+        elaborazione = Elaborazione.objects.get(nome=nome)
+        self.assertEqual((elaborazione.pid, elaborazione.percorso), (4321, f'anagrafica/report/{nome}'))
+        self.assertIsNotNone(elaborazione.avviata_il)
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['stato'], 'in_corso')
+
+        call_command('report_pdf_anagrafica', 'clienti', elaborazione=nome, stdout=io.StringIO())
+        elaborazione.refresh_from_db()
+        self.assertEqual((elaborazione.completati, elaborazione.totale), (130, 130))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+
+        response = self.client.get(reverse('anagrafica:report_pdf_scarica', args=['clienti_settings.pdf']))
+        self.assertEqual(response.status_code, 404)
+
+    def test_file_in_scrittura_non_scaricabile(self):
+        from django.core.files.base import ContentFile
+        from django.core.files.storage import default_storage
+        from home import elaborazioni
+        from .report_pdf import percorso_report
+
+        self.client.login(username='staff', password='testpass123')
+        nome = 'clienti_' + 'a' * 32 + '.pdf'
+        url = reverse('anagrafica:report_pdf_scarica', args=[nome])
+        default_storage.save(percorso_report(nome), ContentFile(b'%PDF-1.4 troncato'))
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+        elaborazioni.crea(nome)
+        self.assertEqual(self.client.get(url).status_code, 202)
+        elaborazioni.fallita(nome)
+        self.assertEqual(self.client.get(url).status_code, 500)
+
+
+class BudgetQueryTests(BudgetQueryMixin, TestCase):
+    """Numero massimo di query degli elenchi dell'anagrafica"""
+
+    BUDGET_QUERY = {
+        'anagrafica:dashboard': 7,
+        'anagrafica:elenco_rappresentanti': 5,
+        'anagrafica:elenco_clienti': 5,
+        'anagrafica:elenco_fornitori': 5,
+        'anagrafica:api_search': 5,
+    }
+
+    def setUp(self):
+        self.utente = User.objects.create_user(username='budget', password='pw', is_staff=True, livello='totale')
+        self.client.force_login(self.utente)
+        self.creati = 0
+        self._anagrafiche()
+
+    def _anagrafiche(self, quanti=3):
+        for numero in range(self.creati, self.creati + quanti):
+            self.creati += 1
+            dipendente = User.objects.create_user(username=f'rappresentante{numero}', password='pw', livello='rappresentante')
+            rappresentante = Rappresentante.objects.create(
+                dipendente=dipendente, nome='Rappresentante', cognome=f'Budget {numero}',
+                email=f'rappresentante{numero}@test.com', telefono='0212345678',
+            )
+            Cliente.objects.create(
+                nome=f'Cliente Budget {numero}', telefono='0212345678',
+                email=f'cliente{numero}@test.com', rappresentante=rappresentante,
+            )
+            Fornitore.objects.create(
+                nome=f'Fornitore Budget {numero}', telefono='0212345678',
+                email=f'fornitore{numero}@test.com', partita_iva=f'{numero:011d}',
+            )
+
+    def test_budget_pagine(self):
+        for nome_url in self.BUDGET_QUERY:
+            parametri = {'q': 'Budget'} if nome_url == 'anagrafica:api_search' else None
+            with self.subTest(nome_url):
+                self.assertBudgetQuery(nome_url, parametri=parametri, aggiungi_righe=self._anagrafiche)
+
+
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()
@@ -56,6 +56,7 @@ urlpatterns = [
     # URL per validazione campi (da views_extra)
     path('api/validate/partita-iva/', views_extra.validate_partita_iva, name='validate_partita_iva'),
     path('api/validate/codice-fiscale/', views_extra.validate_codice_fiscale, name='validate_codice_fiscale'),
+    path('api/validate/batch/', views_extra.validate_identificativi_batch, name='validate_identificativi_batch'),
     
     # URL legacy per retrocompatibilità (se necessario)
     path('vedirappresentante/<int:pk>/', views.RappresentanteDetailView.as_view(), name='vedirappresentante'),
@@ -70,12 +71,21 @@ extra_patterns = [
         path('rappresentanti-pdf/', views_extra.rappresentanti_report_pdf, name='rappresentanti_pdf'),
         path('clienti-pdf/', views_extra.clienti_report_pdf, name='clienti_pdf'),
         path('fornitori-pdf/', views_extra.fornitori_report_pdf, name='fornitori_pdf'),
+        path('pdf/<str:nome>/', views_extra.report_pdf_scarica, name='report_pdf_scarica'),
     ])),
     
     # Import/Export avanzato (da views_extra)
     path('import/', include([
         path('clienti/', views_extra.ImportClientiView.as_view(), name='import_clienti'),
         path('fornitori/', views_extra.ImportFornitoriView.as_view(), name='import_fornitori'),
+        path('report/<str:nome>/', views_extra.download_report_import, name='import_report'),
+    ])),
+    
+    # Revisione duplicati (da views_extra)
+    path('duplicati/', include([
+        path('', views_extra.DuplicatiListView.as_view(), name='duplicati'),
+        path('<int:pk>/unisci/', views_extra.unisci_duplicato, name='unisci_duplicato'),
+        path('<int:pk>/scarta/', views_extra.scarta_duplicato, name='scarta_duplicato'),
     ])),
     
     # Operazioni batch (da views_extra)
@@ -0,0 +1,62 @@
+# anagrafica/validators.py
+"""
+Normalizzazione e validazione dei dati fiscali (P.IVA, CF, IBAN).
+Funzioni pure, senza accesso al database: usabili riga per riga nelle
+importazioni massive senza costi di query.
+"""
+import re
+
+PATTERN_CF_PERSONA = re.compile(r'^[A-Z]{6}\d{2}[A-Z]\d{2}[A-Z]\d{3}[A-Z]$')
+PATTERN_CF_AZIENDA = re.compile(r'^\d{11}$')
+PATTERN_IBAN = re.compile(r'^[A-Z]{2}\d{2}[A-Z0-9]{11,30}$')
+
+
+def normalizza_partita_iva(valore):
+    """
+    Rimuove spazi e punti, porta in maiuscolo e aggiunge il prefisso IT
+    alle partite IVA di sole 11 cifre.
+    """
+    valore = re.sub(r'[\s.]', '', valore or '').upper()
+    if len(valore) == 11 and valore.isdigit():
+        valore = f'IT{valore}'
+    return valore
+
+
+def normalizza_codice_fiscale(valore):
+    return re.sub(r'\s', '', valore or '').upper()
+
+
+def normalizza_iban(valore):
+    return re.sub(r'\s', '', valore or '').upper()
+
+
+def partita_iva_valida(piva):
+    """Validazione Partita IVA italiana (IT + 11 cifre con checksum)"""
+    if not piva.startswith('IT'):
+        return False
+    numeri = piva[2:]
+    if len(numeri) != 11 or not numeri.isdigit():
+        return False
+
+    totale = sum(int(numeri[i]) for i in range(0, 10, 2))
+    for i in range(1, 10, 2):
+        doppio = int(numeri[i]) * 2
+        totale += doppio // 10 + doppio % 10
+
+    return (10 - totale % 10) % 10 == int(numeri[10])
+
+
+def codice_fiscale_valido(cf):
+    """Codice fiscale di persona fisica (16 caratteri) o azienda (11 cifre)"""
+    return bool(PATTERN_CF_PERSONA.match(cf) or PATTERN_CF_AZIENDA.match(cf))
+
+
+def iban_valido(iban):
+    """Validazione IBAN con controllo mod 97; gli IBAN italiani sono di 27 caratteri"""
+    if not PATTERN_IBAN.match(iban):
+        return False
+    if iban.startswith('IT') and len(iban) != 27:
+        return False
+    riordinato = iban[4:] + iban[:4]
+    numerico = ''.join(str(int(c, 36)) for c in riordinato)
+    return int(numerico) % 97 == 1
@@ -17,29 +17,30 @@ import json
 from .models import Rappresentante, Cliente, Fornitore
 from .forms import RappresentanteForm, ClienteForm, FornitoreForm, AnagraficaSearchForm
 from dipendenti.models import Dipendente
+from dipendenti.autorizzazioni import AutorizzazioniMixin, da_request
 
 
-class StaffRequiredMixin(UserPassesTestMixin):
+class StaffRequiredMixin(AutorizzazioniMixin, UserPassesTestMixin):
     """Mixin per verificare che l'utente sia staff"""
     def test_func(self):
-        return self.request.user.is_staff or self.request.user.is_superuser
+        return self.autorizzazioni.is_staff_o_superuser
 
 
-class RappresentanteAccessMixin(UserPassesTestMixin):
+class RappresentanteAccessMixin(AutorizzazioniMixin, UserPassesTestMixin):
     """Mixin per controllare accesso rappresentanti ai propri clienti"""
     def test_func(self):
-        user = self.request.user
+        autorizzazioni = self.autorizzazioni
         # Staff e superuser possono accedere a tutto
-        if user.is_staff or user.is_superuser:
+        if autorizzazioni.is_staff_o_superuser:
             return True
         
         # Rappresentanti possono accedere solo ai propri clienti
-        if hasattr(user, 'rappresentante'):
+        if autorizzazioni.is_rappresentante:
             # Se è una vista di dettaglio/modifica cliente, verifica ownership
-            if hasattr(self, 'get_object'):
-                obj = self.get_object()
-                if isinstance(obj, Cliente):
-                    return obj.rappresentante == user.rappresentante
+            # sui clienti dell'ambito, senza caricare l'oggetto
+            pk = self.kwargs.get(getattr(self, 'pk_url_kwarg', 'pk'))
+            if getattr(self, 'model', None) is Cliente and pk is not None:
+                return autorizzazioni.puo_accedere_cliente(pk)
             return True
         
         return False
@@ -151,11 +152,11 @@ class ClienteListView(LoginRequiredMixin, RappresentanteAccessMixin, ListView):
     paginate_by = 20
 
     def get_queryset(self):
-        queryset = Cliente.objects.select_related('rappresentante').order_by('-created_at')
+        queryset = Cliente.objects.select_related('rappresentante__dipendente').order_by('-created_at')
         
         # Se l'utente è un rappresentante, mostra solo i suoi clienti
-        if hasattr(self.request.user, 'rappresentante') and not self.request.user.is_staff:
-            queryset = queryset.filter(rappresentante=self.request.user.rappresentante)
+        if self.autorizzazioni.limitato_ai_propri_clienti:
+            queryset = queryset.filter(rappresentante_id=self.autorizzazioni.rappresentante_id)
         
         # Filtri di ricerca
         search_query = self.request.GET.get('search')
@@ -187,7 +188,7 @@ class ClienteDetailView(LoginRequiredMixin, RappresentanteAccessMixin, DetailVie
         return context
 
 
-class ClienteCreateView(LoginRequiredMixin, CreateView):
+class ClienteCreateView(LoginRequiredMixin, AutorizzazioniMixin, CreateView):
     """Creazione cliente (SENZA sconto percentuale)"""
     model = Cliente
     form_class = ClienteForm
@@ -201,8 +202,8 @@ class ClienteCreateView(LoginRequiredMixin, CreateView):
 
     def form_valid(self, form):
         # Se l'utente è un rappresentante, assegna automaticamente
-        if hasattr(self.request.user, 'rappresentante') and not self.request.user.is_staff:
-            form.instance.rappresentante = self.request.user.rappresentante
+        if self.autorizzazioni.limitato_ai_propri_clienti:
+            form.instance.rappresentante_id = self.autorizzazioni.rappresentante_id
         
         response = super().form_valid(form)
         messages.success(self.request, f'Cliente {self.object.nome} creato con successo!')
@@ -344,13 +345,14 @@ def api_search_anagrafica(request):
     """API per ricerca nell'anagrafica"""
     query = request.GET.get('q', '').strip()
     tipo = request.GET.get('tipo', '')
+    autorizzazioni = da_request(request)
     
     results = []
     
     if len(query) >= 2:
         # Cerca nei rappresentanti
         if not tipo or tipo == 'rappresentanti':
-            rappresentanti = Rappresentante.objects.filter(
+            rappresentanti = Rappresentante.objects.select_related('dipendente').filter(
                 Q(nome__icontains=query) |
                 Q(cognome__icontains=query) |
                 Q(email__icontains=query) |
@@ -376,8 +378,8 @@ def api_search_anagrafica(request):
             )
             
             # Se l'utente è un rappresentante, limita ai suoi clienti
-            if hasattr(request.user, 'rappresentante') and not request.user.is_staff:
-                clienti_qs = clienti_qs.filter(rappresentante=request.user.rappresentante)
+            if autorizzazioni.limitato_ai_propri_clienti:
+                clienti_qs = clienti_qs.filter(rappresentante_id=autorizzazioni.rappresentante_id)
             
             clienti = clienti_qs[:10]
             
@@ -392,7 +394,7 @@ def api_search_anagrafica(request):
                 })
         
         # Cerca nei fornitori (solo staff)
-        if (not tipo or tipo == 'fornitori') and (request.user.is_staff or request.user.is_superuser):
+        if (not tipo or tipo == 'fornitori') and autorizzazioni.is_staff_o_superuser:
             fornitori = Fornitore.objects.filter(
                 Q(nome__icontains=query) |
                 Q(email__icontains=query) |
@@ -416,6 +418,7 @@ def api_search_anagrafica(request):
 def export_anagrafica(request):
     """Export dati anagrafica in CSV"""
     tipo = request.GET.get('tipo', 'clienti')
+    autorizzazioni = da_request(request)
     
     response = HttpResponse(content_type='text/csv')
     response['Content-Disposition'] = f'attachment; filename="{tipo}_{request.user.id}.csv"'
@@ -424,10 +427,10 @@ def export_anagrafica(request):
     
     if tipo == 'clienti':
         writer.writerow(['Nome', 'Email', 'Telefono', 'Rappresentante', 'Attivo'])
-        clienti = Cliente.objects.select_related('rappresentante')
+        clienti = Cliente.objects.select_related('rappresentante__dipendente')
         
-        if hasattr(request.user, 'rappresentante') and not request.user.is_staff:
-            clienti = clienti.filter(rappresentante=request.user.rappresentante)
+        if autorizzazioni.limitato_ai_propri_clienti:
+            clienti = clienti.filter(rappresentante_id=autorizzazioni.rappresentante_id)
         
         for cliente in clienti:
             writer.writerow([
@@ -438,7 +441,7 @@ def export_anagrafica(request):
                 'Sì' if cliente.attivo else 'No'
             ])
     
-    elif tipo == 'fornitori' and (request.user.is_staff or request.user.is_superuser):
+    elif tipo == 'fornitori' and autorizzazioni.is_staff_o_superuser:
         writer.writerow(['Nome', 'Email', 'Telefono', 'Categoria', 'Attivo'])
         fornitori = Fornitore.objects.all()
         
@@ -457,7 +460,7 @@ def export_anagrafica(request):
 @login_required
 def toggle_attivo(request, tipo, pk):
     """Toggle stato attivo/inattivo per entità anagrafica"""
-    if not (request.user.is_staff or request.user.is_superuser):
+    if not da_request(request).is_staff_o_superuser:
         messages.error(request, 'Non hai i permessi per questa operazione.')
         return redirect('anagrafica:dashboard')
     
@@ -1,30 +1,38 @@
 # anagrafica/views_extra.py
 # Views aggiuntive per funzionalità extra dell'anagrafica
 
-from django.shortcuts import render, redirect
-from django.http import JsonResponse, HttpResponse
+from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
+from django.http import JsonResponse, FileResponse, Http404
 from django.contrib.auth.decorators import login_required
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib import messages
-from django.db.models import Q
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.db.models import Q, ProtectedError
 from django.core.exceptions import ValidationError
 from django.views import View
-from django.views.generic import TemplateView
+from django.views.generic import TemplateView, ListView
+from django.views.decorators.http import require_POST
 from django.utils.translation import gettext_lazy as _
 from django.core.files.storage import default_storage
 from django.core.files.base import ContentFile
 import json
 import csv
-import io
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.lib import colors
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-
-from .models import Rappresentante, Cliente, Fornitore
+
+from .models import Rappresentante, Cliente, Fornitore, IdentificativoFiscale, PossibileDuplicato
 from .forms import RappresentanteForm, ClienteForm, FornitoreForm
+from .importazione import (
+    ImportazioneClienti, SincronizzazioneFornitori, ErroreImportazione, percorso_report
+)
+from .duplicati import unisci
+from . import report_pdf
+from .views import StaffRequiredMixin
+from .validators import (
+    normalizza_partita_iva, normalizza_codice_fiscale, partita_iva_valida, codice_fiscale_valido,
+)
+
+# Limite di identificativi per la validazione batch
+MAX_IDENTIFICATIVI_BATCH = 10000
 
 
 # ========== API AGGIUNTIVE ==========
@@ -78,344 +86,351 @@ def dashboard_stats_api(request):
     return JsonResponse(stats)
 
 
+def _errore_partita_iva(piva):
+    """Messaggio di errore di formato per una P.IVA normalizzata, None se valida"""
+    if len(piva) != 13 or not piva.startswith('IT') or not piva[2:].isdigit():
+        return 'Partita IVA deve essere di 11 cifre'
+    if not partita_iva_valida(piva):
+        return 'Partita IVA non valida (checksum errato)'
+    return None
+
+
+def _errore_codice_fiscale(cf):
+    """Messaggio di errore di formato per un CF normalizzato, None se valido"""
+    if len(cf) not in [11, 16]:
+        return 'Codice fiscale deve essere di 11 o 16 caratteri'
+    if not codice_fiscale_valido(cf):
+        if len(cf) == 16:
+            return 'Formato codice fiscale non valido'
+        return 'Codice fiscale persona giuridica non valido'
+    return None
+
+
+# tipo -> (normalizzazione, controllo formato, messaggi vuoto / valido / già esistente)
+IDENTIFICATIVI = {
+    'partita_iva': (
+        normalizza_partita_iva, _errore_partita_iva,
+        ('Partita IVA vuota', 'Partita IVA valida', 'Partita IVA già esistente'),
+    ),
+    'codice_fiscale': (
+        normalizza_codice_fiscale, _errore_codice_fiscale,
+        ('Codice fiscale vuoto', 'Codice fiscale valido', 'Codice fiscale già esistente'),
+    ),
+}
+
+
+def _verifica_identificativi(tipo_identificativo, valori, tipo='', exclude_id=None):
+    """
+    Valida formato e unicità di una lista di identificativi dello stesso tipo.
+    I duplicati sono cercati nel registro fiscale con una query per blocco
+    di valori non in cache. Restituisce {valore originale: esito}.
+    """
+    normalizza, errore_formato, (msg_vuoto, msg_valido, msg_esistente) = IDENTIFICATIVI[tipo_identificativo]
+    normalizzati = {valore: normalizza(valore) for valore in valori}
+    validi = {
+        normalizzato for normalizzato in normalizzati.values()
+        if normalizzato and errore_formato(normalizzato) is None
+    }
+    registrati = IdentificativoFiscale.objects.cerca_molti(tipo_identificativo, validi)
+
+    esiti = {}
+    for valore, normalizzato in normalizzati.items():
+        if not normalizzato:
+            esiti[valore] = {'valid': False, 'message': msg_vuoto}
+            continue
+        errore = errore_formato(normalizzato)
+        if errore:
+            esiti[valore] = {'valid': False, 'message': errore}
+            continue
+
+        entita = registrati.get(normalizzato, [])
+        if tipo:
+            entita = [
+                (tipo_entita, id_entita) for tipo_entita, id_entita in entita
+                if tipo_entita == tipo and str(id_entita) != str(exclude_id)
+            ]
+        if entita:
+            esiti[valore] = {
+                'valid': False,
+                'message': msg_esistente,
+                'duplicati': [{'tipo': t, 'id': i} for t, i in entita],
+            }
+        else:
+            esiti[valore] = {'valid': True, 'message': msg_valido}
+        esiti[valore]['normalizzato'] = normalizzato
+    return esiti
+
+
 @login_required
 def validate_partita_iva(request):
     """Validazione AJAX partita IVA"""
     piva = request.GET.get('partita_iva', '').strip()
-    
-    if not piva:
-        return JsonResponse({'valid': False, 'message': 'Partita IVA vuota'})
-    
-    if len(piva) != 11 or not piva.isdigit():
-        return JsonResponse({'valid': False, 'message': 'Partita IVA deve essere di 11 cifre'})
-    
-    # Controllo checksum
-    def validate_checksum(piva):
-        total = 0
-        for i, digit in enumerate(piva[:-1]):
-            value = int(digit)
-            if i % 2 == 0:
-                value *= 2
-                if value > 9:
-                    value = (value // 10) + (value % 10)
-            total += value
-        check_digit = (10 - (total % 10)) % 10
-        return int(piva[-1]) == check_digit
-    
-    if not validate_checksum(piva):
-        return JsonResponse({'valid': False, 'message': 'Partita IVA non valida (checksum errato)'})
-    
-    # Verifica se già esiste
-    tipo = request.GET.get('tipo', '')
-    exclude_id = request.GET.get('exclude_id')
-    
-    query = Q(partita_iva=piva)
-    if exclude_id:
-        query &= ~Q(id=exclude_id)
-    
-    if tipo == 'rappresentante':
-        exists = Rappresentante.objects.filter(query).exists()
-    elif tipo == 'cliente':
-        exists = Cliente.objects.filter(query).exists()
-    elif tipo == 'fornitore':
-        exists = Fornitore.objects.filter(query).exists()
-    else:
-        # Cerca in tutti i tipi
-        exists = (Rappresentante.objects.filter(partita_iva=piva).exists() or
-                 Cliente.objects.filter(partita_iva=piva).exists() or
-                 Fornitore.objects.filter(partita_iva=piva).exists())
-    
-    if exists:
-        return JsonResponse({'valid': False, 'message': 'Partita IVA già esistente'})
-    
-    return JsonResponse({'valid': True, 'message': 'Partita IVA valida'})
+    esiti = _verifica_identificativi(
+        'partita_iva', [piva], request.GET.get('tipo', ''), request.GET.get('exclude_id')
+    )
+    return JsonResponse(esiti[piva])
 
 
 @login_required
 def validate_codice_fiscale(request):
     """Validazione AJAX codice fiscale"""
-    cf = request.GET.get('codice_fiscale', '').strip().upper()
-    
-    if not cf:
-        return JsonResponse({'valid': False, 'message': 'Codice fiscale vuoto'})
-    
-    if len(cf) not in [11, 16]:
-        return JsonResponse({'valid': False, 'message': 'Codice fiscale deve essere di 11 o 16 caratteri'})
-    
-    # Validazione formato
-    import re
-    if len(cf) == 16:
-        pattern = r'^[A-Z]{6}[0-9]{2}[A-Z][0-9]{2}[A-Z][0-9]{3}[A-Z]$'
-        if not re.match(pattern, cf):
-            return JsonResponse({'valid': False, 'message': 'Formato codice fiscale non valido'})
-    elif len(cf) == 11:
-        if not cf.isdigit():
-            return JsonResponse({'valid': False, 'message': 'Codice fiscale persona giuridica non valido'})
-    
-    # Verifica se già esiste
-    tipo = request.GET.get('tipo', '')
-    exclude_id = request.GET.get('exclude_id')
-    
-    query = Q(codice_fiscale=cf)
-    if exclude_id:
-        query &= ~Q(id=exclude_id)
-    
-    if tipo == 'rappresentante':
-        exists = Rappresentante.objects.filter(query).exists()
-    elif tipo == 'cliente':
-        exists = Cliente.objects.filter(query).exists()
-    elif tipo == 'fornitore':
-        exists = Fornitore.objects.filter(query).exists()
-    else:
-        # Cerca in tutti i tipi
-        exists = (Rappresentante.objects.filter(codice_fiscale=cf).exists() or
-                 Cliente.objects.filter(codice_fiscale=cf).exists() or
-                 Fornitore.objects.filter(codice_fiscale=cf).exists())
-    
-    if exists:
-        return JsonResponse({'valid': False, 'message': 'Codice fiscale già esistente'})
-    
-    return JsonResponse({'valid': True, 'message': 'Codice fiscale valido'})
+    cf = request.GET.get('codice_fiscale', '').strip()
+    esiti = _verifica_identificativi(
+        'codice_fiscale', [cf], request.GET.get('tipo', ''), request.GET.get('exclude_id')
+    )
+    return JsonResponse(esiti[cf])
+
+
+@login_required
+@require_POST
+def validate_identificativi_batch(request):
+    """
+    Validazione di molti identificativi in una richiesta.
+    Body JSON: {"partite_iva": [...], "codici_fiscali": [...], "tipo": "cliente"}
+    Risposta: {"partite_iva": {valore: esito}, "codici_fiscali": {valore: esito}}
+    """
+    try:
+        dati = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'error': 'JSON non valido'}, status=400)
+
+    liste = {
+        'partite_iva': dati.get('partite_iva') or [],
+        'codici_fiscali': dati.get('codici_fiscali') or [],
+    }
+    if not all(isinstance(lista, list) for lista in liste.values()):
+        return JsonResponse({'error': 'partite_iva e codici_fiscali devono essere liste'}, status=400)
+    if sum(len(lista) for lista in liste.values()) > MAX_IDENTIFICATIVI_BATCH:
+        return JsonResponse(
+            {'error': f'Massimo {MAX_IDENTIFICATIVI_BATCH} identificativi per richiesta'}, status=400
+        )
+
+    tipo = dati.get('tipo', '')
+    return JsonResponse({
+        'partite_iva': _verifica_identificativi(
+            'partita_iva', [str(v).strip() for v in liste['partite_iva']], tipo
+        ),
+        'codici_fiscali': _verifica_identificativi(
+            'codice_fiscale', [str(v).strip() for v in liste['codici_fiscali']], tipo
+        ),
+    })
 
 
 # ========== REPORTS PDF ==========
 
+def _report_pdf(request, tipo):
+    """
+    Report PDF generato in streaming; con ?background=1 la generazione
+    parte in un processo separato e la risposta indica dove scaricare il file
+    """
+    if request.GET.get('background'):
+        nome = report_pdf.avvia_in_background(tipo)
+        return JsonResponse({
+            'stato': 'in_corso',
+            'url': reverse('anagrafica:report_pdf_scarica', args=[nome]),
+        }, status=202)
+
+    classe = report_pdf.REPORT[tipo]
+    return FileResponse(
+        report_pdf.genera_su_file_temporaneo(tipo),
+        as_attachment=True,
+        filename=classe.nome_file,
+        content_type='application/pdf',
+    )
+
+
 @staff_member_required
 def rappresentanti_report_pdf(request):
     """Genera report PDF dei rappresentanti"""
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = 'attachment; filename="rappresentanti_report.pdf"'
-    
-    doc = SimpleDocTemplate(response, pagesize=A4)
-    elements = []
-    styles = getSampleStyleSheet()
-    
-    # Titolo
-    title_style = ParagraphStyle(
-        'TitleStyle',
-        parent=styles['Heading1'],
-        alignment=1,  # Centrato
-        spaceAfter=30,
-    )
-    elements.append(Paragraph("Report Rappresentanti", title_style))
-    elements.append(Spacer(1, 12))
-    
-    # Dati tabella
-    data = [['Nome', 'Ragione Sociale', 'Email', 'Telefone', 'Zona', 'Clienti']]
-    
-    for r in Rappresentante.objects.filter(attivo=True).annotate(clienti_count=Count('clienti')):
-        data.append([
-            r.nome,
-            r.ragione_sociale,
-            r.email,
-            r.telefono,
-            r.zona or '-',
-            str(r.clienti_count)
-        ])
-    
-    # Creazione tabella
-    table = Table(data)
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 14),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black)
-    ]))
-    
-    elements.append(table)
-    doc.build(elements)
-    
-    return response
+    return _report_pdf(request, 'rappresentanti')
 
 
 @staff_member_required
 def clienti_report_pdf(request):
     """Genera report PDF dei clienti"""
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = 'attachment; filename="clienti_report.pdf"'
-    
-    doc = SimpleDocTemplate(response, pagesize=A4)
-    elements = []
-    styles = getSampleStyleSheet()
-    
-    # Titolo
-    title_style = ParagraphStyle(
-        'TitleStyle',
-        parent=styles['Heading1'],
-        alignment=1,
-        spaceAfter=30,
-    )
-    elements.append(Paragraph("Report Clienti", title_style))
-    elements.append(Spacer(1, 12))
-    
-    # Dati tabella
-    data = [['Ragione Sociale', 'Città', 'Email', 'Rappresentante', 'Pagamento']]
-    
-    for c in Cliente.objects.filter(attivo=True).select_related('rappresentante'):
-        data.append([
-            c.ragione_sociale,
-            c.città,
-            c.email,
-            c.rappresentante.nome if c.rappresentante else '-',
-            c.get_pagamento_display()
-        ])
-    
-    # Creazione tabella
-    table = Table(data)
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 12),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black)
-    ]))
-    
-    elements.append(table)
-    doc.build(elements)
-    
-    return response
+    return _report_pdf(request, 'clienti')
 
 
 @staff_member_required
 def fornitori_report_pdf(request):
     """Genera report PDF dei fornitori"""
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = 'attachment; filename="fornitori_report.pdf"'
-    
-    doc = SimpleDocTemplate(response, pagesize=A4)
-    elements = []
-    styles = getSampleStyleSheet()
-    
-    # Titolo
-    title_style = ParagraphStyle(
-        'TitleStyle',
-        parent=styles['Heading1'],
-        alignment=1,
-        spaceAfter=30,
-    )
-    elements.append(Paragraph("Report Fornitori", title_style))
-    elements.append(Spacer(1, 12))
-    
-    # Dati tabella
-    data = [['Ragione Sociale', 'Città', 'Email', 'Categoria', 'Pagamento']]
-    
-    for f in Fornitore.objects.filter(attivo=True):
-        data.append([
-            f.ragione_sociale,
-            f.città,
-            f.email,
-            f.categoria or '-',
-            f.get_pagamento_display()
-        ])
-    
-    # Creazione tabella
-    table = Table(data)
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 12),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black)
-    ]))
-    
-    elements.append(table)
-    doc.build(elements)
-    
-    return response
+    return _report_pdf(request, 'fornitori')
+
+
+@staff_member_required
+def report_pdf_scarica(request, nome):
+    """Download di un report generato in background (202 finché non è pronto)"""
+    stato = report_pdf.stato_report(nome)
+    if stato is None:
+        raise Http404("Report non trovato")
+    if stato == 'pronto':
+        return FileResponse(
+            default_storage.open(report_pdf.percorso_report(nome), 'rb'),
+            as_attachment=True,
+            filename=nome,
+            content_type='application/pdf',
+        )
+    if stato == 'errore':
+        return JsonResponse({'stato': stato, 'error': 'Generazione del report non riuscita'}, status=500)
+    return JsonResponse({'stato': stato}, status=202)
 
 
 # ========== IMPORT/EXPORT ==========
 
-class ImportClientiView(TemplateView):
+class ImportClientiView(LoginRequiredMixin, StaffRequiredMixin, TemplateView):
     """Vista per importazione clienti da CSV"""
     template_name = 'anagrafica/import/clienti.html'
-    
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['campi'] = ImportazioneClienti.CAMPI
+        return context
+
     def post(self, request, *args, **kwargs):
         if 'file' not in request.FILES:
             messages.error(request, 'Nessun file selezionato')
             return self.get(request, *args, **kwargs)
-        
+
         file = request.FILES['file']
-        if not file.name.endswith('.csv'):
+        if not file.name.lower().endswith('.csv'):
             messages.error(request, 'Il file deve essere in formato CSV')
             return self.get(request, *args, **kwargs)
-        
+
         try:
-            decoded_file = file.read().decode('utf-8')
-            reader = csv.DictReader(io.StringIO(decoded_file))
-            
-            created_count = 0
-            error_count = 0
-            errors = []
-            
-            for row_num, row in enumerate(reader, start=2):
-                try:
-                    # Validazione dati obbligatori
-                    if not row.get('ragione_sociale'):
-                        raise ValueError('Ragione sociale obbligatoria')
-                    
-                    # Cerca rappresentante se specificato
-                    rappresentante = None
-                    if row.get('rappresentante'):
-                        try:
-                            rappresentante = Rappresentante.objects.get(
-                                nome__icontains=row['rappresentante'],
-                                attivo=True
-                            )
-                        except Rappresentante.DoesNotExist:
-                            pass
-                    
-                    # Creazione cliente
-                    cliente = Cliente.objects.create(
-                        rappresentante=rappresentante,
-                        ragione_sociale=row['ragione_sociale'],
-                        indirizzo=row.get('indirizzo', ''),
-                        cap=row.get('cap', ''),
-                        città=row.get('città', ''),
-                        provincia=row.get('provincia', ''),
-                        partita_iva=row.get('partita_iva', ''),
-                        codice_fiscale=row.get('codice_fiscale', ''),
-                        telefono=row.get('telefono', ''),
-                        email=row.get('email', ''),
-                        pagamento=row.get('pagamento', '01'),
-                    )
-                    created_count += 1
-                    
-                except Exception as e:
-                    error_count += 1
-                    errors.append(f"Riga {row_num}: {str(e)}")
-            
-            if created_count > 0:
-                messages.success(request, f'{created_count} clienti importati con successo')
-            
-            if error_count > 0:
-                messages.error(request, f'{error_count} errori durante l\'importazione')
-                for error in errors[:5]:  # Mostra solo i primi 5 errori
-                    messages.error(request, error)
-        
+            importazione = ImportazioneClienti(utente=request.user).esegui(file)
+        except ErroreImportazione as e:
+            messages.error(request, str(e))
+            return self.get(request, *args, **kwargs)
         except Exception as e:
             messages.error(request, f'Errore durante l\'importazione: {str(e)}')
-        
-        return self.get(request, *args, **kwargs)
+            return self.get(request, *args, **kwargs)
+
+        if importazione.importati:
+            messages.success(request, f'{importazione.importati} clienti importati con successo')
+        if importazione.scartati:
+            messages.error(request, f'{importazione.scartati} righe scartate: scaricare il report per i dettagli')
+        elif importazione.avvisi:
+            messages.warning(request, f'{importazione.avvisi} righe importate con avvisi')
+
+        return self.render_to_response(self.get_context_data(importazione=importazione))
 
 
-class ImportFornitoriView(TemplateView):
-    """Vista per importazione fornitori da CSV"""
+@staff_member_required
+def download_report_import(request, nome):
+    """Download del report righe scartate/avvisi di un'importazione"""
+    percorso = percorso_report(nome)
+    if percorso is None or not default_storage.exists(percorso):
+        raise Http404('Report non trovato')
+    return FileResponse(default_storage.open(percorso, 'rb'), as_attachment=True, filename=nome)
+
+
+class ImportFornitoriView(LoginRequiredMixin, StaffRequiredMixin, TemplateView):
+    """Vista per sincronizzazione fornitori da CSV (inserisce e aggiorna solo le righe cambiate)"""
     template_name = 'anagrafica/import/fornitori.html'
-    
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['campi'] = SincronizzazioneFornitori.CAMPI
+        return context
+
     def post(self, request, *args, **kwargs):
-        # Implementazione simile a ImportClientiView
-        pass
+        if 'file' not in request.FILES:
+            messages.error(request, 'Nessun file selezionato')
+            return self.get(request, *args, **kwargs)
+
+        file = request.FILES['file']
+        if not file.name.lower().endswith('.csv'):
+            messages.error(request, 'Il file deve essere in formato CSV')
+            return self.get(request, *args, **kwargs)
+
+        dry_run = bool(request.POST.get('dry_run'))
+        try:
+            sincronizzazione = SincronizzazioneFornitori(dry_run=dry_run).esegui(file)
+        except ErroreImportazione as e:
+            messages.error(request, str(e))
+            return self.get(request, *args, **kwargs)
+        except Exception as e:
+            messages.error(request, f'Errore durante la sincronizzazione: {str(e)}')
+            return self.get(request, *args, **kwargs)
+
+        esito = (
+            f'{sincronizzazione.inseriti} inseriti, {sincronizzazione.aggiornati} aggiornati, '
+            f'{sincronizzazione.invariati} invariati'
+        )
+        if dry_run:
+            messages.info(request, f'Simulazione: {esito}. Nessuna modifica salvata')
+        else:
+            messages.success(request, f'Fornitori sincronizzati: {esito}')
+        if sincronizzazione.scartati:
+            messages.error(request, f'{sincronizzazione.scartati} righe scartate: scaricare il report per i dettagli')
+
+        return self.render_to_response(self.get_context_data(sincronizzazione=sincronizzazione))
+
+
+# ========== DUPLICATI ==========
+
+class DuplicatiListView(LoginRequiredMixin, StaffRequiredMixin, ListView):
+    """Coda di revisione dei possibili duplicati, ordinata per punteggio"""
+    model = PossibileDuplicato
+    template_name = 'anagrafica/duplicati/elenco.html'
+    context_object_name = 'coppie'
+    paginate_by = 25
+
+    def get_queryset(self):
+        queryset = PossibileDuplicato.objects.filter(
+            stato=self.request.GET.get('stato', 'da_verificare')
+        )
+        tipo = self.request.GET.get('tipo')
+        if tipo:
+            queryset = queryset.filter(tipo_entita=tipo)
+        return queryset
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        PossibileDuplicato.con_record(context['coppie'])
+        context['stato'] = self.request.GET.get('stato', 'da_verificare')
+        context['tipo'] = self.request.GET.get('tipo', '')
+        context['stati'] = PossibileDuplicato.STATO_CHOICES
+        context['tipi'] = PossibileDuplicato.TIPO_ENTITA_CHOICES
+        return context
+
+
+@staff_member_required
+@require_POST
+def unisci_duplicato(request, pk):
+    """Unisce la coppia mantenendo il record scelto come principale"""
+    coppia = get_object_or_404(PossibileDuplicato, pk=pk, stato='da_verificare')
+    PossibileDuplicato.con_record([coppia])
+    if coppia.record_a is None or coppia.record_b is None:
+        coppia.delete()
+        messages.warning(request, 'Uno dei due record non esiste più: coppia rimossa dalla coda')
+        return redirect('anagrafica:duplicati')
+
+    if request.POST.get('principale') == 'b':
+        principale, duplicato = coppia.record_b, coppia.record_a
+    else:
+        principale, duplicato = coppia.record_a, coppia.record_b
+
+    try:
+        unisci(principale, duplicato)
+    except ProtectedError:
+        messages.error(request, f'{duplicato} ha dati collegati che impediscono l\'unione')
+    except ValueError as e:
+        messages.error(request, str(e))
+    else:
+        messages.success(request, f'{duplicato} unito in {principale}')
+    return redirect(request.META.get('HTTP_REFERER') or 'anagrafica:duplicati')
+
+
+@staff_member_required
+@require_POST
+def scarta_duplicato(request, pk):
+    """Segna la coppia come non duplicata: non verrà più proposta"""
+    coppia = get_object_or_404(PossibileDuplicato, pk=pk)
+    coppia.stato = 'scartato'
+    coppia.save(update_fields=['stato', 'updated_at'])
+    messages.success(request, 'Coppia segnata come non duplicata')
+    return redirect(request.META.get('HTTP_REFERER') or 'anagrafica:duplicati')
 
 
 # ========== OPERAZIONI BATCH ==========
@@ -4,4 +4,8 @@ from .models import *
 admin.site.register(Automezzo)
 admin.site.register(Manutenzione)
 admin.site.register(EventoAutomezzo)
-admin.site.register(Rifornimento)
\ No newline at end of file
+admin.site.register(Rifornimento)
+admin.site.register(StatisticheAutomezzo)
+admin.site.register(TipoCarburante)
+admin.site.register(PrezzoCarburante)
+admin.site.register(AnomaliaRifornimento)
@@ -0,0 +1,278 @@
+# automezzi/aggregati.py
+"""
+Aggregati progressivi per automezzo, aggiornati a ogni scrittura.
+
+Ogni inserimento, modifica o eliminazione di Rifornimento, Manutenzione
+o EventoAutomezzo aggiorna la riga StatisticheAutomezzo del mezzo in
+tempo costante: contatori e somme ricevono la differenza, minimi e
+massimi il confronto con il nuovo valore. Solo quando si elimina il
+valore estremo (km minimo/massimo, ultima data) quel singolo valore
+viene riletto dal database.
+
+La finestra dei consumi recenti contiene gli ultimi
+FINESTRA_CONSUMI rifornimenti del mezzo ([pk, data, km, litri]) e da
+essa si ricava consumo_recente, vuoto se fuori da CONSUMO_MINIMO -
+CONSUMO_MASSIMO come i consumi di automezzi/statistiche.py.
+
+Le scritture massive (bulk_create, update) non inviano segnali: dopo
+di esse va chiamato ricalcola() sugli automezzi coinvolti.
+"""
+from decimal import Decimal
+
+from django.apps import apps as django_apps
+from django.db import transaction
+from django.db.models import Count, F, Max, Min, Q, Sum, Window
+from django.db.models.functions import RowNumber
+
+from .statistiche import CONSUMO_MASSIMO, CONSUMO_MINIMO
+
+FINESTRA_CONSUMI = 10
+ZERO = Decimal('0.00')
+
+CAMPI_AGGREGATI = [
+    'numero_rifornimenti', 'litri_totali', 'costo_carburante_totale', 'km_minimo', 'km_massimo',
+    'ultimo_rifornimento', 'finestra_consumi', 'consumo_recente',
+    'numero_manutenzioni', 'costo_manutenzioni_totale', 'ultima_manutenzione',
+    'numero_eventi', 'costo_eventi_totale',
+]
+
+
+def _voce_finestra(pk, data, chilometri, litri):
+    return [pk, data.isoformat(), chilometri, str(litri)]
+
+
+def consumo_finestra(finestra):
+    """
+    L/100km della finestra: litri dei rifornimenti successivi al primo
+    sui km percorsi dal primo all'ultimo (metodo del pieno). None se il
+    valore è fuori da CONSUMO_MINIMO - CONSUMO_MASSIMO (km inseriti male).
+    """
+    if len(finestra) < 2:
+        return None
+    km = finestra[-1][2] - finestra[0][2]
+    if km <= 0:
+        return None
+    litri = sum(Decimal(voce[3]) for voce in finestra[1:])
+    consumo = (litri * 100 / km).quantize(Decimal('0.01'))
+    if not CONSUMO_MINIMO <= consumo <= CONSUMO_MASSIMO:
+        return None
+    return consumo
+
+
+def _statistiche_bloccate(automezzo_id):
+    """Riga statistiche del mezzo, creata se manca e bloccata fino al commit"""
+    from .models import StatisticheAutomezzo
+
+    try:
+        return StatisticheAutomezzo.objects.select_for_update().get(automezzo_id=automezzo_id)
+    except StatisticheAutomezzo.DoesNotExist:
+        StatisticheAutomezzo.objects.get_or_create(automezzo_id=automezzo_id)
+        return StatisticheAutomezzo.objects.select_for_update().get(automezzo_id=automezzo_id)
+
+
+# ========== RIFORNIMENTI ==========
+
+def _aggiungi_rifornimento(statistiche, valori):
+    statistiche.numero_rifornimenti += 1
+    statistiche.litri_totali += valori['litri']
+    statistiche.costo_carburante_totale += valori['costo_totale']
+    km = valori['chilometri']
+    statistiche.km_minimo = km if statistiche.km_minimo is None else min(statistiche.km_minimo, km)
+    statistiche.km_massimo = km if statistiche.km_massimo is None else max(statistiche.km_massimo, km)
+    if statistiche.ultimo_rifornimento is None or valori['data'] > statistiche.ultimo_rifornimento:
+        statistiche.ultimo_rifornimento = valori['data']
+
+    voce = _voce_finestra(valori['pk'], valori['data'], km, valori['litri'])
+    finestra = [v for v in statistiche.finestra_consumi if v[0] != valori['pk']]
+    if len(finestra) < FINESTRA_CONSUMI or (voce[1], voce[2]) > (finestra[0][1], finestra[0][2]):
+        finestra.append(voce)
+        finestra.sort(key=lambda v: (v[1], v[2], v[0]))
+        finestra = finestra[-FINESTRA_CONSUMI:]
+    statistiche.finestra_consumi = finestra
+
+
+def _togli_rifornimento(statistiche, valori):
+    from .models import Rifornimento
+
+    statistiche.numero_rifornimenti = max(statistiche.numero_rifornimenti - 1, 0)
+    statistiche.litri_totali -= valori['litri']
+    statistiche.costo_carburante_totale -= valori['costo_totale']
+
+    rifornimenti = Rifornimento.objects.filter(automezzo_id=statistiche.automezzo_id)
+    if valori['chilometri'] in (statistiche.km_minimo, statistiche.km_massimo):
+        estremi = rifornimenti.aggregate(km_minimo=Min('chilometri'), km_massimo=Max('chilometri'))
+        statistiche.km_minimo, statistiche.km_massimo = estremi['km_minimo'], estremi['km_massimo']
+    if valori['data'] == statistiche.ultimo_rifornimento:
+        statistiche.ultimo_rifornimento = rifornimenti.aggregate(ultimo=Max('data'))['ultimo']
+    if any(voce[0] == valori['pk'] for voce in statistiche.finestra_consumi):
+        statistiche.finestra_consumi = _finestre({statistiche.automezzo_id}).get(statistiche.automezzo_id, [])
+
+
+# ========== MANUTENZIONI ED EVENTI ==========
+
+def _aggiungi_manutenzione(statistiche, valori):
+    statistiche.numero_manutenzioni += 1
+    statistiche.costo_manutenzioni_totale += valori['costo']
+    if valori['completata'] and (
+        statistiche.ultima_manutenzione is None or valori['data'] > statistiche.ultima_manutenzione
+    ):
+        statistiche.ultima_manutenzione = valori['data']
+
+
+def _togli_manutenzione(statistiche, valori):
+    from .models import Manutenzione
+
+    statistiche.numero_manutenzioni = max(statistiche.numero_manutenzioni - 1, 0)
+    statistiche.costo_manutenzioni_totale -= valori['costo']
+    if valori['completata'] and valori['data'] == statistiche.ultima_manutenzione:
+        statistiche.ultima_manutenzione = Manutenzione.objects.filter(
+            automezzo_id=statistiche.automezzo_id, completata=True
+        ).aggregate(ultima=Max('data'))['ultima']
+
+
+def _aggiungi_evento(statistiche, valori):
+    statistiche.numero_eventi += 1
+    statistiche.costo_eventi_totale += valori['costo'] or ZERO
+
+
+def _togli_evento(statistiche, valori):
+    statistiche.numero_eventi = max(statistiche.numero_eventi - 1, 0)
+    statistiche.costo_eventi_totale -= valori['costo'] or ZERO
+
+
+OPERAZIONI = {
+    'rifornimento': (('pk', 'automezzo_id', 'data', 'litri', 'costo_totale', 'chilometri'),
+                     _aggiungi_rifornimento, _togli_rifornimento),
+    'manutenzione': (('pk', 'automezzo_id', 'data', 'costo', 'completata'),
+                     _aggiungi_manutenzione, _togli_manutenzione),
+    'eventoautomezzo': (('pk', 'automezzo_id', 'costo'),
+                        _aggiungi_evento, _togli_evento),
+}
+
+
+def valori_istanza(istanza):
+    """Valori di un'istanza che contribuiscono agli aggregati"""
+    campi = OPERAZIONI[istanza._meta.model_name][0]
+    # to_python: i valori assegnati a mano (es. stringhe) diventano come quelli letti dal database
+    return {
+        campo: getattr(istanza, campo) if campo == 'pk' else istanza._meta.get_field(campo).to_python(getattr(istanza, campo))
+        for campo in campi
+    }
+
+
+def valori_salvati(istanza):
+    """Valori della riga com'è nel database, prima della modifica (None se nuova)"""
+    if istanza.pk is None:
+        return None
+    campi = OPERAZIONI[istanza._meta.model_name][0]
+    return type(istanza)._base_manager.filter(pk=istanza.pk).values(*campi).first()
+
+
+def applica(nome_modello, prima=None, dopo=None):
+    """
+    Aggiorna gli aggregati togliendo il contributo `prima` (riga modificata
+    o eliminata) e aggiungendo `dopo` (riga inserita o modificata).
+    """
+    _, aggiungi, togli = OPERAZIONI[nome_modello]
+    if prima is not None and dopo is not None and prima == dopo:
+        return
+
+    with transaction.atomic():
+        per_automezzo = {}
+        for valori, operazione in ((prima, togli), (dopo, aggiungi)):
+            if valori is None:
+                continue
+            automezzo_id = valori['automezzo_id']
+            if automezzo_id not in per_automezzo:
+                per_automezzo[automezzo_id] = _statistiche_bloccate(automezzo_id)
+            operazione(per_automezzo[automezzo_id], valori)
+
+        for statistiche in per_automezzo.values():
+            statistiche.consumo_recente = consumo_finestra(statistiche.finestra_consumi)
+            statistiche.save(update_fields=CAMPI_AGGREGATI)
+
+
+# ========== RICALCOLO COMPLETO ==========
+
+def _finestre(automezzo_ids, apps=None):
+    """Ultimi FINESTRA_CONSUMI rifornimenti di ogni mezzo, in una query"""
+    Rifornimento = (apps or django_apps).get_model('automezzi', 'Rifornimento')
+    righe = Rifornimento.objects.filter(automezzo_id__in=automezzo_ids).annotate(
+        posizione=Window(
+            RowNumber(),
+            partition_by=[F('automezzo_id')],
+            order_by=[F('data').desc(), F('chilometri').desc(), F('pk').desc()],
+        ),
+    ).filter(posizione__lte=FINESTRA_CONSUMI).values_list('automezzo_id', 'pk', 'data', 'chilometri', 'litri')
+
+    finestre = {}
+    for automezzo_id, pk, data, chilometri, litri in righe:
+        finestre.setdefault(automezzo_id, []).append(_voce_finestra(pk, data, chilometri, litri))
+    for finestra in finestre.values():
+        finestra.sort(key=lambda v: (v[1], v[2], v[0]))
+    return finestre
+
+
+def ricalcola(automezzo_ids=None, apps=None):
+    """
+    Ricalcola da zero gli aggregati degli automezzi indicati (tutti se None)
+    con una query per tabella; da usare dopo scritture massive o per
+    riallineare i valori. `apps` permette l'uso dalle migrazioni.
+    """
+    registro = apps or django_apps
+    Automezzo = registro.get_model('automezzi', 'Automezzo')
+    Rifornimento = registro.get_model('automezzi', 'Rifornimento')
+    Manutenzione = registro.get_model('automezzi', 'Manutenzione')
+    EventoAutomezzo = registro.get_model('automezzi', 'EventoAutomezzo')
+    StatisticheAutomezzo = registro.get_model('automezzi', 'StatisticheAutomezzo')
+
+    automezzi = Automezzo.objects.all()
+    if automezzo_ids is not None:
+        automezzi = automezzi.filter(pk__in=automezzo_ids)
+    ids = list(automezzi.values_list('pk', flat=True))
+    if not ids:
+        return 0
+
+    valori = {automezzo_id: {
+        'numero_rifornimenti': 0, 'litri_totali': ZERO, 'costo_carburante_totale': ZERO,
+        'km_minimo': None, 'km_massimo': None, 'ultimo_rifornimento': None, 'finestra_consumi': [],
+        'numero_manutenzioni': 0, 'costo_manutenzioni_totale': ZERO, 'ultima_manutenzione': None,
+        'numero_eventi': 0, 'costo_eventi_totale': ZERO,
+    } for automezzo_id in ids}
+
+    for riga in Rifornimento.objects.filter(automezzo_id__in=ids).values('automezzo_id').annotate(
+        numero_rifornimenti=Count('pk'), litri_totali=Sum('litri'), costo_carburante_totale=Sum('costo_totale'),
+        km_minimo=Min('chilometri'), km_massimo=Max('chilometri'), ultimo_rifornimento=Max('data'),
+    ).order_by():
+        valori[riga.pop('automezzo_id')].update(riga)
+
+    for riga in Manutenzione.objects.filter(automezzo_id__in=ids).values('automezzo_id').annotate(
+        numero_manutenzioni=Count('pk'), costo_manutenzioni_totale=Sum('costo'),
+        ultima_manutenzione=Max('data', filter=Q(completata=True)),
+    ).order_by():
+        valori[riga.pop('automezzo_id')].update(riga)
+
+    for riga in EventoAutomezzo.objects.filter(automezzo_id__in=ids).values('automezzo_id').annotate(
+        numero_eventi=Count('pk'), costo_eventi_totale=Sum('costo'),
+    ).order_by():
+        riga['costo_eventi_totale'] = riga['costo_eventi_totale'] or ZERO
+        valori[riga.pop('automezzo_id')].update(riga)
+
+    for automezzo_id, finestra in _finestre(ids, apps).items():
+        valori[automezzo_id]['finestra_consumi'] = finestra
+    for aggregati in valori.values():
+        aggregati['consumo_recente'] = consumo_finestra(aggregati['finestra_consumi'])
+
+    with transaction.atomic():
+        esistenti = {s.automezzo_id: s for s in StatisticheAutomezzo.objects.filter(automezzo_id__in=ids)}
+        nuove = []
+        for automezzo_id, aggregati in valori.items():
+            statistiche = esistenti.get(automezzo_id)
+            if statistiche is None:
+                nuove.append(StatisticheAutomezzo(automezzo_id=automezzo_id, **aggregati))
+            else:
+                for campo, valore in aggregati.items():
+                    setattr(statistiche, campo, valore)
+        StatisticheAutomezzo.objects.bulk_create(nuove, batch_size=1000)
+        StatisticheAutomezzo.objects.bulk_update(list(esistenti.values()), CAMPI_AGGREGATI, batch_size=1000)
+    return len(ids)
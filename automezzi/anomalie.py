@@ -0,0 +1,163 @@
+# automezzi/anomalie.py
+"""
+Rilevamento dei rifornimenti anomali su tutta la flotta.
+
+I rifornimenti del periodo sono caricati con un solo values_list in un
+array NumPy strutturato, ordinati per automezzo, data e chilometri. Tutto
+il resto è vettoriale, senza cicli sugli automezzi:
+
+- il consumo di ogni tratta è il rapporto tra i litri del rifornimento e
+  i km dal precedente dello stesso automezzo;
+- per ogni automezzo mediana e MAD (deviazione assoluta mediana) dei
+  consumi sono calcolate con un solo ordinamento per (automezzo, valore);
+- lo z-score robusto 0.6745 * (consumo - mediana) / MAD segnala le tratte
+  oltre la soglia: consumo alto (possibile furto) o basso (contachilometri
+  o litri errati); i chilometri che diminuiscono sono segnalati a parte.
+
+Mediana e MAD non sono influenzate dagli stessi valori anomali che si
+cercano, a differenza di media e deviazione standard.
+"""
+from datetime import date, timedelta
+from decimal import Decimal
+
+import numpy as np
+from django.db import transaction
+from django.db.models import FloatField
+from django.db.models.functions import Cast
+
+from .models import AnomaliaRifornimento, Rifornimento
+
+# Soglia sullo z-score robusto (Iglewicz e Hoaglin)
+SOGLIA_PUNTEGGIO = 3.5
+# Sotto questo numero di tratte la mediana di un automezzo non è affidabile
+MINIMO_TRATTE = 5
+# MAD e deviazione media assoluta riportate alla scala della deviazione standard
+COSTANTE_MAD = 0.6745
+COSTANTE_DEVIAZIONE_MEDIA = 0.7979
+DIMENSIONE_BLOCCO = 20000
+
+TIPO_RIGA = np.dtype([('automezzo', 'i8'), ('pk', 'i8'), ('km', 'i8'), ('litri', 'f8')])
+
+
+def carica(inizio, fine, automezzi=None):
+    """Rifornimenti del periodo in un array strutturato ordinato per automezzo, data, km"""
+    rifornimenti = Rifornimento.objects.filter(data__range=(inizio, fine))
+    if automezzi is not None:
+        rifornimenti = rifornimenti.filter(automezzo_id__in=automezzi)
+    righe = rifornimenti.order_by('automezzo_id', 'data', 'chilometri', 'pk').values_list(
+        'automezzo_id', 'pk', 'chilometri', Cast('litri', FloatField()),
+    )
+    return np.fromiter(righe.iterator(chunk_size=DIMENSIONE_BLOCCO), dtype=TIPO_RIGA)
+
+
+def mediane(gruppi, valori):
+    """
+    Mediana di `valori` per ogni gruppo: `gruppi` sono codici 0..n-1 tutti
+    presenti (es. l'inverse di np.unique). Un solo ordinamento per tutti i gruppi.
+    """
+    # Gruppo e valore in una sola chiave float: un argsort costa molto meno di
+    # lexsort e l'arrotondamento della chiave è trascurabile sui consumi
+    chiave = gruppi * (np.ptp(valori) + 1.0) + (valori - valori.min())
+    ordinati = valori[np.argsort(chiave)]
+    conteggi = np.bincount(gruppi)
+    inizi = np.cumsum(conteggi) - conteggi
+    return (ordinati[inizi + (conteggi - 1) // 2] + ordinati[inizi + conteggi // 2]) / 2
+
+
+def punteggi_robusti(gruppi, valori):
+    """
+    z-score robusto di ogni valore rispetto al suo gruppo. Se più di metà dei
+    valori coincide la MAD è zero: si usa la deviazione media assoluta.
+    Restituisce (punteggi, mediana del gruppo di ogni valore).
+    """
+    mediana = mediane(gruppi, valori)[gruppi]
+    scarti = np.abs(valori - mediana)
+    mad = mediane(gruppi, scarti)[gruppi]
+    deviazione_media = (np.bincount(gruppi, weights=scarti) / np.bincount(gruppi))[gruppi]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        punteggi = np.where(
+            mad > 0,
+            COSTANTE_MAD * (valori - mediana) / mad,
+            np.where(deviazione_media > 0, COSTANTE_DEVIAZIONE_MEDIA * (valori - mediana) / deviazione_media, 0.0),
+        )
+    return punteggi, mediana
+
+
+def _decimale(valore):
+    return Decimal(f'{valore:.2f}')
+
+
+class RilevamentoAnomalie:
+    """
+    Rileva e salva i rifornimenti anomali del periodo.
+
+    Le segnalazioni non ancora verificate dei rifornimenti del periodo sono
+    sostituite a ogni esecuzione; quelle verificate da un operatore restano.
+
+    Uso:
+        rilevamento = RilevamentoAnomalie(giorni=365).esegui()
+        rilevamento.analizzati, rilevamento.tratte, rilevamento.anomalie
+    """
+
+    def __init__(self, giorni=365, soglia=SOGLIA_PUNTEGGIO, minimo_tratte=MINIMO_TRATTE,
+                 automezzi=None, dry_run=False, oggi=None):
+        self.fine = oggi or date.today()
+        self.inizio = self.fine - timedelta(days=giorni)
+        self.soglia = soglia
+        self.minimo_tratte = minimo_tratte
+        self.automezzi = automezzi
+        self.dry_run = dry_run
+        self.analizzati = self.tratte = self.rimosse = 0
+        self.anomalie = []
+
+    def esegui(self):
+        dati = carica(self.inizio, self.fine, self.automezzi)
+        self.analizzati = len(dati)
+        self.anomalie = self._rileva(dati)
+        if not self.dry_run:
+            self._salva()
+        return self
+
+    def _rileva(self, dati):
+        # Indici dei rifornimenti preceduti da uno dello stesso automezzo
+        successivi = np.flatnonzero(dati['automezzo'][1:] == dati['automezzo'][:-1]) + 1
+        delta_km = dati['km'][successivi] - dati['km'][successivi - 1]
+
+        anomalie = [
+            AnomaliaRifornimento(rifornimento_id=int(pk), automezzo_id=int(automezzo), tipo='km_non_crescenti')
+            for pk, automezzo in zip(dati['pk'][successivi[delta_km < 0]], dati['automezzo'][successivi[delta_km < 0]])
+        ]
+
+        valide = successivi[delta_km > 0]
+        self.tratte = len(valide)
+        if not self.tratte:
+            return anomalie
+        consumi = dati['litri'][valide] * 100.0 / delta_km[delta_km > 0]
+        # Le tratte sono già ordinate per automezzo: i gruppi sono contigui
+        automezzi = dati['automezzo'][valide]
+        gruppi = np.concatenate(([0], np.cumsum(automezzi[1:] != automezzi[:-1])))
+        conteggi = np.bincount(gruppi)
+        punteggi, mediana = punteggi_robusti(gruppi, consumi)
+
+        segnalate = np.flatnonzero((np.abs(punteggi) > self.soglia) & (conteggi[gruppi] >= self.minimo_tratte))
+        for indice in segnalate:
+            riga = dati[valide[indice]]
+            anomalie.append(AnomaliaRifornimento(
+                rifornimento_id=int(riga['pk']),
+                automezzo_id=int(riga['automezzo']),
+                tipo='consumo_alto' if punteggi[indice] > 0 else 'consumo_basso',
+                consumo=_decimale(consumi[indice]),
+                consumo_mediano=_decimale(mediana[indice]),
+                punteggio=round(float(punteggi[indice]), 2),
+            ))
+        return anomalie
+
+    def _salva(self):
+        periodo = AnomaliaRifornimento.objects.filter(rifornimento__data__range=(self.inizio, self.fine))
+        if self.automezzi is not None:
+            periodo = periodo.filter(automezzo_id__in=self.automezzi)
+        with transaction.atomic():
+            self.rimosse, _ = periodo.filter(verificata=False).delete()
+            verificate = set(periodo.filter(verificata=True).values_list('rifornimento_id', flat=True))
+            self.anomalie = [anomalia for anomalia in self.anomalie if anomalia.rifornimento_id not in verificate]
+            AnomaliaRifornimento.objects.bulk_create(self.anomalie, batch_size=1000)
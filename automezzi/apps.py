@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class AutomezziConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'automezzi'
+
+    def ready(self):
+        """Importa i segnali quando l'app è pronta"""
+        import automezzi.signals
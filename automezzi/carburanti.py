@@ -0,0 +1,323 @@
+# automezzi/carburanti.py
+"""
+Importazione in streaming dei prezzi dei carburanti.
+
+Le sorgenti (CSV, JSON, XML) sono lette in modo incrementale e producono
+una riga alla volta {'nome', 'costo_per_litro'}: l'encoding del CSV è
+rilevato una sola volta su un campione iniziale, il JSON è decodificato
+oggetto per oggetto dall'array dei carburanti, l'XML con iterparse
+liberando ogni elemento già letto.
+
+I tipi carburante esistenti sono caricati con una sola query; le righe
+confluiscono in un dizionario per nome (vale l'ultimo prezzo letto) che
+viene scritto con un upsert a lotti (bulk_create con update_conflicts);
+ogni prezzo cambiato aggiunge un punto allo storico (automezzi/prezzi.py).
+Anche un file nazionale con milioni di righe per impianto occupa quindi
+memoria proporzionale ai tipi di carburante, non alle righe.
+"""
+import csv
+import io
+import json
+import xml.etree.ElementTree as ET
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+
+from django.db import transaction
+from django.utils import timezone
+
+from anagrafica.importazione import DIMENSIONE_CAMPIONE, rileva_encoding
+
+from .models import TipoCarburante
+from .prezzi import registra
+
+CAMPI_NOME = ('nome', 'name', 'tipo', 'type', 'carburante', 'fuel', 'fuel_type', 'desccarburante')
+CAMPI_PREZZO = ('prezzo', 'price', 'costo', 'cost', 'costo_per_litro', 'price_per_liter')
+CHIAVI_ARRAY_JSON = ('carburanti', 'fuels', 'data', 'items')
+TAG_XML = ('carburante', 'fuel')
+DIMENSIONE_BLOCCO_JSON = 64 * 1024
+
+
+class ErroreRiga(ValueError):
+    """Riga della sorgente senza nome o prezzo validi"""
+
+
+def converti_prezzo(valore):
+    """Prezzo al litro da stringa ('1,859', '€ 1.859') o numero, con 3 decimali"""
+    if isinstance(valore, str):
+        valore = valore.replace('€', '').replace(',', '.').strip()
+    try:
+        prezzo = Decimal(str(valore)).quantize(Decimal('0.001'))
+    except (InvalidOperation, TypeError, ValueError):
+        raise ErroreRiga(f'Prezzo non valido: {valore!r}')
+    if prezzo < 0:
+        raise ErroreRiga(f'Prezzo negativo: {valore!r}')
+    return prezzo
+
+
+@lru_cache(maxsize=128)
+def _colonne(chiavi):
+    """
+    Colonne di nome e prezzo per un insieme di intestazioni, in ordine di
+    priorità: calcolate una volta per forma di riga, non per ogni riga
+    """
+    normalizzate = {str(chiave).lower().strip(): chiave for chiave in chiavi if chiave is not None}
+    return (
+        [normalizzate[campo] for campo in CAMPI_NOME if campo in normalizzate],
+        [normalizzate[campo] for campo in CAMPI_PREZZO if campo in normalizzate],
+    )
+
+
+def normalizza_riga(riga):
+    """Estrae nome e prezzo da una riga con intestazioni in una delle forme note"""
+    campi_nome, campi_prezzo = _colonne(tuple(riga))
+    nome = next((str(riga[campo]).strip() for campo in campi_nome if riga[campo] not in (None, '')), None)
+    if not nome:
+        raise ErroreRiga(f'Nome carburante non trovato in riga: {riga}')
+    for campo in campi_prezzo:
+        if riga[campo] not in (None, ''):
+            try:
+                return {'nome': nome, 'costo_per_litro': converti_prezzo(riga[campo])}
+            except ErroreRiga:
+                continue
+    raise ErroreRiga(f'Prezzo non valido per {nome}: {riga}')
+
+
+# ========== LETTORI ==========
+
+def leggi_csv(file):
+    """
+    Righe di un CSV aperto in binario. Encoding e separatore sono rilevati
+    una volta sul campione iniziale, poi il file è decodificato a blocchi.
+    """
+    campione = file.read(DIMENSIONE_CAMPIONE)
+    file.seek(0)
+    if not campione:
+        return
+    encoding = rileva_encoding(campione)
+    testo_campione = campione.decode(encoding, errors='ignore')
+    try:
+        separatore = csv.Sniffer().sniff(testo_campione, delimiters=',;\t|').delimiter
+    except csv.Error:
+        intestazione = testo_campione.splitlines()[0]
+        separatore = ';' if intestazione.count(';') > intestazione.count(',') else ','
+
+    testo = io.TextIOWrapper(file, encoding=encoding, newline='')
+    try:
+        for riga in csv.DictReader(testo, delimiter=separatore):
+            yield {k: (v or '').strip() for k, v in riga.items() if k}
+    finally:
+        testo.detach()
+
+
+class _LettoreJSON:
+    """
+    Decodifica incrementale di un documento JSON: restituisce uno alla
+    volta gli elementi dell'array dei carburanti (array radice o valore di
+    una delle CHIAVI_ARRAY_JSON) leggendo il file a blocchi.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.posizione = 0
+        self.finito = False
+
+    def _leggi(self):
+        blocco = self.file.read(DIMENSIONE_BLOCCO_JSON)
+        if not blocco:
+            self.finito = True
+            return False
+        self.buffer = self.buffer[self.posizione:] + blocco
+        self.posizione = 0
+        return True
+
+    def _carattere(self):
+        """Primo carattere significativo, senza consumarlo ('' a fine file)"""
+        while True:
+            while self.posizione < len(self.buffer) and self.buffer[self.posizione].isspace():
+                self.posizione += 1
+            if self.posizione < len(self.buffer):
+                return self.buffer[self.posizione]
+            if not self._leggi():
+                return ''
+
+    def _consuma(self, atteso):
+        if self._carattere() != atteso:
+            raise ValueError(f'JSON non valido: atteso {atteso!r} in posizione {self.posizione}')
+        self.posizione += 1
+
+    def _valore(self):
+        self._carattere()
+        while True:
+            try:
+                valore, fine = self.decoder.raw_decode(self.buffer, self.posizione)
+            except json.JSONDecodeError:
+                if self._leggi():
+                    continue
+                raise ValueError('JSON troncato o non valido')
+            # Un numero a fine buffer potrebbe continuare nel blocco successivo
+            if fine == len(self.buffer) and not self.finito and self._leggi():
+                continue
+            self.posizione = fine
+            return valore
+
+    def _elementi_array(self):
+        self._consuma('[')
+        if self._carattere() == ']':
+            self.posizione += 1
+            return
+        while True:
+            yield self._valore()
+            if self._carattere() == ',':
+                self.posizione += 1
+                continue
+            self._consuma(']')
+            return
+
+    def elementi(self):
+        primo = self._carattere()
+        if primo == '[':
+            yield from self._elementi_array()
+            return
+        if primo != '{':
+            raise ValueError('Formato JSON non riconosciuto')
+
+        # Oggetto radice: si cerca la chiave dell'array, gli altri valori sono saltati
+        self._consuma('{')
+        oggetto = {}
+        while self._carattere() not in ('}', ''):
+            chiave = self._valore()
+            self._consuma(':')
+            if chiave in CHIAVI_ARRAY_JSON and self._carattere() == '[':
+                yield from self._elementi_array()
+                return
+            oggetto[chiave] = self._valore()
+            if self._carattere() == ',':
+                self.posizione += 1
+        # Nessun array: l'oggetto è un singolo carburante
+        yield oggetto
+
+
+def leggi_json(file):
+    """Oggetti dell'array dei carburanti di un JSON aperto in binario"""
+    testo = io.TextIOWrapper(file, encoding='utf-8-sig')
+    try:
+        for elemento in _LettoreJSON(testo).elementi():
+            if isinstance(elemento, dict):
+                yield elemento
+    finally:
+        testo.detach()
+
+
+def leggi_xml(file):
+    """
+    Elementi <carburante>/<fuel> con figli nome/prezzo o attributi
+    nome/prezzo. Ogni elemento letto viene svuotato e staccato dal proprio
+    genitore, a qualunque profondità: la memoria non cresce con la
+    dimensione del file.
+    """
+    aperti = []
+    for evento, elemento in ET.iterparse(file, events=('start', 'end')):
+        if evento == 'start':
+            aperti.append(elemento)
+            continue
+        aperti.pop()
+        if elemento.tag in TAG_XML or (elemento.get('nome') and elemento.get('prezzo')):
+            dati = dict(elemento.attrib)
+            for figlio in elemento:
+                dati.setdefault(figlio.tag, (figlio.text or '').strip())
+            yield dati
+            elemento.clear()
+            if aperti:
+                aperti[-1].remove(elemento)
+
+
+LETTORI = {
+    'csv': leggi_csv,
+    'json': leggi_json,
+    'xml': leggi_xml,
+}
+
+
+# ========== IMPORTAZIONE ==========
+
+class ImportazioneCarburanti:
+    """
+    Upsert dei prezzi per nome carburante a partire da righe in streaming.
+
+    Uso:
+        importazione = ImportazioneCarburanti(update_existing=True)
+        importazione.esegui(leggi_csv(file))
+        importazione.creati, importazione.aggiornati, importazione.errori
+    """
+
+    DIMENSIONE_LOTTO = 1000
+
+    def __init__(self, update_existing=False, create_missing=True, dry_run=False,
+                 dimensione_lotto=None, su_errore=None, data_prezzo=None):
+        self.update_existing = update_existing
+        self.create_missing = create_missing
+        self.dry_run = dry_run
+        self.dimensione_lotto = dimensione_lotto or self.DIMENSIONE_LOTTO
+        self.su_errore = su_errore
+        # Data da cui i prezzi importati sono in vigore nello storico
+        self.data_prezzo = data_prezzo or timezone.localdate()
+        self.righe = self.errori = 0
+        self.creati, self.aggiornati, self.saltati = set(), set(), set()
+
+    def esegui(self, righe):
+        with transaction.atomic():
+            # Una query per tutti i tipi esistenti: nome -> prezzo attuale
+            self.esistenti = dict(TipoCarburante.objects.values_list('nome', 'costo_per_litro'))
+            self.preesistenti = set(self.esistenti)
+            in_sospeso = {}
+            for riga in righe:
+                self.righe += 1
+                try:
+                    dati = normalizza_riga(riga)
+                except ErroreRiga as e:
+                    self.errori += 1
+                    if self.su_errore:
+                        self.su_errore(self.righe, str(e))
+                    continue
+                in_sospeso[dati['nome']] = dati['costo_per_litro']
+                if len(in_sospeso) >= self.dimensione_lotto:
+                    self._scrivi(in_sospeso)
+                    in_sospeso = {}
+            self._scrivi(in_sospeso)
+
+            if self.dry_run:
+                transaction.set_rollback(True)
+        return self
+
+    def _scrivi(self, lotto):
+        adesso = timezone.now()
+        da_scrivere = []
+        for nome, prezzo in lotto.items():
+            preesistente = nome in self.preesistenti
+            if (preesistente and not self.update_existing) or (not preesistente and not self.create_missing):
+                self.saltati.add(nome)
+                continue
+            if self.esistenti.get(nome) == prezzo:
+                if nome not in self.creati and nome not in self.aggiornati:
+                    self.saltati.add(nome)
+                continue
+            (self.aggiornati if preesistente else self.creati).add(nome)
+            self.saltati.discard(nome)
+            self.esistenti[nome] = prezzo
+            da_scrivere.append(TipoCarburante(nome=nome, costo_per_litro=prezzo, data_aggiornamento=adesso))
+
+        if da_scrivere:
+            TipoCarburante.objects.bulk_create(
+                da_scrivere,
+                update_conflicts=True,
+                unique_fields=['nome'],
+                update_fields=['costo_per_litro', 'data_aggiornamento'],
+            )
+            # Storico: un punto per ogni prezzo cambiato (gli id servono anche per i tipi appena creati)
+            nomi = [carburante.nome for carburante in da_scrivere]
+            registra(
+                {pk: self.esistenti[nome] for nome, pk in TipoCarburante.objects.filter(nome__in=nomi).values_list('nome', 'pk')},
+                self.data_prezzo,
+            )
@@ -0,0 +1,211 @@
+# automezzi/carta_carburante.py
+"""
+Importazione degli estratti conto delle carte carburante in Rifornimento.
+
+Il CSV del fornitore è letto in streaming con il lettore dell'anagrafica
+(encoding e separatore rilevati una volta). Le targhe sono abbinate agli
+automezzi con una sola query iniziale; ogni transazione ha come chiave
+(automezzo, data, litri, chilometri): le chiavi già presenti nel database
+sono lette a lotti sull'indice rifornimento_chiave_idx, quelle già viste
+nel file sono scartate come duplicati, le altre inserite con bulk_create.
+
+bulk_create non invia segnali: a fine importazione gli aggregati degli
+automezzi toccati sono ricalcolati con aggregati.ricalcola() e
+chilometri_attuali è aggiornato con un solo UPDATE per tutti i mezzi.
+"""
+import logging
+import re
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import F, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from anagrafica.importazione import converti_decimale, leggi_csv
+
+from .aggregati import ricalcola
+from .models import Automezzo, Rifornimento
+
+logger = logging.getLogger(__name__)
+
+CENTESIMI = Decimal('0.01')
+# Limiti delle colonne di Rifornimento: oltre, l'INSERT fallirebbe con DataError
+MASSIMO_LITRI = Decimal(10) ** 4 - CENTESIMI  # max_digits=6, decimal_places=2
+MASSIMO_COSTO = Decimal(10) ** 5 - CENTESIMI  # max_digits=7, decimal_places=2
+MASSIMO_CHILOMETRI = 2147483647  # PositiveIntegerField
+FORMATI_DATA = ('%d/%m/%Y', '%Y-%m-%d', '%d-%m-%Y', '%d.%m.%Y', '%d/%m/%y')
+
+
+def normalizza_targa(targa):
+    """Targa senza spazi né trattini, in maiuscolo"""
+    return ''.join(carattere for carattere in (targa or '').upper() if carattere.isalnum())
+
+
+def converti_data(valore):
+    """Data della transazione; l'eventuale ora ('12/03/2025 08:15', ISO con 'T') è ignorata"""
+    testo = valore.replace('T', ' ').split(' ')[0]
+    for formato in FORMATI_DATA:
+        try:
+            return datetime.strptime(testo, formato).date()
+        except ValueError:
+            continue
+    raise ValueError(f'Data non valida: {valore!r}')
+
+
+def converti_chilometri(valore):
+    """
+    Chilometri interi (decimali troncati) in formato italiano ('123.456',
+    '123.456,7') o con il punto decimale ('12345.6'): il punto separa le
+    migliaia solo se seguito da gruppi di tre cifre e senza virgola
+    """
+    testo = valore.replace(' ', '')
+    if re.fullmatch(r'\d{1,3}(\.\d{3})+', testo):
+        testo = testo.replace('.', '')
+    try:
+        chilometri = converti_decimale(testo)
+    except InvalidOperation:
+        raise ValueError(f'Chilometri non validi: {valore!r}') from None
+    if not 0 <= chilometri <= MASSIMO_CHILOMETRI:
+        raise ValueError(f'Chilometri fuori intervallo: {valore!r}')
+    return int(chilometri)
+
+
+class ImportazioneCartaCarburante:
+    """
+    Inserimento massivo dei rifornimenti da un estratto conto CSV.
+
+    Uso:
+        importazione = ImportazioneCartaCarburante(dry_run=True).esegui(file)
+        importazione.inseriti, importazione.duplicati, importazione.scartati
+    """
+
+    BATCH_SIZE = 1000
+    # Righe scartate conservate con il motivo (le altre sono solo contate)
+    MAX_ERRORI = 50
+    CAMPI = ['targa', 'data', 'litri', 'costo_totale', 'chilometri']
+    # Intestazioni dei tracciati dei principali emittenti
+    ALIAS = {
+        'targa_veicolo': 'targa',
+        'plate': 'targa',
+        'license_plate': 'targa',
+        'data_transazione': 'data',
+        'data_operazione': 'data',
+        'date': 'data',
+        'quantità': 'litri',
+        'quantita': 'litri',
+        'quantity': 'litri',
+        'volume': 'litri',
+        'importo': 'costo_totale',
+        'importo_totale': 'costo_totale',
+        'totale': 'costo_totale',
+        'amount': 'costo_totale',
+        'km': 'chilometri',
+        'odometro': 'chilometri',
+        'contachilometri': 'chilometri',
+        'mileage': 'chilometri',
+    }
+
+    def __init__(self, dry_run=False, batch_size=None):
+        self.dry_run = dry_run
+        self.batch_size = batch_size or self.BATCH_SIZE
+        self.righe = self.inseriti = self.duplicati = self.scartati = 0
+        self.errori = []
+        self.automezzi = set()
+        self._visti = set()
+
+    def esegui(self, file):
+        # Una query per tutte le targhe: targa normalizzata -> pk
+        self._targhe = {
+            normalizza_targa(targa): pk for targa, pk in Automezzo.objects.values_list('targa', 'pk')
+        }
+
+        with transaction.atomic():
+            lotto = []
+            for numero, dati in leggi_csv(file, self.ALIAS):
+                self.righe += 1
+                try:
+                    chiave, rifornimento = self._prepara(dati)
+                except (ValueError, InvalidOperation) as e:
+                    self._scarta(numero, str(e) or 'Valore non valido')
+                    continue
+                if chiave in self._visti:
+                    self.duplicati += 1
+                    continue
+                self._visti.add(chiave)
+                lotto.append((chiave, rifornimento))
+                if len(lotto) >= self.batch_size:
+                    self._inserisci(lotto)
+                    lotto = []
+            self._inserisci(lotto)
+
+            if self.automezzi and not self.dry_run:
+                ricalcola(self.automezzi)
+                self._aggiorna_chilometri()
+
+        logger.info(
+            f"IMPORT carta carburante{' (dry-run)' if self.dry_run else ''}: "
+            f"{self.inseriti} inseriti, {self.duplicati} duplicati, {self.scartati} scartati"
+        )
+        return self
+
+    def _scarta(self, numero, messaggio):
+        self.scartati += 1
+        if len(self.errori) < self.MAX_ERRORI:
+            self.errori.append((numero, messaggio))
+
+    def _prepara(self, dati):
+        """Valida una riga: restituisce (chiave, Rifornimento) o solleva ValueError"""
+        mancanti = [campo for campo in self.CAMPI if not dati.get(campo)]
+        if mancanti:
+            raise ValueError(f"Campi obbligatori mancanti: {', '.join(mancanti)}")
+
+        automezzo_id = self._targhe.get(normalizza_targa(dati['targa']))
+        if automezzo_id is None:
+            raise ValueError(f"Targa {dati['targa']} non presente in flotta")
+        data = converti_data(dati['data'])
+        # Arrotondati ai due decimali del modello, come nelle chiavi già salvate
+        litri = converti_decimale(dati['litri']).quantize(CENTESIMI)
+        costo = converti_decimale(dati['costo_totale'].replace('€', '').strip()).quantize(CENTESIMI)
+        chilometri = converti_chilometri(dati['chilometri'])
+        if not 0 < litri <= MASSIMO_LITRI:
+            raise ValueError(f"Litri non validi: {dati['litri']!r}")
+        if costo < 0:
+            raise ValueError(f"Importo negativo: {dati['costo_totale']!r}")
+        if costo > MASSIMO_COSTO:
+            raise ValueError(f"Importo fuori intervallo: {dati['costo_totale']!r}")
+
+        chiave = (automezzo_id, data, litri, chilometri)
+        return chiave, Rifornimento(
+            automezzo_id=automezzo_id, data=data, litri=litri, costo_totale=costo, chilometri=chilometri,
+        )
+
+    def _inserisci(self, lotto):
+        if not lotto:
+            return
+        # Una query per le chiavi già registrate sugli automezzi e le date del lotto
+        date = [chiave[1] for chiave, _ in lotto]
+        esistenti = {
+            (automezzo_id, data, Decimal(litri).quantize(CENTESIMI), chilometri)
+            for automezzo_id, data, litri, chilometri in Rifornimento.objects.filter(
+                automezzo_id__in={chiave[0] for chiave, _ in lotto},
+                data__range=(min(date), max(date)),
+            ).values_list('automezzo_id', 'data', 'litri', 'chilometri')
+        }
+        nuovi = [rifornimento for chiave, rifornimento in lotto if chiave not in esistenti]
+        self.duplicati += len(lotto) - len(nuovi)
+        if nuovi and not self.dry_run:
+            Rifornimento.objects.bulk_create(nuovi)
+        self.inseriti += len(nuovi)
+        self.automezzi.update(rifornimento.automezzo_id for rifornimento in nuovi)
+
+    def _aggiorna_chilometri(self):
+        """chilometri_attuali = massimo tra il valore attuale e l'ultimo rifornimento, un solo UPDATE"""
+        km_rifornimenti = Rifornimento.objects.filter(
+            automezzo_id=OuterRef('pk')
+        ).values('automezzo_id').annotate(massimo=Max('chilometri')).values('massimo')
+        Automezzo.objects.filter(pk__in=self.automezzi).update(
+            chilometri_attuali=Greatest(
+                F('chilometri_attuali'), Coalesce(Subquery(km_rifornimenti), F('chilometri_attuali')),
+            )
+        )
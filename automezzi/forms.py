@@ -7,7 +7,8 @@ class AutomezzoForm(forms.ModelForm):
         fields = [
             'targa', 'marca', 'modello', 'anno_immatricolazione', 'chilometri_attuali',
             'attivo', 'disponibile', 'bloccata', 'motivo_blocco',
-            'libretto_fronte', 'libretto_retro', 'assicurazione', 'data_revisione', 'assegnato_a'
+            'libretto_fronte', 'libretto_retro', 'assicurazione', 'data_revisione', 'assegnato_a',
+            'tipo_carburante',
         ]
         widgets = {
             'data_revisione': forms.DateInput(attrs={'type': 'date'}),
@@ -0,0 +1,36 @@
+# automezzi/management/commands/compatta_prezzi_carburante.py
+from django.core.management.base import BaseCommand, CommandError
+
+from automezzi.models import PrezzoCarburante, TipoCarburante
+from automezzi.prezzi import compatta
+
+
+class Command(BaseCommand):
+    help = 'Compatta lo storico prezzi carburante eliminando i prezzi invariati consecutivi'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tipo',
+            type=str,
+            help='Compatta solo il tipo carburante indicato (nome)'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Mostra quante righe verrebbero eliminate senza salvare'
+        )
+
+    def handle(self, *args, **options):
+        tipo_ids = None
+        if options['tipo']:
+            tipo_ids = list(TipoCarburante.objects.filter(nome=options['tipo']).values_list('pk', flat=True))
+            if not tipo_ids:
+                raise CommandError(f'Tipo carburante "{options["tipo"]}" non trovato')
+
+        totale = PrezzoCarburante.objects.count()
+        eliminate = compatta(tipo_ids, dry_run=options['dry_run'])
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(f'🔍 [DRY-RUN] {eliminate} righe su {totale} verrebbero eliminate'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'🗜️  Storico compattato: {eliminate} righe eliminate su {totale}'))
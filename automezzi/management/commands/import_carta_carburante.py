@@ -0,0 +1,56 @@
+# automezzi/management/commands/import_carta_carburante.py
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from anagrafica.importazione import ErroreImportazione
+from automezzi.carta_carburante import ImportazioneCartaCarburante
+
+
+class Command(BaseCommand):
+    help = 'Importa i rifornimenti dall\'estratto conto CSV delle carte carburante'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'file',
+            type=str,
+            help='Path all\'estratto conto CSV'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Mostra cosa verrebbe importato senza salvare'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=ImportazioneCartaCarburante.BATCH_SIZE,
+            help='Transazioni controllate e inserite per lotto (default: %(default)s)'
+        )
+
+    def handle(self, *args, **options):
+        if not os.path.exists(options['file']):
+            raise CommandError(f'File non trovato: {options["file"]}')
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING('🔍 MODALITÀ DRY-RUN - Nessuna modifica verrà salvata\n'))
+
+        try:
+            with open(options['file'], 'rb') as file:
+                importazione = ImportazioneCartaCarburante(
+                    dry_run=options['dry_run'], batch_size=options['batch_size'],
+                ).esegui(file)
+        except ErroreImportazione as e:
+            raise CommandError(str(e))
+
+        for numero, messaggio in importazione.errori:
+            self.stdout.write(self.style.ERROR(f'  ❌ Riga {numero}: {messaggio}'))
+
+        self.stdout.write(f'📄 Transazioni lette: {importazione.righe}')
+        self.stdout.write(f'⛽ Rifornimenti inseriti: {importazione.inseriti}')
+        self.stdout.write(f'⏭ Duplicati: {importazione.duplicati}')
+        self.stdout.write(f'🚚 Automezzi aggiornati: {len(importazione.automezzi)}')
+        if importazione.scartati:
+            self.stdout.write(self.style.WARNING(f'⚠ Righe scartate: {importazione.scartati}'))
+        else:
+            self.stdout.write(self.style.SUCCESS('🎉 Importazione completata!'))
@@ -0,0 +1,71 @@
+# automezzi/management/commands/rileva_anomalie_rifornimenti.py
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from automezzi.anomalie import MINIMO_TRATTE, SOGLIA_PUNTEGGIO, RilevamentoAnomalie
+from automezzi.models import Automezzo
+
+
+class Command(BaseCommand):
+    help = 'Segnala i rifornimenti con consumi anomali (z-score robusto per automezzo)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--giorni',
+            type=int,
+            default=365,
+            help='Giorni di rifornimenti da analizzare (default: 365)'
+        )
+        parser.add_argument(
+            '--soglia',
+            type=float,
+            default=SOGLIA_PUNTEGGIO,
+            help='Soglia sullo z-score robusto (default: %(default)s)'
+        )
+        parser.add_argument(
+            '--minimo-tratte',
+            type=int,
+            default=MINIMO_TRATTE,
+            help='Tratte minime per valutare un automezzo (default: %(default)s)'
+        )
+        parser.add_argument(
+            '--automezzo',
+            type=str,
+            help='Analizza solo l\'automezzo specificato (targa)'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Mostra le anomalie senza salvarle'
+        )
+
+    def handle(self, *args, **options):
+        automezzi = None
+        if options['automezzo']:
+            automezzi = list(Automezzo.objects.filter(targa=options['automezzo']).values_list('pk', flat=True))
+            if not automezzi:
+                raise CommandError(f'Automezzo con targa "{options["automezzo"]}" non trovato')
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING('🔍 MODALITÀ DRY-RUN - Nessuna modifica verrà salvata\n'))
+
+        inizio = time.monotonic()
+        rilevamento = RilevamentoAnomalie(
+            giorni=options['giorni'],
+            soglia=options['soglia'],
+            minimo_tratte=options['minimo_tratte'],
+            automezzi=automezzi,
+            dry_run=options['dry_run'],
+        ).esegui()
+
+        if options['verbosity'] >= 2:
+            for anomalia in rilevamento.anomalie:
+                dettaglio = f' {anomalia.consumo} L/100km (mediana {anomalia.consumo_mediano}, z {anomalia.punteggio})' if anomalia.consumo is not None else ''
+                self.stdout.write(f'  ⚠ Rifornimento {anomalia.rifornimento_id}: {anomalia.get_tipo_display()}{dettaglio}')
+
+        self.stdout.write(f'⛽ Rifornimenti analizzati: {rilevamento.analizzati} ({rilevamento.tratte} tratte)')
+        self.stdout.write(f'🚨 Anomalie: {len(rilevamento.anomalie)}')
+        if not options['dry_run']:
+            self.stdout.write(f'🗑 Segnalazioni precedenti sostituite: {rilevamento.rimosse}')
+        self.stdout.write(self.style.SUCCESS(f'✅ Completato in {time.monotonic() - inizio:.1f}s'))
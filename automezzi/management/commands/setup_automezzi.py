@@ -1,7 +1,5 @@
 # automezzi/management/commands/setup_automezzi.py
 from django.core.management.base import BaseCommand, CommandError
-from django.contrib.auth.models import Group, Permission
-from django.contrib.contenttypes.models import ContentType
 from django.utils import timezone
 from datetime import date, timedelta
 from decimal import Decimal
@@ -10,13 +8,12 @@ import random
 from automezzi.models import (
     TipoCarburante,
     Automezzo,
-    DocumentoAutomezzo,
     Manutenzione,
-    RifornimentoCarburante,
     EventoAutomezzo,
     StatisticheAutomezzo
 )
 from dipendenti.models import Dipendente
+from dipendenti.ruoli import RUOLI_AUTOMEZZI, SincronizzazioneRuoli
 
 
 class Command(BaseCommand):
@@ -98,106 +95,20 @@ class Command(BaseCommand):
         self.stdout.write(f'  📊 Totale creati: {created_count}/5\n')
 
     def create_groups_and_permissions(self):
-        """Crea gruppi e assegna permessi"""
+        """Crea i gruppi degli automezzi e aggiunge i permessi mancanti della specifica in dipendenti/ruoli.py"""
         self.stdout.write('👥 Creazione gruppi e permessi...')
 
-        # Definizione gruppi e permessi
-        groups_permissions = {
-            'Gestori Automezzi': {
-                'description': 'Accesso completo alla gestione automezzi',
-                'permissions': [
-                    # Automezzi
-                    'add_automezzo', 'change_automezzo', 'delete_automezzo', 'view_automezzo',
-                    # Documenti
-                    'add_documentoautomezzo', 'change_documentoautomezzo', 
-                    'delete_documentoautomezzo', 'view_documentoautomezzo',
-                    # Manutenzioni
-                    'add_manutenzione', 'change_manutenzione', 
-                    'delete_manutenzione', 'view_manutenzione',
-                    # Rifornimenti
-                    'add_rifornimentocarburante', 'change_rifornimentocarburante',
-                    'delete_rifornimentocarburante', 'view_rifornimentocarburante',
-                    # Eventi
-                    'add_eventoautomezzo', 'change_eventoautomezzo',
-                    'delete_eventoautomezzo', 'view_eventoautomezzo',
-                    # Tipi carburante
-                    'add_tipocarburante', 'change_tipocarburante',
-                    'delete_tipocarburante', 'view_tipocarburante',
-                    # Statistiche
-                    'view_statisticheautomezzo',
-                ]
-            },
-            'Operatori Automezzi': {
-                'description': 'Gestione operativa automezzi (no eliminazione)',
-                'permissions': [
-                    # Automezzi - solo lettura e modifica
-                    'change_automezzo', 'view_automezzo',
-                    # Documenti - gestione completa tranne cancellazione
-                    'add_documentoautomezzo', 'change_documentoautomezzo', 'view_documentoautomezzo',
-                    # Manutenzioni - gestione completa
-                    'add_manutenzione', 'change_manutenzione', 'view_manutenzione',
-                    # Rifornimenti - gestione completa
-                    'add_rifornimentocarburante', 'change_rifornimentocarburante', 'view_rifornimentocarburante',
-                    # Eventi - gestione completa
-                    'add_eventoautomezzo', 'change_eventoautomezzo', 'view_eventoautomezzo',
-                    # Tipi carburante - solo lettura
-                    'view_tipocarburante',
-                    # Statistiche - solo lettura
-                    'view_statisticheautomezzo',
-                ]
-            },
-            'Autisti': {
-                'description': 'Accesso limitato per autisti (solo propri veicoli)',
-                'permissions': [
-                    # Rifornimenti per i propri veicoli
-                    'add_rifornimentocarburante', 'view_rifornimentocarburante',
-                    # Eventi per i propri veicoli
-                    'add_eventoautomezzo', 'view_eventoautomezzo',
-                    # Visualizzazione automezzo assegnato
-                    'view_automezzo',
-                    # Visualizzazione documenti
-                    'view_documentoautomezzo',
-                    # Visualizzazione manutenzioni
-                    'view_manutenzione',
-                ]
-            }
-        }
-
-        created_groups = 0
-        for group_name, group_data in groups_permissions.items():
-            group, created = Group.objects.get_or_create(name=group_name)
-            
-            if created:
-                created_groups += 1
+        sync = SincronizzazioneRuoli(gruppi=RUOLI_AUTOMEZZI, rimuovi=False).esegui()
+        for group_name in RUOLI_AUTOMEZZI:
+            if group_name in sync.gruppi_creati:
                 self.stdout.write(f'  ✓ Gruppo creato: {group_name}')
             else:
                 self.stdout.write(f'  - Gruppo esistente: {group_name}')
+        for schema in sync.sconosciuti:
+            self.stdout.write(self.style.WARNING(f'    ⚠ Permesso non trovato: {schema}'))
 
-            # Assegna permessi
-            permissions_added = 0
-            for perm_codename in group_data['permissions']:
-                try:
-                    # Trova il content type dall'app automezzi
-                    content_type = ContentType.objects.get(
-                        app_label='automezzi',
-                        model=perm_codename.split('_')[1]
-                    )
-                    permission = Permission.objects.get(
-                        codename=perm_codename,
-                        content_type=content_type
-                    )
-                    group.permissions.add(permission)
-                    permissions_added += 1
-                except (Permission.DoesNotExist, ContentType.DoesNotExist):
-                    self.stdout.write(
-                        self.style.WARNING(
-                            f'    ⚠ Permesso non trovato: {perm_codename}'
-                        )
-                    )
-
-            self.stdout.write(f'    📝 Permessi assegnati: {permissions_added}')
-
-        self.stdout.write(f'  📊 Gruppi creati: {created_groups}/3\n')
+        self.stdout.write(f'    📝 Permessi aggiunti: {sync.aggiunti}')
+        self.stdout.write(f'  📊 Gruppi creati: {len(sync.gruppi_creati)}/{len(RUOLI_AUTOMEZZI)}\n')
 
     def create_sample_data(self):
         """Crea dati di esempio per test"""
@@ -329,6 +240,10 @@ class Command(BaseCommand):
 
     def create_sample_documents(self, automezzo):
         """Crea documenti di esempio per un automezzo"""
+        # Modello non (ancora) presente in automezzi.models: importato qui
+        # perché il resto del comando (carburanti, gruppi) resti utilizzabile
+        from automezzi.models import DocumentoAutomezzo
+
         documenti_data = [
             {
                 'tipo': 'assicurazione',
@@ -392,6 +307,8 @@ class Command(BaseCommand):
 
     def create_sample_refuels(self, automezzo, dipendenti):
         """Crea rifornimenti di esempio"""
+        from automezzi.models import RifornimentoCarburante
+
         # Crea 5 rifornimenti negli ultimi 3 mesi
         base_km = automezzo.chilometri_iniziali
         for i in range(5):
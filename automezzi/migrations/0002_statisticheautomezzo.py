@@ -0,0 +1,33 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('automezzi', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatisticheAutomezzo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('consumo_medio', models.DecimalField(blank=True, decimal_places=2, help_text='Consumo medio L/100km (media troncata al 10%)', max_digits=5, null=True)),
+                ('rifornimenti_analizzati', models.PositiveIntegerField(default=0)),
+                ('costo_km_carburante', models.DecimalField(blank=True, decimal_places=3, max_digits=6, null=True)),
+                ('km_periodo', models.PositiveIntegerField(default=0, help_text='Km percorsi nel periodo dei consumi')),
+                ('costo_manutenzioni_anno', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('ultimo_rifornimento', models.DateField(blank=True, null=True)),
+                ('ultima_manutenzione', models.DateField(blank=True, null=True)),
+                ('prossima_revisione', models.DateField(blank=True, null=True)),
+                ('manutenzioni_programmate', models.PositiveIntegerField(default=0, help_text='Manutenzioni non completate nei prossimi 90 giorni')),
+                ('data_aggiornamento', models.DateTimeField(blank=True, null=True)),
+                ('automezzo', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='statistiche', to='automezzi.automezzo')),
+            ],
+            options={
+                'verbose_name': 'Statistiche automezzo',
+                'verbose_name_plural': 'Statistiche automezzi',
+            },
+        ),
+    ]
@@ -0,0 +1,72 @@
+from django.db import migrations, models
+
+
+def calcola_totali(apps, schema_editor):
+    from automezzi.aggregati import ricalcola
+    ricalcola(apps=apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('automezzi', '0002_statisticheautomezzo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='statisticheautomezzo',
+            name='numero_rifornimenti',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='statisticheautomezzo',
+            name='litri_totali',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='statisticheautomezzo',
+            name='costo_carburante_totale',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='statisticheautomezzo',
+            name='km_minimo',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='statisticheautomezzo',
+            name='km_massimo',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='statisticheautomezzo',
+            name='finestra_consumi',
+            field=models.JSONField(blank=True, default=list, help_text='Ultimi rifornimenti: [id, data, km, litri]'),
+        ),
+        migrations.AddField(
+            model_name='statisticheautomezzo',
+            name='consumo_recente',
+            field=models.DecimalField(blank=True, decimal_places=2, help_text='Consumo L/100km sugli ultimi rifornimenti', max_digits=5, null=True),
+        ),
+        migrations.AddField(
+            model_name='statisticheautomezzo',
+            name='numero_manutenzioni',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='statisticheautomezzo',
+            name='costo_manutenzioni_totale',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='statisticheautomezzo',
+            name='numero_eventi',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='statisticheautomezzo',
+            name='costo_eventi_totale',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.RunPython(calcola_totali, migrations.RunPython.noop),
+    ]
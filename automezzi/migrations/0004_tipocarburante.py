@@ -0,0 +1,26 @@
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('automezzi', '0003_statistiche_totali_progressivi'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TipoCarburante',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nome', models.CharField(max_length=50, unique=True)),
+                ('costo_per_litro', models.DecimalField(decimal_places=3, max_digits=6)),
+                ('data_aggiornamento', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Tipo carburante',
+                'verbose_name_plural': 'Tipi carburante',
+                'ordering': ['nome'],
+            },
+        ),
+    ]
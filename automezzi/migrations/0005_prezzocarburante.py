@@ -0,0 +1,46 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def storico_iniziale(apps, schema_editor):
+    """Il prezzo corrente di ogni tipo diventa il primo punto dello storico"""
+    TipoCarburante = apps.get_model('automezzi', 'TipoCarburante')
+    PrezzoCarburante = apps.get_model('automezzi', 'PrezzoCarburante')
+    PrezzoCarburante.objects.bulk_create([
+        PrezzoCarburante(tipo_id=pk, data=aggiornamento.date(), prezzo=prezzo)
+        for pk, prezzo, aggiornamento in TipoCarburante.objects.values_list('pk', 'costo_per_litro', 'data_aggiornamento')
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('automezzi', '0004_tipocarburante'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='automezzo',
+            name='tipo_carburante',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='automezzi', to='automezzi.tipocarburante'),
+        ),
+        migrations.CreateModel(
+            name='PrezzoCarburante',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.DateField()),
+                ('prezzo', models.DecimalField(decimal_places=3, max_digits=6)),
+                ('tipo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='prezzi', to='automezzi.tipocarburante')),
+            ],
+            options={
+                'verbose_name': 'Prezzo carburante',
+                'verbose_name_plural': 'Storico prezzi carburante',
+                'ordering': ['tipo', 'data'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='prezzocarburante',
+            constraint=models.UniqueConstraint(fields=('tipo', 'data'), name='prezzo_carburante_unico_per_data'),
+        ),
+        migrations.RunPython(storico_iniziale, migrations.RunPython.noop),
+    ]
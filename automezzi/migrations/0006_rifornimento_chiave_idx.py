@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('automezzi', '0005_prezzocarburante'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='rifornimento',
+            index=models.Index(fields=['automezzo', 'data', 'litri', 'chilometri'], name='rifornimento_chiave_idx'),
+        ),
+    ]
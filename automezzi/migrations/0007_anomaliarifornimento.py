@@ -0,0 +1,31 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('automezzi', '0006_rifornimento_chiave_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnomaliaRifornimento',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('consumo_alto', 'Consumo anomalo alto'), ('consumo_basso', 'Consumo anomalo basso'), ('km_non_crescenti', 'Chilometri non crescenti')], max_length=20)),
+                ('consumo', models.DecimalField(blank=True, decimal_places=2, help_text='L/100km della tratta', max_digits=8, null=True)),
+                ('consumo_mediano', models.DecimalField(blank=True, decimal_places=2, max_digits=8, null=True)),
+                ('punteggio', models.FloatField(blank=True, help_text='z-score robusto (mediana/MAD)', null=True)),
+                ('rilevata_il', models.DateTimeField(auto_now_add=True)),
+                ('verificata', models.BooleanField(default=False, help_text='Controllata da un operatore')),
+                ('automezzo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='anomalie_rifornimenti', to='automezzi.automezzo')),
+                ('rifornimento', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='anomalia', to='automezzi.rifornimento')),
+            ],
+            options={
+                'verbose_name': 'Anomalia rifornimento',
+                'verbose_name_plural': 'Anomalie rifornimenti',
+                'ordering': ['-rilevata_il'],
+            },
+        ),
+    ]
@@ -1,5 +1,11 @@
 from django.db import models
 from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.utils import timezone
+from dateutil.relativedelta import relativedelta
+
+# Intervallo tra due revisioni
+INTERVALLO_REVISIONE = relativedelta(years=2)
 
 def libretto_upload_path(instance, filename):
     return f"automezzi/libretti/{instance.targa}/{filename}"
@@ -16,6 +22,40 @@ def allegati_manutenzione_path(instance, filename):
 def allegato_evento_path(instance, filename):
     return f"automezzi/eventi/{instance.automezzo.targa}/{filename}"
 
+class TipoCarburante(models.Model):
+    """Tipo di carburante con il prezzo al litro corrente (vedi import_carburanti)"""
+    nome = models.CharField(max_length=50, unique=True)
+    costo_per_litro = models.DecimalField(max_digits=6, decimal_places=3)
+    data_aggiornamento = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = "Tipo carburante"
+        verbose_name_plural = "Tipi carburante"
+        ordering = ['nome']
+
+    def __str__(self):
+        return f"{self.nome} - €{self.costo_per_litro}/L"
+
+class PrezzoCarburante(models.Model):
+    """
+    Storico dei prezzi: ogni riga è il prezzo in vigore da `data` fino alla
+    riga successiva dello stesso tipo (vedi automezzi/prezzi.py)
+    """
+    tipo = models.ForeignKey(TipoCarburante, on_delete=models.CASCADE, related_name='prezzi')
+    data = models.DateField()
+    prezzo = models.DecimalField(max_digits=6, decimal_places=3)
+
+    class Meta:
+        verbose_name = "Prezzo carburante"
+        verbose_name_plural = "Storico prezzi carburante"
+        ordering = ['tipo', 'data']
+        constraints = [
+            models.UniqueConstraint(fields=['tipo', 'data'], name='prezzo_carburante_unico_per_data'),
+        ]
+
+    def __str__(self):
+        return f"{self.tipo.nome} {self.data}: €{self.prezzo}/L"
+
 class Automezzo(models.Model):
     targa = models.CharField(max_length=10, unique=True)
     marca = models.CharField(max_length=50)
@@ -33,6 +73,9 @@ class Automezzo(models.Model):
     assegnato_a = models.ForeignKey(
         settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='automezzi_assegnati'
     )
+    tipo_carburante = models.ForeignKey(
+        TipoCarburante, on_delete=models.SET_NULL, null=True, blank=True, related_name='automezzi'
+    )
 
     def __str__(self):
         return f"{self.targa} - {self.marca} {self.modello}"
@@ -42,14 +85,30 @@ class Automezzo(models.Model):
         from datetime import date
         return date.today().year - self.anno_immatricolazione
 
+    @property
+    def prossima_revisione(self):
+        if self.data_revisione is None:
+            return None
+        return self.data_revisione + INTERVALLO_REVISIONE
+
+    def _statistiche(self):
+        # Senza riga di statistiche il mezzo non ha ancora movimenti
+        try:
+            return self.statistiche
+        except ObjectDoesNotExist:
+            return None
+
     def manutenzioni_count(self):
-        return self.manutenzioni.count()
+        statistiche = self._statistiche()
+        return statistiche.numero_manutenzioni if statistiche else 0
 
     def rifornimenti_count(self):
-        return self.rifornimenti.count()
+        statistiche = self._statistiche()
+        return statistiche.numero_rifornimenti if statistiche else 0
 
     def eventi_count(self):
-        return self.eventi.count()
+        statistiche = self._statistiche()
+        return statistiche.numero_eventi if statistiche else 0
 
 class Manutenzione(models.Model):
     automezzo = models.ForeignKey(Automezzo, on_delete=models.CASCADE, related_name='manutenzioni')
@@ -71,6 +130,12 @@ class Rifornimento(models.Model):
     chilometri = models.PositiveIntegerField(help_text="Chilometraggio al momento del rifornimento")
     scontrino = models.ImageField(upload_to=scontrino_upload_path, blank=True, null=True, help_text="Foto dello scontrino del rifornimento")
 
+    class Meta:
+        indexes = [
+            # Chiave di deduplica delle transazioni importate dalle carte carburante
+            models.Index(fields=['automezzo', 'data', 'litri', 'chilometri'], name='rifornimento_chiave_idx'),
+        ]
+
     def __str__(self):
         return f"{self.automezzo} - {self.data} - {self.litri}L"
 
@@ -95,4 +160,88 @@ class EventoAutomezzo(models.Model):
     risolto = models.BooleanField(default=False)
 
     def __str__(self):
-        return f"{self.automezzo} - {self.get_tipo_display()} - {self.data_evento}"
\ No newline at end of file
+        return f"{self.automezzo} - {self.get_tipo_display()} - {self.data_evento}"
+
+class StatisticheAutomezzo(models.Model):
+    """
+    Statistiche calcolate per automezzo dal comando aggiorna_statistiche
+    (vedi automezzi/statistiche.py): consumi, costi e scadenze.
+
+    I totali progressivi (contatori, litri, costi, km, finestra dei consumi)
+    sono invece aggiornati a ogni scrittura di rifornimenti, manutenzioni ed
+    eventi (vedi automezzi/aggregati.py).
+    """
+    automezzo = models.OneToOneField(Automezzo, on_delete=models.CASCADE, related_name='statistiche')
+    consumo_medio = models.DecimalField(
+        max_digits=5, decimal_places=2, blank=True, null=True,
+        help_text="Consumo medio L/100km (media troncata al 10%)"
+    )
+    rifornimenti_analizzati = models.PositiveIntegerField(default=0)
+    costo_km_carburante = models.DecimalField(max_digits=6, decimal_places=3, blank=True, null=True)
+    km_periodo = models.PositiveIntegerField(default=0, help_text="Km percorsi nel periodo dei consumi")
+    costo_manutenzioni_anno = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    ultimo_rifornimento = models.DateField(blank=True, null=True)
+    ultima_manutenzione = models.DateField(blank=True, null=True)
+    prossima_revisione = models.DateField(blank=True, null=True)
+    manutenzioni_programmate = models.PositiveIntegerField(
+        default=0, help_text="Manutenzioni non completate nei prossimi 90 giorni"
+    )
+    data_aggiornamento = models.DateTimeField(blank=True, null=True)
+
+    # Totali progressivi
+    numero_rifornimenti = models.PositiveIntegerField(default=0)
+    litri_totali = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    costo_carburante_totale = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    km_minimo = models.PositiveIntegerField(blank=True, null=True)
+    km_massimo = models.PositiveIntegerField(blank=True, null=True)
+    finestra_consumi = models.JSONField(
+        default=list, blank=True, help_text="Ultimi rifornimenti: [id, data, km, litri]"
+    )
+    consumo_recente = models.DecimalField(
+        max_digits=5, decimal_places=2, blank=True, null=True,
+        help_text="Consumo L/100km sugli ultimi rifornimenti"
+    )
+    numero_manutenzioni = models.PositiveIntegerField(default=0)
+    costo_manutenzioni_totale = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    numero_eventi = models.PositiveIntegerField(default=0)
+    costo_eventi_totale = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        verbose_name = "Statistiche automezzo"
+        verbose_name_plural = "Statistiche automezzi"
+
+    def __str__(self):
+        return f"Statistiche {self.automezzo}"
+
+    @property
+    def km_percorsi(self):
+        """Km tra il primo e l'ultimo rifornimento registrato"""
+        if self.km_minimo is None or self.km_massimo is None:
+            return 0
+        return self.km_massimo - self.km_minimo
+
+
+class AnomaliaRifornimento(models.Model):
+    """Rifornimento sospetto segnalato da automezzi/anomalie.py (furto, contachilometri errato)"""
+    TIPO_CHOICES = [
+        ('consumo_alto', 'Consumo anomalo alto'),
+        ('consumo_basso', 'Consumo anomalo basso'),
+        ('km_non_crescenti', 'Chilometri non crescenti'),
+    ]
+
+    rifornimento = models.OneToOneField(Rifornimento, on_delete=models.CASCADE, related_name='anomalia')
+    automezzo = models.ForeignKey(Automezzo, on_delete=models.CASCADE, related_name='anomalie_rifornimenti')
+    tipo = models.CharField(max_length=20, choices=TIPO_CHOICES)
+    consumo = models.DecimalField(max_digits=8, decimal_places=2, blank=True, null=True, help_text="L/100km della tratta")
+    consumo_mediano = models.DecimalField(max_digits=8, decimal_places=2, blank=True, null=True)
+    punteggio = models.FloatField(blank=True, null=True, help_text="z-score robusto (mediana/MAD)")
+    rilevata_il = models.DateTimeField(auto_now_add=True)
+    verificata = models.BooleanField(default=False, help_text="Controllata da un operatore")
+
+    class Meta:
+        verbose_name = "Anomalia rifornimento"
+        verbose_name_plural = "Anomalie rifornimenti"
+        ordering = ['-rilevata_il']
+
+    def __str__(self):
+        return f"{self.rifornimento} - {self.get_tipo_display()}"
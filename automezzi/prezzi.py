@@ -0,0 +1,163 @@
+# automezzi/prezzi.py
+"""
+Storico dei prezzi dei carburanti.
+
+PrezzoCarburante contiene solo i punti di variazione: ogni riga è il
+prezzo in vigore dalla sua data fino alla riga successiva dello stesso
+tipo. Su questa serie a gradini:
+
+- prezzo_al(): prezzo in vigore a una data, una query sull'indice
+  (tipo, data);
+- prezzi_al(): lo stesso per molte coppie (tipo, data) in una query,
+  es. tutti i rifornimenti di un report (vedi prezzi_rifornimenti());
+- serie(): valori giornalieri o settimanali (media, minimo, massimo
+  pesati sui giorni) per i grafici;
+- compatta(): elimina le righe che ripetono il prezzo precedente.
+"""
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, Value, Window
+from django.db.models.functions import Coalesce, Lag
+
+from .models import PrezzoCarburante, Rifornimento
+
+PASSI = ('giorno', 'settimana')
+
+
+def prezzo_al(tipo_id, data):
+    """Prezzo in vigore per il tipo alla data, None se non c'è storico"""
+    return PrezzoCarburante.objects.filter(
+        tipo_id=tipo_id, data__lte=data
+    ).order_by('-data').values_list('prezzo', flat=True).first()
+
+
+def _punti(tipo_ids, inizio, fine):
+    """
+    Una query: per ogni tipo i punti tra `inizio` e `fine` più l'ultimo
+    punto precedente a `inizio` (il prezzo in vigore all'inizio).
+    Restituisce {tipo_id: ([date], [prezzi])} ordinati per data.
+    """
+    in_vigore = PrezzoCarburante.objects.filter(
+        tipo_id=OuterRef('tipo_id'), data__lte=inizio
+    ).order_by('-data').values('data')[:1]
+    righe = PrezzoCarburante.objects.filter(
+        tipo_id__in=tipo_ids, data__lte=fine,
+    ).filter(
+        data__gte=Coalesce(Subquery(in_vigore), Value(inizio)),
+    ).order_by('tipo_id', 'data').values_list('tipo_id', 'data', 'prezzo')
+
+    punti = defaultdict(lambda: ([], []))
+    for tipo_id, data, prezzo in righe:
+        date, prezzi = punti[tipo_id]
+        date.append(data)
+        prezzi.append(prezzo)
+    return punti
+
+
+def prezzi_al(richieste):
+    """
+    Prezzi in vigore per molte coppie (tipo_id, data) con una sola query.
+    Restituisce {(tipo_id, data): prezzo o None}.
+    """
+    richieste = {(tipo_id, data) for tipo_id, data in richieste if tipo_id is not None and data is not None}
+    if not richieste:
+        return {}
+    date_richieste = [data for _, data in richieste]
+    punti = _punti({tipo_id for tipo_id, _ in richieste}, min(date_richieste), max(date_richieste))
+
+    risultato = {}
+    for tipo_id, data in richieste:
+        date, prezzi = punti.get(tipo_id, ([], []))
+        posizione = bisect_right(date, data)
+        risultato[(tipo_id, data)] = prezzi[posizione - 1] if posizione else None
+    return risultato
+
+
+def prezzi_rifornimenti(rifornimenti):
+    """
+    Prezzo al litro in vigore alla data di ogni rifornimento, per il tipo
+    carburante del suo automezzo: {rifornimento_id: prezzo o None}.
+    Due query qualunque sia il numero di rifornimenti.
+    """
+    righe = list(
+        Rifornimento.objects.filter(pk__in=[r.pk if isinstance(r, Rifornimento) else r for r in rifornimenti])
+        .values_list('pk', 'automezzo__tipo_carburante_id', 'data')
+    )
+    prezzi = prezzi_al((tipo_id, data) for _, tipo_id, data in righe)
+    return {pk: prezzi.get((tipo_id, data)) for pk, tipo_id, data in righe}
+
+
+def serie(tipo_id, inizio, fine, passo='giorno'):
+    """
+    Serie del prezzo da `inizio` a `fine` (incluse) per grafici.
+    passo='giorno': un valore per giorno; passo='settimana': media, minimo
+    e massimo dei valori giornalieri di ogni settimana (da lunedì).
+    I giorni prima del primo prezzo noto non compaiono.
+    """
+    if passo not in PASSI:
+        raise ValueError(f"Passo non gestito: {passo}")
+    date, prezzi = _punti([tipo_id], inizio, fine).get(tipo_id, ([], []))
+    if not date:
+        return []
+
+    periodi = {}
+    giorno = max(inizio, date[0])
+    posizione = 0
+    while giorno <= fine:
+        while posizione + 1 < len(date) and date[posizione + 1] <= giorno:
+            posizione += 1
+        prezzo = prezzi[posizione]
+        periodo = giorno if passo == 'giorno' else giorno - timedelta(days=giorno.weekday())
+        valori = periodi.setdefault(periodo, [])
+        valori.append(prezzo)
+        giorno += timedelta(days=1)
+
+    return [
+        {
+            'periodo': periodo,
+            'prezzo_medio': (sum(valori) / len(valori)).quantize(valori[0]),
+            'minimo': min(valori),
+            'massimo': max(valori),
+            'giorni': len(valori),
+        }
+        for periodo, valori in periodi.items()
+    ]
+
+
+def registra(prezzi_per_tipo, data):
+    """
+    Aggiunge allo storico i prezzi {tipo_id: prezzo} in vigore da `data`
+    (un upsert: un secondo import nello stesso giorno sovrascrive)
+    """
+    if not prezzi_per_tipo:
+        return
+    PrezzoCarburante.objects.bulk_create(
+        [PrezzoCarburante(tipo_id=tipo_id, data=data, prezzo=prezzo) for tipo_id, prezzo in prezzi_per_tipo.items()],
+        update_conflicts=True,
+        unique_fields=['tipo', 'data'],
+        update_fields=['prezzo'],
+    )
+
+
+def compatta(tipo_ids=None, dry_run=False, dimensione_lotto=1000):
+    """
+    Elimina le righe con lo stesso prezzo della precedente dello stesso
+    tipo: la serie a gradini resta identica. Le righe ridondanti sono
+    individuate nel database con LAG; restituisce quante sono.
+    """
+    righe = PrezzoCarburante.objects.all()
+    if tipo_ids is not None:
+        righe = righe.filter(tipo_id__in=tipo_ids)
+    ridondanti = list(
+        righe.annotate(
+            precedente=Window(Lag('prezzo'), partition_by=[F('tipo_id')], order_by=[F('data').asc()]),
+        ).filter(prezzo=F('precedente')).values_list('pk', flat=True)
+    )
+    if not dry_run:
+        with transaction.atomic():
+            for i in range(0, len(ridondanti), dimensione_lotto):
+                PrezzoCarburante.objects.filter(pk__in=ridondanti[i:i + dimensione_lotto]).delete()
+    return len(ridondanti)
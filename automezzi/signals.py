@@ -0,0 +1,39 @@
+# automezzi/signals.py
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from .aggregati import applica, valori_istanza, valori_salvati
+from .models import Automezzo, Rifornimento, Manutenzione, EventoAutomezzo
+
+
+def _eliminazione_automezzo(origin):
+    """Le righe eliminate in cascata con l'automezzo non toccano le statistiche, eliminate anch'esse"""
+    return isinstance(origin, Automezzo) or getattr(origin, 'model', None) is Automezzo
+
+
+@receiver(pre_save, sender=Rifornimento)
+@receiver(pre_save, sender=Manutenzione)
+@receiver(pre_save, sender=EventoAutomezzo)
+def memorizza_valori_precedenti(sender, instance, raw=False, **kwargs):
+    """Prima di una modifica legge i valori salvati, da togliere dagli aggregati"""
+    if not raw:
+        instance._aggregati_prima = valori_salvati(instance)
+
+
+@receiver(post_save, sender=Rifornimento)
+@receiver(post_save, sender=Manutenzione)
+@receiver(post_save, sender=EventoAutomezzo)
+def aggiorna_aggregati_salvataggio(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    prima = None if created else getattr(instance, '_aggregati_prima', None)
+    applica(sender._meta.model_name, prima=prima, dopo=valori_istanza(instance))
+    instance._aggregati_prima = None
+
+
+@receiver(post_delete, sender=Rifornimento)
+@receiver(post_delete, sender=Manutenzione)
+@receiver(post_delete, sender=EventoAutomezzo)
+def aggiorna_aggregati_eliminazione(sender, instance, origin=None, **kwargs):
+    if not _eliminazione_automezzo(origin):
+        applica(sender._meta.model_name, prima=valori_istanza(instance))
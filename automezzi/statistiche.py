@@ -0,0 +1,285 @@
+# automezzi/statistiche.py
+"""
+Calcolo delle statistiche della flotta con poche query set-based.
+
+Invece di interrogare il database automezzo per automezzo, ogni misura
+viene calcolata per tutta la flotta in una sola query:
+
+- consumi: LAG(chilometri) sui rifornimenti partizionati per automezzo,
+  consumo di ogni tratta calcolato e filtrato nel database; in Python
+  resta solo la media troncata sulle righe già ordinate;
+- costo carburante al km, km del periodo e ultimo rifornimento: una
+  aggregazione condizionale sui rifornimenti;
+- costo manutenzioni annualizzato, ultima manutenzione e manutenzioni
+  programmate: una aggregazione condizionale sulle manutenzioni;
+- prossima revisione: dalla data dell'ultima revisione dell'automezzo.
+
+Le statistiche sono poi scritte con un bulk_create e un bulk_update.
+Per flotte molto grandi gli automezzi possono essere divisi in intervalli
+di id calcolati in processi separati (vedi esegui_in_parallelo).
+"""
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.db import connections, transaction
+from django.db.models import Case, Count, F, FloatField, Max, Min, Q, Sum, When, Window
+from django.db.models.functions import Cast, Lag
+from django.utils import timezone
+
+from .models import INTERVALLO_REVISIONE, Automezzo, Manutenzione, Rifornimento, StatisticheAutomezzo
+
+# Consumi fuori da questo intervallo (L/100km) sono errori di inserimento
+CONSUMO_MINIMO = 2
+CONSUMO_MASSIMO = 50
+# Quota dei valori estremi scartata da ogni lato nella media troncata
+QUOTA_TRONCATA = 0.1
+GIORNI_MANUTENZIONI_PROGRAMMATE = 90
+
+CAMPI_STATISTICHE = [
+    'consumo_medio', 'rifornimenti_analizzati', 'costo_km_carburante', 'km_periodo',
+    'costo_manutenzioni_anno', 'ultimo_rifornimento', 'ultima_manutenzione',
+    'prossima_revisione', 'manutenzioni_programmate',
+]
+
+
+def media_troncata(valori, quota=QUOTA_TRONCATA):
+    """Media dei valori ordinati escludendo la quota più bassa e più alta"""
+    n = len(valori)
+    inizio, fine = int(n * quota), n - int(n * quota)
+    if fine <= inizio:
+        return None
+    selezionati = valori[inizio:fine]
+    return sum(selezionati) / len(selezionati)
+
+
+class CalcoloStatistiche:
+    """
+    Statistiche di tutti gli automezzi attivi (o di un sottoinsieme).
+
+    Uso:
+        calcolo = CalcoloStatistiche(periodo_consumi=365).esegui()
+        calcolo.creati, calcolo.aggiornati, calcolo.invariati, calcolo.risultati
+    """
+
+    def __init__(self, periodo_consumi=365, periodo_manutenzioni=365, automezzi=None,
+                 intervallo_id=None, force=False, dry_run=False, oggi=None):
+        self.periodo_consumi = periodo_consumi
+        self.periodo_manutenzioni = periodo_manutenzioni
+        self.automezzi = automezzi if automezzi is not None else Automezzo.objects.filter(attivo=True)
+        if intervallo_id is not None:
+            self.automezzi = self.automezzi.filter(pk__gte=intervallo_id[0], pk__lte=intervallo_id[1])
+        self.force = force
+        self.dry_run = dry_run
+        self.oggi = oggi or date.today()
+        self.creati = self.aggiornati = self.invariati = self.saltati = 0
+        self.risultati = {}
+
+    def esegui(self):
+        automezzi = dict(self.automezzi.values_list('pk', 'data_revisione'))
+        if not automezzi:
+            return self
+
+        # Sottoquery invece di una lista di id: niente limiti sui parametri
+        flotta = self.automezzi.values('pk')
+        consumi = self._consumi(flotta)
+        rifornimenti = self._rifornimenti(flotta)
+        manutenzioni = self._manutenzioni(flotta)
+
+        for automezzo_id, data_revisione in automezzi.items():
+            valori = {
+                'consumo_medio': None, 'rifornimenti_analizzati': 0, 'costo_km_carburante': None,
+                'km_periodo': 0, 'costo_manutenzioni_anno': None, 'ultimo_rifornimento': None,
+                'ultima_manutenzione': None, 'manutenzioni_programmate': 0,
+                'prossima_revisione': data_revisione + INTERVALLO_REVISIONE if data_revisione else None,
+            }
+            valori.update(consumi.get(automezzo_id, {}))
+            valori.update(rifornimenti.get(automezzo_id, {}))
+            valori.update(manutenzioni.get(automezzo_id, {}))
+            self.risultati[automezzo_id] = valori
+
+        self._salva(flotta)
+        return self
+
+    def _consumi(self, flotta):
+        """
+        Una query: il consumo di ogni tratta (litri del rifornimento sui km
+        dal precedente) è calcolato con LAG su tutti i rifornimenti della
+        flotta e solo dopo ristretto al periodo, così la prima tratta del
+        periodo parte dall'ultimo rifornimento precedente; le righe arrivano
+        ordinate per automezzo e consumo, pronte per la media troncata.
+        """
+        inizio = self.oggi - timedelta(days=self.periodo_consumi)
+        # Il filtro sulla data sta nel CASE e non nel WHERE: i filtri su
+        # espressioni finestra finiscono nella query esterna, dopo il LAG
+        tratte = Rifornimento.objects.filter(
+            automezzo_id__in=flotta,
+        ).annotate(
+            km_precedenti=Window(
+                Lag('chilometri'),
+                partition_by=[F('automezzo_id')],
+                order_by=[F('data').asc(), F('chilometri').asc(), F('pk').asc()],
+            ),
+        ).annotate(
+            consumo=Case(
+                When(
+                    data__gte=inizio,
+                    then=Cast('litri', FloatField()) * 100.0
+                    / Cast(F('chilometri') - F('km_precedenti'), FloatField()),
+                ),
+                output_field=FloatField(),
+            ),
+        ).filter(
+            chilometri__gt=F('km_precedenti'),
+            consumo__gte=CONSUMO_MINIMO,
+            consumo__lte=CONSUMO_MASSIMO,
+        ).order_by('automezzo_id', 'consumo').values_list('automezzo_id', 'consumo')
+
+        per_automezzo = defaultdict(list)
+        for automezzo_id, consumo in tratte:
+            per_automezzo[automezzo_id].append(consumo)
+
+        risultato = {}
+        for automezzo_id, valori in per_automezzo.items():
+            media = media_troncata(valori)
+            risultato[automezzo_id] = {
+                'consumo_medio': Decimal(str(round(media, 2))) if media is not None else None,
+                'rifornimenti_analizzati': len(valori),
+            }
+        return risultato
+
+    def _rifornimenti(self, flotta):
+        """Una query: costo e km del periodo, ultimo rifornimento in assoluto"""
+        nel_periodo = Q(data__gte=self.oggi - timedelta(days=self.periodo_consumi))
+        righe = Rifornimento.objects.filter(automezzo_id__in=flotta).values('automezzo_id').annotate(
+            costo=Sum('costo_totale', filter=nel_periodo),
+            km_min=Min('chilometri', filter=nel_periodo),
+            km_max=Max('chilometri', filter=nel_periodo),
+            ultimo=Max('data'),
+        ).order_by()
+
+        risultato = {}
+        for riga in righe:
+            km = (riga['km_max'] or 0) - (riga['km_min'] or 0)
+            costo_km = None
+            if riga['costo'] and km > 0:
+                costo_km = (riga['costo'] / km).quantize(Decimal('0.001'))
+            risultato[riga['automezzo_id']] = {
+                'costo_km_carburante': costo_km,
+                'km_periodo': max(km, 0),
+                'ultimo_rifornimento': riga['ultimo'],
+            }
+        return risultato
+
+    def _manutenzioni(self, flotta):
+        """Una query: costo annualizzato, ultima manutenzione, manutenzioni programmate"""
+        completate = Q(completata=True)
+        righe = Manutenzione.objects.filter(automezzo_id__in=flotta).values('automezzo_id').annotate(
+            costo=Sum('costo', filter=completate & Q(
+                data__gte=self.oggi - timedelta(days=self.periodo_manutenzioni)
+            )),
+            ultima=Max('data', filter=completate),
+            programmate=Count('pk', filter=Q(
+                completata=False,
+                data__gte=self.oggi,
+                data__lte=self.oggi + timedelta(days=GIORNI_MANUTENZIONI_PROGRAMMATE),
+            )),
+        ).order_by()
+
+        risultato = {}
+        for riga in righe:
+            costo_anno = None
+            if riga['costo'] is not None:
+                # Costo del periodo riportato a 365 giorni
+                costo_anno = (riga['costo'] * 365 / self.periodo_manutenzioni).quantize(Decimal('0.01'))
+            risultato[riga['automezzo_id']] = {
+                'costo_manutenzioni_anno': costo_anno,
+                'ultima_manutenzione': riga['ultima'],
+                'manutenzioni_programmate': riga['programmate'],
+            }
+        return risultato
+
+    def _salva(self, flotta):
+        """Un bulk_create per le statistiche nuove e un bulk_update per quelle cambiate"""
+        esistenti = {
+            statistiche.automezzo_id: statistiche
+            for statistiche in StatisticheAutomezzo.objects.filter(automezzo_id__in=flotta)
+        }
+        adesso = timezone.now()
+        recenti = adesso - timedelta(hours=1)
+        nuove, modificate = [], []
+        prime = 0
+
+        for automezzo_id, valori in self.risultati.items():
+            statistiche = esistenti.get(automezzo_id)
+            if statistiche is None:
+                nuove.append(StatisticheAutomezzo(automezzo_id=automezzo_id, data_aggiornamento=adesso, **valori))
+                continue
+            if statistiche.data_aggiornamento is None:
+                # Riga creata dagli aggregati progressivi, mai calcolata: conta come nuova
+                prime += 1
+                for campo, valore in valori.items():
+                    setattr(statistiche, campo, valore)
+                statistiche.data_aggiornamento = adesso
+                modificate.append(statistiche)
+                continue
+            if not self.force and statistiche.data_aggiornamento and statistiche.data_aggiornamento > recenti:
+                self.saltati += 1
+                continue
+            if all(getattr(statistiche, campo) == valore for campo, valore in valori.items()):
+                self.invariati += 1
+                continue
+            for campo, valore in valori.items():
+                setattr(statistiche, campo, valore)
+            statistiche.data_aggiornamento = adesso
+            modificate.append(statistiche)
+
+        self.creati, self.aggiornati = len(nuove) + prime, len(modificate) - prime
+        if self.dry_run:
+            return
+        with transaction.atomic():
+            StatisticheAutomezzo.objects.bulk_create(nuove, batch_size=1000)
+            StatisticheAutomezzo.objects.bulk_update(
+                modificate, CAMPI_STATISTICHE + ['data_aggiornamento'], batch_size=1000
+            )
+
+
+def intervalli_id(automezzi, parti):
+    """Divide gli id degli automezzi in `parti` intervalli contigui di dimensione simile"""
+    ids = list(automezzi.order_by('pk').values_list('pk', flat=True))
+    if not ids:
+        return []
+    dimensione = -(-len(ids) // max(parti, 1))
+    return [(blocco[0], blocco[-1]) for blocco in (ids[i:i + dimensione] for i in range(0, len(ids), dimensione))]
+
+
+def _calcola_intervallo(opzioni, intervallo):
+    try:
+        calcolo = CalcoloStatistiche(intervallo_id=intervallo, **opzioni).esegui()
+        return calcolo.creati, calcolo.aggiornati, calcolo.invariati, calcolo.saltati
+    finally:
+        connections.close_all()
+
+
+def esegui_in_parallelo(parti, **opzioni):
+    """
+    Calcola le statistiche degli automezzi attivi in `parti` processi, uno
+    per intervallo di id. I processi sono creati con fork: le connessioni
+    del processo padre vengono chiuse prima, ogni figlio apre la propria.
+    Ai figli passano solo gli estremi degli intervalli, mai queryset.
+    Restituisce i totali (creati, aggiornati, invariati, saltati).
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    intervalli = intervalli_id(Automezzo.objects.filter(attivo=True), parti)
+    if not intervalli:
+        return 0, 0, 0, 0
+
+    connections.close_all()
+    totali = [0, 0, 0, 0]
+    with ProcessPoolExecutor(max_workers=len(intervalli),
+                             mp_context=multiprocessing.get_context('fork')) as executor:
+        for parziali in executor.map(_calcola_intervallo, [opzioni] * len(intervalli), intervalli):
+            totali = [totale + parziale for totale, parziale in zip(totali, parziali)]
+    return tuple(totali)
@@ -1,3 +1,765 @@
+import json
+import tempfile
+from datetime import date, timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
 from django.test import TestCase
+from django.urls import reverse
+
+from home.query_ripetute import BudgetQueryMixin
+
+import numpy as np
+
+from .aggregati import FINESTRA_CONSUMI, consumo_finestra, ricalcola
+from .anomalie import RilevamentoAnomalie, mediane, punteggi_robusti
+from .carburanti import ImportazioneCarburanti, leggi_csv, leggi_json, leggi_xml
+from .carta_carburante import ImportazioneCartaCarburante
+from .models import (
+    INTERVALLO_REVISIONE, AnomaliaRifornimento, Automezzo, EventoAutomezzo, Manutenzione, PrezzoCarburante, Rifornimento,
+    StatisticheAutomezzo, TipoCarburante,
+)
+from .prezzi import compatta, prezzi_al, prezzi_rifornimenti, prezzo_al, registra, serie
+from .statistiche import CalcoloStatistiche, intervalli_id, media_troncata
+
+
+class StatisticheFlottaTests(TestCase):
+    """Test per il calcolo set-based delle statistiche della flotta"""
+
+    def setUp(self):
+        self.oggi = date.today()
+        self.furgone = self._automezzo('AB123CD', data_revisione=date(2024, 3, 10))
+        # Tratte da 500 km: 40 L -> 8, 35 L -> 7; l'ultima (80 L su 100 km) è scartata
+        for giorni, km, litri, costo in [
+            (100, 10000, 30, 60), (80, 10500, 40, 80), (60, 11000, 35, 70), (40, 11100, 80, 160),
+        ]:
+            self._rifornimento(self.furgone, giorni, km, litri, costo)
+        Manutenzione.objects.create(
+            automezzo=self.furgone, data=self.oggi - timedelta(days=30),
+            descrizione='Tagliando', costo=Decimal('300.00'), completata=True,
+        )
+        Manutenzione.objects.create(
+            automezzo=self.furgone, data=self.oggi + timedelta(days=10),
+            descrizione='Gomme', costo=Decimal('400.00'),
+        )
+
+    def _automezzo(self, targa, **kwargs):
+        return Automezzo.objects.create(
+            targa=targa, marca='Fiat', modello='Ducato', anno_immatricolazione=2020, **kwargs
+        )
+
+    def _rifornimento(self, automezzo, giorni_fa, km, litri, costo):
+        return Rifornimento.objects.create(
+            automezzo=automezzo, data=self.oggi - timedelta(days=giorni_fa),
+            chilometri=km, litri=Decimal(litri), costo_totale=Decimal(costo),
+        )
+
+    def test_statistiche_calcolate(self):
+        calcolo = CalcoloStatistiche().esegui()
+        self.assertEqual(calcolo.creati, 1)
+
+        statistiche = StatisticheAutomezzo.objects.get(automezzo=self.furgone)
+        self.assertEqual(statistiche.consumo_medio, Decimal('7.50'))
+        self.assertEqual(statistiche.rifornimenti_analizzati, 2)
+        self.assertEqual(statistiche.km_periodo, 1100)
+        self.assertEqual(statistiche.costo_km_carburante, Decimal('0.336'))
+        self.assertEqual(statistiche.costo_manutenzioni_anno, Decimal('300.00'))
+        self.assertEqual(statistiche.ultimo_rifornimento, self.oggi - timedelta(days=40))
+        self.assertEqual(statistiche.ultima_manutenzione, self.oggi - timedelta(days=30))
+        self.assertEqual(statistiche.manutenzioni_programmate, 1)
+        self.assertEqual(statistiche.prossima_revisione, date(2026, 3, 10))
+
+    def test_prima_tratta_del_periodo_dal_rifornimento_precedente(self):
+        # Periodo di 90 giorni: la tratta del giorno 80 parte dai km del giorno 100
+        CalcoloStatistiche(periodo_consumi=90).esegui()
+
+        statistiche = StatisticheAutomezzo.objects.get(automezzo=self.furgone)
+        self.assertEqual(statistiche.consumo_medio, Decimal('7.50'))
+        self.assertEqual(statistiche.rifornimenti_analizzati, 2)
+
+    def test_query_costanti_rispetto_alla_flotta(self):
+        with self.assertNumQueries(8) as piccola:
+            CalcoloStatistiche().esegui()
+
+        for numero in range(20):
+            automezzo = self._automezzo(f'ZZ{numero:03d}XX')
+            self._rifornimento(automezzo, 20, 1000, 10, 20)
+            self._rifornimento(automezzo, 10, 1200, 14, 28)
+        with self.assertNumQueries(len(piccola.captured_queries)):
+            # Le righe esistono già (aggregati progressivi): un solo bulk_update per tutti
+            CalcoloStatistiche(force=True, periodo_manutenzioni=180).esegui()
+
+    def test_statistiche_invariate_e_recenti(self):
+        CalcoloStatistiche().esegui()
+
+        self.assertEqual(CalcoloStatistiche().esegui().saltati, 1)
+        self.assertEqual(CalcoloStatistiche(force=True).esegui().invariati, 1)
+
+    def test_media_troncata_e_intervalli(self):
+        valori = sorted([1, 7, 7.5, 8, 7, 8.5, 7.2, 6.8, 7.9, 30])
+        self.assertAlmostEqual(media_troncata(valori), 7.4875)
+        self.assertIsNone(media_troncata([]))
+
+        for numero in range(4):
+            self._automezzo(f'XY{numero:03d}ZZ')
+        intervalli = intervalli_id(Automezzo.objects.all(), 2)
+        self.assertEqual(len(intervalli), 2)
+        self.assertEqual(intervalli[0][0], self.furgone.pk)
+
+    def test_comando_aggiorna_statistiche(self):
+        out = StringIO()
+        call_command('aggiorna_statistiche', '--verbose', stdout=out)
+
+        self.assertIn('Statistiche create: 1', out.getvalue())
+        self.assertIn('7.50 L/100km', out.getvalue())
+        self.assertTrue(StatisticheAutomezzo.objects.exists())
+
+
+class AggregatiProgressiviTests(TestCase):
+    """Test per i totali progressivi aggiornati a ogni scrittura"""
+
+    def setUp(self):
+        self.furgone = Automezzo.objects.create(
+            targa='AG001AA', marca='Iveco', modello='Daily', anno_immatricolazione=2019
+        )
+        self.inizio = date(2025, 1, 1)
+
+    def _rifornimento(self, giorno, km, litri='40.00', costo='70.00', automezzo=None):
+        return Rifornimento.objects.create(
+            automezzo=automezzo or self.furgone, data=self.inizio + timedelta(days=giorno),
+            chilometri=km, litri=Decimal(litri), costo_totale=Decimal(costo),
+        )
+
+    def _statistiche(self, automezzo=None):
+        return StatisticheAutomezzo.objects.get(automezzo=automezzo or self.furgone)
+
+    def _confronta_con_ricalcolo(self):
+        attesi = {
+            campo: getattr(self._statistiche(), campo)
+            for campo in ('numero_rifornimenti', 'litri_totali', 'costo_carburante_totale', 'km_minimo',
+                          'km_massimo', 'ultimo_rifornimento', 'finestra_consumi', 'consumo_recente',
+                          'numero_manutenzioni', 'costo_manutenzioni_totale', 'ultima_manutenzione',
+                          'numero_eventi', 'costo_eventi_totale')
+        }
+        ricalcola([self.furgone.pk])
+        statistiche = self._statistiche()
+        for campo, valore in attesi.items():
+            self.assertEqual(getattr(statistiche, campo), valore, campo)
+
+    def test_rifornimenti_aggiornano_i_totali(self):
+        self._rifornimento(0, 10000)
+        self._rifornimento(10, 10500, litri='35.00')
+        self._rifornimento(20, 11000, litri='45.00')
+
+        statistiche = self._statistiche()
+        self.assertEqual(statistiche.numero_rifornimenti, 3)
+        self.assertEqual(statistiche.litri_totali, Decimal('120.00'))
+        self.assertEqual(statistiche.costo_carburante_totale, Decimal('210.00'))
+        self.assertEqual(statistiche.km_percorsi, 1000)
+        self.assertEqual(statistiche.ultimo_rifornimento, self.inizio + timedelta(days=20))
+        # 80 litri dopo il primo pieno su 1000 km
+        self.assertEqual(statistiche.consumo_recente, Decimal('8.00'))
+        self._confronta_con_ricalcolo()
+
+    def test_costo_costante_per_scrittura(self):
+        self._rifornimento(0, 10000)
+        with self.assertNumQueries(5) as primo:
+            self._rifornimento(1, 10100)
+        for giorno in range(2, 40):
+            self._rifornimento(giorno, 10000 + giorno * 100)
+        with self.assertNumQueries(len(primo.captured_queries)):
+            self._rifornimento(50, 20000)
+
+        finestra = self._statistiche().finestra_consumi
+        self.assertEqual(len(finestra), FINESTRA_CONSUMI)
+        self.assertEqual(finestra[-1][2], 20000)
+        self._confronta_con_ricalcolo()
+
+    def test_km_errati_senza_consumo_recente(self):
+        # 50 litri su 1 km: 5000 L/100km non entra nella colonna e non è un consumo reale
+        self._rifornimento(0, 10000)
+        self._rifornimento(1, 10001, litri='50.00')
+
+        statistiche = self._statistiche()
+        self.assertEqual(statistiche.numero_rifornimenti, 2)
+        self.assertIsNone(statistiche.consumo_recente)
+        self.assertIsNone(consumo_finestra([[1, '2025-01-01', 1000, '40'], [2, '2025-01-05', 1100, '1']]))
+        self._confronta_con_ricalcolo()
+
+    def test_modifica_ed_eliminazione(self):
+        primo = self._rifornimento(0, 10000)
+        self._rifornimento(10, 10500)
+        ultimo = self._rifornimento(20, 11000)
+
+        ultimo.litri = Decimal('50.00')
+        ultimo.save()
+        self.assertEqual(self._statistiche().litri_totali, Decimal('130.00'))
+
+        ultimo.delete()
+        primo.delete()
+        statistiche = self._statistiche()
+        self.assertEqual(statistiche.numero_rifornimenti, 1)
+        self.assertEqual((statistiche.km_minimo, statistiche.km_massimo), (10500, 10500))
+        self.assertEqual(statistiche.ultimo_rifornimento, self.inizio + timedelta(days=10))
+        self.assertIsNone(statistiche.consumo_recente)
+        self._confronta_con_ricalcolo()
+
+    def test_spostamento_su_altro_automezzo(self):
+        auto = Automezzo.objects.create(targa='AG002BB', marca='Fiat', modello='Panda', anno_immatricolazione=2021)
+        rifornimento = self._rifornimento(0, 10000)
+        rifornimento.automezzo = auto
+        rifornimento.save()
+
+        self.assertEqual(self._statistiche().numero_rifornimenti, 0)
+        self.assertEqual(self._statistiche(auto).numero_rifornimenti, 1)
+        self.assertEqual(self._statistiche(auto).litri_totali, Decimal('40.00'))
+
+    def test_manutenzioni_ed_eventi(self):
+        tagliando = Manutenzione.objects.create(
+            automezzo=self.furgone, data=self.inizio, descrizione='Tagliando', costo=Decimal('300.00')
+        )
+        self.assertIsNone(self._statistiche().ultima_manutenzione)
+        tagliando.completata = True
+        tagliando.save()
+        EventoAutomezzo.objects.create(
+            automezzo=self.furgone, tipo='guasto', data_evento=self.inizio, descrizione='Frizione'
+        )
+        EventoAutomezzo.objects.create(
+            automezzo=self.furgone, tipo='incidente', data_evento=self.inizio,
+            descrizione='Paraurti', costo=Decimal('250.00'),
+        )
+
+        statistiche = self._statistiche()
+        self.assertEqual(statistiche.numero_manutenzioni, 1)
+        self.assertEqual(statistiche.costo_manutenzioni_totale, Decimal('300.00'))
+        self.assertEqual(statistiche.ultima_manutenzione, self.inizio)
+        self.assertEqual(statistiche.numero_eventi, 2)
+        self.assertEqual(statistiche.costo_eventi_totale, Decimal('250.00'))
+        self._confronta_con_ricalcolo()
+
+        tagliando.delete()
+        self.assertIsNone(self._statistiche().ultima_manutenzione)
+
+    def test_helper_e_viste_senza_count(self):
+        self._rifornimento(0, 10000)
+        self._rifornimento(10, 10600, litri='42.00')
+        Manutenzione.objects.create(automezzo=self.furgone, data=self.inizio, descrizione='Olio', costo=Decimal('90.00'))
+
+        automezzo = Automezzo.objects.select_related('statistiche').get(pk=self.furgone.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(automezzo.rifornimenti_count(), 2)
+            self.assertEqual(automezzo.manutenzioni_count(), 1)
+            self.assertEqual(automezzo.eventi_count(), 0)
+        nuovo = Automezzo.objects.create(targa='AG003CC', marca='Fiat', modello='Doblo', anno_immatricolazione=2022)
+        self.assertEqual(nuovo.rifornimenti_count(), 0)
+
+        utente = get_user_model().objects.create_user(username='flotta', password='pw')
+        self.client.force_login(utente)
+        risposta = self.client.get(reverse('automezzi:automezzo_detail', args=[self.furgone.pk]))
+        self.assertContains(risposta, '7,00 L/100km')
+        risposta = self.client.get(reverse('automezzi:dashboard'))
+        self.assertEqual(risposta.context['tot_rifornimenti'], 2)
+        self.assertEqual(risposta.context['tot_manutenzioni'], 1)
+        self.assertEqual(risposta.context['tot_automezzi'], 2)
+
+    def test_eliminazione_automezzo_e_consumo_finestra(self):
+        self._rifornimento(0, 10000)
+        self.furgone.delete()
+        self.assertFalse(StatisticheAutomezzo.objects.exists())
+
+        self.assertIsNone(consumo_finestra([[1, '2025-01-01', 1000, '40']]))
+        self.assertEqual(
+            consumo_finestra([[1, '2025-01-01', 1000, '40'], [2, '2025-01-05', 1500, '30']]),
+            Decimal('6.00'),
+        )
+
+
+class PanoramicaFlottaTests(TestCase):
+    """Test per l'elenco automezzi con gli indicatori annotati"""
+
+    def setUp(self):
+        utente = get_user_model().objects.create_user(username='flotta', password='pw')
+        self.client.force_login(utente)
+        self.oggi = date.today()
+        self.furgone = Automezzo.objects.create(
+            targa='PF001AA', marca='Iveco', modello='Daily', anno_immatricolazione=2019,
+            data_revisione=self.oggi - timedelta(days=700),
+        )
+        self.auto = Automezzo.objects.create(
+            targa='PF002BB', marca='Fiat', modello='Panda', anno_immatricolazione=2021, attivo=False,
+        )
+        for giorni, km, costo in [(400, 9000, '50.00'), (2, 10000, '70.00'), (1, 10400, '60.00')]:
+            Rifornimento.objects.create(
+                automezzo=self.furgone, data=self.oggi - timedelta(days=giorni), chilometri=km,
+                litri=Decimal('30.00'), costo_totale=Decimal(costo),
+            )
+        Manutenzione.objects.create(
+            automezzo=self.furgone, data=self.oggi, descrizione='Freni', costo=Decimal('200.00'), completata=True,
+        )
+        self.url = reverse('automezzi:automezzo_list')
+
+    def test_indicatori_annotati(self):
+        risposta = self.client.get(self.url)
+        furgone = next(a for a in risposta.context['automezzi'] if a.pk == self.furgone.pk)
+
+        self.assertEqual(furgone.num_rifornimenti, 3)
+        self.assertEqual(furgone.num_manutenzioni, 1)
+        self.assertEqual(furgone.km_ultimo_rifornimento, 10400)
+        self.assertEqual(furgone.ultimo_rifornimento, self.oggi - timedelta(days=1))
+        self.assertEqual(furgone.ultima_manutenzione, self.oggi)
+        self.assertEqual(furgone.costo_manutenzioni_anno, Decimal('200.00'))
+        self.assertEqual(furgone.prossima_revisione, self.furgone.data_revisione + INTERVALLO_REVISIONE)
+        if (self.oggi - timedelta(days=2)).year == self.oggi.year:
+            self.assertEqual(furgone.costo_carburante_anno, Decimal('130.00'))
+
+    def test_query_costanti_rispetto_alla_pagina(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(5) as pochi:
+            self.client.get(self.url)
+        for numero in range(30):
+            automezzo = Automezzo.objects.create(
+                targa=f'PF{numero:03d}ZZ', marca='Fiat', modello='Doblo', anno_immatricolazione=2020
+            )
+            EventoAutomezzo.objects.create(automezzo=automezzo, tipo='guasto', data_evento=self.oggi)
+        with self.assertNumQueries(len(pochi.captured_queries)):
+            risposta = self.client.get(self.url)
+        self.assertEqual(len(risposta.context['automezzi']), 20)
+
+    def test_ordinamento_e_filtri(self):
+        risposta = self.client.get(self.url, {'ordina': '-rifornimenti'})
+        self.assertEqual(risposta.context['automezzi'][0].pk, self.furgone.pk)
+        risposta = self.client.get(self.url, {'ordina': 'rifornimenti'})
+        self.assertEqual(risposta.context['automezzi'][0].pk, self.auto.pk)
+
+        risposta = self.client.get(self.url, {'stato': 'attivi'})
+        self.assertEqual([a.pk for a in risposta.context['automezzi']], [self.furgone.pk])
+        risposta = self.client.get(self.url, {'revisione': 'in_scadenza', 'search': 'daily'})
+        self.assertEqual([a.pk for a in risposta.context['automezzi']], [self.furgone.pk])
+        risposta = self.client.get(self.url, {'revisione': 'scaduta'})
+        self.assertEqual(list(risposta.context['automezzi']), [])
+        # Ordinamento sconosciuto: si torna alla targa
+        risposta = self.client.get(self.url, {'ordina': 'password'})
+        self.assertEqual(risposta.status_code, 200)
+
+
+class ImportCarburantiTests(TestCase):
+    """Test per l'importazione in streaming dei prezzi carburante"""
+
+    def _importa(self, lettore, contenuto, **opzioni):
+        return ImportazioneCarburanti(**opzioni).esegui(lettore(BytesIO(contenuto)))
+
+    def test_csv_encoding_rilevato_e_upsert_a_lotti(self):
+        TipoCarburante.objects.create(nome='Gasolio', costo_per_litro=Decimal('1.700'))
+        righe = ['descCarburante;prezzo;idImpianto']
+        righe += [f'{nome};{prezzo};{i}' for i, (nome, prezzo) in enumerate([
+            ('Benzina', '1,859'), ('Gasolio', '1,749'), ('GPL', '0,799'), ('Metano', '1,299'),
+            ('Benzina', '1,869'), ('HVO', '1,999'), ('Bioetanolo', '€ 1,5'),
+        ])]
+        righe.append('Senza prezzo;;99')
+        contenuto = '\n'.join(righe).replace('Bioetanolo', 'Bioetanolo è').encode('cp1252')
+
+        # Savepoint, una query per i tipi esistenti, per ognuno dei 4 lotti da 2 carburanti
+        # l'upsert dei tipi, la lettura dei loro id e l'upsert dello storico
+        with self.assertNumQueries(15):
+            importazione = self._importa(leggi_csv, contenuto, update_existing=True, dimensione_lotto=2)
+
+        self.assertEqual(importazione.righe, 8)
+        self.assertEqual(importazione.errori, 1)
+        self.assertEqual(len(importazione.creati), 5)
+        self.assertEqual(importazione.aggiornati, {'Gasolio'})
+        self.assertEqual(TipoCarburante.objects.get(nome='Benzina').costo_per_litro, Decimal('1.869'))
+        self.assertEqual(TipoCarburante.objects.get(nome='Bioetanolo è').costo_per_litro, Decimal('1.500'))
+
+    def test_json_letto_a_blocchi(self):
+        documento = {
+            'fonte': 'prezzi [giornalieri]', 'totale': 1234567.891,
+            'carburanti': [{'nome': 'Diesel', 'costo_per_litro': 1.759}, {'name': 'GPL', 'price': '0,81'}],
+        }
+        with patch('automezzi.carburanti.DIMENSIONE_BLOCCO_JSON', 5):
+            self._importa(leggi_json, json.dumps(documento).encode())
+            self._importa(leggi_json, b'[{"nome": "Metano", "prezzo": 1.2}]')
+
+        self.assertEqual(
+            dict(TipoCarburante.objects.values_list('nome', 'costo_per_litro')),
+            {'Diesel': Decimal('1.759'), 'GPL': Decimal('0.810'), 'Metano': Decimal('1.200')},
+        )
+
+    def test_xml_e_esistenti_non_aggiornati(self):
+        TipoCarburante.objects.create(nome='Diesel', costo_per_litro=Decimal('1.700'))
+        contenuto = (
+            b'<prezzi><impianto id="1"><carburante><nome>Diesel</nome><prezzo>1.8</prezzo></carburante>'
+            b'<fuel nome="GPL" prezzo="0.8"/></impianto><voce nome="Benzina" prezzo="1.9"/></prezzi>'
+        )
+        importazione = self._importa(leggi_xml, contenuto)
+
+        self.assertEqual(importazione.saltati, {'Diesel'})
+        self.assertEqual(importazione.creati, {'GPL', 'Benzina'})
+        self.assertEqual(TipoCarburante.objects.get(nome='Diesel').costo_per_litro, Decimal('1.700'))
+
+    def test_xml_elementi_letti_staccati_dall_albero(self):
+        contenuto = b'<root><carburanti>' + b''.join(
+            f'<carburante><nome>C{i}</nome><prezzo>1.5</prezzo></carburante>'.encode() for i in range(5000)
+        ) + b'</carburanti></root>'
+        iterparse = leggi_xml.__globals__['ET'].iterparse
+        radici = []
+
+        def registra(*args, **kwargs):
+            for evento, elemento in iterparse(*args, **kwargs):
+                if not radici:
+                    radici.append(elemento)
+                yield evento, elemento
+
+        # In memoria restano al più gli elementi del blocco letto dal parser
+        with patch('automezzi.carburanti.ET.iterparse', registra):
+            letti = 0
+            for letti, _ in enumerate(leggi_xml(BytesIO(contenuto)), 1):
+                self.assertLess(len(list(radici[0].iter('carburante'))), 1000)
+        self.assertEqual(letti, 5000)
+        self.assertEqual(len(list(radici[0].iter())), 2)
+
+    def test_comando(self):
+        out = StringIO()
+        call_command('import_carburanti', '--preset', 'basic', '--dry-run', stdout=out)
+        self.assertIn('Creati: 4', out.getvalue())
+        self.assertFalse(TipoCarburante.objects.exists())
+
+        with tempfile.NamedTemporaryFile(suffix='.csv') as file:
+            file.write(b'nome,prezzo\nDiesel,1.75\nGPL,0.85\n')
+            file.flush()
+            call_command('import_carburanti', '--file', file.name, stdout=StringIO())
+        self.assertEqual(TipoCarburante.objects.count(), 2)
+
+
+class StoricoPrezziCarburanteTests(TestCase):
+    """Test per lo storico dei prezzi carburante"""
+
+    def setUp(self):
+        self.diesel = TipoCarburante.objects.create(nome='Diesel', costo_per_litro=Decimal('1.700'))
+        self.gpl = TipoCarburante.objects.create(nome='GPL', costo_per_litro=Decimal('0.800'))
+        # Diesel: 1.700 dal 1/3, 1.800 dal 4/3 (ripetuto il 6/3), 1.750 dal 10/3
+        for giorno, prezzo in [(1, '1.700'), (4, '1.800'), (6, '1.800'), (10, '1.750')]:
+            PrezzoCarburante.objects.create(tipo=self.diesel, data=date(2025, 3, giorno), prezzo=Decimal(prezzo))
+        PrezzoCarburante.objects.create(tipo=self.gpl, data=date(2025, 3, 5), prezzo=Decimal('0.800'))
+
+    def test_prezzo_al_e_in_blocco(self):
+        self.assertIsNone(prezzo_al(self.diesel.pk, date(2025, 2, 28)))
+        self.assertEqual(prezzo_al(self.diesel.pk, date(2025, 3, 5)), Decimal('1.800'))
+        self.assertEqual(prezzo_al(self.diesel.pk, date(2025, 12, 31)), Decimal('1.750'))
+
+        with self.assertNumQueries(1):
+            prezzi = prezzi_al([
+                (self.diesel.pk, date(2025, 3, 3)), (self.diesel.pk, date(2025, 3, 10)),
+                (self.gpl.pk, date(2025, 3, 4)), (self.gpl.pk, date(2025, 3, 9)),
+            ])
+        self.assertEqual(prezzi, {
+            (self.diesel.pk, date(2025, 3, 3)): Decimal('1.700'),
+            (self.diesel.pk, date(2025, 3, 10)): Decimal('1.750'),
+            (self.gpl.pk, date(2025, 3, 4)): None,
+            (self.gpl.pk, date(2025, 3, 9)): Decimal('0.800'),
+        })
+
+    def test_prezzi_rifornimenti_query_costanti(self):
+        automezzo = Automezzo.objects.create(
+            targa='PR001AA', marca='Iveco', modello='Daily', anno_immatricolazione=2020,
+            chilometri_attuali=0, tipo_carburante=self.diesel,
+        )
+        senza_tipo = Automezzo.objects.create(
+            targa='PR002AA', marca='Iveco', modello='Daily', anno_immatricolazione=2020, chilometri_attuali=0,
+        )
+        rifornimenti = [
+            Rifornimento.objects.create(
+                automezzo=automezzo, data=date(2025, 3, giorno), litri=Decimal('50'),
+                costo_totale=Decimal('90'), chilometri=1000 * giorno,
+            )
+            for giorno in (2, 7, 12)
+        ]
+        altro = Rifornimento.objects.create(
+            automezzo=senza_tipo, data=date(2025, 3, 7), litri=Decimal('50'),
+            costo_totale=Decimal('90'), chilometri=500,
+        )
+
+        with self.assertNumQueries(2):
+            prezzi = prezzi_rifornimenti(rifornimenti + [altro])
+        self.assertEqual(
+            [prezzi[r.pk] for r in rifornimenti], [Decimal('1.700'), Decimal('1.800'), Decimal('1.750')],
+        )
+        self.assertIsNone(prezzi[altro.pk])
+
+    def test_serie_giornaliera_e_settimanale(self):
+        giornaliera = serie(self.diesel.pk, date(2025, 2, 27), date(2025, 3, 4))
+        self.assertEqual([p['periodo'] for p in giornaliera], [date(2025, 3, d) for d in range(1, 5)])
+        self.assertEqual(giornaliera[-1]['prezzo_medio'], Decimal('1.800'))
+
+        # Settimana dal 3/3 (lunedì): 3/3 a 1.700, poi sei giorni a 1.800
+        settimanale = serie(self.diesel.pk, date(2025, 3, 3), date(2025, 3, 9), passo='settimana')
+        self.assertEqual(settimanale, [{
+            'periodo': date(2025, 3, 3), 'prezzo_medio': Decimal('1.786'),
+            'minimo': Decimal('1.700'), 'massimo': Decimal('1.800'), 'giorni': 7,
+        }])
+
+    def test_compatta_conserva_la_serie(self):
+        prima = serie(self.diesel.pk, date(2025, 3, 1), date(2025, 3, 15))
+
+        out = StringIO()
+        call_command('compatta_prezzi_carburante', '--dry-run', stdout=out)
+        self.assertEqual(PrezzoCarburante.objects.count(), 5)
+
+        self.assertEqual(compatta(), 1)
+        self.assertFalse(PrezzoCarburante.objects.filter(data=date(2025, 3, 6)).exists())
+        self.assertEqual(serie(self.diesel.pk, date(2025, 3, 1), date(2025, 3, 15)), prima)
+
+    def test_importazione_registra_storico(self):
+        ImportazioneCarburanti(update_existing=True, data_prezzo=date(2025, 4, 1)).esegui(
+            [{'nome': 'Diesel', 'prezzo': '1.650'}, {'nome': 'GPL', 'prezzo': '0.800'}, {'nome': 'HVO', 'prezzo': '1.9'}]
+        )
+        # GPL invariato: nessun punto nuovo
+        self.assertEqual(prezzo_al(self.diesel.pk, date(2025, 4, 2)), Decimal('1.650'))
+        self.assertFalse(PrezzoCarburante.objects.filter(tipo=self.gpl, data=date(2025, 4, 1)).exists())
+        self.assertEqual(
+            PrezzoCarburante.objects.get(tipo__nome='HVO').data, date(2025, 4, 1),
+        )
+        # Un secondo import nello stesso giorno sovrascrive il punto
+        registra({self.diesel.pk: Decimal('1.640')}, date(2025, 4, 1))
+        self.assertEqual(prezzo_al(self.diesel.pk, date(2025, 4, 1)), Decimal('1.640'))
+
+    def test_vista_serie(self):
+        utente = get_user_model().objects.create_user(username='prezzi', password='x')
+        self.client.force_login(utente)
+        url = reverse('automezzi:prezzi_carburante_serie', args=[self.diesel.pk])
+
+        risposta = self.client.get(url, {'dal': '2025-03-03', 'al': '2025-03-16', 'passo': 'settimana'})
+        self.assertEqual(risposta.status_code, 200)
+        self.assertEqual(
+            [p['prezzo_medio'] for p in risposta.json()['serie']], ['1.786', '1.750'],
+        )
+        self.assertEqual(self.client.get(url, {'dal': 'ieri'}).status_code, 400)
+
+
+class ImportCartaCarburanteTests(TestCase):
+    """Test per l'importazione degli estratti conto delle carte carburante"""
+
+    def setUp(self):
+        self.furgone = Automezzo.objects.create(
+            targa='CC001AA', marca='Iveco', modello='Daily', anno_immatricolazione=2020, chilometri_attuali=20000,
+        )
+        self.camion = Automezzo.objects.create(
+            targa='CC002BB', marca='Fiat', modello='Ducato', anno_immatricolazione=2021, chilometri_attuali=5000,
+        )
+        Rifornimento.objects.create(
+            automezzo=self.furgone, data=date(2025, 3, 1), litri=Decimal('50.00'),
+            costo_totale=Decimal('90.00'), chilometri=10000,
+        )
+
+    def _estratto(self, righe):
+        intestazione = 'Targa veicolo;Data transazione;Quantità;Importo;Km'
+        return BytesIO('\n'.join([intestazione] + righe).encode('cp1252'))
+
+    def test_deduplica_e_aggiorna_flotta(self):
+        estratto = self._estratto([
+            'CC001AA;01/03/2025 07:40;50,00;90,00;10.000',   # già registrato a mano
+            'cc-001 aa;08/03/2025 18:02;60,50;110,11;10.700',
+            'CC001AA;08/03/2025 18:02;60,50;110,11;10.700',  # ripetuto nel file
+            'CC002BB;2025-03-09;40,004;72,001;6.100',  # arrotondato ai centesimi del modello
+            'ZZ999ZZ;09/03/2025;40;72,00;1.000',
+            'CC002BB;31/02/2025;40;72,00;6.200',
+        ])
+        importazione = ImportazioneCartaCarburante(batch_size=2).esegui(estratto)
+
+        self.assertEqual(importazione.righe, 6)
+        self.assertEqual(importazione.inseriti, 2)
+        self.assertEqual(importazione.duplicati, 2)
+        self.assertEqual(importazione.scartati, 2)
+        self.assertEqual([numero for numero, _ in importazione.errori], [6, 7])
+        self.assertEqual(self.furgone.rifornimenti.count(), 2)
+
+        # Aggregati ricalcolati e chilometri mai ridotti
+        self.furgone.refresh_from_db()
+        self.camion.refresh_from_db()
+        self.assertEqual(self.furgone.chilometri_attuali, 20000)
+        self.assertEqual(self.camion.chilometri_attuali, 6100)
+        self.assertEqual(self.furgone.statistiche.numero_rifornimenti, 2)
+        self.assertEqual(self.furgone.statistiche.litri_totali, Decimal('110.50'))
+        self.assertEqual(self.camion.statistiche.km_massimo, 6100)
+        self.assertEqual(self.camion.rifornimenti.get().litri, Decimal('40.00'))
+
+        # Reimportare lo stesso estratto non inserisce nulla
+        estratto.seek(0)
+        self.assertEqual(ImportazioneCartaCarburante().esegui(estratto).inseriti, 0)
+
+    def test_chilometri_decimali_e_valori_fuori_colonna(self):
+        importazione = ImportazioneCartaCarburante().esegui(self._estratto([
+            'CC002BB;10/03/2025;40;72,00;6100.6',
+            'CC002BB;11/03/2025;40;72,00;6.200,9',
+            'CC002BB;12/03/2025;40;72,00;99999999999',
+            'CC002BB;13/03/2025;12345,00;72,00;6.300',
+            'CC002BB;14/03/2025;40;123.456,00;6.400',
+        ]))
+
+        self.assertEqual((importazione.inseriti, importazione.scartati), (2, 3))
+        self.assertEqual([numero for numero, _ in importazione.errori], [4, 5, 6])
+        self.assertEqual(list(self.camion.rifornimenti.order_by('data').values_list('chilometri', flat=True)), [6100, 6200])
+
+    def test_query_indipendenti_dalle_righe(self):
+        def estratto(giorni):
+            return self._estratto([
+                f'CC00{1 + giorno % 2}{"AA" if giorno % 2 == 0 else "BB"};{giorno:02d}/04/2025;40;72,00;{30000 + giorno * 100}'
+                for giorno in range(1, giorni + 1)
+            ])
+
+        Rifornimento.objects.create(
+            automezzo=self.camion, data=date(2025, 3, 1), litri=Decimal('40.00'),
+            costo_totale=Decimal('72.00'), chilometri=5000,
+        )
+        # Targhe, savepoint, chiavi esistenti e inserimento del lotto, ricalcolo
+        # degli aggregati (10 query) e un solo UPDATE dei chilometri
+        with self.assertNumQueries(15) as pochi:
+            ImportazioneCartaCarburante().esegui(estratto(4))
+        with self.assertNumQueries(len(pochi.captured_queries)):
+            importazione = ImportazioneCartaCarburante().esegui(estratto(30))
+        self.assertEqual(importazione.inseriti, 26)
+
+    def test_comando_e_vista(self):
+        with tempfile.NamedTemporaryFile(suffix='.csv') as file:
+            file.write(self._estratto(['CC002BB;10/03/2025;40;72,00;6.100']).getvalue())
+            file.flush()
+            out = StringIO()
+            call_command('import_carta_carburante', file.name, '--dry-run', stdout=out)
+            self.assertIn('Rifornimenti inseriti: 1', out.getvalue())
+            self.assertFalse(self.camion.rifornimenti.exists())
+
+        utente = get_user_model().objects.create_user(username='flotta', password='x')
+        self.client.force_login(utente)
+        estratto = self._estratto(['CC002BB;10/03/2025;40;72,00;6.100'])
+        estratto.name = 'estratto.csv'
+        risposta = self.client.post(reverse('automezzi:rifornimento_import'), {'file': estratto})
+        self.assertEqual(risposta.status_code, 200)
+        self.assertContains(risposta, 'Rifornimenti inseriti: <strong>1</strong>', html=False)
+        self.assertEqual(self.camion.rifornimenti.count(), 1)
+
+
+class AnomalieRifornimentiTests(TestCase):
+    """Test per il rilevamento vettoriale dei rifornimenti anomali"""
+
+    def setUp(self):
+        self.oggi = date(2025, 6, 30)
+        self.furgone = Automezzo.objects.create(
+            targa='AN001AA', marca='Iveco', modello='Daily', anno_immatricolazione=2020,
+        )
+        self.camion = Automezzo.objects.create(
+            targa='AN002BB', marca='Fiat', modello='Ducato', anno_immatricolazione=2021,
+        )
+
+    def _tratte(self, automezzo, litri_per_tratta, km_tratta=500):
+        """Rifornimenti settimanali: il primo apre la serie, gli altri chiudono una tratta"""
+        km = 10000
+        rifornimenti = []
+        for settimana, litri in enumerate([Decimal('40')] + litri_per_tratta):
+            km += km_tratta if settimana else 0
+            rifornimenti.append(Rifornimento.objects.create(
+                automezzo=automezzo, data=self.oggi - timedelta(weeks=len(litri_per_tratta) - settimana),
+                litri=litri, costo_totale=litri * 2, chilometri=km,
+            ))
+        return rifornimenti
+
+    def test_mediane_e_punteggi_per_gruppo(self):
+        gruppi = np.array([0, 1, 0, 1, 0, 1, 1])
+        valori = np.array([3.0, 10.0, 1.0, 30.0, 2.0, 20.0, 40.0])
+        np.testing.assert_array_equal(mediane(gruppi, valori), [2.0, 25.0])
+
+        # Gruppo con MAD nulla: si ricade sulla deviazione media assoluta
+        punteggi, mediana = punteggi_robusti(np.zeros(5, dtype=int), np.array([8.0, 8.0, 8.0, 8.0, 18.0]))
+        self.assertEqual(mediana[0], 8.0)
+        self.assertEqual(punteggi[:4].tolist(), [0.0] * 4)
+        self.assertGreater(punteggi[4], 3.5)
+
+    def test_rileva_e_salva(self):
+        normali = [Decimal(litri) for litri in ('50', '52', '49', '51', '50', '48', '53', '50')]
+        rifornimenti = self._tratte(self.furgone, normali[:4] + [Decimal('95')] + normali[4:])
+        sospetto = rifornimenti[5]
+        # Pochi rifornimenti: il camion non viene valutato sui consumi
+        pochi = self._tratte(self.camion, [Decimal('50'), Decimal('150')])
+        errato = Rifornimento.objects.create(
+            automezzo=self.camion, data=self.oggi - timedelta(days=1), litri=Decimal('40'), costo_totale=Decimal('80'), chilometri=100,
+        )
+        vecchio = AnomaliaRifornimento.objects.create(
+            rifornimento=rifornimenti[1], automezzo=self.furgone, tipo='consumo_basso',
+        )
+
+        with self.assertNumQueries(1):
+            risultato = RilevamentoAnomalie(oggi=self.oggi, dry_run=True).esegui()
+        self.assertEqual(risultato.analizzati, 14)
+        self.assertEqual(risultato.tratte, 11)
+
+        rilevamento = RilevamentoAnomalie(oggi=self.oggi).esegui()
+        self.assertEqual(rilevamento.rimosse, 1)
+        self.assertFalse(AnomaliaRifornimento.objects.filter(pk=vecchio.pk).exists())
+        self.assertEqual(
+            {(a.rifornimento_id, a.tipo) for a in AnomaliaRifornimento.objects.all()},
+            {(sospetto.pk, 'consumo_alto'), (errato.pk, 'km_non_crescenti')},
+        )
+        anomalia = sospetto.anomalia
+        self.assertEqual(anomalia.consumo, Decimal('19.00'))
+        self.assertEqual(anomalia.consumo_mediano, Decimal('10.00'))
+        self.assertNotIn(pochi[-1].pk, AnomaliaRifornimento.objects.values_list('rifornimento_id', flat=True))
+
+        # Le segnalazioni verificate sopravvivono alle esecuzioni successive
+        AnomaliaRifornimento.objects.filter(pk=anomalia.pk).update(verificata=True)
+        RilevamentoAnomalie(oggi=self.oggi).esegui()
+        self.assertEqual(AnomaliaRifornimento.objects.count(), 2)
+        self.assertTrue(AnomaliaRifornimento.objects.get(rifornimento=sospetto).verificata)
+
+    def test_comando_e_dashboard(self):
+        self._tratte(self.furgone, [Decimal(litri) for litri in ('50', '51', '49', '50', '120', '50')])
+        out = StringIO()
+        call_command('rileva_anomalie_rifornimenti', '--giorni', '100000', stdout=out)
+        self.assertIn('Anomalie: 1', out.getvalue())
+
+        utente = get_user_model().objects.create_user(username='anomalie', password='x')
+        self.client.force_login(utente)
+        risposta = self.client.get(reverse('automezzi:dashboard'))
+        self.assertEqual(risposta.context['anomalie_count'], 1)
+        self.assertContains(risposta, 'Consumo anomalo alto')
+
+
+class BudgetQueryTests(BudgetQueryMixin, TestCase):
+    """Numero massimo di query delle pagine più usate della flotta"""
+
+    BUDGET_QUERY = {
+        'automezzi:dashboard': 9,
+        'automezzi:automezzo_list': 5,
+        'automezzi:rifornimento_list': 5,
+        'automezzi:manutenzione_list': 5,
+        'automezzi:evento_list': 5,
+    }
+
+    def setUp(self):
+        self.utente = get_user_model().objects.create_user(username='flotta', password='pw', livello='totale')
+        self.client.force_login(self.utente)
+        self.oggi = date.today()
+        self.creati = 0
+        self._mezzi()
+
+    def _mezzi(self, quanti=3):
+        for numero in range(self.creati, self.creati + quanti):
+            self.creati += 1
+            automezzo = Automezzo.objects.create(
+                targa=f'BQ{numero:03d}AA', marca='Fiat', modello='Ducato', anno_immatricolazione=2020,
+                assegnato_a=self.utente,
+            )
+            Rifornimento.objects.create(
+                automezzo=automezzo, data=self.oggi, chilometri=1000, litri=Decimal('30.00'), costo_totale=Decimal('60.00'),
+            )
+            Manutenzione.objects.create(
+                automezzo=automezzo, data=self.oggi, descrizione='Tagliando', costo=Decimal('200.00'), responsabile=self.utente,
+            )
+            EventoAutomezzo.objects.create(
+                automezzo=automezzo, tipo='guasto', data_evento=self.oggi, dipendente_coinvolto=self.utente,
+            )
 
-# Create your tests here.
+    def test_budget_pagine(self):
+        for nome_url in self.BUDGET_QUERY:
+            with self.subTest(nome_url):
+                self.assertBudgetQuery(nome_url, aggiungi_righe=self._mezzi)
@@ -4,7 +4,8 @@ from .views import (
     AutomezzoListView, AutomezzoDetailView, AutomezzoCreateView, AutomezzoUpdateView, AutomezzoDeleteView,
     ManutenzioneListView, ManutenzioneDetailView, ManutenzioneCreateView, ManutenzioneUpdateView, ManutenzioneDeleteView,
     RifornimentoListView, RifornimentoDetailView, RifornimentoCreateView, RifornimentoUpdateView, RifornimentoDeleteView,
-    EventoAutomezzoListView, EventoAutomezzoDetailView, EventoAutomezzoCreateView, EventoAutomezzoUpdateView, EventoAutomezzoDeleteView, DashboardView
+    EventoAutomezzoListView, EventoAutomezzoDetailView, EventoAutomezzoCreateView, EventoAutomezzoUpdateView, EventoAutomezzoDeleteView, DashboardView,
+    ImportCartaCarburanteView, PrezziCarburanteSerieView,
 )
 
 app_name = "automezzi"
@@ -31,6 +32,7 @@ urlpatterns = [
     # RIFORNIMENTI
     path("rifornimenti/", RifornimentoListView.as_view(), name="rifornimento_list"),
     path("rifornimenti/nuovo/", RifornimentoCreateView.as_view(), name="rifornimento_create"),
+    path("rifornimenti/importa/", ImportCartaCarburanteView.as_view(), name="rifornimento_import"),
     path("rifornimenti/<int:pk>/", RifornimentoDetailView.as_view(), name="rifornimento_detail"),
     path("rifornimenti/<int:pk>/modifica/", RifornimentoUpdateView.as_view(), name="rifornimento_update"),
     path("rifornimenti/<int:pk>/elimina/", RifornimentoDeleteView.as_view(), name="rifornimento_delete"),
@@ -47,4 +49,7 @@ urlpatterns = [
     # annidate per automezzo
     path("automezzi/<int:automezzo_pk>/eventi/", EventoAutomezzoListView.as_view(), name="evento_list_automezzo"),
     path("automezzi/<int:automezzo_pk>/eventi/nuovo/", EventoAutomezzoCreateView.as_view(), name="evento_create_automezzo"),
+
+    # PREZZI CARBURANTE
+    path("carburanti/<int:pk>/serie/", PrezziCarburanteSerieView.as_view(), name="prezzi_carburante_serie"),
 ]
\ No newline at end of file
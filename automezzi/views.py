@@ -1,25 +1,149 @@
 from django.urls import reverse_lazy
+from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+from django.views import View
 from django.views.generic import (
     ListView, DetailView, CreateView, UpdateView, DeleteView, TemplateView
 )
-from .models import Automezzo, Manutenzione, Rifornimento, EventoAutomezzo
+from anagrafica.importazione import ErroreImportazione
+
+from . import prezzi
+from .carta_carburante import ImportazioneCartaCarburante
+from .models import (
+    AnomaliaRifornimento, Automezzo, Manutenzione, Rifornimento, EventoAutomezzo, TipoCarburante, INTERVALLO_REVISIONE,
+)
 from .forms import (
     AutomezzoForm, ManutenzioneForm, RifornimentoForm, EventoAutomezzoForm
 )
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.db.models import Count, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 # AUTOMEZZI CRUD
 class AutomezzoListView(LoginRequiredMixin, ListView):
+    """
+    Panoramica della flotta: tutti gli indicatori di ogni mezzo arrivano
+    annotati nella stessa query (join sulle statistiche e sottoquery),
+    quindi la pagina costa poche query qualunque sia la sua dimensione.
+    """
     model = Automezzo
     template_name = "automezzi/automezzo_list.html"
     context_object_name = "automezzi"
     paginate_by = 20
 
+    # Parametro ?ordina= -> campo annotato (prefisso '-' per l'ordine decrescente)
+    ORDINAMENTI = {
+        "targa": "targa",
+        "modello": "marca",
+        "km": "chilometri_attuali",
+        "rifornimenti": "num_rifornimenti",
+        "manutenzioni": "num_manutenzioni",
+        "eventi": "num_eventi",
+        "ultimo_rifornimento": "ultimo_rifornimento",
+        "ultima_manutenzione": "ultima_manutenzione",
+        "carburante_anno": "costo_carburante_anno",
+        "manutenzioni_anno": "costo_manutenzioni_anno",
+        "revisione": "data_revisione",
+    }
+    GIORNI_REVISIONE_IN_SCADENZA = 60
+
+    def get_queryset(self):
+        today = timezone.now().date()
+        inizio_anno = today.replace(month=1, day=1)
+        rifornimenti = Rifornimento.objects.filter(automezzo=OuterRef("pk"))
+        queryset = Automezzo.objects.annotate(
+            num_rifornimenti=Coalesce("statistiche__numero_rifornimenti", 0),
+            num_manutenzioni=Coalesce("statistiche__numero_manutenzioni", 0),
+            num_eventi=Coalesce("statistiche__numero_eventi", 0),
+            ultimo_rifornimento=F("statistiche__ultimo_rifornimento"),
+            ultima_manutenzione=F("statistiche__ultima_manutenzione"),
+            km_ultimo_rifornimento=Subquery(
+                rifornimenti.order_by("-data", "-chilometri", "-pk").values("chilometri")[:1]
+            ),
+            costo_carburante_anno=Coalesce(
+                Subquery(_somma(rifornimenti.filter(data__gte=inizio_anno, data__lte=today), "costo_totale")),
+                Value(Decimal("0.00")),
+            ),
+            costo_manutenzioni_anno=Coalesce(
+                Subquery(_somma(Manutenzione.objects.filter(
+                    automezzo=OuterRef("pk"), data__gte=inizio_anno, data__lte=today
+                ), "costo")),
+                Value(Decimal("0.00")),
+            ),
+        )
+        return self._ordina(self._filtra(queryset, today))
+
+    def _filtra(self, queryset, today):
+        search_query = self.request.GET.get("search")
+        if search_query:
+            queryset = queryset.filter(
+                Q(targa__icontains=search_query) |
+                Q(marca__icontains=search_query) |
+                Q(modello__icontains=search_query)
+            )
+
+        stato = self.request.GET.get("stato")
+        if stato == "attivi":
+            queryset = queryset.filter(attivo=True)
+        elif stato == "non_attivi":
+            queryset = queryset.filter(attivo=False)
+        elif stato == "disponibili":
+            queryset = queryset.filter(attivo=True, disponibile=True, bloccata=False)
+        elif stato == "bloccati":
+            queryset = queryset.filter(bloccata=True)
+
+        # Prossima revisione = ultima revisione + INTERVALLO_REVISIONE: si filtra sulla data salvata
+        revisione = self.request.GET.get("revisione")
+        if revisione == "scaduta":
+            queryset = queryset.filter(data_revisione__lt=today - INTERVALLO_REVISIONE)
+        elif revisione == "in_scadenza":
+            queryset = queryset.filter(
+                data_revisione__gte=today - INTERVALLO_REVISIONE,
+                data_revisione__lte=today + timedelta(days=self.GIORNI_REVISIONE_IN_SCADENZA) - INTERVALLO_REVISIONE,
+            )
+        return queryset
+
+    def _ordina(self, queryset):
+        ordina = self.request.GET.get("ordina", "targa")
+        campo = self.ORDINAMENTI.get(ordina.lstrip("-"))
+        if campo is None:
+            return queryset.order_by("targa")
+        espressione = F(campo).desc(nulls_last=True) if ordina.startswith("-") else F(campo).asc(nulls_last=True)
+        # pk come spareggio: la paginazione resta stabile
+        return queryset.order_by(espressione, "pk")
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["search_query"] = self.request.GET.get("search", "")
+        context["stato"] = self.request.GET.get("stato", "")
+        context["revisione"] = self.request.GET.get("revisione", "")
+        context["ordina"] = self.request.GET.get("ordina", "targa")
+        # Parametri da mantenere nei link di paginazione e ordinamento
+        parametri = self.request.GET.copy()
+        parametri.pop("page", None)
+        context["parametri_pagina"] = parametri.urlencode()
+        parametri.pop("ordina", None)
+        context["parametri_ordina"] = parametri.urlencode()
+        return context
+
+
+def _somma(queryset, campo):
+    """Sottoquery con la somma di `campo` per l'automezzo esterno"""
+    return queryset.order_by().values("automezzo").annotate(totale=Sum(campo)).values("totale")
+
 class AutomezzoDetailView(LoginRequiredMixin, DetailView):
     model = Automezzo
     template_name = "automezzi/automezzo_detail.html"
     context_object_name = "automezzo"
 
+    def get_queryset(self):
+        # Totali progressivi già calcolati: nessun COUNT sulle tabelle collegate
+        return super().get_queryset().select_related('statistiche', 'assegnato_a')
+
 class AutomezzoCreateView(LoginRequiredMixin, CreateView):
     model = Automezzo
     form_class = AutomezzoForm
@@ -47,7 +171,7 @@ class ManutenzioneListView(LoginRequiredMixin, ListView):
     def get_queryset(self):
         # Se presente pk automezzo in url, filtra per automezzo
         pk = self.kwargs.get("automezzo_pk")
-        qs = super().get_queryset()
+        qs = super().get_queryset().select_related("automezzo").order_by("-data", "-pk")
         if pk:
             qs = qs.filter(automezzo_id=pk)
         return qs
@@ -96,7 +220,7 @@ class RifornimentoListView(LoginRequiredMixin, ListView):
 
     def get_queryset(self):
         pk = self.kwargs.get("automezzo_pk")
-        qs = super().get_queryset()
+        qs = super().get_queryset().select_related("automezzo__tipo_carburante").order_by("-data", "-pk")
         if pk:
             qs = qs.filter(automezzo_id=pk)
         return qs
@@ -134,6 +258,41 @@ class RifornimentoDeleteView(LoginRequiredMixin, DeleteView):
     def get_success_url(self):
         return reverse_lazy("automezzi:rifornimento_list")
 
+class ImportCartaCarburanteView(LoginRequiredMixin, TemplateView):
+    """Importazione dei rifornimenti dall'estratto conto CSV delle carte carburante"""
+    template_name = "automezzi/rifornimento_import.html"
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["campi"] = ImportazioneCartaCarburante.CAMPI
+        return context
+
+    def post(self, request, *args, **kwargs):
+        file = request.FILES.get("file")
+        if file is None:
+            messages.error(request, "Nessun file selezionato")
+            return self.get(request, *args, **kwargs)
+        if not file.name.lower().endswith(".csv"):
+            messages.error(request, "Il file deve essere in formato CSV")
+            return self.get(request, *args, **kwargs)
+
+        dry_run = bool(request.POST.get("dry_run"))
+        try:
+            importazione = ImportazioneCartaCarburante(dry_run=dry_run).esegui(file)
+        except ErroreImportazione as e:
+            messages.error(request, str(e))
+            return self.get(request, *args, **kwargs)
+
+        esito = f"{importazione.inseriti} rifornimenti inseriti, {importazione.duplicati} duplicati"
+        if dry_run:
+            messages.info(request, f"Simulazione: {esito}. Nessuna modifica salvata")
+        else:
+            messages.success(request, f"Estratto conto importato: {esito}")
+        if importazione.scartati:
+            messages.error(request, f"{importazione.scartati} righe scartate")
+
+        return self.render_to_response(self.get_context_data(importazione=importazione))
+
 # EVENTI AUTOMEZZO CRUD
 class EventoAutomezzoListView(LoginRequiredMixin, ListView):
     model = EventoAutomezzo
@@ -143,7 +302,7 @@ class EventoAutomezzoListView(LoginRequiredMixin, ListView):
 
     def get_queryset(self):
         pk = self.kwargs.get("automezzo_pk")
-        qs = super().get_queryset()
+        qs = super().get_queryset().order_by("-data_evento", "-pk")
         if pk:
             qs = qs.filter(automezzo_id=pk)
         return qs
@@ -188,12 +347,71 @@ class DashboardView(LoginRequiredMixin, TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         today = timezone.now().date()
-        context["automezzi_count"] = Automezzo.objects.count()
-        context["attivi_count"] = Automezzo.objects.filter(attivo=True).count()
-        context["disponibili_count"] = Automezzo.objects.filter(disponibile=True, attivo=True, bloccata=False).count()
+        # Conteggi della flotta e totali progressivi in una sola query
+        totali = Automezzo.objects.aggregate(
+            automezzi=Count('pk'),
+            attivi=Count('pk', filter=Q(attivo=True)),
+            disponibili=Count('pk', filter=Q(disponibile=True, attivo=True, bloccata=False)),
+            manutenzioni=Sum('statistiche__numero_manutenzioni'),
+            rifornimenti=Sum('statistiche__numero_rifornimenti'),
+            eventi=Sum('statistiche__numero_eventi'),
+        )
+        context["automezzi_count"] = totali["automezzi"]
+        context["attivi_count"] = totali["attivi"]
+        context["disponibili_count"] = totali["disponibili"]
+        context["tot_automezzi"] = totali["attivi"]
+        context["tot_manutenzioni"] = totali["manutenzioni"] or 0
+        context["tot_rifornimenti"] = totali["rifornimenti"] or 0
+        context["tot_eventi"] = totali["eventi"] or 0
+        context["ultimi_automezzi"] = Automezzo.objects.order_by('-pk')[:5]
+        context["ultime_manutenzioni"] = Manutenzione.objects.select_related('automezzo').order_by('-data', '-pk')[:5]
+        context["ultimi_rifornimenti"] = Rifornimento.objects.select_related('automezzo').order_by('-data', '-pk')[:5]
+        context["ultimi_eventi"] = EventoAutomezzo.objects.select_related('automezzo').order_by('-data_evento', '-pk')[:5]
         context["automezzi_bloccati"] = Automezzo.objects.filter(bloccata=True)
         context["manutenzioni_in_corso"] = Manutenzione.objects.filter(completata=False)
         context["prossime_revisioni"] = Automezzo.objects.filter(data_revisione__gte=today).order_by('data_revisione')[:5]
         context["eventi_recenti"] = EventoAutomezzo.objects.order_by('-data_evento')[:5]
         context["rifornimenti_recenti"] = Rifornimento.objects.order_by('-data')[:5]
-        return context
\ No newline at end of file
+        # Segnalazioni di rileva_anomalie_rifornimenti ancora da verificare
+        anomalie = AnomaliaRifornimento.objects.filter(verificata=False)
+        context["anomalie_count"] = anomalie.count()
+        context["anomalie_rifornimenti"] = anomalie.select_related(
+            'rifornimento', 'automezzo'
+        ).order_by('-rifornimento__data', '-pk')[:5]
+        return context
+
+
+class PrezziCarburanteSerieView(LoginRequiredMixin, View):
+    """
+    Serie dei prezzi di un tipo carburante per i grafici, in JSON:
+    ?dal=AAAA-MM-GG&al=AAAA-MM-GG&passo=giorno|settimana (default ultimi 90 giorni)
+    """
+    GIORNI_DEFAULT = 90
+
+    def get(self, request, pk):
+        tipo = get_object_or_404(TipoCarburante, pk=pk)
+        try:
+            fine = date.fromisoformat(request.GET['al']) if request.GET.get('al') else timezone.localdate()
+            inizio = (
+                date.fromisoformat(request.GET['dal']) if request.GET.get('dal')
+                else fine - timedelta(days=self.GIORNI_DEFAULT)
+            )
+        except ValueError:
+            return JsonResponse({'errore': 'Date non valide (formato AAAA-MM-GG)'}, status=400)
+        passo = request.GET.get('passo', 'giorno')
+        if passo not in prezzi.PASSI or inizio > fine:
+            return JsonResponse({'errore': 'Parametri non validi'}, status=400)
+
+        return JsonResponse({
+            'tipo': tipo.nome,
+            'passo': passo,
+            'serie': [
+                {
+                    'periodo': punto['periodo'].isoformat(),
+                    'prezzo_medio': str(punto['prezzo_medio']),
+                    'minimo': str(punto['minimo']),
+                    'massimo': str(punto['massimo']),
+                }
+                for punto in prezzi.serie(tipo.pk, inizio, fine, passo)
+            ],
+        })
@@ -1,6 +1,14 @@
 from django.contrib import admin
-from .models import Dipendente, Giornata, AllegatoDipendente
+from .models import Dipendente, Giornata, AllegatoDipendente, RiepilogoMensile
 
 admin.site.register(Dipendente)
 admin.site.register(Giornata)
-admin.site.register(AllegatoDipendente)
\ No newline at end of file
+admin.site.register(AllegatoDipendente)
+
+
+@admin.register(RiepilogoMensile)
+class RiepilogoMensileAdmin(admin.ModelAdmin):
+    list_display = ('operatore', 'mese', 'ore_lavorate', 'giornate', 'giornate_assenza')
+    list_filter = ('mese',)
+    search_fields = ('operatore__username', 'operatore__last_name')
+    readonly_fields = ('operatore', 'mese', 'minuti_lavorati', 'giornate', 'giornate_assenza')
@@ -8,5 +8,4 @@ class DipendentiConfig(AppConfig):
     
     def ready(self):
         """Eseguito quando l'app è pronta"""
-        # Import dei segnali se necessario
-        # import dipendenti.signals
\ No newline at end of file
+        import dipendenti.signals
\ No newline at end of file
@@ -0,0 +1,219 @@
+# dipendenti/autorizzazioni.py
+"""
+Ambito di autorizzazione per utente: gruppi, permessi e clienti
+rappresentati calcolati una volta e tenuti in cache.
+
+Le verifiche di accesso dei mixin (livello totale/contabile, staff,
+rappresentante e propri clienti) leggono request.autorizzazioni, creato in
+modo pigro da AutorizzazioniMiddleware: una sola get_many di cache per
+richiesta, nessuna query per gruppi, permessi o Rappresentante.
+
+livello, is_staff, is_superuser e is_active non sono mai in cache: vengono
+dall'utente caricato a ogni richiesta dalla sessione, così un utente
+declassato o disattivato perde subito l'accesso in tutti i processi, anche
+se la modifica è arrivata con un update() che non invia segnali.
+
+Invalidazione per versione:
+- ogni voce in cache registra la versione globale e quella dell'utente
+  con cui è stata calcolata; le modifiche a Group e ai suoi permessi
+  incrementano la versione globale e rendono vecchie tutte le voci;
+- le modifiche a un Dipendente (gruppi, permessi), al suo Rappresentante
+  o ai clienti assegnati incrementano solo la sua versione.
+Le versioni sono lette insieme alla voce prima del calcolo: una voce
+calcolata mentre arriva un'invalidazione viene scritta con la versione
+precedente e alla lettura successiva risulta già vecchia.
+I segnali sono collegati in dipendenti/signals.py; le scritture massive
+che non li inviano (bulk_create dei clienti) chiamano invalida_rappresentanti().
+Perché l'invalidazione raggiunga tutti i processi server la cache deve
+essere condivisa (vedi CACHES in amm/settings.py e amm/cache.py).
+
+Uso:
+    autorizzazioni = da_request(request)
+    autorizzazioni.is_contabile, autorizzazioni.has_perm('ordini.add_ordine')
+    autorizzazioni.puo_accedere_cliente(cliente_id)
+"""
+import time
+
+from django.apps import apps
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils.functional import SimpleLazyObject
+
+CACHE_KEY = 'autorizzazioni:{}'
+CACHE_KEY_VERSIONE = 'autorizzazioni:versione'
+CACHE_KEY_VERSIONE_UTENTE = 'autorizzazioni:versione:{}'
+CACHE_TTL = 60 * 60
+
+
+class Autorizzazioni:
+    """
+    Ambito di autorizzazione di un utente, immutabile. Solo i campi di
+    AMBITO vanno in cache, gli altri sono letti dall'utente.
+    """
+
+    __slots__ = (
+        'user_id', 'livello', 'is_staff', 'is_superuser', 'is_active', 'gruppi', 'permessi',
+        'rappresentante_id', 'clienti',
+    )
+    AMBITO = ('gruppi', 'permessi', 'rappresentante_id', 'clienti')
+
+    def __init__(self, user_id=None, livello='', is_staff=False, is_superuser=False, is_active=False,
+                 gruppi=(), permessi=(), rappresentante_id=None, clienti=()):
+        self.user_id = user_id
+        self.livello = livello
+        self.is_staff = is_staff
+        self.is_superuser = is_superuser
+        self.is_active = is_active
+        self.gruppi = frozenset(gruppi)
+        self.permessi = frozenset(permessi)
+        self.rappresentante_id = rappresentante_id
+        self.clienti = frozenset(clienti)
+
+    def __repr__(self):
+        return f'<Autorizzazioni utente={self.user_id} livello={self.livello!r}>'
+
+    @property
+    def is_totale(self):
+        return self.is_superuser or self.livello == 'totale'
+
+    @property
+    def is_contabile(self):
+        """Livello contabile o superiore"""
+        return self.is_superuser or self.livello in ('totale', 'contabile')
+
+    @property
+    def is_staff_o_superuser(self):
+        return self.is_staff or self.is_superuser
+
+    @property
+    def is_rappresentante(self):
+        """Utente collegato a un Rappresentante (lo staff vede comunque tutto)"""
+        return self.rappresentante_id is not None
+
+    @property
+    def limitato_ai_propri_clienti(self):
+        return self.is_rappresentante and not self.is_staff
+
+    def has_perm(self, permesso):
+        # Come ModelBackend: nessun permesso agli utenti disattivati
+        return self.is_active and (self.is_superuser or permesso in self.permessi)
+
+    def puo_accedere_cliente(self, cliente_id):
+        if self.is_staff_o_superuser:
+            return True
+        return self.is_rappresentante and int(cliente_id) in self.clienti
+
+    def _ambito(self):
+        return {campo: getattr(self, campo) for campo in self.AMBITO}
+
+
+ANONIMO = Autorizzazioni()
+
+
+def _dall_utente(user, ambito):
+    """Ambito in cache completato con i flag correnti dell'utente"""
+    return Autorizzazioni(
+        user_id=user.pk,
+        livello=user.livello,
+        is_staff=user.is_staff,
+        is_superuser=user.is_superuser,
+        is_active=user.is_active,
+        **ambito,
+    )
+
+
+def calcola(user):
+    """Ambito dal database: gruppi, permessi (anche dei gruppi), rappresentante e suoi clienti"""
+    Rappresentante = apps.get_model('anagrafica', 'Rappresentante')
+    Cliente = apps.get_model('anagrafica', 'Cliente')
+    Permission = apps.get_model('auth', 'Permission')
+
+    rappresentante_id = Rappresentante.objects.filter(dipendente_id=user.pk).values_list('pk', flat=True).first()
+    clienti = ()
+    if rappresentante_id is not None:
+        clienti = Cliente.objects.filter(rappresentante_id=rappresentante_id).values_list('pk', flat=True)
+    # Permessi dell'utente e dei suoi gruppi, come ModelBackend ma senza il
+    # filtro su is_active e is_superuser: lo applica has_perm con i flag correnti
+    permessi = Permission.objects.filter(Q(user=user) | Q(group__user=user)).values_list(
+        'content_type__app_label', 'codename'
+    ).distinct()
+    return _dall_utente(user, {
+        'gruppi': user.groups.values_list('name', flat=True),
+        'permessi': [f'{app}.{codename}' for app, codename in permessi],
+        'rappresentante_id': rappresentante_id,
+        'clienti': clienti,
+    })
+
+
+def per_utente(user):
+    """Ambito dell'utente dalla cache (una get_many), ricalcolato se manca o è vecchio"""
+    if not user.is_authenticated:
+        return ANONIMO
+    chiave = CACHE_KEY.format(user.pk)
+    chiave_versione = CACHE_KEY_VERSIONE_UTENTE.format(user.pk)
+    valori = cache.get_many([chiave, CACHE_KEY_VERSIONE, chiave_versione])
+    versione = (valori.get(CACHE_KEY_VERSIONE, 0), valori.get(chiave_versione, 0))
+    voce = valori.get(chiave)
+    if voce is not None and voce[0] == versione:
+        return _dall_utente(user, voce[1])
+
+    autorizzazioni = calcola(user)
+    cache.set(chiave, (versione, autorizzazioni._ambito()), CACHE_TTL)
+    return autorizzazioni
+
+
+def da_request(request):
+    """request.autorizzazioni se c'è il middleware, altrimenti calcolato al momento"""
+    autorizzazioni = getattr(request, 'autorizzazioni', None)
+    if autorizzazioni is None:
+        autorizzazioni = request.autorizzazioni = per_utente(request.user)
+    return autorizzazioni
+
+
+def _incrementa(chiave):
+    try:
+        cache.incr(chiave)
+    except ValueError:
+        # Chiave assente (cache svuotata o primo utilizzo): un valore mai usato
+        # prima, così nessuna voce calcolata con una versione persa torna valida
+        cache.set(chiave, time.time_ns(), None)
+
+
+def invalida(*user_ids):
+    """Incrementa la versione degli utenti indicati: le loro voci in cache diventano vecchie"""
+    for user_id in {user_id for user_id in user_ids if user_id is not None}:
+        _incrementa(CACHE_KEY_VERSIONE_UTENTE.format(user_id))
+
+
+def invalida_rappresentanti(*rappresentante_ids):
+    """Elimina le voci dei dipendenti collegati ai rappresentanti indicati (clienti assegnati cambiati)"""
+    Rappresentante = apps.get_model('anagrafica', 'Rappresentante')
+    ids = {pk for pk in rappresentante_ids if pk is not None}
+    if ids:
+        invalida(*Rappresentante.objects.filter(pk__in=ids, dipendente__isnull=False).values_list(
+            'dipendente_id', flat=True
+        ))
+
+
+def invalida_tutti():
+    """Incrementa la versione globale: tutte le voci in cache diventano vecchie"""
+    _incrementa(CACHE_KEY_VERSIONE)
+
+
+class AutorizzazioniMiddleware:
+    """Espone request.autorizzazioni, calcolato solo se una vista lo usa"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.autorizzazioni = SimpleLazyObject(lambda: per_utente(request.user))
+        return self.get_response(request)
+
+
+class AutorizzazioniMixin:
+    """Rende disponibile self.autorizzazioni alle viste e ai mixin di accesso"""
+
+    @property
+    def autorizzazioni(self):
+        return da_request(self.request)
@@ -162,12 +162,8 @@ class GiornataForm(GiornataFormBase):
         fields = ['ora_fine_mattina', 'ora_inizio_pomeriggio', 'ora_fine_pomeriggio', 
                   'assenza', 'nota_assenza', 'chiudi_giornata']
 
-class MensilitaForm(forms.Form):
-    """Form per la generazione del report mensile"""
-    dipendente = forms.ModelChoiceField(
-        queryset=Dipendente.objects.filter(is_active=True),
-        label=_("Dipendente")
-    )
+class MensilitaTuttiForm(forms.Form):
+    """Form per il report mensile di tutti i dipendenti"""
     data_inizio = forms.DateField(widget=DateInput(), label=_("Data inizio"))
     data_fine = forms.DateField(widget=DateInput(), label=_("Data fine"))
     
@@ -179,4 +175,13 @@ class MensilitaForm(forms.Form):
         if data_inizio and data_fine and data_inizio > data_fine:
             self.add_error('data_fine', _("La data fine deve essere successiva alla data inizio"))
         
-        return cleaned_data
\ No newline at end of file
+        return cleaned_data
+
+class MensilitaForm(MensilitaTuttiForm):
+    """Form per la generazione del report mensile"""
+    dipendente = forms.ModelChoiceField(
+        queryset=Dipendente.objects.filter(is_active=True),
+        label=_("Dipendente")
+    )
+    
+    field_order = ['dipendente', 'data_inizio', 'data_fine']
@@ -0,0 +1,91 @@
+# dipendenti/management/commands/report_ore_mensile.py
+import time
+from datetime import date, datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dipendenti.report_ore import PROCESSI, ReportOreMensile, genera_in_storage, percorso_report
+
+
+def _data(valore):
+    return datetime.strptime(valore, '%Y-%m-%d').date()
+
+
+class Command(BaseCommand):
+    help = 'Genera lo ZIP con il report mensile delle ore di tutti i dipendenti attivi'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--mese',
+            type=str,
+            help='Mese del report (AAAA-MM, default: mese precedente)'
+        )
+        parser.add_argument(
+            '--dal',
+            type=str,
+            help='Data inizio (AAAA-MM-GG), in alternativa a --mese'
+        )
+        parser.add_argument(
+            '--al',
+            type=str,
+            help='Data fine (AAAA-MM-GG), in alternativa a --mese'
+        )
+        parser.add_argument(
+            '--output',
+            type=str,
+            help='File ZIP da scrivere (default: ore_<dal>_<al>.zip)'
+        )
+        parser.add_argument(
+            '--processi',
+            type=int,
+            default=PROCESSI,
+            help='Processi per il rendering dei PDF (default: %(default)s)'
+        )
+        parser.add_argument(
+            '--elaborazione',
+            type=str,
+            help='Nome del report in background: lo ZIP va nello storage e lo stato nel database'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            if options['dal'] or options['al']:
+                if not (options['dal'] and options['al']):
+                    raise CommandError('Specificare sia --dal che --al')
+                inizio, fine = _data(options['dal']), _data(options['al'])
+            else:
+                if options['mese']:
+                    inizio = datetime.strptime(options['mese'], '%Y-%m').date()
+                else:
+                    inizio = (date.today().replace(day=1) - timedelta(days=1)).replace(day=1)
+                fine = (inizio.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+        except ValueError as e:
+            raise CommandError(f'Data non valida: {e}')
+        if inizio > fine:
+            raise CommandError('La data inizio deve precedere la data fine')
+        if options['processi'] < 1:
+            raise CommandError('--processi deve essere almeno 1')
+        if options['elaborazione'] and percorso_report(options['elaborazione']) is None:
+            raise CommandError(f'Nome di report non valido: {options["elaborazione"]}')
+
+        output = options['output'] or f'ore_{inizio}_{fine}.zip'
+        self.stdout.write(f'📅 Periodo: {inizio:%d/%m/%Y} - {fine:%d/%m/%Y}')
+
+        def avanzamento(completati, totale):
+            if options['verbosity'] >= 2 and completati:
+                self.stdout.write(f'  📄 {completati}/{totale}')
+
+        inizio_esecuzione = time.monotonic()
+        if options['elaborazione']:
+            output = options['elaborazione']
+            report = genera_in_storage(output, inizio, fine, processi=options['processi'])
+        else:
+            report = ReportOreMensile(inizio, fine, processi=options['processi'])
+            report.genera(output, avanzamento)
+
+        for nome in report.errori:
+            self.stdout.write(self.style.ERROR(f'  ❌ PDF non generato: {nome}'))
+        self.stdout.write(f'👥 PDF generati: {report.generati}')
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ {output} scritto in {time.monotonic() - inizio_esecuzione:.1f}s'
+        ))
@@ -0,0 +1,30 @@
+# dipendenti/management/commands/ricalcola_ore_mensili.py
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dipendenti.models import Dipendente
+from dipendenti.riepiloghi import ricalcola
+
+
+class Command(BaseCommand):
+    help = 'Ricalcola i minuti lavorati delle giornate e i riepiloghi mensili delle ore'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dipendente',
+            type=str,
+            help='Ricalcola solo il dipendente specificato (username)'
+        )
+
+    def handle(self, *args, **options):
+        operatori = None
+        if options['dipendente']:
+            operatori = list(Dipendente.objects.filter(username=options['dipendente']).values_list('pk', flat=True))
+            if not operatori:
+                raise CommandError(f'Dipendente "{options["dipendente"]}" non trovato')
+
+        inizio = time.monotonic()
+        riepiloghi = ricalcola(operatori)
+        self.stdout.write(f'📊 Riepiloghi mensili: {riepiloghi}')
+        self.stdout.write(self.style.SUCCESS(f'✅ Completato in {time.monotonic() - inizio:.1f}s'))
@@ -0,0 +1,22 @@
+# dipendenti/management/commands/salva_presenze.py
+from django.core.management.base import BaseCommand
+
+from amm.cache import cache_condivisa
+from dipendenti import presenza
+
+
+class Command(BaseCommand):
+    help = "Salva nel database l'ultimo accesso e lo stato online dalle presenze in cache (da eseguire ogni pochi minuti)"
+
+    def handle(self, *args, **options):
+        aggiornati = presenza.salva()
+        if options['verbosity'] < 1:
+            return
+        if not cache_condivisa():
+            self.stdout.write(self.style.WARNING(
+                '⚠ Cache locale al processo: le presenze sono già scritte nel database dalle richieste'
+            ))
+            self.stdout.write(self.style.SUCCESS(f'✅ Dipendenti messi offline: {aggiornati}'))
+            return
+        self.stdout.write(f'👥 Online: {len(presenza.online())}')
+        self.stdout.write(self.style.SUCCESS(f'✅ Ultimo accesso aggiornato per {aggiornati} dipendenti'))
@@ -0,0 +1,35 @@
+# dipendenti/management/commands/sincronizza_ruoli.py
+from django.core.management.base import BaseCommand
+
+from dipendenti.ruoli import RUOLI, SincronizzazioneRuoli
+
+
+class Command(BaseCommand):
+    help = 'Allinea gruppi e permessi alla specifica dei ruoli, scrivendo solo le differenze'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--gruppo',
+            action='append',
+            dest='gruppi',
+            choices=list(RUOLI),
+            help='Sincronizza solo il gruppo indicato (ripetibile)'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Mostra le differenze senza salvare'
+        )
+
+    def handle(self, *args, **options):
+        sync = SincronizzazioneRuoli(gruppi=options['gruppi'], dry_run=options['dry_run']).esegui()
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING('DRY RUN - Nessuna modifica salvata'))
+        for schema in sync.sconosciuti:
+            self.stdout.write(self.style.WARNING(f'⚠ Nessun permesso corrisponde a: {schema}'))
+        for nome in sync.gruppi_creati:
+            self.stdout.write(f'✓ Gruppo creato: {nome}')
+        self.stdout.write(f'Permessi aggiunti: {sync.aggiunti}')
+        self.stdout.write(f'Permessi rimossi: {sync.rimossi}')
+        self.stdout.write(self.style.SUCCESS('Sincronizzazione ruoli completata'))
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.21 on 2026-10-19 07:24
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def calcola_riepiloghi(apps, schema_editor):
+    from dipendenti.riepiloghi import ricalcola
+    ricalcola(apps=apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dipendenti', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='giornata',
+            name='minuti_lavorati',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Minuti lavorati'),
+        ),
+        migrations.CreateModel(
+            name='RiepilogoMensile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mese', models.DateField(help_text='Primo giorno del mese', verbose_name='Mese')),
+                ('minuti_lavorati', models.IntegerField(default=0, verbose_name='Minuti lavorati')),
+                ('giornate', models.IntegerField(default=0, verbose_name='Giornate registrate')),
+                ('giornate_assenza', models.IntegerField(default=0, verbose_name='Giornate di assenza')),
+                ('operatore', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='riepiloghi_mensili', to=settings.AUTH_USER_MODEL, verbose_name='Operatore')),
+            ],
+            options={
+                'verbose_name': 'Riepilogo mensile',
+                'verbose_name_plural': 'Riepiloghi mensili',
+                'ordering': ['-mese'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='riepilogomensile',
+            constraint=models.UniqueConstraint(fields=('operatore', 'mese'), name='riepilogo_mensile_unico'),
+        ),
+        migrations.RunPython(calcola_riepiloghi, migrations.RunPython.noop),
+    ]
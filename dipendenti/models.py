@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractUser, Group
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
@@ -123,6 +123,23 @@ class AllegatoDipendente(models.Model):
         return f"{self.get_tipo_display()} - {self.nome}"
 
 
+def secondi_lavorati(inizio_mattina, fine_mattina, inizio_pomeriggio, fine_pomeriggio):
+    """
+    Secondi lavorati dati gli orari di una giornata, senza costruire datetime:
+    mattina e pomeriggio contano solo se completi e con la fine dopo l'inizio;
+    con solo inizio mattina e fine pomeriggio la giornata è continuativa.
+    """
+    def durata(inizio, fine):
+        if not (inizio and fine):
+            return 0
+        secondi = (fine.hour - inizio.hour) * 3600 + (fine.minute - inizio.minute) * 60 + fine.second - inizio.second
+        return max(secondi, 0)
+
+    if inizio_mattina and fine_pomeriggio and not fine_mattina and not inizio_pomeriggio:
+        return durata(inizio_mattina, fine_pomeriggio)
+    return durata(inizio_mattina, fine_mattina) + durata(inizio_pomeriggio, fine_pomeriggio)
+
+
 class Giornata(models.Model):
     data = models.DateField(auto_now_add=True, verbose_name=_('Data'))
     operatore = models.ForeignKey('dipendenti.Dipendente', on_delete=models.CASCADE, related_name='giornate', verbose_name=_('Operatore'))
@@ -154,6 +171,9 @@ class Giornata(models.Model):
     confermata_da = models.ForeignKey('dipendenti.Dipendente', on_delete=models.SET_NULL, null=True, blank=True, 
                                       related_name='giornate_confermate', verbose_name=_('Confermata da'))
     
+    # Calcolato a ogni salvataggio dagli orari (vedi secondi_lavorati)
+    minuti_lavorati = models.PositiveIntegerField(default=0, editable=False, verbose_name=_('Minuti lavorati'))
+    
     class Meta:
         verbose_name = _('Giornata lavorativa')
         verbose_name_plural = _('Giornate lavorative')
@@ -163,31 +183,60 @@ class Giornata(models.Model):
     def __str__(self):
         return f'{self.data} - {self.operatore}'
     
+    def save(self, *args, **kwargs):
+        from .riepiloghi import ORARI, applica, valori_da_salvare, valori_salvati
+
+        update_fields = kwargs.get('update_fields')
+        with transaction.atomic():
+            prima = valori_salvati(self, blocca=True)
+            # I minuti seguono gli orari come saranno nel database, non quelli in memoria
+            orari = valori_da_salvare(self, prima, update_fields)
+            self.minuti_lavorati = secondi_lavorati(*(orari[campo] for campo in ORARI)) // 60
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'minuti_lavorati'}
+            super().save(*args, **kwargs)
+            applica(prima=prima, dopo=valori_da_salvare(self, prima, kwargs.get('update_fields')))
+    
+    def delete(self, *args, **kwargs):
+        from .riepiloghi import applica, valori_salvati
+
+        with transaction.atomic():
+            prima = valori_salvati(self, blocca=True)
+            risultato = super().delete(*args, **kwargs)
+            applica(prima=prima)
+        return risultato
+    
     def daily_hours(self):
         """Calcola le ore lavorate nella giornata"""
-        total = timedelta()
-        today_date = self.data  # Usa la data dell'oggetto anziché la data corrente
-        
-        # Calcolo ore mattina
-        if self.ora_inizio_mattina and self.ora_fine_mattina:
-            inizio = datetime.combine(today_date, self.ora_inizio_mattina)
-            fine = datetime.combine(today_date, self.ora_fine_mattina)
-            if fine > inizio:  # Verifica che l'orario di fine sia dopo l'inizio
-                total += (fine - inizio)
-        
-        # Calcolo ore pomeriggio
-        if self.ora_inizio_pomeriggio and self.ora_fine_pomeriggio:
-            inizio = datetime.combine(today_date, self.ora_inizio_pomeriggio)
-            fine = datetime.combine(today_date, self.ora_fine_pomeriggio)
-            if fine > inizio:  # Verifica che l'orario di fine sia dopo l'inizio
-                total += (fine - inizio)
-        
-        # Caso speciale: solo inizio mattina e fine pomeriggio (giornata continuativa)
-        if (self.ora_inizio_mattina and self.ora_fine_pomeriggio and 
-            not self.ora_fine_mattina and not self.ora_inizio_pomeriggio):
-            inizio = datetime.combine(today_date, self.ora_inizio_mattina)
-            fine = datetime.combine(today_date, self.ora_fine_pomeriggio)
-            if fine > inizio:
-                total = (fine - inizio)
-        
-        return total
\ No newline at end of file
+        return timedelta(seconds=secondi_lavorati(
+            self.ora_inizio_mattina, self.ora_fine_mattina,
+            self.ora_inizio_pomeriggio, self.ora_fine_pomeriggio,
+        ))
+
+
+
+class RiepilogoMensile(models.Model):
+    """
+    Totali mensili delle giornate di un dipendente, aggiornati in modo
+    incrementale a ogni salvataggio o eliminazione di Giornata
+    """
+    operatore = models.ForeignKey('dipendenti.Dipendente', on_delete=models.CASCADE, related_name='riepiloghi_mensili', verbose_name=_('Operatore'))
+    mese = models.DateField(verbose_name=_('Mese'), help_text=_('Primo giorno del mese'))
+    minuti_lavorati = models.IntegerField(default=0, verbose_name=_('Minuti lavorati'))
+    giornate = models.IntegerField(default=0, verbose_name=_('Giornate registrate'))
+    giornate_assenza = models.IntegerField(default=0, verbose_name=_('Giornate di assenza'))
+    
+    class Meta:
+        verbose_name = _('Riepilogo mensile')
+        verbose_name_plural = _('Riepiloghi mensili')
+        ordering = ['-mese']
+        constraints = [
+            models.UniqueConstraint(fields=['operatore', 'mese'], name='riepilogo_mensile_unico'),
+        ]
+    
+    def __str__(self):
+        return f'{self.mese:%m/%Y} - {self.operatore}'
+    
+    @property
+    def ore_lavorate(self):
+        return timedelta(minutes=self.minuti_lavorati)
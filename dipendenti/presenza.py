@@ -0,0 +1,140 @@
+# dipendenti/presenza.py
+"""
+Presenza online dei dipendenti tenuta in cache, senza scritture sulla
+tabella utenti a ogni richiesta.
+
+Ogni dipendente ha la sua chiave di cache [ultimo heartbeat, collegato] e
+ogni scrittura è un solo set della propria chiave: heartbeat concorrenti
+di utenti diversi non si sovrascrivono a vicenda.
+- PresenzaMiddleware legge la chiave dell'utente una volta per richiesta e
+  la riscrive solo se l'heartbeat è più vecchio di INTERVALLO_HEARTBEAT;
+- chi lascia una pagina aperta invia l'heartbeat dalla vista `heartbeat` (/dipendenti/presenza/);
+- è online chi ha un heartbeat negli ultimi PRESENZA_TTL secondi e non ha
+  fatto logout: leggi() prende i pk dal database e le voci con una get_many.
+
+Con una cache condivisa tra i processi (vedi amm/cache.py) il comando
+`salva_presenze`, da eseguire periodicamente, riporta nel database
+(write-behind) ultimo_accesso con un solo bulk_update e allinea la colonna
+is_online per chi la usa ancora (admin, esportazioni). Con la cache del
+singolo processo il comando non vedrebbe le presenze: heartbeat e logout
+scrivono allora direttamente nel database (write-through, al più un UPDATE
+per utente ogni INTERVALLO_HEARTBEAT) e salva_presenze si limita a mettere
+offline chi non dà più segni di vita.
+"""
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+
+from amm.cache import cache_condivisa
+
+CACHE_KEY = 'dipendenti:presenza:{}'
+# {pk: istante dell'heartbeat salvato} scritto da salva()
+CACHE_KEY_SALVATAGGIO = 'dipendenti:presenze:salvate'
+# Secondi senza heartbeat dopo i quali un dipendente non è più online
+PRESENZA_TTL = getattr(settings, 'PRESENZA_TTL', 5 * 60)
+INTERVALLO_HEARTBEAT = 60
+# Le voci restano in cache finché non sono salvate nel database
+CONSERVAZIONE = 24 * 60 * 60
+BATCH_SIZE = 500
+
+
+def _istante(timestamp):
+    return datetime.fromtimestamp(timestamp, tz=dt_timezone.utc)
+
+
+def leggi(pks=None):
+    """{pk: [timestamp ultimo heartbeat, collegato]} dei dipendenti indicati (tutti se None)"""
+    from .models import Dipendente
+
+    if pks is None:
+        pks = Dipendente.objects.values_list('pk', flat=True)
+    chiavi = {CACHE_KEY.format(pk): pk for pk in pks}
+    return {chiavi[chiave]: voce for chiave, voce in cache.get_many(chiavi).items()}
+
+
+def online(presenze=None, adesso=None):
+    """pk dei dipendenti online"""
+    presenze = leggi() if presenze is None else presenze
+    limite = (adesso or time.time()) - PRESENZA_TTL
+    return {pk for pk, (istante, collegato) in presenze.items() if collegato and istante > limite}
+
+
+def _scrivi(user_id, istante, collegato):
+    from .models import Dipendente
+
+    cache.set(CACHE_KEY.format(user_id), [istante, collegato], CONSERVAZIONE)
+    if not cache_condivisa():
+        Dipendente.objects.filter(pk=user_id).update(ultimo_accesso=_istante(istante), is_online=collegato)
+
+
+def heartbeat(user_id, adesso=None):
+    """
+    Segna l'utente online: una lettura della sua chiave e una scrittura
+    solo se l'ultimo heartbeat è più vecchio di INTERVALLO_HEARTBEAT.
+    Restituisce True se ha scritto.
+    """
+    adesso = adesso or time.time()
+    istante, collegato = cache.get(CACHE_KEY.format(user_id)) or (0, False)
+    if collegato and adesso - istante < INTERVALLO_HEARTBEAT:
+        return False
+    _scrivi(user_id, adesso, True)
+    return True
+
+
+def disconnetti(user_id, adesso=None):
+    """Al logout l'utente esce subito dagli online; l'ultimo accesso resta da salvare"""
+    _scrivi(user_id, adesso or time.time(), False)
+
+
+def salva(adesso=None):
+    """
+    Scrive nel database gli heartbeat diversi da quelli salvati l'ultima
+    volta per lo stesso dipendente (un bulk_update di ultimo_accesso) e
+    allinea is_online con due UPDATE.
+    Con la cache del singolo processo gli heartbeat sono già nel database:
+    mette solo offline chi non ne invia da PRESENZA_TTL secondi.
+    Restituisce il numero di dipendenti aggiornati.
+    """
+    from .models import Dipendente
+
+    adesso = adesso or time.time()
+    if not cache_condivisa():
+        return Dipendente.objects.filter(
+            is_online=True, ultimo_accesso__lte=_istante(adesso - PRESENZA_TTL)
+        ).update(is_online=False)
+
+    presenze = leggi()
+    salvate = cache.get(CACHE_KEY_SALVATAGGIO) or {}
+
+    dipendenti = [
+        Dipendente(pk=pk, ultimo_accesso=_istante(istante))
+        for pk, (istante, _) in presenze.items() if salvate.get(pk) != istante
+    ]
+    Dipendente.objects.bulk_update(dipendenti, ['ultimo_accesso'], batch_size=BATCH_SIZE)
+
+    pk_online = online(presenze, adesso)
+    Dipendente.objects.filter(is_online=True).exclude(pk__in=pk_online).update(is_online=False)
+    Dipendente.objects.filter(pk__in=pk_online, is_online=False).update(is_online=True)
+
+    # Si registra l'istante salvato per ogni chiave, non un massimo globale:
+    # un heartbeat scritto mentre si salvava differisce da quello letto e
+    # viene salvato al prossimo giro anche se il suo istante è più vecchio
+    cache.set(CACHE_KEY_SALVATAGGIO, {pk: istante for pk, (istante, _) in presenze.items()}, None)
+    return len(dipendenti)
+
+
+class PresenzaMiddleware:
+    """
+    Heartbeat degli utenti autenticati: una lettura di cache per richiesta,
+    una scrittura al massimo ogni INTERVALLO_HEARTBEAT
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.user.is_authenticated:
+            heartbeat(request.user.pk)
+        return self.get_response(request)
@@ -0,0 +1,227 @@
+# dipendenti/report_ore.py
+"""
+Report mensile delle ore di tutti i dipendenti in un unico archivio ZIP.
+
+Le giornate del periodo di tutti i dipendenti attivi arrivano con una sola
+query: un LEFT JOIN filtrato (FilteredRelation) che restituisce anche chi
+non ha giornate nel periodo. Le ore sono la somma della colonna
+minuti_lavorati, calcolata al salvataggio di ogni giornata.
+
+Il rendering dei PDF (xhtml2pdf, CPU-bound) è distribuito su un pool di
+processi: ai worker arrivano solo dizionari, i PDF tornano come bytes e il
+processo principale li scrive nello ZIP nell'ordine dei dipendenti,
+aggiornando l'avanzamento. I worker non usano il database.
+
+In background l'archivio è generato dal comando report_ore_mensile in un
+processo separato dal server (il pool di processi nasce lì, non nel
+worker web) e stato e avanzamento sono un'Elaborazione nel database (vedi
+home.elaborazioni), condivisa da tutti i processi server.
+
+Uso:
+    ReportOreMensile(inizio, fine).genera(file)       # file binario in scrittura
+    nome = avvia_in_background(inizio, fine)          # poi stato_report(nome)
+"""
+import csv
+import io
+import logging
+import os
+import re
+import tempfile
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db.models import FilteredRelation, Q
+
+from home import elaborazioni
+from utils import produci_pdf
+
+from .models import Dipendente, Giornata
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_PDF = 'dipendenti/oremese.html'
+CARTELLA_REPORT = 'dipendenti/report'
+# Un processo resta libero per il server e per la scrittura dello ZIP
+PROCESSI = max((os.cpu_count() or 2) - 1, 1)
+
+CAMPI_DIPENDENTE = ['pk', 'username', 'first_name', 'last_name', 'livello']
+CAMPI_GIORNATA = [
+    'data', 'ora_inizio_mattina', 'ora_fine_mattina', 'ora_inizio_pomeriggio',
+    'ora_fine_pomeriggio', 'assenza', 'minuti_lavorati',
+]
+
+
+def ore_dipendenti(inizio, fine, dipendenti=None):
+    """
+    Giornate e minuti lavorati nel periodo di ogni dipendente attivo, con
+    una sola query. Restituisce una lista ordinata per cognome e nome di
+    {'dipendente': {...}, 'giornate': [{...}], 'minuti': totale}.
+    """
+    queryset = Dipendente.objects.filter(is_active=True)
+    if dipendenti is not None:
+        queryset = queryset.filter(pk__in=dipendenti)
+    righe = queryset.annotate(
+        giornata=FilteredRelation('giornate', condition=Q(giornate__data__range=(inizio, fine))),
+    ).order_by('last_name', 'first_name', 'username', 'pk', 'giornata__data').values_list(
+        *CAMPI_DIPENDENTE, *[f'giornata__{campo}' for campo in CAMPI_GIORNATA],
+    )
+
+    risultato = []
+    for riga in righe.iterator(chunk_size=2000):
+        dipendente = dict(zip(CAMPI_DIPENDENTE, riga[:len(CAMPI_DIPENDENTE)]))
+        if not risultato or risultato[-1]['dipendente']['pk'] != dipendente['pk']:
+            risultato.append({'dipendente': dipendente, 'giornate': [], 'minuti': 0})
+        giornata = dict(zip(CAMPI_GIORNATA, riga[len(CAMPI_DIPENDENTE):]))
+        if giornata['data'] is None:
+            # Nessuna giornata nel periodo: il LEFT JOIN restituisce una riga vuota
+            continue
+        risultato[-1]['giornate'].append(giornata)
+        risultato[-1]['minuti'] += giornata['minuti_lavorati']
+    return risultato
+
+
+def nome_file_pdf(dipendente, inizio, fine):
+    return f"Ore_{dipendente['username']}_{inizio}_{fine}.pdf"
+
+
+def genera_pdf(dati):
+    """
+    Eseguita nei processi del pool: dagli orari in dizionari ricostruisce
+    istanze non salvate per il template del report singolo e restituisce
+    (nome file, bytes del PDF o None se xhtml2pdf fallisce).
+    """
+    dipendente = Dipendente(**{campo: valore for campo, valore in dati['dipendente'].items()})
+    context = {
+        'dipendente': dipendente,
+        'giornate': [Giornata(operatore=dipendente, **giornata) for giornata in dati['giornate']],
+        'data_inizio': dati['inizio'],
+        'data_fine': dati['fine'],
+        'ore_totali': timedelta(minutes=dati['minuti']),
+    }
+    nome = nome_file_pdf(dati['dipendente'], dati['inizio'], dati['fine'])
+    pdf = produci_pdf(TEMPLATE_PDF, context, filename=nome)
+    return nome, pdf.getvalue() if pdf else None
+
+
+def _formatta_ore(minuti):
+    return f'{minuti // 60}:{minuti % 60:02d}'
+
+
+class ReportOreMensile:
+    """
+    Archivio ZIP con il PDF delle ore di ogni dipendente e un riepilogo CSV.
+
+    `avanzamento(completati, totale)` è chiamata dopo ogni PDF scritto.
+    Con processi=1 i PDF sono generati nel processo corrente.
+    """
+
+    def __init__(self, inizio, fine, dipendenti=None, processi=None):
+        self.inizio = inizio
+        self.fine = fine
+        self.dipendenti = dipendenti
+        self.processi = processi or PROCESSI
+        self.generati = 0
+        self.errori = []
+
+    def genera(self, file, avanzamento=None):
+        """Scrive lo ZIP su `file` (path o file binario) e restituisce il numero di PDF"""
+        ore = ore_dipendenti(self.inizio, self.fine, self.dipendenti)
+        lavori = [{**voce, 'inizio': self.inizio, 'fine': self.fine} for voce in ore]
+        if avanzamento:
+            avanzamento(0, len(lavori))
+
+        with zipfile.ZipFile(file, 'w', compression=zipfile.ZIP_DEFLATED) as archivio:
+            for completati, (nome, pdf) in enumerate(self._pdf(lavori), start=1):
+                if pdf is None:
+                    self.errori.append(nome)
+                else:
+                    archivio.writestr(nome, pdf)
+                    self.generati += 1
+                if avanzamento:
+                    avanzamento(completati, len(lavori))
+            archivio.writestr('riepilogo.csv', self._riepilogo(ore))
+
+        logger.info(
+            f'Report ore {self.inizio} - {self.fine}: {self.generati} PDF, {len(self.errori)} errori'
+        )
+        return self.generati
+
+    def _pdf(self, lavori):
+        if self.processi == 1 or len(lavori) < 2:
+            yield from map(genera_pdf, lavori)
+            return
+        with ProcessPoolExecutor(max_workers=min(self.processi, len(lavori))) as pool:
+            # map conserva l'ordine dei dipendenti; i blocchi riducono i passaggi tra processi
+            yield from pool.map(genera_pdf, lavori, chunksize=max(len(lavori) // (self.processi * 4), 1))
+
+    def _riepilogo(self, ore):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, delimiter=';')
+        writer.writerow(['Username', 'Cognome', 'Nome', 'Giornate', 'Assenze', 'Ore'])
+        for voce in ore:
+            dipendente = voce['dipendente']
+            writer.writerow([
+                dipendente['username'], dipendente['last_name'], dipendente['first_name'],
+                len(voce['giornate']),
+                sum(1 for giornata in voce['giornate'] if giornata['assenza'] != 'nessuna'),
+                _formatta_ore(voce['minuti']),
+            ])
+        return buffer.getvalue()
+
+
+# ========== GENERAZIONE IN BACKGROUND ==========
+
+def percorso_report(nome):
+    """Path nello storage di un archivio generato in background, se il nome è valido"""
+    if not re.fullmatch(r'ore_\d{4}-\d{2}-\d{2}_\d{4}-\d{2}-\d{2}_[0-9a-f]{32}\.zip', nome):
+        return None
+    return f'{CARTELLA_REPORT}/{nome}'
+
+
+def genera_in_storage(nome, inizio, fine, processi=None):
+    """
+    Genera l'archivio e lo salva nello storage con il nome indicato,
+    aggiornando l'avanzamento dell'elaborazione nel database. Lo stato
+    passa a 'pronto' solo a salvataggio concluso.
+    """
+    def avanzamento(completati, totale):
+        elaborazioni.avanzamento(nome, completati, totale)
+
+    report = ReportOreMensile(inizio, fine, processi=processi)
+    try:
+        with tempfile.TemporaryFile(suffix='.zip') as file:
+            report.genera(file, avanzamento)
+            file.seek(0)
+            default_storage.save(percorso_report(nome), File(file, name=nome))
+    except Exception:
+        logger.exception(f'Errore generazione report ore ({nome})')
+        elaborazioni.fallita(nome)
+        raise
+    elaborazioni.completa(nome, completati=report.generati, totale=report.generati + len(report.errori))
+    return report
+
+
+def avvia_in_background(inizio, fine):
+    """
+    Registra l'elaborazione, avvia il comando report_ore_mensile in un
+    processo separato e restituisce il nome del file da scaricare
+    """
+    nome = f'ore_{inizio}_{fine}_{uuid.uuid4().hex}.zip'
+    elaborazioni.avvia(
+        nome, percorso_report(nome), 'report_ore_mensile', '--dal', inizio, '--al', fine, '--elaborazione', nome,
+    )
+    return nome
+
+
+def stato_report(nome):
+    """
+    {'stato': 'pronto'|'in_corso'|'errore', 'completati', 'totale'}
+    o None se l'archivio non esiste
+    """
+    if percorso_report(nome) is None:
+        return None
+    return elaborazioni.stato(nome)
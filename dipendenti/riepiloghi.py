@@ -0,0 +1,148 @@
+# dipendenti/riepiloghi.py
+"""
+Riepiloghi mensili delle ore per dipendente, aggiornati a ogni scrittura.
+
+Giornata.save() calcola minuti_lavorati dagli orari e, con i valori letti
+prima del salvataggio, passa ad applica() il contributo da togliere e
+quello da aggiungere: la riga RiepilogoMensile del mese riceve le
+differenze con un UPDATE su F() (nessuna lettura, nessuna corsa tra
+salvataggi concorrenti). Se la giornata cambia mese o operatore i due
+contributi vanno su righe diverse. Lettura (con select_for_update),
+salvataggio e aggiornamento del riepilogo stanno in una transazione:
+due modifiche della stessa giornata si serializzano e un errore annulla
+tutto, senza lasciare i totali fuori allineamento.
+
+Le scritture massive (bulk_create, update) non passano da save(): dopo
+di esse va chiamato ricalcola() sui dipendenti coinvolti.
+"""
+from django.apps import apps as django_apps
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncMonth
+
+CAMPI = ('operatore_id', 'data', 'minuti_lavorati', 'assenza')
+ORARI = ('ora_inizio_mattina', 'ora_fine_mattina', 'ora_inizio_pomeriggio', 'ora_fine_pomeriggio')
+BATCH_SIZE = 1000
+
+
+def valori_salvati(giornata, blocca=False):
+    """
+    Valori della giornata com'è nel database, prima della modifica (None se
+    nuova). Con blocca=True la riga resta bloccata fino alla fine della
+    transazione, così due modifiche della stessa giornata non si sovrappongono.
+    """
+    if giornata.pk is None:
+        return None
+    giornate = type(giornata)._base_manager.filter(pk=giornata.pk)
+    if blocca:
+        giornate = giornate.select_for_update()
+    return giornate.values(*CAMPI, *ORARI).first()
+
+
+def valori_da_salvare(giornata, prima, update_fields=None):
+    """
+    Valori che save() scriverà: quelli in memoria per i campi in
+    update_fields, quelli del database per gli altri (tutti in memoria se
+    update_fields è None o la giornata è nuova)
+    """
+    campi = CAMPI + ORARI
+    if update_fields is None or prima is None:
+        return {campo: getattr(giornata, campo) for campo in campi}
+    salvati = {giornata._meta.get_field(nome).attname for nome in update_fields}
+    return {campo: getattr(giornata, campo) if campo in salvati else prima[campo] for campo in campi}
+
+
+def _contributo(valori):
+    """(chiave della riga di riepilogo, differenze) di una giornata"""
+    chiave = (valori['operatore_id'], valori['data'].replace(day=1))
+    return chiave, (valori['minuti_lavorati'], 1, int(valori['assenza'] != 'nessuna'))
+
+
+def applica(prima=None, dopo=None):
+    """
+    Toglie dai riepiloghi il contributo `prima` (valori salvati della giornata
+    modificata o eliminata) e aggiunge quello di `dopo` (valori scritti dal
+    salvataggio, vedi valori_da_salvare)
+    """
+    differenze = {}
+    if prima is not None:
+        chiave, valori = _contributo(prima)
+        differenze[chiave] = tuple(-valore for valore in valori)
+    if dopo is not None:
+        chiave, valori = _contributo(dopo)
+        precedenti = differenze.get(chiave, (0, 0, 0))
+        differenze[chiave] = tuple(a + b for a, b in zip(precedenti, valori))
+
+    for (operatore_id, mese), (minuti, giornate, assenze) in differenze.items():
+        if minuti or giornate or assenze:
+            _aggiorna(operatore_id, mese, minuti, giornate, assenze)
+
+
+def _aggiorna(operatore_id, mese, minuti, giornate, assenze):
+    from .models import RiepilogoMensile
+
+    riga = RiepilogoMensile.objects.filter(operatore_id=operatore_id, mese=mese)
+    differenze = {
+        'minuti_lavorati': F('minuti_lavorati') + minuti,
+        'giornate': F('giornate') + giornate,
+        'giornate_assenza': F('giornate_assenza') + assenze,
+    }
+    if riga.update(**differenze):
+        return
+    try:
+        with transaction.atomic():
+            RiepilogoMensile.objects.create(
+                operatore_id=operatore_id, mese=mese,
+                minuti_lavorati=minuti, giornate=giornate, giornate_assenza=assenze,
+            )
+    except IntegrityError:
+        # Creata nel frattempo da un salvataggio concorrente
+        riga.update(**differenze)
+
+
+def ricalcola(operatori=None, apps=None):
+    """
+    Ricostruisce minuti_lavorati delle giornate e i riepiloghi mensili dei
+    dipendenti indicati (tutti se None). Restituisce il numero di riepiloghi.
+    """
+    from .models import secondi_lavorati
+
+    apps = apps or django_apps
+    Giornata = apps.get_model('dipendenti', 'Giornata')
+    RiepilogoMensile = apps.get_model('dipendenti', 'RiepilogoMensile')
+
+    giornate = Giornata.objects.all()
+    riepiloghi = RiepilogoMensile.objects.all()
+    if operatori is not None:
+        giornate = giornate.filter(operatore_id__in=operatori)
+        riepiloghi = riepiloghi.filter(operatore_id__in=operatori)
+
+    with transaction.atomic():
+        da_aggiornare = []
+        for giornata in giornate.only(
+            'pk', 'ora_inizio_mattina', 'ora_fine_mattina', 'ora_inizio_pomeriggio',
+            'ora_fine_pomeriggio', 'minuti_lavorati',
+        ).iterator(chunk_size=BATCH_SIZE):
+            minuti = secondi_lavorati(
+                giornata.ora_inizio_mattina, giornata.ora_fine_mattina,
+                giornata.ora_inizio_pomeriggio, giornata.ora_fine_pomeriggio,
+            ) // 60
+            if minuti != giornata.minuti_lavorati:
+                giornata.minuti_lavorati = minuti
+                da_aggiornare.append(giornata)
+        Giornata.objects.bulk_update(da_aggiornare, ['minuti_lavorati'], batch_size=BATCH_SIZE)
+
+        riepiloghi.delete()
+        totali = giornate.annotate(mese=TruncMonth('data')).values('operatore_id', 'mese').annotate(
+            totale_minuti=Sum('minuti_lavorati'),
+            totale_giornate=Count('pk'),
+            totale_assenze=Count('pk', filter=~Q(assenza='nessuna')),
+        ).order_by()
+        nuovi = RiepilogoMensile.objects.bulk_create([
+            RiepilogoMensile(
+                operatore_id=riga['operatore_id'], mese=riga['mese'], minuti_lavorati=riga['totale_minuti'],
+                giornate=riga['totale_giornate'], giornate_assenza=riga['totale_assenze'],
+            )
+            for riga in totali
+        ], batch_size=BATCH_SIZE)
+    return len(nuovi)
@@ -0,0 +1,188 @@
+# dipendenti/ruoli.py
+"""
+Gruppi e permessi dell'applicazione descritti in modo dichiarativo.
+
+RUOLI associa a ogni gruppo l'elenco dei permessi nella forma
+'app_label.codename'; sono ammessi i caratteri jolly di fnmatch
+('anagrafica.*', 'automezzi.view_*', '*' per tutti). Con None il gruppo
+viene solo creato e i suoi permessi restano gestiti a mano dall'admin.
+
+SincronizzazioneRuoli legge lo stato attuale con due query (permessi
+esistenti; gruppi con i permessi assegnati), calcola le differenze con la
+specifica e le applica con un bulk_create e una sola DELETE sulla tabella
+gruppi-permessi: eseguita di nuovo su un database già allineato non scrive
+nulla. Le scritture massive non inviano m2m_changed, quindi al termine
+l'ambito di autorizzazione in cache viene invalidato esplicitamente.
+Con rimuovi=False la sincronizzazione è solo additiva: i permessi mancanti
+vengono aggiunti, quelli assegnati a mano oltre la specifica restano.
+
+Al post_migrate i gruppi dei livelli (RUOLI_LIVELLI) sono allineati alla
+specifica, i gruppi delle app (RUOLI_APP) solo in modo additivo.
+
+Uso:
+    sync = SincronizzazioneRuoli(gruppi=['Autisti'], dry_run=True).esegui()
+    sync.gruppi_creati, sync.aggiunti, sync.rimossi, sync.sconosciuti
+"""
+import logging
+from fnmatch import fnmatchcase
+
+from django.apps import apps as django_apps
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Q
+
+from . import autorizzazioni
+
+logger = logging.getLogger(__name__)
+
+# Gruppi assegnati automaticamente in base a Dipendente.livello
+RUOLI_LIVELLI = {
+    'Totale': ['*'],
+    'Contabile': ['dipendenti.*_dipendente', 'anagrafica.*'],
+    'Operativo': None,
+    'Operatore': None,
+    'Rappresentante': None,
+}
+
+RUOLI_ANAGRAFICA = {
+    'Gestori Anagrafica': [
+        'anagrafica.*_rappresentante', 'anagrafica.*_cliente', 'anagrafica.*_fornitore',
+    ],
+    'Rappresentanti': [
+        'anagrafica.view_cliente', 'anagrafica.add_cliente', 'anagrafica.change_cliente',
+    ],
+}
+
+RUOLI_AUTOMEZZI = {
+    'Gestori Automezzi': [
+        'automezzi.*_automezzo', 'automezzi.*_manutenzione', 'automezzi.*_rifornimento',
+        'automezzi.*_eventoautomezzo', 'automezzi.*_tipocarburante',
+        'automezzi.view_statisticheautomezzo',
+    ],
+    'Operatori Automezzi': [
+        'automezzi.change_automezzo', 'automezzi.view_automezzo',
+        'automezzi.add_manutenzione', 'automezzi.change_manutenzione', 'automezzi.view_manutenzione',
+        'automezzi.add_rifornimento', 'automezzi.change_rifornimento', 'automezzi.view_rifornimento',
+        'automezzi.add_eventoautomezzo', 'automezzi.change_eventoautomezzo', 'automezzi.view_eventoautomezzo',
+        'automezzi.view_tipocarburante', 'automezzi.view_statisticheautomezzo',
+    ],
+    'Autisti': [
+        'automezzi.add_rifornimento', 'automezzi.view_rifornimento',
+        'automezzi.add_eventoautomezzo', 'automezzi.view_eventoautomezzo',
+        'automezzi.view_automezzo', 'automezzi.view_manutenzione',
+    ],
+}
+
+RUOLI_APP = {**RUOLI_ANAGRAFICA, **RUOLI_AUTOMEZZI}
+
+RUOLI = {**RUOLI_LIVELLI, **RUOLI_APP}
+
+
+class SincronizzazioneRuoli:
+    """
+    Allinea gruppi e permessi del database alla specifica `ruoli`
+    (limitata ai `gruppi` indicati, se presenti). I gruppi non citati nella
+    specifica non vengono toccati; con rimuovi=False nessun permesso viene
+    tolto ai gruppi.
+    """
+
+    def __init__(self, ruoli=None, gruppi=None, dry_run=False, using=DEFAULT_DB_ALIAS, apps=None, rimuovi=True):
+        ruoli = RUOLI if ruoli is None else ruoli
+        if gruppi is not None:
+            ruoli = {nome: ruoli[nome] for nome in gruppi}
+        self.ruoli = ruoli
+        self.dry_run = dry_run
+        self.rimuovi = rimuovi
+        self.using = using
+        self.apps = apps or django_apps
+        self.gruppi_creati = []
+        self.aggiunti = 0
+        self.rimossi = 0
+        # Schemi della specifica che non corrispondono ad alcun permesso
+        self.sconosciuti = []
+
+    @property
+    def modificato(self):
+        return bool(self.gruppi_creati or self.aggiunti or self.rimossi)
+
+    def esegui(self):
+        Group = self.apps.get_model('auth', 'Group')
+        Permission = self.apps.get_model('auth', 'Permission')
+        GruppoPermesso = Group.permissions.through
+
+        # Query 1: tutti i permessi come 'app_label.codename'
+        permessi = {
+            f'{app_label}.{codename}': pk
+            for pk, app_label, codename in Permission.objects.using(self.using).values_list(
+                'pk', 'content_type__app_label', 'codename'
+            )
+        }
+        voluti = {
+            nome: self._risolvi(schemi, permessi)
+            for nome, schemi in self.ruoli.items()
+        }
+
+        # Query 2: gruppi della specifica con i permessi assegnati (LEFT JOIN)
+        gruppi = {}
+        attuali = {}
+        for pk, nome, permesso_id in Group.objects.using(self.using).filter(
+            name__in=self.ruoli
+        ).values_list('pk', 'name', 'permissions'):
+            gruppi[nome] = pk
+            attuali.setdefault(nome, set())
+            if permesso_id is not None:
+                attuali[nome].add(permesso_id)
+
+        self.gruppi_creati = [nome for nome in self.ruoli if nome not in gruppi]
+        da_aggiungere = {}
+        da_rimuovere = {}
+        for nome, permessi_voluti in voluti.items():
+            if permessi_voluti is None:
+                continue
+            presenti = attuali.get(nome, set())
+            if permessi_voluti - presenti:
+                da_aggiungere[nome] = permessi_voluti - presenti
+            if self.rimuovi and presenti - permessi_voluti:
+                da_rimuovere[nome] = presenti - permessi_voluti
+        self.aggiunti = sum(len(ids) for ids in da_aggiungere.values())
+        self.rimossi = sum(len(ids) for ids in da_rimuovere.values())
+
+        if self.dry_run or not self.modificato:
+            return self
+
+        with transaction.atomic(using=self.using):
+            if self.gruppi_creati:
+                Group.objects.using(self.using).bulk_create(
+                    [Group(name=nome) for nome in self.gruppi_creati], ignore_conflicts=True
+                )
+                # ignore_conflicts non restituisce le chiavi: si rileggono
+                gruppi.update(Group.objects.using(self.using).filter(
+                    name__in=self.gruppi_creati
+                ).values_list('name', 'pk'))
+            if da_rimuovere:
+                condizione = Q()
+                for nome, ids in da_rimuovere.items():
+                    condizione |= Q(group_id=gruppi[nome], permission_id__in=ids)
+                GruppoPermesso.objects.using(self.using).filter(condizione).delete()
+            if da_aggiungere:
+                GruppoPermesso.objects.using(self.using).bulk_create([
+                    GruppoPermesso(group_id=gruppi[nome], permission_id=permesso_id)
+                    for nome, ids in da_aggiungere.items() for permesso_id in sorted(ids)
+                ], ignore_conflicts=True)
+
+        autorizzazioni.invalida_tutti()
+        logger.info(
+            f'Ruoli sincronizzati: {len(self.gruppi_creati)} gruppi creati, '
+            f'{self.aggiunti} permessi aggiunti, {self.rimossi} rimossi'
+        )
+        return self
+
+    def _risolvi(self, schemi, permessi):
+        if schemi is None:
+            return None
+        risolti = set()
+        for schema in schemi:
+            trovati = [pk for nome, pk in permessi.items() if fnmatchcase(nome, schema)]
+            if not trovati:
+                self.sconosciuti.append(schema)
+            risolti.update(trovati)
+        return risolti
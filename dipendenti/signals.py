@@ -1,46 +1,101 @@
-from django.db.models.signals import post_migrate
+from django.db.models.signals import post_migrate, post_save, post_delete, pre_save, m2m_changed
 from django.dispatch import receiver
-from django.contrib.auth.models import Group, Permission
-from django.contrib.contenttypes.models import ContentType
+from django.contrib.auth.management import create_permissions
+from django.contrib.auth.models import Group
+from django.contrib.contenttypes.management import create_contenttypes
 from django.apps import apps
+from django.db import DEFAULT_DB_ALIAS
+
+from anagrafica.models import Cliente, Rappresentante
+
+from . import autorizzazioni
+from .models import Dipendente
+from .ruoli import RUOLI_APP, RUOLI_LIVELLI, SincronizzazioneRuoli
 
 @receiver(post_migrate)
-def create_default_groups(sender, **kwargs):
-    """Crea i gruppi predefiniti con le relative autorizzazioni dopo la migrazione"""
-    # Esegui solo se l'app è dipendenti
-    if sender.name != 'dipendenti':
+def sincronizza_ruoli(sender, using=DEFAULT_DB_ALIAS, verbosity=1, **kwargs):
+    """
+    Allinea gruppi e permessi predefiniti (dipendenti/ruoli.py) dopo la migrazione:
+    i gruppi dei livelli alla specifica, quelli delle app solo aggiungendo i
+    permessi mancanti (le aggiunte fatte dall'admin restano). I permessi di ogni app sono creati dal post_migrate di quell'app: la
+    sincronizzazione parte con l'ultima, quando esistono tutti.
+    """
+    ultima = [config for config in apps.get_app_configs() if config.models_module is not None][-1]
+    if sender.label != ultima.label:
+        return
+
+    # dipendenti precede auth e contenttypes in INSTALLED_APPS, quindi questo
+    # ricevitore gira prima dei loro: i permessi dell'ultima app si creano qui
+    # (le due funzioni sono idempotenti)
+    create_contenttypes(verbosity=verbosity, using=using, **kwargs)
+    create_permissions(verbosity=verbosity, using=using, **kwargs)
+    for sync in (
+        SincronizzazioneRuoli(ruoli=RUOLI_LIVELLI, using=using).esegui(),
+        SincronizzazioneRuoli(ruoli=RUOLI_APP, using=using, rimuovi=False).esegui(),
+    ):
+        if verbosity >= 1 and sync.modificato:
+            print(
+                f"Ruoli sincronizzati: {len(sync.gruppi_creati)} gruppi creati, "
+                f"{sync.aggiunti} permessi aggiunti, {sync.rimossi} rimossi"
+            )
+
+
+# ========== INVALIDAZIONE AMBITO DI AUTORIZZAZIONE ==========
+
+@receiver(post_save, sender=Dipendente, dispatch_uid='autorizzazioni_dipendente_salvato')
+@receiver(post_delete, sender=Dipendente, dispatch_uid='autorizzazioni_dipendente_eliminato')
+def invalida_autorizzazioni_dipendente(sender, instance, **kwargs):
+    autorizzazioni.invalida(instance.pk)
+
+
+@receiver(m2m_changed, sender=Dipendente.groups.through, dispatch_uid='autorizzazioni_gruppi_dipendente')
+@receiver(m2m_changed, sender=Dipendente.user_permissions.through, dispatch_uid='autorizzazioni_permessi_dipendente')
+def invalida_autorizzazioni_relazioni(sender, instance, action, reverse, pk_set, **kwargs):
+    """Gruppi o permessi di un dipendente (o dipendenti di un gruppo) modificati"""
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        autorizzazioni.invalida(instance.pk)
+    elif pk_set:
+        autorizzazioni.invalida(*pk_set)
+    else:
+        # clear() dal lato del gruppo o del permesso: utenti non noti
+        autorizzazioni.invalida_tutti()
+
+
+@receiver(post_save, sender=Group, dispatch_uid='autorizzazioni_gruppo_salvato')
+@receiver(post_delete, sender=Group, dispatch_uid='autorizzazioni_gruppo_eliminato')
+def invalida_autorizzazioni_gruppo(sender, instance, **kwargs):
+    autorizzazioni.invalida_tutti()
+
+
+@receiver(m2m_changed, sender=Group.permissions.through, dispatch_uid='autorizzazioni_permessi_gruppo')
+def invalida_autorizzazioni_permessi_gruppo(sender, action, **kwargs):
+    if action.startswith('post_'):
+        autorizzazioni.invalida_tutti()
+
+
+@receiver(pre_save, sender=Rappresentante, dispatch_uid='autorizzazioni_rappresentante_prima')
+@receiver(pre_save, sender=Cliente, dispatch_uid='autorizzazioni_cliente_prima')
+def memorizza_collegamento_precedente(sender, instance, raw=False, **kwargs):
+    """Dipendente (o rappresentante del cliente) prima della modifica, da invalidare anch'esso"""
+    if raw or instance.pk is None or instance._state.adding:
+        instance._autorizzazioni_prima = None
         return
-    
-    # Crea i gruppi predefiniti
-    groups = {
-        'Totale': 'Amministratore con accesso completo',
-        'Contabile': 'Accesso a tutte le funzioni contabili e anagrafiche',
-        'Operativo': 'Accesso alle funzioni operative',
-        'Operatore': 'Accesso limitato alle proprie funzioni',
-        'Rappresentante': 'Accesso alle funzioni commerciali'
-    }
-    
-    for group_name, description in groups.items():
-        group, created = Group.objects.get_or_create(name=group_name)
-        if created:
-            print(f"Gruppo '{group_name}' creato")
-
-    # Assegna permessi per il gruppo Totale
-    totale_group = Group.objects.get(name='Totale')
-    # Aggiungi tutti i permessi
-    all_perms = Permission.objects.all()
-    totale_group.permissions.set(all_perms)
-    
-    # Assegna permessi per il gruppo Contabile
-    contabile_group = Group.objects.get(name='Contabile')
-    
-    # Ottieni i content type per le app rilevanti
-    dipendenti_ct = ContentType.objects.get_for_model(apps.get_model('dipendenti', 'Dipendente'))
-    anagrafica_ct = ContentType.objects.filter(app_label='anagrafica')
-    
-    # Ottieni i permessi per queste app
-    contabile_perms = Permission.objects.filter(content_type__in=[dipendenti_ct, *anagrafica_ct])
-    contabile_group.permissions.set(contabile_perms)
-    
-    # Assegnazione simile per gli altri gruppi...
-    # ...
\ No newline at end of file
+    campo = 'dipendente_id' if sender is Rappresentante else 'rappresentante_id'
+    instance._autorizzazioni_prima = sender._base_manager.filter(pk=instance.pk).values_list(campo, flat=True).first()
+
+
+@receiver(post_save, sender=Rappresentante, dispatch_uid='autorizzazioni_rappresentante_salvato')
+@receiver(post_delete, sender=Rappresentante, dispatch_uid='autorizzazioni_rappresentante_eliminato')
+def invalida_autorizzazioni_rappresentante(sender, instance, **kwargs):
+    autorizzazioni.invalida(instance.dipendente_id, getattr(instance, '_autorizzazioni_prima', None))
+
+
+@receiver(post_save, sender=Cliente, dispatch_uid='autorizzazioni_cliente_salvato')
+@receiver(post_delete, sender=Cliente, dispatch_uid='autorizzazioni_cliente_eliminato')
+def invalida_autorizzazioni_cliente(sender, instance, **kwargs):
+    """I clienti rappresentati fanno parte dell'ambito del dipendente rappresentante"""
+    autorizzazioni.invalida_rappresentanti(
+        instance.rappresentante_id, getattr(instance, '_autorizzazioni_prima', None)
+    )
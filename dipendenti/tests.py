@@ -1,3 +1,537 @@
-from django.test import TestCase
+import csv
+import io
+import shutil
+import tempfile
+import zipfile
+from datetime import date, time, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from home.models import Elaborazione
+from home.query_ripetute import BudgetQueryMixin
+
+from . import autorizzazioni, presenza, report_ore
+from .models import Dipendente, Giornata, RiepilogoMensile, secondi_lavorati
+
+
+class ReportOreMensileTests(TestCase):
+    """Test per il report mensile delle ore di tutti i dipendenti"""
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        media_root = override_settings(MEDIA_ROOT=media)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+
+        self.admin = Dipendente.objects.create_user(username='admin', password='testpass123', livello='totale')
+        self.rossi = Dipendente.objects.create_user(username='mrossi', first_name='Mario', last_name='Rossi')
+        self.bianchi = Dipendente.objects.create_user(username='lbianchi', first_name='Luca', last_name='Bianchi')
+        Dipendente.objects.create_user(username='ex', is_active=False)
+        self._giornata(self.rossi, date(2025, 3, 3), time(8), time(12), time(13), time(17, 30))
+        # Giornata continuativa: solo inizio mattina e fine pomeriggio
+        self._giornata(self.rossi, date(2025, 3, 4), time(7), None, None, time(15))
+        # Fuori dal periodo
+        self._giornata(self.rossi, date(2025, 4, 1), time(8), time(12), None, None)
+        self._giornata(self.bianchi, date(2025, 3, 5), None, None, None, None, assenza='ferie')
+
+    def _giornata(self, operatore, data, inizio_mattina, fine_mattina, inizio_pomeriggio, fine_pomeriggio, assenza='nessuna'):
+        giornata = Giornata.objects.create(
+            operatore=operatore, ora_inizio_mattina=inizio_mattina, ora_fine_mattina=fine_mattina,
+            ora_inizio_pomeriggio=inizio_pomeriggio, ora_fine_pomeriggio=fine_pomeriggio, assenza=assenza,
+        )
+        # data è auto_now_add: la data voluta si imposta dopo la creazione
+        giornata.data = data
+        giornata.save()
+        return giornata
+
+    def test_secondi_lavorati_come_daily_hours(self):
+        self.assertEqual(secondi_lavorati(time(8), time(12), time(13), time(17, 30)), 8.5 * 3600)
+        self.assertEqual(secondi_lavorati(time(7), None, None, time(15)), 8 * 3600)
+        self.assertEqual(secondi_lavorati(time(12), time(8), None, None), 0)
+        self.assertEqual(secondi_lavorati(time(8), time(12), None, time(17)), 4 * 3600)
+        giornata = Giornata(ora_inizio_mattina=time(7), ora_fine_pomeriggio=time(15))
+        self.assertEqual(giornata.daily_hours(), timedelta(hours=8))
+
+    def test_ore_di_tutti_in_una_query(self):
+        with self.assertNumQueries(1):
+            ore = report_ore.ore_dipendenti(date(2025, 3, 1), date(2025, 3, 31))
+
+        # Ordinati per cognome; gli inattivi esclusi, chi non ha giornate incluso
+        self.assertEqual([voce['dipendente']['username'] for voce in ore], ['admin', 'lbianchi', 'mrossi'])
+        admin, bianchi, rossi = ore
+        self.assertEqual(admin['giornate'], [])
+        self.assertEqual(bianchi['minuti'], 0)
+        self.assertEqual(len(bianchi['giornate']), 1)
+        self.assertEqual([giornata['data'] for giornata in rossi['giornate']], [date(2025, 3, 3), date(2025, 3, 4)])
+        self.assertEqual(rossi['minuti'], 990)
+
+    def test_archivio_zip_con_riepilogo(self):
+        avanzamento = []
+        contenuto = io.BytesIO()
+        report = report_ore.ReportOreMensile(date(2025, 3, 1), date(2025, 3, 31), processi=1)
+        report.genera(contenuto, lambda completati, totale: avanzamento.append((completati, totale)))
+
+        self.assertEqual(report.generati, 3)
+        self.assertEqual(avanzamento, [(0, 3), (1, 3), (2, 3), (3, 3)])
+        with zipfile.ZipFile(contenuto) as archivio:
+            nomi = archivio.namelist()
+            self.assertIn('Ore_mrossi_2025-03-01_2025-03-31.pdf', nomi)
+            self.assertTrue(archivio.read('Ore_mrossi_2025-03-01_2025-03-31.pdf').startswith(b'%PDF'))
+            riepilogo = list(csv.reader(io.StringIO(archivio.read('riepilogo.csv').decode()), delimiter=';'))
+        self.assertEqual(riepilogo[2], ['lbianchi', 'Bianchi', 'Luca', '1', '1', '0:00'])
+        self.assertEqual(riepilogo[3], ['mrossi', 'Rossi', 'Mario', '2', '0', '16:30'])
+
+    def test_viste_avvio_avanzamento_e_download(self):
+        url = reverse('dipendenti:stampa_mese_tutti')
+        self.client.login(username='mrossi', password='')
+        self.assertNotEqual(self.client.get(url).status_code, 200)
+
+        self.client.login(username='admin', password='testpass123')
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+        with mock.patch('home.elaborazioni.subprocess.Popen') as popen:
+            popen.return_value.pid = 4322
+            response = self.client.post(url, {'data_inizio': '2025-03-01', 'data_fine': '2025-03-31'})
+        nome = response['Location'].split('report=')[1]
+        self.assertRedirects(response, f'{url}?report={nome}')
+        self.assertEqual(popen.call_args.args[0][-7:], [
+            'report_ore_mensile', '--dal', '2025-03-01', '--al', '2025-03-31', '--elaborazione', nome,
+        ])
+
+        self.assertEqual(Elaborazione.objects.get(nome=nome).pid, 4322)
+
+        stato = reverse('dipendenti:stampa_mese_tutti_stato', args=[nome])
+        self.assertEqual(self.client.get(stato).json()['stato'], 'in_corso')
+        self.assertEqual(
+            self.client.get(reverse('dipendenti:stampa_mese_tutti_scarica', args=[nome])).status_code, 404
+        )
+        call_command(
+            'report_ore_mensile', dal='2025-03-01', al='2025-03-31', elaborazione=nome, processi=1,
+            stdout=io.StringIO(),
+        )
+        dati = self.client.get(stato).json()
+        self.assertEqual((dati['stato'], dati['completati'], dati['totale']), ('pronto', 3, 3))
+
+        response = self.client.get(dati['url'])
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        with zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content))) as archivio:
+            self.assertEqual(len(archivio.namelist()), 4)
+        self.assertEqual(
+            self.client.get(reverse('dipendenti:stampa_mese_tutti_scarica', args=['settings.zip'])).status_code, 404
+        )
+
+
+class RiepilogoMensileTests(TestCase):
+    """Test per minuti lavorati e riepiloghi mensili aggiornati al salvataggio"""
+
+    def setUp(self):
+        self.rossi = Dipendente.objects.create_user(username='mrossi', password='testpass123')
+
+    def _giornata(self, data, **orari):
+        giornata = Giornata.objects.create(operatore=self.rossi, **orari)
+        giornata.data = data
+        giornata.save()
+        return giornata
+
+    def _riepilogo(self, mese):
+        return RiepilogoMensile.objects.filter(operatore=self.rossi, mese=mese).values_list(
+            'minuti_lavorati', 'giornate', 'giornate_assenza'
+        ).first()
+
+    def test_aggiornamento_incrementale(self):
+        lunedi = self._giornata(date(2025, 3, 3), ora_inizio_mattina=time(8), ora_fine_mattina=time(12))
+        self.assertEqual(lunedi.minuti_lavorati, 240)
+        # Giornata continuativa
+        martedi = self._giornata(date(2025, 3, 4), ora_inizio_mattina=time(7), ora_fine_pomeriggio=time(15, 15))
+        self.assertEqual(martedi.minuti_lavorati, 495)
+        self.assertEqual(self._riepilogo(date(2025, 3, 1)), (735, 2, 0))
+
+        # Modifica con update_fields: anche minuti_lavorati viene salvato
+        lunedi.ora_inizio_pomeriggio, lunedi.ora_fine_pomeriggio = time(13), time(17)
+        lunedi.save(update_fields=['ora_inizio_pomeriggio', 'ora_fine_pomeriggio'])
+        lunedi.refresh_from_db()
+        self.assertEqual(lunedi.minuti_lavorati, 480)
+        self.assertEqual(self._riepilogo(date(2025, 3, 1)), (975, 2, 0))
+
+        # Cambio di mese: il contributo passa da un riepilogo all'altro
+        martedi.data, martedi.assenza = date(2025, 4, 1), 'permesso'
+        martedi.save()
+        self.assertEqual(self._riepilogo(date(2025, 3, 1)), (480, 1, 0))
+        self.assertEqual(self._riepilogo(date(2025, 4, 1)), (495, 1, 1))
+
+        martedi.delete()
+        self.assertEqual(self._riepilogo(date(2025, 4, 1)), (0, 0, 0))
+
+    def test_update_fields_e_errori_non_spostano_i_totali(self):
+        lunedi = self._giornata(date(2025, 3, 3), ora_inizio_mattina=time(8), ora_fine_mattina=time(12))
+
+        # Valori in memoria non salvati: il riepilogo segue solo i campi scritti
+        lunedi.data, lunedi.assenza, lunedi.ora_fine_mattina = date(2025, 4, 7), 'ferie', time(13)
+        lunedi.save(update_fields=['nota_assenza'])
+        self.assertEqual(self._riepilogo(date(2025, 3, 1)), (240, 1, 0))
+        self.assertIsNone(self._riepilogo(date(2025, 4, 1)))
+        self.assertEqual(Giornata.objects.get(pk=lunedi.pk).minuti_lavorati, 240)
+
+        # Un errore nell'aggiornamento del riepilogo annulla anche il salvataggio
+        lunedi.refresh_from_db()
+        lunedi.ora_fine_mattina = time(13)
+        with mock.patch('dipendenti.riepiloghi._aggiorna', side_effect=DatabaseError('riepilogo')):
+            with self.assertRaises(DatabaseError):
+                lunedi.save()
+        self.assertEqual(Giornata.objects.get(pk=lunedi.pk).minuti_lavorati, 240)
+        self.assertEqual(self._riepilogo(date(2025, 3, 1)), (240, 1, 0))
+
+    def test_ricalcola_dopo_scritture_massive(self):
+        self._giornata(date(2025, 3, 3), ora_inizio_mattina=time(8), ora_fine_mattina=time(12))
+        Giornata.objects.update(ora_fine_mattina=time(13))
+        RiepilogoMensile.objects.all().delete()
+
+        out = io.StringIO()
+        call_command('ricalcola_ore_mensili', stdout=out)
+        self.assertIn('Riepiloghi mensili: 1', out.getvalue())
+        self.assertEqual(Giornata.objects.get().minuti_lavorati, 300)
+        self.assertEqual(self._riepilogo(date(2025, 3, 1)), (300, 1, 0))
+
+    def test_profilo_legge_i_totali(self):
+        oggi = date.today()
+        self._giornata(oggi, ora_inizio_mattina=time(8), ora_fine_mattina=time(12, 30))
+        self.client.login(username='mrossi', password='testpass123')
+        url = reverse('dipendenti:profilo', args=['mrossi'])
+        # Conteggio dei messaggi non letti in cache, come a regime
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.client.get(url)
+
+        with self.assertNumQueries(8):
+            response = self.client.get(url)
+        self.assertEqual(response.context['ore_mensili'], timedelta(hours=4, minutes=30))
+        self.assertEqual(response.context['ore_settimanali'], timedelta(hours=4, minutes=30))
+
+
+class PresenzaTests(TestCase):
+    """Test per la presenza online in cache con salvataggio differito"""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.rossi = Dipendente.objects.create_user(username='mrossi', password='testpass123')
+        self.bianchi = Dipendente.objects.create_user(username='lbianchi', password='testpass123')
+
+    @mock.patch('dipendenti.presenza.cache_condivisa', return_value=True)
+    def test_richieste_senza_scritture_sul_database(self, _):
+        self.client.login(username='mrossi', password='testpass123')
+        url = reverse('dipendenti:profilo', args=['mrossi'])
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.assertIn(self.rossi.pk, presenza.online())
+        primo = presenza.leggi()[self.rossi.pk][0]
+
+        # Entro INTERVALLO_HEARTBEAT la cache non viene riscritta
+        with CaptureQueriesContext(connection) as altre:
+            self.client.get(url)
+        self.assertEqual(presenza.leggi()[self.rossi.pk][0], primo)
+        self.assertFalse([q for q in queries.captured_queries + altre.captured_queries if 'dipendenti_dipendente' in q['sql'] and q['sql'].startswith('UPDATE')])
+
+    def test_colleghi_online_e_scadenza(self):
+        adesso = timezone.now().timestamp()
+        presenza.heartbeat(self.bianchi.pk, adesso=adesso - presenza.PRESENZA_TTL - 1)
+        self.client.login(username='mrossi', password='testpass123')
+        response = self.client.get(reverse('home:index'))
+        self.assertEqual(list(response.context['dipendenti_online']), [])
+
+        presenza.heartbeat(self.bianchi.pk)
+        response = self.client.get(reverse('home:index'))
+        self.assertEqual(list(response.context['dipendenti_online']), [self.bianchi])
+
+        presenza.disconnetti(self.bianchi.pk)
+        self.assertNotIn(self.bianchi.pk, presenza.online())
+
+    @mock.patch('dipendenti.presenza.cache_condivisa', return_value=True)
+    def test_salvataggio_differito(self, _):
+        adesso = timezone.now().timestamp()
+        presenza.heartbeat(self.rossi.pk, adesso=adesso - 10)
+        presenza.heartbeat(self.bianchi.pk, adesso=adesso - 5)
+        presenza.disconnetti(self.bianchi.pk, adesso=adesso)
+
+        out = io.StringIO()
+        with mock.patch('dipendenti.management.commands.salva_presenze.cache_condivisa', return_value=True):
+            call_command('salva_presenze', stdout=out)
+        self.assertIn('aggiornato per 2 dipendenti', out.getvalue())
+        self.rossi.refresh_from_db()
+        self.bianchi.refresh_from_db()
+        self.assertAlmostEqual(self.rossi.ultimo_accesso.timestamp(), adesso - 10, places=3)
+        self.assertAlmostEqual(self.bianchi.ultimo_accesso.timestamp(), adesso, places=3)
+        self.assertTrue(self.rossi.is_online)
+        self.assertFalse(self.bianchi.is_online)
+
+        # Nessun nuovo heartbeat: nulla da salvare
+        self.assertEqual(presenza.salva(), 0)
+
+        # Heartbeat scritto durante il salvataggio, con un istante precedente a
+        # quello salvato per un altro dipendente: va nel database al giro dopo
+        presenza.disconnetti(self.bianchi.pk, adesso=adesso + 100)
+        leggi = presenza.leggi
+
+        def leggi_e_heartbeat(pks=None):
+            presenze = leggi(pks)
+            presenza.heartbeat(self.rossi.pk, adesso=adesso + 60)
+            return presenze
+
+        with mock.patch.object(presenza, 'leggi', leggi_e_heartbeat):
+            self.assertEqual(presenza.salva(), 1)
+        self.assertEqual(presenza.salva(), 1)
+        self.rossi.refresh_from_db()
+        self.assertAlmostEqual(self.rossi.ultimo_accesso.timestamp(), adesso + 60, places=3)
+
+    @mock.patch('dipendenti.presenza.cache_condivisa', return_value=True)
+    def test_heartbeat_restituisce_solo_lo_stato_del_chiamante(self, _):
+        presenza.heartbeat(self.bianchi.pk)
+        self.client.force_login(self.rossi)
+        with self.assertNumQueries(2):
+            risposta = self.client.post(reverse('dipendenti:heartbeat'))
+        self.assertEqual(risposta.json(), {'online': True})
+
+    def test_cache_locale_scrive_nel_database(self):
+        # Con la cache del singolo processo il comando non vedrebbe le presenze
+        adesso = timezone.now().timestamp()
+        presenza.heartbeat(self.rossi.pk, adesso=adesso - presenza.PRESENZA_TTL - 1)
+        presenza.heartbeat(self.bianchi.pk, adesso=adesso)
+        self.rossi.refresh_from_db()
+        self.assertTrue(self.rossi.is_online)
+        self.assertAlmostEqual(self.rossi.ultimo_accesso.timestamp(), adesso - presenza.PRESENZA_TTL - 1, places=3)
+
+        cache.clear()
+        out = io.StringIO()
+        call_command('salva_presenze', stdout=out)
+        self.assertIn('Dipendenti messi offline: 1', out.getvalue())
+        self.assertEqual(set(Dipendente.objects.filter(is_online=True).values_list('pk', flat=True)), {self.bianchi.pk})
+
+
+    def test_avviso_cache_locale_in_produzione(self):
+        from amm.cache import controlla_cache_condivisa
+
+        with override_settings(DEBUG=True):
+            self.assertEqual(controlla_cache_condivisa(None), [])
+        with override_settings(DEBUG=False):
+            self.assertEqual([avviso.id for avviso in controlla_cache_condivisa(None)], ['amm.W001'])
+        condivisa = {'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'cache'}}
+        with override_settings(DEBUG=False, CACHES=condivisa):
+            self.assertEqual(controlla_cache_condivisa(None), [])
+
+class AutorizzazioniTests(TestCase):
+    """Test per l'ambito di autorizzazione in cache e la sua invalidazione"""
+
+    def setUp(self):
+        from anagrafica.models import Cliente, Rappresentante
+
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.rossi = Dipendente.objects.create_user(username='mrossi', password='testpass123', livello='operatore')
+        self.verdi = Dipendente.objects.create_user(username='gverdi', password='testpass123', livello='operatore')
+        self.rappresentante = Rappresentante.objects.create(
+            dipendente=self.rossi, nome='Mario', partita_iva='01234567897',
+            codice_fiscale='RSSMRA80A01F205Z', telefono='1', email='m@test.com',
+        )
+        self.altro = Rappresentante.objects.create(dipendente=self.verdi, nome='Giuseppe')
+        self.mio = Cliente.objects.create(nome='Bar Centrale', telefono='1', email='a@test.com', rappresentante=self.rappresentante)
+        self.suo = Cliente.objects.create(nome='Bar Stazione', telefono='2', email='b@test.com', rappresentante=self.altro)
+
+    def test_ambito_in_cache(self):
+        ambito = autorizzazioni.per_utente(self.rossi)
+        self.assertEqual(ambito.rappresentante_id, self.rappresentante.pk)
+        self.assertEqual(ambito.clienti, {self.mio.pk})
+        self.assertIn('Operatore', ambito.gruppi)
+        self.assertTrue(ambito.limitato_ai_propri_clienti)
+        self.assertFalse(ambito.is_contabile)
+
+        with self.assertNumQueries(0):
+            ambito = autorizzazioni.per_utente(self.rossi)
+        self.assertTrue(ambito.puo_accedere_cliente(self.mio.pk))
+        self.assertFalse(ambito.puo_accedere_cliente(self.suo.pk))
+
+    def test_invalidazione(self):
+        from django.contrib.auth.models import Group, Permission
+
+        autorizzazioni.per_utente(self.rossi)
+        self.rossi.livello = 'contabile'
+        self.rossi.save()
+        ambito = autorizzazioni.per_utente(self.rossi)
+        self.assertTrue(ambito.is_contabile)
+        self.assertIn('Contabile', ambito.gruppi)
+
+        # Permesso aggiunto al gruppo: la versione globale rende vecchie tutte le voci
+        permesso = Permission.objects.get(codename='add_giornata')
+        gruppo = Group.objects.get(name='Contabile')
+        gruppo.permissions.remove(permesso)
+        self.assertFalse(autorizzazioni.per_utente(self.rossi).has_perm('dipendenti.add_giornata'))
+        gruppo.permissions.add(permesso)
+        self.assertTrue(autorizzazioni.per_utente(self.rossi).has_perm('dipendenti.add_giornata'))
+
+        # Cliente riassegnato: cambia l'ambito del vecchio e del nuovo rappresentante
+        autorizzazioni.per_utente(self.verdi)
+        self.suo.rappresentante = self.rappresentante
+        self.suo.save()
+        self.assertEqual(autorizzazioni.per_utente(self.rossi).clienti, {self.mio.pk, self.suo.pk})
+        self.assertEqual(autorizzazioni.per_utente(self.verdi).clienti, set())
+
+    def test_invalidazione_durante_il_calcolo(self):
+        calcola = autorizzazioni.calcola
+
+        def calcola_e_invalida(user):
+            ambito = calcola(user)
+            # Il cliente cambia rappresentante dopo la lettura dal database
+            self.mio.rappresentante = self.altro
+            self.mio.save()
+            return ambito
+
+        with mock.patch.object(autorizzazioni, 'calcola', calcola_e_invalida):
+            self.assertEqual(autorizzazioni.per_utente(self.rossi).clienti, {self.mio.pk})
+        # La voce scritta dal calcolo concorrente è già vecchia
+        self.assertEqual(autorizzazioni.per_utente(self.rossi).clienti, set())
+
+    def test_flag_correnti_e_importazione(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from anagrafica.importazione import ImportazioneClienti
+
+        self.rossi.livello = 'contabile'
+        self.rossi.save()
+        self.assertTrue(autorizzazioni.per_utente(Dipendente.objects.get(pk=self.rossi.pk)).is_contabile)
+
+        # Declassato e disattivato con un update (nessun segnale): l'ambito in
+        # cache resta valido, i flag vengono dall'utente della richiesta
+        Dipendente.objects.filter(pk=self.rossi.pk).update(livello='operatore', is_active=False)
+        utente = Dipendente.objects.get(pk=self.rossi.pk)
+        with self.assertNumQueries(0):
+            ambito = autorizzazioni.per_utente(utente)
+        self.assertFalse(ambito.is_contabile)
+        self.assertFalse(ambito.has_perm('dipendenti.add_giornata'))
+
+        # bulk_create dei clienti importati: ambito del rappresentante invalidato
+        autorizzazioni.per_utente(self.verdi)
+        contenuto = 'ragione_sociale;telefono;email;partita_iva;rappresentante\nBar Nuovo;3;c@test.com;09876543217;Giuseppe\n'
+        with self.captureOnCommitCallbacks(execute=True):
+            ImportazioneClienti().esegui(SimpleUploadedFile('clienti.csv', contenuto.encode()))
+        nuovo = self.altro.clienti.get(nome='Bar Nuovo')
+        self.assertEqual(autorizzazioni.per_utente(self.verdi).clienti, {self.suo.pk, nuovo.pk})
+
+    def test_accesso_ai_propri_clienti(self):
+        self.client.force_login(self.rossi)
+        self.assertEqual(self.client.get(reverse('anagrafica:dettaglio_cliente', args=[self.mio.pk])).status_code, 200)
+        self.assertEqual(self.client.get(reverse('anagrafica:dettaglio_cliente', args=[self.suo.pk])).status_code, 403)
+
+        response = self.client.get(reverse('anagrafica:elenco_clienti'))
+        self.assertEqual(list(response.context['clienti']), [self.mio])
+        response = self.client.get(reverse('anagrafica:api_search'), {'q': 'Bar', 'tipo': 'clienti'})
+        self.assertEqual([voce['id'] for voce in response.json()['results']], [self.mio.pk])
+
+        # Livello insufficiente per le viste riservate al livello contabile
+        self.assertEqual(self.client.get(reverse('dipendenti:elencodipendenti')).status_code, 403)
+
+
+class RuoliTests(TestCase):
+    """Test per la sincronizzazione dichiarativa di gruppi e permessi"""
+
+    def test_database_gia_allineato_non_scrive(self):
+        from django.contrib.auth.models import Group, Permission
+        from .ruoli import RUOLI, SincronizzazioneRuoli
+
+        # Sincronizzati dal post_migrate alla creazione del database di test
+        self.assertEqual(set(Group.objects.filter(name__in=RUOLI).values_list('name', flat=True)), set(RUOLI))
+        self.assertEqual(Group.objects.get(name='Totale').permissions.count(), Permission.objects.count())
+
+        with self.assertNumQueries(2):
+            sync = SincronizzazioneRuoli().esegui()
+        self.assertFalse(sync.modificato)
+        self.assertEqual(sync.sconosciuti, [])
+
+    def test_differenze_applicate(self):
+        from django.contrib.auth.models import Group, Permission
+        from .ruoli import SincronizzazioneRuoli
+
+        contabile = Group.objects.get(name='Contabile')
+        operativo = Group.objects.get(name='Operativo')
+        manuale = Permission.objects.get(codename='view_giornata')
+        contabile.permissions.remove(Permission.objects.get(codename='view_cliente'))
+        contabile.permissions.add(manuale)
+        operativo.permissions.add(manuale)
+        Group.objects.filter(name='Autisti').delete()
+
+        rossi = Dipendente.objects.create_user(username='mrossi', livello='contabile')
+        self.assertTrue(autorizzazioni.per_utente(rossi).has_perm('dipendenti.view_giornata'))
+
+        anteprima = SincronizzazioneRuoli(dry_run=True).esegui()
+        self.assertEqual((anteprima.gruppi_creati, anteprima.rimossi), (['Autisti'], 1))
+        self.assertFalse(Group.objects.filter(name='Autisti').exists())
+
+        sync = SincronizzazioneRuoli().esegui()
+        self.assertEqual(sync.gruppi_creati, ['Autisti'])
+        self.assertEqual((sync.aggiunti, sync.rimossi), (1 + 6, 1))
+        self.assertTrue(contabile.permissions.filter(codename='view_cliente').exists())
+        self.assertFalse(contabile.permissions.filter(pk=manuale.pk).exists())
+        # Gruppo con permessi gestiti a mano: invariato
+        self.assertTrue(operativo.permissions.filter(pk=manuale.pk).exists())
+        self.assertEqual(Group.objects.get(name='Autisti').permissions.count(), 6)
+        # Scritture massive senza m2m_changed: l'ambito in cache è comunque invalidato
+        self.assertFalse(autorizzazioni.per_utente(rossi).has_perm('dipendenti.view_giornata'))
+
+        self.assertFalse(SincronizzazioneRuoli().esegui().modificato)
+
+    def test_migrate_conserva_i_permessi_aggiunti_ai_gruppi_delle_app(self):
+        from django.contrib.auth.models import Group, Permission
+        from django.core.management import call_command
+
+        autisti = Group.objects.get(name='Autisti')
+        contabile = Group.objects.get(name='Contabile')
+        manuale = Permission.objects.get(codename='change_automezzo')
+        autisti.permissions.add(manuale)
+        autisti.permissions.remove(Permission.objects.get(codename='view_automezzo'))
+        contabile.permissions.add(manuale)
+
+        call_command('migrate', verbosity=0)
+
+        # Gruppi delle app: solo aggiunte
+        self.assertTrue(autisti.permissions.filter(pk=manuale.pk).exists())
+        self.assertTrue(autisti.permissions.filter(codename='view_automezzo').exists())
+        # Gruppi dei livelli: allineati alla specifica
+        self.assertFalse(contabile.permissions.filter(pk=manuale.pk).exists())
+
+
+class BudgetQueryTests(BudgetQueryMixin, TestCase):
+    """Numero massimo di query delle pagine del personale"""
+
+    BUDGET_QUERY = {
+        'dipendenti:dashboard': 5,
+        'dipendenti:elencodipendenti': 4,
+        'dipendenti:vedidipendente': 7,
+        'dipendenti:profilo': 8,
+    }
+
+    def setUp(self):
+        self.utente = Dipendente.objects.create_user(username='budget', password='pw', livello='totale')
+        self.client.force_login(self.utente)
+        Giornata.objects.create(operatore=self.utente, ora_inizio_mattina=time(8), ora_fine_mattina=time(12))
+        self.creati = 0
+        self._dipendenti()
+
+    def _dipendenti(self, quanti=3):
+        for numero in range(self.creati, self.creati + quanti):
+            self.creati += 1
+            dipendente = Dipendente.objects.create_user(username=f'dipendente{numero}', password='pw', livello='operatore')
+            Giornata.objects.create(operatore=dipendente, ora_inizio_mattina=time(8), ora_fine_mattina=time(12))
+
+    def test_budget_pagine(self):
+        argomenti = {
+            'dipendenti:vedidipendente': [self.utente.pk],
+            'dipendenti:profilo': [self.utente.username],
+        }
+        for nome_url in self.BUDGET_QUERY:
+            with self.subTest(nome_url):
+                self.assertBudgetQuery(nome_url, args=argomenti.get(nome_url), aggiungi_righe=self._dipendenti)
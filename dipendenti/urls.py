@@ -7,6 +7,7 @@ urlpatterns = [
     # Autenticazione
     path('', views.entra, name='login'),
     path('esci/', views.esci, name='esci'),
+    path('presenza/', views.heartbeat, name='heartbeat'),
     path('dashboard/', views.dashboard_dipendenti, name='dashboard'),
     # Gestione Dipendenti
     path('elenco/', views.DipendenteListView.as_view(), name='elencodipendenti'),
@@ -24,6 +25,9 @@ urlpatterns = [
     
     # Reportistica
     path('report/mensile/', views.ReportMensileView.as_view(), name='stampa_mese_dipendente'),
+    path('report/mensile/tutti/', views.ReportMensileTuttiView.as_view(), name='stampa_mese_tutti'),
+    path('report/mensile/tutti/<str:nome>/stato/', views.ReportMensileTuttiStatoView.as_view(), name='stampa_mese_tutti_stato'),
+    path('report/mensile/tutti/<str:nome>/', views.ReportMensileTuttiScaricaView.as_view(), name='stampa_mese_tutti_scarica'),
     
     # Profilo Utente
     path('profilo/<str:username>/', views.profilo, name='profilo'),
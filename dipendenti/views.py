@@ -1,28 +1,33 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
 from django.contrib import messages
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponse, HttpResponseRedirect, HttpResponseForbidden
+from django.views.decorators.http import require_POST
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseRedirect, HttpResponseForbidden, JsonResponse
 from django.utils.translation import gettext_lazy as _
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView, FormView
-from django.views.generic.base import TemplateView
+from django.views.generic.base import TemplateView, View
 from django.utils import timezone
+from django.core.files.storage import default_storage
+from django.db.models import Sum
 from utils import produci_pdf
 from datetime import date, datetime, timedelta
 from io import BytesIO
 
-from .models import Dipendente, AllegatoDipendente, Giornata
+from .models import Dipendente, AllegatoDipendente, Giornata, RiepilogoMensile
+from . import presenza, report_ore
+from .autorizzazioni import AutorizzazioniMixin, da_request
 from .forms import (
     DipendenteCreationForm, DipendenteChangeForm, AllegatoDipendenteForm,
-    InizioGiornataForm, GiornataForm, MensilitaForm
+    InizioGiornataForm, GiornataForm, MensilitaForm, MensilitaTuttiForm
 )
 
 @login_required
 def dashboard_dipendenti(request):
     # Consenti solo a livello "totale" o superuser
-    if not (request.user.livello == Dipendente.Autorizzazioni.totale or request.user.is_superuser):
+    if not da_request(request).is_totale:
         return HttpResponseForbidden("Non hai i permessi per accedere a questa pagina.")
 
     dipendenti_count = Dipendente.objects.count()
@@ -35,26 +40,20 @@ def dashboard_dipendenti(request):
     }
     return render(request, "dipendenti/dashboard.html", context)
 
-class StaffRequiredMixin(UserPassesTestMixin):
+class StaffRequiredMixin(AutorizzazioniMixin, UserPassesTestMixin):
     """Mixin per verificare che l'utente sia staff"""
     def test_func(self):
-        return self.request.user.is_staff
+        return self.autorizzazioni.is_staff
 
-class TotaleLivelloRequiredMixin(UserPassesTestMixin):
-    """Mixin per verificare che l'utente abbia livello 'totale'"""
+class TotaleLivelloRequiredMixin(AutorizzazioniMixin, UserPassesTestMixin):
+    """Mixin per verificare che l'utente abbia livello 'totale' (o sia superuser)"""
     def test_func(self):
-        # Corretto per includere i superuser
-        return (self.request.user.livello == Dipendente.Autorizzazioni.totale or 
-                self.request.user.is_superuser)
+        return self.autorizzazioni.is_totale
 
-class ContabileLivelloRequiredMixin(UserPassesTestMixin):
-    """Mixin per verificare che l'utente abbia livello 'contabile' o superiore"""
+class ContabileLivelloRequiredMixin(AutorizzazioniMixin, UserPassesTestMixin):
+    """Mixin per verificare che l'utente abbia livello 'contabile' o superiore (o sia superuser)"""
     def test_func(self):
-        # Modificato per includere i superuser
-        return self.request.user.livello in [
-            Dipendente.Autorizzazioni.totale,
-            Dipendente.Autorizzazioni.contabile
-        ] or self.request.user.is_superuser
+        return self.autorizzazioni.is_contabile
 
 class DipendenteListView(LoginRequiredMixin, ContabileLivelloRequiredMixin, ListView):
     """Vista per l'elenco dei dipendenti"""
@@ -81,7 +80,7 @@ class DipendenteListView(LoginRequiredMixin, ContabileLivelloRequiredMixin, List
         
         return queryset
 
-class DipendenteDetailView(LoginRequiredMixin, UserPassesTestMixin, DetailView):
+class DipendenteDetailView(LoginRequiredMixin, AutorizzazioniMixin, UserPassesTestMixin, DetailView):
     """Vista per i dettagli di un dipendente"""
     model = Dipendente
     template_name = 'dipendenti/vedidipendente.html'
@@ -90,16 +89,13 @@ class DipendenteDetailView(LoginRequiredMixin, UserPassesTestMixin, DetailView):
     def test_func(self):
         """Verifica che l'utente possa visualizzare il dipendente"""
         # L'utente può vedere se stesso o se ha livello contabile o superiore o se è superuser
-        return (self.request.user.pk == self.kwargs.get('pk') or
-                self.request.user.livello in [Dipendente.Autorizzazioni.totale, 
-                                             Dipendente.Autorizzazioni.contabile] or
-                self.request.user.is_superuser)
+        return self.request.user.pk == self.kwargs.get('pk') or self.autorizzazioni.is_contabile
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         
         # Aggiungi gli allegati visibili all'utente
-        if self.request.user.livello in [Dipendente.Autorizzazioni.totale, Dipendente.Autorizzazioni.contabile] or self.request.user.is_superuser:
+        if self.autorizzazioni.is_contabile:
             # Admin, superuser e contabili vedono tutti gli allegati
             context['allegati'] = AllegatoDipendente.objects.filter(dipendente=self.object)
         else:
@@ -222,7 +218,7 @@ class GiornataCreateView(LoginRequiredMixin, CreateView):
     def get_success_url(self):
         return reverse_lazy('dipendenti:profilo', kwargs={'username': self.request.user.username})
 
-class GiornataUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
+class GiornataUpdateView(LoginRequiredMixin, AutorizzazioniMixin, UserPassesTestMixin, UpdateView):
     """Vista per l'aggiornamento di una giornata lavorativa"""
     model = Giornata
     form_class = GiornataForm
@@ -230,10 +226,10 @@ class GiornataUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
     
     def test_func(self):
         """Verifica che l'utente possa modificare la giornata"""
-        giornata = self.get_object()
         # L'utente può modificare la propria giornata non confermata o se è staff o superuser
-        if self.request.user.is_staff or self.request.user.is_superuser:
+        if self.autorizzazioni.is_staff_o_superuser:
             return True
+        giornata = self.get_object()
         return self.request.user == giornata.operatore and not giornata.confermata
     
     def form_valid(self, form):
@@ -270,11 +266,8 @@ class ReportMensileView(LoginRequiredMixin, TotaleLivelloRequiredMixin, FormView
         ).order_by('data')
         
         # Calcola le ore totali
-        ore_totali = timedelta()
-        for giornata in giornate:
-            ore_giornata = giornata.daily_hours()
-            if ore_giornata:
-                ore_totali += ore_giornata
+        minuti_totali = giornate.aggregate(totale=Sum('minuti_lavorati'))['totale']
+        ore_totali = timedelta(minutes=minuti_totali or 0)
         
         # Prepara il contesto per il template
         context = {
@@ -310,6 +303,60 @@ class ReportMensileView(LoginRequiredMixin, TotaleLivelloRequiredMixin, FormView
         # In caso di errore
         return self.form_invalid(form)
 
+class ReportMensileTuttiView(LoginRequiredMixin, TotaleLivelloRequiredMixin, FormView):
+    """
+    Report mensile delle ore di tutti i dipendenti: la generazione parte in
+    background e la pagina ne segue l'avanzamento fino al download dello ZIP
+    """
+    template_name = 'dipendenti/stampamesetutti.html'
+    form_class = MensilitaTuttiForm
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        nome = self.request.GET.get('report')
+        if nome and report_ore.percorso_report(nome):
+            context['report'] = nome
+        return context
+
+    def form_valid(self, form):
+        nome = report_ore.avvia_in_background(form.cleaned_data['data_inizio'], form.cleaned_data['data_fine'])
+        messages.info(self.request, _('Generazione del report avviata'))
+        return redirect(f"{reverse('dipendenti:stampa_mese_tutti')}?report={nome}")
+
+
+class ReportMensileTuttiStatoView(LoginRequiredMixin, TotaleLivelloRequiredMixin, View):
+    """Avanzamento della generazione in JSON, con l'URL di download quando è pronto"""
+
+    def get(self, request, nome):
+        stato = report_ore.stato_report(nome)
+        if stato is None:
+            raise Http404(_("Report non trovato"))
+        if stato['stato'] == 'pronto':
+            stato['url'] = reverse('dipendenti:stampa_mese_tutti_scarica', args=[nome])
+        return JsonResponse(stato)
+
+
+class ReportMensileTuttiScaricaView(LoginRequiredMixin, TotaleLivelloRequiredMixin, View):
+    """Download dell'archivio ZIP generato in background"""
+
+    def get(self, request, nome):
+        stato = report_ore.stato_report(nome)
+        if stato is None or stato['stato'] != 'pronto':
+            raise Http404(_("Report non disponibile"))
+        return FileResponse(
+            default_storage.open(report_ore.percorso_report(nome), 'rb'),
+            as_attachment=True,
+            filename=nome,
+            content_type='application/zip',
+        )
+
+@require_POST
+@login_required
+def heartbeat(request):
+    """Heartbeat delle pagine lasciate aperte (di norma già registrato da PresenzaMiddleware)"""
+    presenza.heartbeat(request.user.pk)
+    return JsonResponse({'online': request.user.pk in presenza.online(presenza.leggi([request.user.pk]))})
+
 def entra(request):
     """Vista per l'accesso al sistema"""
     if request.method == 'POST':
@@ -318,6 +365,7 @@ def entra(request):
         user = authenticate(request, username=username, password=password)
         if user is not None:
             login(request, user)
+            presenza.heartbeat(user.pk)
             nome = user.username
             messages.success(request, _('Buongiorno {0}!').format(nome))
             return redirect('home:index')  # Cambia in base alla tua configurazione
@@ -329,6 +377,7 @@ def esci(request):
     """Vista per il logout dal sistema"""
     if request.user.is_authenticated:
         username = request.user.username
+        presenza.disconnetti(request.user.pk)
         logout(request)
         messages.success(request, f'Arrivederci {username}!')
     return redirect('home:landing_page')
@@ -340,7 +389,7 @@ def profilo(request, username):
     oggi = date.today()
     
     # Verifica che l'utente possa vedere il profilo richiesto
-    if user != request.user and not request.user.is_staff and not request.user.is_superuser:
+    if user != request.user and not da_request(request).is_staff_o_superuser:
         messages.error(request, _("Non hai i permessi per visualizzare questo profilo"))
         return redirect('dipendenti:profilo', username=request.user.username)
     
@@ -354,19 +403,14 @@ def profilo(request, username):
     inizio_settimana = oggi - timedelta(days=oggi.weekday())
     inizio_mese = oggi.replace(day=1)
     
-    ore_settimanali = timedelta()
-    giornate_settimana = Giornata.objects.filter(operatore=user, data__gte=inizio_settimana)
-    for giornata in giornate_settimana:
-        ore = giornata.daily_hours()
-        if ore:
-            ore_settimanali += ore
+    # Settimana dalla colonna minuti_lavorati, mese dal riepilogo mensile
+    minuti_settimana = Giornata.objects.filter(operatore=user, data__gte=inizio_settimana).aggregate(
+        totale=Sum('minuti_lavorati')
+    )['totale']
+    ore_settimanali = timedelta(minutes=minuti_settimana or 0)
     
-    ore_mensili = timedelta()
-    giornate_mese = Giornata.objects.filter(operatore=user, data__gte=inizio_mese)
-    for giornata in giornate_mese:
-        ore = giornata.daily_hours()
-        if ore:
-            ore_mensili += ore
+    riepilogo = RiepilogoMensile.objects.filter(operatore=user, mese=inizio_mese).first()
+    ore_mensili = riepilogo.ore_lavorate if riepilogo else timedelta()
             
     context = {
         'user': user,
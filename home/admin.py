@@ -1,3 +1,11 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import Scadenza
+
+
+@admin.register(Scadenza)
+class ScadenzaAdmin(admin.ModelAdmin):
+    list_display = ['data', 'tipo', 'descrizione', 'destinatario', 'ruolo', 'notificata_il']
+    list_filter = ['tipo', 'ruolo']
+    search_fields = ['descrizione']
+    date_hierarchy = 'data'
@@ -40,7 +40,7 @@ def check_messages(request):
         latest_msg = Messaggio.objects.filter(
             destinatario=user,
             letto=False
-        ).order_by('-data_invio').first()
+        ).select_related('mittente').order_by('-data_invio').first()
         
         if latest_msg:
             latest_message = {
@@ -3,4 +3,9 @@ from django.apps import AppConfig
 class HomeConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'home'
-    verbose_name = 'Dashboard principale'
\ No newline at end of file
+    verbose_name = 'Dashboard principale'
+
+    def ready(self):
+        """Importa i segnali e i system check quando l'app è pronta"""
+        import home.signals
+        import amm.cache
@@ -0,0 +1,270 @@
+# home/benchmark.py
+"""
+Benchmark delle viste più usate sul dataset di generate_dataset.
+
+Ogni Scenario è una richiesta a una URL con nome (dashboard, elenchi con
+filtri, esportazioni, ricerche, ricezione merce), eseguita con il client
+di test di Django come utente del dataset: dopo `riscaldamento` richieste
+a vuoto ne vengono misurate `iterazioni`, con durata e numero di query.
+Le POST girano in una transazione annullata al termine, così il dataset
+resta identico tra un'esecuzione e l'altra e i risultati di commit diversi
+sono confrontabili.
+
+Il risultato è un dizionario serializzabile in JSON: commit, database,
+DEBUG, volumi del dataset e per ogni scenario mediana, p95, minimo e
+massimo in millisecondi e query per richiesta. Gli scenari che non si
+possono misurare (URL inesistente o URLconf che non si importa, nessun
+dato su cui lavorare, vista che solleva un'eccezione) sono riportati con
+l'errore invece di interrompere l'esecuzione.
+
+Uso:
+    risultato = Benchmark(iterazioni=20).esegui()
+    confronta(risultato_precedente, risultato)
+"""
+import math
+import platform
+import subprocess
+import time
+from contextlib import contextmanager
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import NoReverseMatch, reverse
+from django.utils import timezone
+
+from .dataset import UTENTE_BENCHMARK
+from .query_ripetute import RilevatoreQueryRipetute
+
+# Modelli contati nei metadati del risultato (volumi del dataset misurato)
+MODELLI_DATASET = (
+    'dipendenti.Dipendente', 'dipendenti.Giornata', 'home.Messaggio', 'anagrafica.Cliente',
+    'anagrafica.Fornitore', 'ordini.Prodotto', 'ordini.Ordine', 'ordini.Magazzino',
+    'automezzi.Automezzo', 'automezzi.Rifornimento',
+)
+
+
+def percentile(valori, quota):
+    """Percentile `quota` (0-1) con il metodo nearest-rank"""
+    if not valori:
+        return None
+    ordinati = sorted(valori)
+    return ordinati[max(0, math.ceil(quota * len(ordinati)) - 1)]
+
+
+def commit_corrente():
+    """Hash del commit git del progetto, se disponibile"""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True, timeout=5,
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+@contextmanager
+def ambiente_di_test():
+    """
+    Host 'testserver' ammesso e mail in memoria per le richieste del client
+    di test (la ricezione non deve inviare nulla). Se l'ambiente è già
+    preparato, es. dentro i test, lo lascia com'è.
+    """
+    try:
+        setup_test_environment()
+    except RuntimeError:
+        yield
+        return
+    try:
+        yield
+    finally:
+        teardown_test_environment()
+
+
+# ========== SCENARI ==========
+
+class Scenario:
+    """
+    Richiesta da misurare. `prepara`, se indicato, è chiamato una volta
+    prima delle misure e restituisce {'kwargs': ..., 'dati': ...} per la
+    URL e il corpo della POST, o None se nel database non c'è nulla su cui
+    lavorare.
+    """
+
+    def __init__(self, nome, url, parametri=None, metodo='GET', prepara=None):
+        self.nome = nome
+        self.url = url
+        self.parametri = parametri or {}
+        self.metodo = metodo
+        self.prepara = prepara
+
+
+def dati_ricezione(ordine, numero_lotto):
+    """Corpo della POST di ricezione di `ordine`: tutta la quantità ordinata in un lotto"""
+    return {
+        'data_ricezione': timezone.localdate().isoformat(),
+        'note': '',
+        'prodotti_ricevuti-TOTAL_FORMS': '1',
+        'prodotti_ricevuti-INITIAL_FORMS': '0',
+        'prodotti_ricevuti-MIN_NUM_FORMS': '0',
+        'prodotti_ricevuti-MAX_NUM_FORMS': '1000',
+        'prodotti_ricevuti-0-quantita_ricevuta': str(ordine.quantita_ordinata),
+        'prodotti_ricevuti-0-numero_lotto': numero_lotto,
+        'prodotti_ricevuti-0-data_scadenza': '',
+        'prodotti_ricevuti-0-note': '',
+    }
+
+
+def _ricezione():
+    from ordini.models import Ordine
+
+    ordine = Ordine.objects.da_ricevere().filter(ricezione__isnull=True).order_by('pk').first()
+    if ordine is None:
+        return None
+    return {'kwargs': {'ordine_id': ordine.pk}, 'dati': dati_ricezione(ordine, 'BENCHMARK')}
+
+
+SCENARI = [
+    Scenario('home.dashboard', 'home:index'),
+    Scenario('home.messaggi_non_letti', 'home:api_check_messages'),
+    Scenario('home.ricerca', 'home:global_search', {'q': 'Rossi'}),
+    Scenario('home.scadenzario', 'home:scadenzario', {'giorni': 60}),
+    Scenario('dipendenti.elenco', 'dipendenti:elencodipendenti'),
+    Scenario('anagrafica.dashboard', 'anagrafica:dashboard'),
+    Scenario('anagrafica.clienti', 'anagrafica:elenco_clienti', {'search': 'Bar'}),
+    Scenario('anagrafica.fornitori', 'anagrafica:elenco_fornitori', {'search': 'Distribuzione'}),
+    Scenario('anagrafica.ricerca', 'anagrafica:api_search', {'q': 'Pizzeria'}),
+    Scenario('anagrafica.export_clienti', 'anagrafica:export_anagrafica', {'tipo': 'clienti'}),
+    Scenario('automezzi.dashboard', 'automezzi:dashboard'),
+    Scenario('automezzi.elenco', 'automezzi:automezzo_list', {'stato': 'attivi', 'ordina': '-km'}),
+    Scenario('automezzi.rifornimenti', 'automezzi:rifornimento_list'),
+    Scenario('ordini.dashboard', 'ordini:dashboard'),
+    Scenario('ordini.elenco', 'ordini:lista_ordini', {'status': 'inviato'}),
+    Scenario('ordini.da_ricevere', 'ordini:lista_ordini_da_ricevere'),
+    Scenario('ordini.prodotti_scorte_basse', 'ordini:lista_prodotti', {'scorte_basse': 'true'}),
+    Scenario('ordini.magazzino', 'ordini:visualizza_magazzino'),
+    Scenario('ordini.ricezione', 'ordini:ricevi_ordine', metodo='POST', prepara=_ricezione),
+]
+
+
+# ========== ESECUZIONE ==========
+
+class Benchmark:
+    """Misura gli `scenari` (tutti se None, oppure i nomi indicati) come `utente`"""
+
+    def __init__(self, scenari=None, iterazioni=10, riscaldamento=2, utente=UTENTE_BENCHMARK):
+        self.scenari = [s for s in SCENARI if scenari is None or s.nome in scenari]
+        self.iterazioni = iterazioni
+        self.riscaldamento = riscaldamento
+        self.utente = utente
+
+    def esegui(self):
+        try:
+            utente = get_user_model().objects.get(username=self.utente)
+        except get_user_model().DoesNotExist:
+            raise ValueError(f'Utente "{self.utente}" non trovato: generare prima il dataset (generate_dataset)')
+
+        with ambiente_di_test():
+            client = Client()
+            client.force_login(utente)
+            risultati = [self._misura(client, scenario) for scenario in self.scenari]
+
+        return {
+            'commit': commit_corrente(),
+            'data': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'debug': settings.DEBUG,
+            'iterazioni': self.iterazioni,
+            'riscaldamento': self.riscaldamento,
+            'dataset': self._volumi(),
+            'scenari': risultati,
+        }
+
+    def _volumi(self):
+        from django.apps import apps
+
+        return {label: apps.get_model(label).objects.count() for label in MODELLI_DATASET}
+
+    def _misura(self, client, scenario):
+        voce = {'nome': scenario.nome, 'metodo': scenario.metodo}
+        try:
+            preparazione = scenario.prepara() if scenario.prepara else {}
+        except Exception as e:
+            return {**voce, 'errore': f'preparazione non riuscita: {e!r}'}
+        if preparazione is None:
+            return {**voce, 'errore': 'nessun dato su cui eseguire lo scenario'}
+        try:
+            url = reverse(scenario.url, kwargs=preparazione.get('kwargs'))
+        except NoReverseMatch:
+            return {**voce, 'errore': f'URL {scenario.url} non disponibile'}
+        except Exception as e:
+            # Un URLconf che non si importa (es. una vista mancante) fa fallire ogni reverse
+            return {**voce, 'errore': f'URL {scenario.url} non risolvibile: {e!r}'}
+        voce['url'] = url
+
+        durate = []
+        query = []
+        stati = set()
+        try:
+            for _ in range(self.riscaldamento):
+                self._richiesta(client, scenario, url, preparazione.get('dati'))
+            for _ in range(self.iterazioni):
+                stato, durata, numero_query = self._richiesta(client, scenario, url, preparazione.get('dati'))
+                stati.add(stato)
+                durate.append(durata * 1000)
+                query.append(numero_query)
+        except Exception as e:
+            return {**voce, 'errore': f'richiesta non riuscita: {e!r}'}
+
+        return {
+            **voce,
+            'stato': sorted(stati),
+            'query': max(query) if query else None,
+            'mediana_ms': round(percentile(durate, 0.5), 2) if durate else None,
+            'p95_ms': round(percentile(durate, 0.95), 2) if durate else None,
+            'min_ms': round(min(durate), 2) if durate else None,
+            'max_ms': round(max(durate), 2) if durate else None,
+        }
+
+    def _richiesta(self, client, scenario, url, dati):
+        with RilevatoreQueryRipetute() as rilevatore:
+            inizio = time.perf_counter()
+            if scenario.metodo == 'POST':
+                # Scrittura annullata: il dataset resta lo stesso per le iterazioni successive
+                with transaction.atomic():
+                    response = client.post(url, dati or {})
+                    transaction.set_rollback(True)
+            else:
+                response = client.get(url, scenario.parametri)
+            if response.streaming:
+                # Le esportazioni in streaming costano quando il contenuto viene consumato
+                b''.join(response.streaming_content)
+            durata = time.perf_counter() - inizio
+        return response.status_code, durata, rilevatore.totale
+
+
+def confronta(prima, dopo):
+    """
+    Righe di confronto per scenario tra due risultati: mediane, variazione
+    percentuale e query, dal peggioramento maggiore.
+    """
+    precedenti = {voce['nome']: voce for voce in prima['scenari'] if 'mediana_ms' in voce}
+    righe = []
+    for voce in dopo['scenari']:
+        base = precedenti.get(voce['nome'])
+        if base is None or 'mediana_ms' not in voce or not base['mediana_ms']:
+            continue
+        righe.append({
+            'nome': voce['nome'],
+            'prima_ms': base['mediana_ms'],
+            'dopo_ms': voce['mediana_ms'],
+            'variazione': round((voce['mediana_ms'] - base['mediana_ms']) / base['mediana_ms'] * 100, 1),
+            'query_prima': base['query'],
+            'query_dopo': voce['query'],
+        })
+    return sorted(righe, key=lambda riga: riga['variazione'], reverse=True)
@@ -0,0 +1,496 @@
+# home/dataset.py
+"""
+Dataset sintetico a volumi di produzione, per misurare l'applicazione.
+
+GeneratoreDataset crea dipendenti con le giornate lavorate, messaggi,
+rappresentanti, clienti, fornitori, categorie e prodotti, ordini con
+ricezioni, prodotti ricevuti e lotti di magazzino, automezzi con
+rifornimenti e manutenzioni. La generazione è deterministica: stesso
+seme, stessi volumi e stessa data di riferimento producono le stesse righe.
+
+Le righe sono scritte con bulk_create a blocchi di `batch`, senza save()
+né segnali; al termine vengono ricalcolati i valori che i save() e i
+segnali manterrebbero: minuti lavorati e riepiloghi mensili, aggregati
+degli automezzi, scadenzario, conteggi dei messaggi non letti in cache.
+
+Le righe generate sono riconoscibili (username 'ds_', targhe, numeri
+d'ordine e lotti 'DS', codici prodotto 'DS-', nota MARCATORE) e svuota()
+le elimina prima di una nuova generazione.
+
+Uso:
+    GeneratoreDataset(volumi={'ordini': 1000}, seme=42).esegui().creati
+"""
+import logging
+import random
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from anagrafica.models import Cliente, Fornitore, Rappresentante
+from automezzi.models import Automezzo, Manutenzione, Rifornimento, TipoCarburante
+from dipendenti.models import Dipendente, Giornata
+from ordini.models import Categoria, Magazzino, Ordine, Prodotto, ProdottoRicevuto, Ricezione
+
+from .models import Messaggio
+
+logger = logging.getLogger(__name__)
+
+MARCATORE = 'Dataset sintetico (generate_dataset)'
+UTENTE_BENCHMARK = 'ds_admin'
+
+# Volumi predefiniti, moltiplicati da `scala`; 'giorni' sono le giornate per dipendente
+VOLUMI = {
+    'dipendenti': 60,
+    'giorni': 220,
+    'messaggi': 50000,
+    'fornitori': 300,
+    'clienti': 3000,
+    'categorie': 25,
+    'prodotti': 5000,
+    'ordini': 40000,
+    'automezzi': 40,
+    'rifornimenti': 8000,
+    'manutenzioni': 600,
+}
+# Quota dei livelli tra i dipendenti generati (il resto sono operatori)
+LIVELLI = (
+    (Dipendente.Autorizzazioni.contabile, 0.10),
+    (Dipendente.Autorizzazioni.operativo, 0.20),
+    (Dipendente.Autorizzazioni.rappresentante, 0.15),
+)
+
+NOMI = ('Marco', 'Giulia', 'Luca', 'Francesca', 'Andrea', 'Sara', 'Paolo', 'Chiara', 'Matteo', 'Elena',
+        'Davide', 'Laura', 'Simone', 'Anna', 'Stefano', 'Valentina', 'Alessandro', 'Martina')
+COGNOMI = ('Rossi', 'Bianchi', 'Verdi', 'Russo', 'Ferrari', 'Esposito', 'Romano', 'Colombo', 'Ricci',
+           'Marino', 'Greco', 'Bruno', 'Gallo', 'Conti', 'De Luca', 'Costa', 'Giordano', 'Mancini')
+CITTA = (('Milano', '20100'), ('Torino', '10100'), ('Bergamo', '24100'), ('Brescia', '25100'),
+         ('Monza', '20900'), ('Como', '22100'), ('Varese', '21100'), ('Pavia', '27100'))
+ATTIVITA = ('Bar', 'Ristorante', 'Pizzeria', 'Trattoria', 'Enoteca', 'Pub', 'Caffè', 'Hotel', 'Osteria')
+CATEGORIE = ('Acque', 'Bibite', 'Birre', 'Vini rossi', 'Vini bianchi', 'Spumanti', 'Liquori', 'Distillati',
+             'Succhi', 'Caffè', 'Sciroppi', 'Snack', 'Surgelati', 'Latticini', 'Salumi', 'Pasta')
+PRODOTTI = ('Acqua naturale', 'Acqua frizzante', 'Aranciata', 'Cola', 'Birra chiara', 'Birra rossa',
+            'Prosecco', 'Chianti', 'Vermentino', 'Amaro', 'Grappa', 'Gin', 'Succo di pesca',
+            'Caffè in grani', 'Sciroppo di menta', 'Patatine', 'Mozzarella', 'Prosciutto crudo')
+FORMATI = ('33cl', '50cl', '75cl', '1L', '1,5L', '6x1L', '24x33cl', '1kg', '500g')
+MARCHE_AUTOMEZZI = (('Fiat', 'Ducato'), ('Iveco', 'Daily'), ('Ford', 'Transit'), ('Renault', 'Master'),
+                    ('Mercedes', 'Sprinter'), ('Volkswagen', 'Crafter'))
+INTERVENTI = ('Tagliando', 'Cambio gomme', 'Freni', 'Frizione', 'Carrozzeria', 'Batteria', 'Revisione')
+FRASI = ('Passa in magazzino quando puoi', 'Consegna completata', 'Il cliente chiede uno sconto',
+         'Ordine in ritardo dal fornitore', 'Ricordati il DDT', 'Ci vediamo alle 14', 'Furgone in officina')
+
+
+@contextmanager
+def date_esplicite(modello, *campi):
+    """Disattiva auto_now/auto_now_add dei campi: bulk_create scrive le date generate"""
+    campi = [modello._meta.get_field(nome) for nome in campi]
+    originali = [(campo.auto_now, campo.auto_now_add) for campo in campi]
+    for campo in campi:
+        campo.auto_now = campo.auto_now_add = False
+    try:
+        yield
+    finally:
+        for campo, (auto_now, auto_now_add) in zip(campi, originali):
+            campo.auto_now, campo.auto_now_add = auto_now, auto_now_add
+
+
+def svuota():
+    """Elimina le righe di una generazione precedente. Restituisce le righe eliminate per modello."""
+    eliminati = {}
+    with transaction.atomic():
+        for queryset in (
+            # Prima gli ordini, anche quelli creati dopo sui prodotti del dataset (es. simula_turno):
+            # proteggono prodotti e fornitori (ricezioni e prodotti ricevuti in cascata)
+            Ordine.objects.filter(Q(numero_ordine__startswith='DS') | Q(prodotto__codice_interno__startswith='DS-')),
+            Magazzino.objects.filter(numero_lotto__startswith='DS'),
+            Prodotto.objects.filter(codice_interno__startswith='DS-'),
+            Categoria.objects.filter(descrizione=MARCATORE),
+            Cliente.objects.filter(note=MARCATORE),
+            Fornitore.objects.filter(note=MARCATORE),
+            Automezzo.objects.filter(targa__startswith='DS'),
+            # Giornate, messaggi e rappresentanti in cascata
+            Dipendente.objects.filter(username__startswith='ds_'),
+        ):
+            _, per_modello = queryset.delete()
+            for modello, righe in per_modello.items():
+                eliminati[modello] = eliminati.get(modello, 0) + righe
+    return eliminati
+
+
+class GeneratoreDataset:
+    """
+    Genera il dataset con i `volumi` indicati (gli altri da VOLUMI per
+    `scala`). `oggi` è la data di riferimento di tutte le date generate.
+    """
+
+    def __init__(self, volumi=None, scala=1.0, seme=42, batch=1000, oggi=None, password='dataset'):
+        self.volumi = {
+            nome: valore if nome == 'giorni' else max(1, round(valore * scala))
+            for nome, valore in VOLUMI.items()
+        }
+        self.volumi.update(volumi or {})
+        self.seme = seme
+        self.batch = batch
+        self.oggi = oggi or timezone.localdate()
+        self.password = password
+        self.casuale = random.Random(seme)
+        self.creati = {}
+
+    def esegui(self):
+        with transaction.atomic():
+            self._dipendenti()
+            self._giornate()
+            self._messaggi()
+            self._anagrafica()
+            self._prodotti()
+            self._ordini()
+            self._automezzi()
+        self._ricalcola_derivati()
+        logger.info(f'Dataset generato (seme {self.seme}): {self.creati}')
+        return self
+
+    # ========== SUPPORTO ==========
+
+    def _inserisci(self, modello, oggetti):
+        """bulk_create a blocchi; restituisce gli oggetti con la chiave primaria"""
+        oggetti = modello.objects.bulk_create(oggetti, batch_size=self.batch)
+        nome = modello._meta.label
+        self.creati[nome] = self.creati.get(nome, 0) + len(oggetti)
+        return oggetti
+
+    def _giorno(self, giorni_indietro_max, giorni_indietro_min=0):
+        return self.oggi - timedelta(days=self.casuale.randint(giorni_indietro_min, giorni_indietro_max))
+
+    def _momento(self, giorno):
+        ora = time(self.casuale.randint(7, 19), self.casuale.randint(0, 59))
+        return timezone.make_aware(datetime.combine(giorno, ora))
+
+    def _telefono(self):
+        return f'02{self.casuale.randint(1000000, 9999999)}'
+
+    def _partita_iva(self):
+        return f'{self.casuale.randint(0, 10 ** 11 - 1):011d}'
+
+    def _nome_persona(self):
+        return self.casuale.choice(NOMI), self.casuale.choice(COGNOMI)
+
+    # ========== DIPENDENTI ==========
+
+    def _dipendenti(self):
+        # Un solo hash per tutti: PBKDF2 per riga renderebbe la generazione lentissima
+        password = make_password(self.password)
+        dipendenti = [Dipendente(
+            username=UTENTE_BENCHMARK, first_name='Admin', last_name='Dataset', email='admin@dataset.test',
+            livello=Dipendente.Autorizzazioni.totale, is_staff=True, is_superuser=True, password=password,
+        )]
+        for numero in range(1, self.volumi['dipendenti']):
+            livello = Dipendente.Autorizzazioni.operatore
+            soglia = self.casuale.random()
+            for candidato, quota in LIVELLI:
+                if soglia < quota:
+                    livello = candidato
+                    break
+                soglia -= quota
+            nome, cognome = self._nome_persona()
+            dipendenti.append(Dipendente(
+                username=f'ds_{numero:05d}', first_name=nome, last_name=cognome,
+                email=f'ds_{numero:05d}@dataset.test', livello=livello, password=password,
+                telefono=self._telefono(),
+                data_assunzione=self._giorno(3000, 30),
+                data_scadenza_ci=self._giorno(30, -900),
+                data_scadenza_patente=self._giorno(30, -1500),
+            ))
+        self.dipendenti = self._inserisci(Dipendente, dipendenti)
+        self.per_livello = {}
+        for dipendente in self.dipendenti:
+            self.per_livello.setdefault(dipendente.livello, []).append(dipendente)
+
+        # Gruppi come Dipendente._assign_groups, che bulk_create non chiama
+        gruppi = {
+            livello: Group.objects.get_or_create(name=livello.capitalize())[0]
+            for livello in self.per_livello
+        }
+        GruppoDipendente = Dipendente.groups.through
+        self._inserisci(GruppoDipendente, [
+            GruppoDipendente(dipendente_id=dipendente.pk, group_id=gruppi[dipendente.livello].pk)
+            for dipendente in self.dipendenti
+        ])
+
+    def _giornate(self):
+        giorni = []
+        giorno = self.oggi - timedelta(days=1)
+        while len(giorni) < self.volumi['giorni']:
+            if giorno.weekday() < 5:
+                giorni.append(giorno)
+            giorno -= timedelta(days=1)
+
+        operatori = [d for d in self.dipendenti if d.livello != Dipendente.Autorizzazioni.rappresentante]
+        giornate = []
+        for operatore in operatori:
+            for giorno in giorni:
+                giornata = Giornata(
+                    operatore=operatore, data=giorno, chiudi_giornata=True,
+                    confermata=(self.oggi - giorno).days > 7,
+                )
+                if self.casuale.random() < 0.05:
+                    giornata.assenza = self.casuale.choice(['ferie', 'malattia', 'permesso'])
+                else:
+                    giornata.ora_inizio_mattina = time(8, self.casuale.choice([0, 0, 15, 30]))
+                    giornata.ora_fine_mattina = time(12, self.casuale.choice([0, 30]))
+                    giornata.ora_inizio_pomeriggio = time(13, self.casuale.choice([30, 45]))
+                    giornata.ora_fine_pomeriggio = time(self.casuale.choice([17, 17, 18]), self.casuale.choice([0, 30]))
+                giornate.append(giornata)
+        with date_esplicite(Giornata, 'data'):
+            self._inserisci(Giornata, giornate)
+        self.operatori_giornate = [operatore.pk for operatore in operatori]
+
+    def _messaggi(self):
+        admin = self.dipendenti[0]
+        messaggi = []
+        for _ in range(self.volumi['messaggi']):
+            mittente, destinatario = self.casuale.sample(self.dipendenti, 2)
+            # Una quota all'utente del benchmark: dashboard e chat con dati realistici
+            if self.casuale.random() < 0.05 and mittente is not admin:
+                destinatario = admin
+            giorno = self._giorno(180)
+            inviato = self._momento(giorno)
+            # Estrazione sempre eseguita e confronto con `oggi`: la sequenza non dipende dall'ora di esecuzione
+            letto = self.casuale.random() < 0.9 and (self.oggi - giorno).days > 2
+            messaggi.append(Messaggio(
+                mittente=mittente, destinatario=destinatario, testo=self.casuale.choice(FRASI),
+                data_invio=inviato, letto=letto,
+                data_lettura=inviato + timedelta(hours=self.casuale.randint(1, 48)) if letto else None,
+            ))
+        with date_esplicite(Messaggio, 'data_invio'):
+            self._inserisci(Messaggio, messaggi)
+
+    # ========== ANAGRAFICA ==========
+
+    def _anagrafica(self):
+        rappresentanti = self._inserisci(Rappresentante, [
+            Rappresentante(
+                dipendente=dipendente, nome=dipendente.first_name, cognome=dipendente.last_name,
+                email=dipendente.email, telefono=dipendente.telefono, partita_iva=self._partita_iva(),
+                percentuale_provvigione=Decimal(self.casuale.choice(['3.00', '5.00', '7.50'])),
+                zona_competenza=self.casuale.choice(CITTA)[0],
+            )
+            for dipendente in self.per_livello.get(Dipendente.Autorizzazioni.rappresentante, [])
+        ])
+
+        clienti = []
+        for numero in range(self.volumi['clienti']):
+            citta, cap = self.casuale.choice(CITTA)
+            clienti.append(Cliente(
+                nome=f'{self.casuale.choice(ATTIVITA)} {self.casuale.choice(COGNOMI)} {numero}',
+                citta=citta, cap=cap, indirizzo=f'Via Roma {self.casuale.randint(1, 200)}',
+                telefono=self._telefono(), email=f'cliente{numero}@dataset.test',
+                partita_iva=self._partita_iva(),
+                rappresentante=self.casuale.choice(rappresentanti) if rappresentanti and self.casuale.random() < 0.8 else None,
+                attivo=self.casuale.random() < 0.95, note=MARCATORE,
+            ))
+        self._inserisci(Cliente, clienti)
+
+        fornitori = []
+        categorie = [valore for valore, _ in Fornitore.CATEGORIA_CHOICES]
+        for numero in range(self.volumi['fornitori']):
+            citta, cap = self.casuale.choice(CITTA)
+            fornitori.append(Fornitore(
+                nome=f'{self.casuale.choice(COGNOMI)} Distribuzione {numero}',
+                citta=citta, cap=cap, telefono=self._telefono(), email=f'fornitore{numero}@dataset.test',
+                partita_iva=self._partita_iva(), categoria=self.casuale.choice(categorie),
+                attivo=self.casuale.random() < 0.95, note=MARCATORE,
+            ))
+        self.fornitori = self._inserisci(Fornitore, fornitori)
+
+    # ========== PRODOTTI E ORDINI ==========
+
+    def _prodotti(self):
+        categorie = []
+        for numero in range(self.volumi['categorie']):
+            nome = CATEGORIE[numero % len(CATEGORIE)]
+            giro = numero // len(CATEGORIE)
+            categorie.append(Categoria(
+                nome_categoria=f'{nome} (DS{f" {giro}" if giro else ""})',
+                descrizione=MARCATORE, ordinamento=numero,
+            ))
+        categorie = self._inserisci(Categoria, categorie)
+
+        prodotti = []
+        for numero in range(self.volumi['prodotti']):
+            minima = self.casuale.randint(5, 100)
+            prodotti.append(Prodotto(
+                categoria=self.casuale.choice(categorie),
+                nome_prodotto=f'{self.casuale.choice(PRODOTTI)} {self.casuale.choice(FORMATI)} {numero}',
+                # Prefisso 2: codici a uso interno, non assegnati a produttori
+                ean=f'29{numero:011d}', codice_interno=f'DS-{numero:06d}',
+                misura=self.casuale.choice(Prodotto.Misura.values),
+                aliquota_iva=self.casuale.choice(Prodotto.AliquotaIva.values),
+                scorta_minima=minima, scorta_massima=minima * 10,
+                attivo=self.casuale.random() < 0.97,
+            ))
+        self.prodotti = self._inserisci(Prodotto, prodotti)
+
+    def _ordini(self):
+        acquirenti = [
+            d for d in self.dipendenti
+            if d.livello in (Dipendente.Autorizzazioni.totale, Dipendente.Autorizzazioni.contabile,
+                             Dipendente.Autorizzazioni.operativo)
+        ]
+        magazzinieri = self.per_livello.get(Dipendente.Autorizzazioni.operatore, acquirenti)
+        totale = self.volumi['ordini']
+        for inizio in range(0, totale, self.batch):
+            ordini = [self._ordine(numero, acquirenti) for numero in range(inizio, min(inizio + self.batch, totale))]
+            with date_esplicite(Ordine, 'data_creazione_ordine'):
+                ordini = self._inserisci(Ordine, ordini)
+
+            ricevuti = [ordine for ordine in ordini if ordine.data_ricezione_ordine]
+            ricezioni = self._inserisci(Ricezione, [
+                Ricezione(
+                    ordine=ordine, data_ricezione=ordine.data_ricezione_ordine,
+                    ricevuto_da=self.casuale.choice(magazzinieri),
+                )
+                for ordine in ricevuti
+            ])
+            prodotti_ricevuti = []
+            lotti = []
+            for ordine, ricezione in zip(ricevuti, ricezioni):
+                quantita = ordine.quantita_ordinata
+                if self.casuale.random() < 0.05:
+                    quantita = max(1, quantita - self.casuale.randint(1, quantita))
+                scadenza = None
+                if self.casuale.random() < 0.7:
+                    scadenza = ricezione.data_ricezione + timedelta(days=self.casuale.randint(60, 720))
+                lotto = ordine.numero_ordine
+                prodotti_ricevuti.append(ProdottoRicevuto(
+                    ricezione=ricezione, prodotto=ordine.prodotto, quantita_ricevuta=quantita,
+                    data_scadenza=scadenza, numero_lotto=lotto,
+                ))
+                # I lotti vecchi sono in gran parte già usciti dal magazzino
+                giacenza = quantita
+                if (self.oggi - ricezione.data_ricezione).days > 120 and self.casuale.random() < 0.8:
+                    giacenza = 0
+                elif self.casuale.random() < 0.5:
+                    giacenza = self.casuale.randint(0, quantita)
+                lotti.append(Magazzino(
+                    prodotto=ordine.prodotto, quantita_in_magazzino=giacenza, data_scadenza=scadenza,
+                    numero_lotto=lotto, data_ingresso=ricezione.data_ricezione,
+                    costo_unitario=ordine.prezzo_unitario_ordine,
+                    settore=self.casuale.choice('ABCD'), scaffale=str(self.casuale.randint(1, 30)),
+                    piano=str(self.casuale.randint(1, 5)),
+                ))
+            self._inserisci(ProdottoRicevuto, prodotti_ricevuti)
+            self._inserisci(Magazzino, lotti)
+
+    def _ordine(self, numero, acquirenti):
+        prodotto = self.casuale.choice(self.prodotti)
+        giorno = self._giorno(365)
+        eta = (self.oggi - giorno).days
+        ordine = Ordine(
+            prodotto=prodotto, fornitore=self.casuale.choice(self.fornitori),
+            numero_ordine=f'DS{numero:08d}', misura=prodotto.misura,
+            quantita_ordinata=self.casuale.randint(1, 200),
+            prezzo_unitario_ordine=Decimal(self.casuale.randint(50, 8000)) / 100,
+            sconto_percentuale=Decimal(self.casuale.choice([0, 0, 0, 5, 10])),
+            data_creazione_ordine=self._momento(giorno),
+            creato_da=self.casuale.choice(acquirenti),
+        )
+        if ordine.misura == Ordine.Misura.CONFEZIONE:
+            ordine.pezzi_per_confezione = Decimal(self.casuale.choice([6, 12, 24]))
+
+        # Stato coerente con l'età: i vecchi quasi tutti ricevuti, i recenti ancora in corso
+        if eta > 30:
+            stati = [Ordine.StatusOrdine.COMPLETATO] * 6 + [Ordine.StatusOrdine.RICEVUTO] * 3 + [Ordine.StatusOrdine.ANNULLATO]
+        else:
+            stati = [
+                Ordine.StatusOrdine.BOZZA, Ordine.StatusOrdine.INVIATO, Ordine.StatusOrdine.CONFERMATO,
+                Ordine.StatusOrdine.SPEDITO, Ordine.StatusOrdine.IN_TRANSITO, Ordine.StatusOrdine.RICEVUTO,
+            ]
+        ordine.status = self.casuale.choice(stati)
+        if ordine.status != Ordine.StatusOrdine.BOZZA:
+            ordine.data_invio_ordine = giorno + timedelta(days=self.casuale.randint(0, 2))
+            ordine.data_arrivo_previsto = ordine.data_invio_ordine + timedelta(days=self.casuale.randint(3, 15))
+        if ordine.status in (Ordine.StatusOrdine.RICEVUTO, Ordine.StatusOrdine.COMPLETATO):
+            arrivo = ordine.data_arrivo_previsto + timedelta(days=self.casuale.randint(-2, 4))
+            ordine.data_ricezione_ordine = min(arrivo, self.oggi)
+
+        # Totali come Ordine.save(), che bulk_create non chiama
+        prezzo_scontato = ordine.prezzo_unitario_ordine * (1 - ordine.sconto_percentuale / 100)
+        ordine.prezzo_totale_ordine = (prezzo_scontato * (ordine.pezzi_per_confezione or 1) * ordine.quantita_ordinata).quantize(Decimal('0.01'))
+        ordine.totale_ordine_ivato = (ordine.prezzo_totale_ordine * (1 + prodotto.get_aliquota_iva_numerica())).quantize(Decimal('0.01'))
+        return ordine
+
+    # ========== AUTOMEZZI ==========
+
+    def _automezzi(self):
+        carburanti = [
+            TipoCarburante.objects.get_or_create(nome=nome, defaults={'costo_per_litro': Decimal(prezzo)})[0]
+            for nome, prezzo in (('Gasolio', '1.750'), ('Benzina', '1.850'))
+        ]
+        conducenti = self.per_livello.get(Dipendente.Autorizzazioni.operatore, self.dipendenti)
+        numero_automezzi = self.volumi['automezzi']
+
+        # Rifornimenti per automezzo, in ordine di data con chilometri crescenti
+        date_rifornimenti = {numero: [] for numero in range(numero_automezzi)}
+        for _ in range(self.volumi['rifornimenti']):
+            date_rifornimenti[self.casuale.randrange(numero_automezzi)].append(self._giorno(365))
+        automezzi = []
+        piano = []
+        for numero in range(numero_automezzi):
+            marca, modello = self.casuale.choice(MARCHE_AUTOMEZZI)
+            percorsi = self.casuale.randint(20000, 200000)
+            tappe = []
+            for giorno in sorted(date_rifornimenti[numero]):
+                percorsi += self.casuale.randint(300, 900)
+                tappe.append((giorno, percorsi))
+            piano.append(tappe)
+            automezzi.append(Automezzo(
+                targa=f'DS{numero:05d}X', marca=marca, modello=modello,
+                anno_immatricolazione=self.oggi.year - self.casuale.randint(0, 12),
+                chilometri_attuali=percorsi, data_revisione=self._giorno(700),
+                assegnato_a=self.casuale.choice(conducenti), tipo_carburante=self.casuale.choice(carburanti),
+                bloccata=self.casuale.random() < 0.05,
+            ))
+        automezzi = self._inserisci(Automezzo, automezzi)
+
+        rifornimenti = []
+        for automezzo, tappe in zip(automezzi, piano):
+            for giorno, percorsi in tappe:
+                litri = Decimal(self.casuale.randint(2000, 7000)) / 100
+                rifornimenti.append(Rifornimento(
+                    automezzo=automezzo, data=giorno, chilometri=percorsi, litri=litri,
+                    costo_totale=(litri * automezzo.tipo_carburante.costo_per_litro).quantize(Decimal('0.01')),
+                ))
+        self._inserisci(Rifornimento, rifornimenti)
+
+        manutenzioni = []
+        for _ in range(self.volumi['manutenzioni']):
+            giorno = self._giorno(365, -60)
+            manutenzioni.append(Manutenzione(
+                automezzo=self.casuale.choice(automezzi), data=giorno,
+                descrizione=self.casuale.choice(INTERVENTI), costo=Decimal(self.casuale.randint(50, 2500)),
+                completata=giorno < self.oggi, responsabile=self.casuale.choice(self.dipendenti),
+            ))
+        self._inserisci(Manutenzione, manutenzioni)
+        self.automezzi = [automezzo.pk for automezzo in automezzi]
+
+    # ========== VALORI DERIVATI ==========
+
+    def _ricalcola_derivati(self):
+        from automezzi import aggregati
+        from automezzi.statistiche import CalcoloStatistiche
+        from dipendenti import riepiloghi
+
+        from .scadenzario import ricostruisci
+
+        riepiloghi.ricalcola(self.operatori_giornate)
+        aggregati.ricalcola(self.automezzi)
+        CalcoloStatistiche(automezzi=Automezzo.objects.filter(pk__in=self.automezzi), force=True, oggi=self.oggi).esegui()
+        # Solo le sorgenti dello scadenzario alimentate dal dataset
+        ricostruisci(['revisione', 'patente', 'carta_identita'] + (['lotto'] if self.volumi['ordini'] else []))
+        for dipendente in self.dipendenti:
+            Messaggio.invalida_non_letti(dipendente.pk)
@@ -0,0 +1,123 @@
+# home/elaborazioni.py
+"""
+Report generati in background, con lo stato condiviso tra i processi.
+
+Lo stato (in corso con l'avanzamento, pronto, errore) è una riga di
+Elaborazione nel database: qualunque processo server risponde al polling
+e al download con lo stesso dato. La generazione non gira nel processo
+web ma in un comando di gestione avviato in un processo separato
+(avvia): sopravvive al riciclo del worker e può usare a sua volta un
+pool di processi. La riga conserva PID e avvio del processo figlio.
+
+Il file va salvato nello storage prima di chiamare completa(): il
+download controlla lo stato e non serve mai un file ancora in scrittura.
+Un'elaborazione in corso che non si aggiorna da TIMEOUT secondi (processo
+morto prima di segnare l'errore, riavvio della macchina) risulta in
+errore: i comandi chiamano avanzamento() mentre il lavoro procede.
+pulisci(), dal comando pulisci_elaborazioni, elimina le elaborazioni più
+vecchie di CONSERVAZIONE con i loro file.
+
+Uso:
+    avvia(nome, percorso, 'report_ore_mensile', '--elaborazione', nome, ...)
+    # nel comando: avanzamento(nome, 3, 10), poi completa(nome) o fallita(nome)
+    stato(nome)   # {'stato', 'completati', 'totale'} o None
+"""
+import logging
+import subprocess
+import sys
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from .models import Elaborazione
+
+logger = logging.getLogger(__name__)
+
+# Secondi minimi tra due aggiornamenti dell'avanzamento nel database
+INTERVALLO_AVANZAMENTO = 1
+# Secondi senza aggiornamenti dopo i quali un'elaborazione in corso è considerata fallita
+TIMEOUT = getattr(settings, 'ELABORAZIONI_TIMEOUT', 15 * 60)
+# Giorni dopo i quali elaborazioni e file sono eliminati da pulisci()
+CONSERVAZIONE = getattr(settings, 'ELABORAZIONI_CONSERVAZIONE', 7)
+
+_ultimo_avanzamento = {}
+
+
+def crea(nome, percorso=''):
+    return Elaborazione.objects.create(nome=nome, percorso=percorso)
+
+
+def avvia(nome, percorso, *argomenti):
+    """
+    Registra l'elaborazione ed esegue `manage.py <argomenti>` in un processo
+    separato, staccato dal server; PID e avvio restano nella riga
+    """
+    crea(nome, percorso)
+    try:
+        processo = subprocess.Popen(
+            [sys.executable, str(settings.BASE_DIR / 'manage.py'), *map(str, argomenti)],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+    except OSError:
+        logger.exception(f'Avvio elaborazione {nome} non riuscito')
+        fallita(nome)
+        raise
+    _aggiorna(nome, pid=processo.pid, avviata_il=timezone.now())
+    return processo
+
+
+def _aggiorna(nome, **campi):
+    Elaborazione.objects.filter(nome=nome).update(aggiornata_il=timezone.now(), **campi)
+
+
+def avanzamento(nome, completati, totale):
+    """Aggiorna l'avanzamento al più una volta ogni INTERVALLO_AVANZAMENTO secondi, sempre all'inizio e alla fine"""
+    adesso = time.monotonic()
+    if 0 < completati < totale and adesso - _ultimo_avanzamento.get(nome, 0) < INTERVALLO_AVANZAMENTO:
+        return
+    _ultimo_avanzamento[nome] = adesso
+    _aggiorna(nome, completati=completati, totale=totale)
+
+
+def completa(nome, **campi):
+    """Da chiamare solo dopo il salvataggio del file nello storage"""
+    _ultimo_avanzamento.pop(nome, None)
+    _aggiorna(nome, stato=Elaborazione.Stato.PRONTO, **campi)
+
+
+def fallita(nome):
+    _ultimo_avanzamento.pop(nome, None)
+    _aggiorna(nome, stato=Elaborazione.Stato.ERRORE)
+
+
+def stato(nome, adesso=None):
+    """
+    {'stato', 'completati', 'totale'} dell'elaborazione, None se non esiste;
+    'errore' se è in corso ma non si aggiorna da TIMEOUT secondi
+    """
+    voce = Elaborazione.objects.filter(nome=nome).values('stato', 'completati', 'totale', 'aggiornata_il').first()
+    if voce is None:
+        return None
+    aggiornata_il = voce.pop('aggiornata_il')
+    limite = (adesso or timezone.now()) - timedelta(seconds=TIMEOUT)
+    if voce['stato'] == Elaborazione.Stato.IN_CORSO and aggiornata_il < limite:
+        voce['stato'] = Elaborazione.Stato.ERRORE
+    return voce
+
+
+def pulisci(giorni=CONSERVAZIONE, adesso=None):
+    """Elimina le elaborazioni create da più di `giorni` giorni e i loro file; restituisce quante"""
+    vecchie = Elaborazione.objects.filter(creata_il__lt=(adesso or timezone.now()) - timedelta(days=giorni))
+    eliminate = 0
+    for pk, percorso in vecchie.values_list('pk', 'percorso').iterator():
+        if percorso:
+            # Un'elaborazione fallita può non avere il file
+            default_storage.delete(percorso)
+        Elaborazione.objects.filter(pk=pk).delete()
+        eliminate += 1
+    return eliminate
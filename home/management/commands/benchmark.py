@@ -0,0 +1,101 @@
+# home/management/commands/benchmark.py
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from home.benchmark import SCENARI, Benchmark, confronta
+from home.dataset import UTENTE_BENCHMARK
+
+
+class Command(BaseCommand):
+    help = 'Misura le viste più usate sul dataset di generate_dataset e scrive i risultati in JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterazioni',
+            type=int,
+            default=10,
+            help='Richieste misurate per scenario (default: %(default)s)'
+        )
+        parser.add_argument(
+            '--riscaldamento',
+            type=int,
+            default=2,
+            help='Richieste a vuoto prima delle misure (default: %(default)s)'
+        )
+        parser.add_argument(
+            '--scenario',
+            action='append',
+            dest='scenari',
+            choices=[scenario.nome for scenario in SCENARI],
+            help='Esegue solo lo scenario indicato (ripetibile)'
+        )
+        parser.add_argument(
+            '--utente',
+            default=UTENTE_BENCHMARK,
+            help='Username con cui eseguire le richieste (default: %(default)s)'
+        )
+        parser.add_argument(
+            '--output',
+            help='File JSON dei risultati (default: stampati a video)'
+        )
+        parser.add_argument(
+            '--confronta',
+            help='File JSON di un\'esecuzione precedente da confrontare'
+        )
+        parser.add_argument(
+            '--soglia',
+            type=float,
+            help='Con --confronta: termina con errore se una mediana peggiora oltre questa percentuale'
+        )
+
+    def handle(self, *args, **options):
+        if settings.DEBUG:
+            self.stderr.write(self.style.WARNING(
+                '⚠ DEBUG attivo: debug toolbar e log delle query falsano i tempi, confrontare solo esecuzioni omogenee'
+            ))
+
+        precedente = None
+        if options['confronta']:
+            try:
+                with open(options['confronta']) as file:
+                    precedente = json.load(file)
+            except (OSError, ValueError) as e:
+                raise CommandError(f'Impossibile leggere {options["confronta"]}: {e}')
+
+        try:
+            risultato = Benchmark(
+                scenari=options['scenari'], iterazioni=options['iterazioni'],
+                riscaldamento=options['riscaldamento'], utente=options['utente'],
+            ).esegui()
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        testo = json.dumps(risultato, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(testo + '\n')
+            self.stdout.write(self.style.SUCCESS(f'✅ Risultati salvati in {options["output"]}'))
+        else:
+            self.stdout.write(testo)
+
+        for voce in risultato['scenari']:
+            if 'errore' in voce:
+                self.stderr.write(self.style.WARNING(f'⚠ {voce["nome"]}: {voce["errore"]}'))
+
+        if precedente is None:
+            return
+        righe = confronta(precedente, risultato)
+        self.stderr.write(f'\nConfronto con {precedente.get("commit") or options["confronta"]}:')
+        for riga in righe:
+            self.stderr.write(
+                f'  {riga["nome"]:<32} {riga["prima_ms"]:>9.1f} → {riga["dopo_ms"]:>9.1f} ms '
+                f'({riga["variazione"]:+.1f}%)  query {riga["query_prima"]} → {riga["query_dopo"]}'
+            )
+        peggiorati = [riga for riga in righe if options['soglia'] is not None and riga['variazione'] > options['soglia']]
+        if peggiorati:
+            raise CommandError(
+                f'{len(peggiorati)} scenari peggiorati oltre il {options["soglia"]}%: '
+                + ', '.join(riga['nome'] for riga in peggiorati)
+            )
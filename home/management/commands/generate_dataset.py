@@ -0,0 +1,84 @@
+# home/management/commands/generate_dataset.py
+import time
+from datetime import date
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+
+from home.dataset import UTENTE_BENCHMARK, VOLUMI, GeneratoreDataset, svuota
+
+
+class Command(BaseCommand):
+    help = 'Genera un dataset sintetico a volumi di produzione, deterministico dal seme (per benchmark)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--seme',
+            type=int,
+            default=42,
+            help='Seme del generatore casuale (default: %(default)s)'
+        )
+        parser.add_argument(
+            '--scala',
+            type=float,
+            default=1.0,
+            help='Moltiplicatore dei volumi predefiniti (default: %(default)s)'
+        )
+        for nome, valore in VOLUMI.items():
+            parser.add_argument(
+                f'--{nome}',
+                type=int,
+                help=f'Numero di {nome} (default: {valore} per la scala)'
+            )
+        parser.add_argument(
+            '--oggi',
+            type=date.fromisoformat,
+            help='Data di riferimento AAAA-MM-GG: con lo stesso seme rigenera esattamente le stesse righe'
+        )
+        parser.add_argument(
+            '--batch',
+            type=int,
+            default=1000,
+            help='Righe per bulk_create (default: %(default)s)'
+        )
+        parser.add_argument(
+            '--password',
+            default='dataset',
+            help='Password di tutti gli utenti generati (default: %(default)s)'
+        )
+        parser.add_argument(
+            '--svuota',
+            action='store_true',
+            help='Elimina prima le righe di una generazione precedente'
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Consente la generazione anche con DEBUG=False'
+        )
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG and not options['force']:
+            raise CommandError('Dataset sintetico su un ambiente non di sviluppo: usare --force per confermare')
+
+        if options['svuota']:
+            eliminati = svuota()
+            self.stdout.write(f'🗑  Righe eliminate: {sum(eliminati.values())}')
+
+        volumi = {nome: options[nome] for nome in VOLUMI if options[nome] is not None}
+        inizio = time.monotonic()
+        try:
+            generatore = GeneratoreDataset(
+                volumi=volumi, scala=options['scala'], seme=options['seme'], batch=options['batch'],
+                oggi=options['oggi'], password=options['password'],
+            ).esegui()
+        except IntegrityError as e:
+            raise CommandError(f'Righe già presenti ({e}): rigenerare con --svuota')
+
+        for modello, righe in generatore.creati.items():
+            self.stdout.write(f'  {modello}: {righe}')
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ Dataset generato in {time.monotonic() - inizio:.1f}s (seme {options["seme"]}, '
+            f'utente per i benchmark: {UTENTE_BENCHMARK})'
+        ))
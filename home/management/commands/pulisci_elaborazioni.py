@@ -0,0 +1,22 @@
+# home/management/commands/pulisci_elaborazioni.py
+from django.core.management.base import BaseCommand, CommandError
+
+from home.elaborazioni import CONSERVAZIONE, pulisci
+
+
+class Command(BaseCommand):
+    help = 'Elimina i report generati in background più vecchi dei giorni indicati, con i loro file'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--giorni',
+            type=int,
+            default=CONSERVAZIONE,
+            help='Giorni di conservazione delle elaborazioni (default: %(default)s)'
+        )
+
+    def handle(self, *args, **options):
+        if options['giorni'] < 0:
+            raise CommandError('--giorni non può essere negativo')
+        eliminate = pulisci(options['giorni'])
+        self.stdout.write(self.style.SUCCESS(f'✅ Elaborazioni eliminate: {eliminate}'))
@@ -0,0 +1,66 @@
+# home/management/commands/scadenzario.py
+from django.core.management.base import BaseCommand, CommandError
+
+from home.models import Scadenza
+from home.scadenzario import GIORNI_PREAVVISO, DigestScadenze, ricostruisci
+
+
+class Command(BaseCommand):
+    help = 'Scadenzario unico: ricostruzione della tabella e digest giornaliero via mail'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--ricostruisci',
+            action='store_true',
+            help='Ricalcola tutte le scadenze dai modelli di origine (dopo importazioni massive)'
+        )
+        parser.add_argument(
+            '--tipo',
+            action='append',
+            choices=Scadenza.Tipo.values,
+            help='Ricostruisce solo il tipo di scadenza indicato (ripetibile)'
+        )
+        parser.add_argument(
+            '--digest',
+            action='store_true',
+            help='Invia a ogni utente una mail con le scadenze non ancora notificate'
+        )
+        parser.add_argument(
+            '--giorni',
+            type=int,
+            default=GIORNI_PREAVVISO,
+            help='Giorni di preavviso del digest (default: %(default)s)'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Mostra le mail del digest senza inviarle'
+        )
+
+    def handle(self, *args, **options):
+        if not options['ricostruisci'] and not options['digest']:
+            raise CommandError('Specificare --ricostruisci e/o --digest')
+
+        if options['ricostruisci']:
+            totale = ricostruisci(options['tipo'])
+            self.stdout.write(self.style.SUCCESS(f'📅 Scadenzario ricostruito: {totale} scadenze'))
+
+        if options['digest']:
+            digest = DigestScadenze(giorni=options['giorni'], dry_run=options['dry_run']).esegui()
+            if options['dry_run']:
+                for oggetto, testo, _, destinatari in digest.messaggi:
+                    self.stdout.write(f'✉ {", ".join(destinatari)}: {oggetto}')
+                    if options['verbosity'] >= 2:
+                        self.stdout.write(testo + '\n')
+                self.stdout.write(self.style.WARNING(
+                    f'🔍 [DRY-RUN] {digest.scadenze} scadenze, {len(digest.messaggi)} mail non inviate'
+                ))
+            else:
+                self.stdout.write(self.style.SUCCESS(
+                    f'✉ Digest: {digest.notificate} scadenze notificate, {digest.inviate} mail inviate'
+                ))
+                if digest.notificate < digest.scadenze:
+                    self.stdout.write(self.style.WARNING(
+                        f'⚠ {digest.scadenze - digest.notificate} scadenze non notificate per errori di invio, '
+                        'saranno riproposte al prossimo digest'
+                    ))
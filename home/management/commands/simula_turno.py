@@ -0,0 +1,114 @@
+# home/management/commands/simula_turno.py
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from home.dataset import UTENTE_BENCHMARK
+from home.simulazione_turno import MIX, SimulazioneTurno
+
+
+class Command(BaseCommand):
+    help = 'Simula un turno di magazzino con operatori concorrenti e riporta throughput, latenze, errori e lock'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--operatori',
+            type=int,
+            default=8,
+            help='Operatori in parallelo (default: %(default)s)'
+        )
+        parser.add_argument(
+            '--durata',
+            type=float,
+            default=30,
+            help='Durata del turno in secondi (default: %(default)s)'
+        )
+        parser.add_argument(
+            '--processi',
+            action='store_true',
+            help='Un processo per operatore invece dei thread (richiede fork)'
+        )
+        parser.add_argument(
+            '--url',
+            help='Server già avviato sullo stesso database, es. http://127.0.0.1:8000 (default: client di test)'
+        )
+        parser.add_argument(
+            '--peso',
+            action='append',
+            default=[],
+            metavar='OPERAZIONE=PESO',
+            help=f'Cambia il peso di un\'operazione del mix, 0 per escluderla (ripetibile). Default: '
+                 + ', '.join(f'{nome}={peso}' for nome, peso in MIX.items())
+        )
+        parser.add_argument(
+            '--pausa',
+            type=float,
+            default=0,
+            help='Secondi massimi di pausa casuale tra due operazioni di un operatore (default: %(default)s)'
+        )
+        parser.add_argument(
+            '--lotti-contesi',
+            type=int,
+            default=5,
+            help='Lotti di magazzino su cui si concentrano i movimenti (default: %(default)s)'
+        )
+        parser.add_argument(
+            '--seme',
+            type=int,
+            default=42,
+            help='Seme delle scelte degli operatori (default: %(default)s)'
+        )
+        parser.add_argument(
+            '--utente',
+            default=UTENTE_BENCHMARK,
+            help='Username con cui eseguire le richieste (default: %(default)s)'
+        )
+        parser.add_argument(
+            '--output',
+            help='File JSON dei risultati (default: stampati a video)'
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Consente la simulazione anche con DEBUG=False (le operazioni scrivono sul database)'
+        )
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG and not options['force']:
+            raise CommandError('La simulazione scrive ordini, ricezioni e movimenti: usare --force per confermare')
+
+        mix = dict(MIX)
+        for voce in options['peso']:
+            nome, _, peso = voce.partition('=')
+            if nome not in MIX or not peso.isdigit():
+                raise CommandError(f'Peso non valido "{voce}": operazioni {", ".join(MIX)}')
+            mix[nome] = int(peso)
+
+        try:
+            risultato = SimulazioneTurno(
+                operatori=options['operatori'], durata=options['durata'], mix=mix, utente=options['utente'],
+                processi=options['processi'], url=options['url'], pausa=options['pausa'],
+                lotti_contesi=options['lotti_contesi'], seme=options['seme'],
+            ).esegui()
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        testo = json.dumps(risultato, indent=2, ensure_ascii=False, default=str)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(testo + '\n')
+            self.stdout.write(self.style.SUCCESS(f'✅ Risultati salvati in {options["output"]}'))
+        else:
+            self.stdout.write(testo)
+
+        for operazione, urls in risultato['operazioni_escluse'].items():
+            self.stderr.write(self.style.WARNING(f'⚠ {operazione}: URL non disponibili {", ".join(urls)}'))
+        self.stderr.write(
+            f'\n{risultato["richieste"]} richieste in {risultato["durata_s"]}s '
+            f'({risultato["throughput_rps"]} req/s), p95 {risultato["latenza"].get("p95_ms")} ms, '
+            f'errori {risultato["tasso_errori"] or 0:.2%}, errori di lock {risultato["lock"]["errori"]}'
+        )
+        fallite = [verifica['nome'] for verifica in risultato['verifiche'] if not verifica['esito']]
+        if fallite:
+            raise CommandError(f'Verifiche di coerenza fallite: {", ".join(fallite)}')
@@ -0,0 +1,294 @@
+# home/metriche.py
+"""
+Metriche delle richieste per vista, esposte in formato Prometheus su /metrics.
+
+MetricheMiddleware misura ogni richiesta e la etichetta con il nome della
+URL risolta (es. 'ordini:dashboard', 'home:api_check_messages'):
+- durata totale della richiesta;
+- numero di query e tempo passato nel database (execute_wrapper sulle
+  connessioni, nessun SQL conservato);
+- tempo di rendering dei template (solo il template più esterno, gli
+  include sono già compresi);
+- richieste per metodo e codice di stato.
+I valori finiscono in istogrammi in memoria, protetti da un lock per i
+worker a thread.
+
+Con più processi (gunicorn) ogni worker salva periodicamente i propri
+istogrammi in un file JSON nella cartella METRICHE_DIR, con scrittura
+atomica; la vista `metriche` somma i file di tutti i worker. I file dei
+worker terminati restano, così i contatori non tornano indietro: la
+cartella va svuotata all'avvio del master, ad esempio nel gunicorn.conf.py:
+
+    def on_starting(server):
+        from home.metriche import azzera
+        azzera()
+
+L'endpoint è accessibile allo staff autenticato o, per lo scraper, con
+l'header `Authorization: Bearer <METRICHE_TOKEN>`.
+"""
+import contextvars
+import hmac
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+
+from dipendenti.autorizzazioni import da_request
+
+logger = logging.getLogger(__name__)
+
+PREFISSO = 'amm'
+# Secondi tra due salvataggi su file dello stesso processo
+INTERVALLO_SALVATAGGIO = 5
+BUCKET_SECONDI = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BUCKET_QUERY = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+ISTOGRAMMI = {
+    'richiesta_durata_secondi': ('Durata totale della richiesta', BUCKET_SECONDI),
+    'richiesta_db_secondi': ('Tempo passato nelle query', BUCKET_SECONDI),
+    'richiesta_template_secondi': ('Tempo di rendering dei template', BUCKET_SECONDI),
+    'richiesta_query': ('Query eseguite per richiesta', BUCKET_QUERY),
+}
+VISTA_NON_RISOLTA = 'non_risolta'
+
+
+def cartella():
+    return getattr(settings, 'METRICHE_DIR', os.path.join(tempfile.gettempdir(), 'amm-metriche'))
+
+
+class Registro:
+    """Istogrammi e contatori del processo corrente"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._azzera()
+
+    def _azzera(self):
+        self.pid = os.getpid()
+        # Il pid può essere riusato dopo il riavvio di un worker: il file ha anche un identificativo unico
+        self.file = f'{self.pid}-{uuid.uuid4().hex[:8]}.json'
+        self.istogrammi = {}
+        self.contatori = {}
+        self.salvato = time.monotonic()
+        self.modificato = False
+
+    def registra(self, vista, metodo, stato, valori):
+        """`valori`: {nome istogramma: osservazione}"""
+        with self._lock:
+            if self.pid != os.getpid():
+                # Processo nato da fork (gunicorn --preload): non eredita le misure del master
+                self._azzera()
+            for nome, valore in valori.items():
+                bucket = ISTOGRAMMI[nome][1]
+                voce = self.istogrammi.setdefault((nome, vista), [[0] * len(bucket), 0.0, 0])
+                for i, limite in enumerate(bucket):
+                    if valore <= limite:
+                        voce[0][i] += 1
+                        break
+                voce[1] += valore
+                voce[2] += 1
+            chiave = (vista, metodo, stato)
+            self.contatori[chiave] = self.contatori.get(chiave, 0) + 1
+            self.modificato = True
+
+    def stato(self):
+        with self._lock:
+            return {
+                'istogrammi': [[*chiave, list(voce[0]), voce[1], voce[2]] for chiave, voce in self.istogrammi.items()],
+                'contatori': [[*chiave, valore] for chiave, valore in self.contatori.items()],
+            }
+
+    def salva(self, forza=False):
+        """Scrive lo stato nel file del processo, al massimo ogni INTERVALLO_SALVATAGGIO"""
+        if not self.modificato or (not forza and time.monotonic() - self.salvato < INTERVALLO_SALVATAGGIO):
+            return
+        self.salvato = time.monotonic()
+        self.modificato = False
+        destinazione = cartella()
+        try:
+            os.makedirs(destinazione, exist_ok=True)
+            fd, temporaneo = tempfile.mkstemp(dir=destinazione, suffix='.tmp')
+            with os.fdopen(fd, 'w') as file:
+                json.dump(self.stato(), file)
+            os.replace(temporaneo, os.path.join(destinazione, self.file))
+        except OSError:
+            logger.exception('Salvataggio metriche non riuscito')
+
+
+registro = Registro()
+
+
+def azzera():
+    """Elimina i file dei worker (da chiamare all'avvio del server)"""
+    destinazione = cartella()
+    if not os.path.isdir(destinazione):
+        return
+    for nome in os.listdir(destinazione):
+        if nome.endswith('.json') or nome.endswith('.tmp'):
+            os.remove(os.path.join(destinazione, nome))
+
+
+def aggrega():
+    """Somma gli stati salvati da tutti i processi"""
+    registro.salva(forza=True)
+    istogrammi = {}
+    contatori = {}
+    destinazione = cartella()
+    nomi = os.listdir(destinazione) if os.path.isdir(destinazione) else []
+    for nome in nomi:
+        if not nome.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(destinazione, nome)) as file:
+                stato = json.load(file)
+        except (OSError, ValueError):
+            # File di un worker appena terminato o illeggibile: ignorato
+            continue
+        for metrica, vista, bucket, somma, conteggio in stato['istogrammi']:
+            voce = istogrammi.setdefault((metrica, vista), [[0] * len(bucket), 0.0, 0])
+            voce[0] = [a + b for a, b in zip(voce[0], bucket)]
+            voce[1] += somma
+            voce[2] += conteggio
+        for vista, metodo, stato_http, valore in stato['contatori']:
+            chiave = (vista, metodo, stato_http)
+            contatori[chiave] = contatori.get(chiave, 0) + valore
+    return istogrammi, contatori
+
+
+def _etichette(**valori):
+    def escape(valore):
+        return str(valore).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return ','.join(f'{nome}="{escape(valore)}"' for nome, valore in valori.items())
+
+
+def formato_prometheus(istogrammi, contatori):
+    righe = []
+    for nome, (descrizione, bucket) in ISTOGRAMMI.items():
+        metrica = f'{PREFISSO}_{nome}'
+        righe += [f'# HELP {metrica} {descrizione}', f'# TYPE {metrica} histogram']
+        for (nome_voce, vista), (conteggi, somma, conteggio) in sorted(istogrammi.items()):
+            if nome_voce != nome:
+                continue
+            cumulato = 0
+            for limite, valore in zip(bucket, conteggi):
+                cumulato += valore
+                righe.append(f'{metrica}_bucket{{{_etichette(vista=vista, le=limite)}}} {cumulato}')
+            righe.append(f'{metrica}_bucket{{{_etichette(vista=vista, le="+Inf")}}} {conteggio}')
+            righe.append(f'{metrica}_sum{{{_etichette(vista=vista)}}} {somma}')
+            righe.append(f'{metrica}_count{{{_etichette(vista=vista)}}} {conteggio}')
+
+    metrica = f'{PREFISSO}_richieste_totale'
+    righe += [f'# HELP {metrica} Richieste servite', f'# TYPE {metrica} counter']
+    for (vista, metodo, stato), valore in sorted(contatori.items()):
+        righe.append(f'{metrica}{{{_etichette(vista=vista, metodo=metodo, stato=stato)}}} {valore}')
+    return '\n'.join(righe) + '\n'
+
+
+# ========== MISURE DELLA RICHIESTA ==========
+
+_misura = contextvars.ContextVar('metriche_misura', default=None)
+
+
+class _Misura:
+    __slots__ = ('query', 'db', 'template', 'profondita_template')
+
+    def __init__(self):
+        self.query = 0
+        self.db = 0.0
+        self.template = 0.0
+        self.profondita_template = 0
+
+
+def _wrapper_query(execute, sql, params, many, context):
+    misura = _misura.get()
+    if misura is None:
+        return execute(sql, params, many, context)
+    inizio = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        misura.db += time.perf_counter() - inizio
+        misura.query += 1
+
+
+def _installa_misura_template():
+    """Avvolge Template.render per misurare il tempo del template più esterno"""
+    from django.template.base import Template
+
+    if getattr(Template.render, '_metriche', False):
+        return
+    render_originale = Template.render
+
+    def render(self, context):
+        misura = _misura.get()
+        if misura is None:
+            return render_originale(self, context)
+        misura.profondita_template += 1
+        inizio = time.perf_counter()
+        try:
+            return render_originale(self, context)
+        finally:
+            misura.profondita_template -= 1
+            if not misura.profondita_template:
+                misura.template += time.perf_counter() - inizio
+
+    render._metriche = True
+    Template.render = render
+
+
+class MetricheMiddleware:
+    """Registra durata, query, tempo DB e template di ogni richiesta, per vista"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        _installa_misura_template()
+
+    def __call__(self, request):
+        misura = _Misura()
+        token = _misura.set(misura)
+        inizio = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connessione in connections.all():
+                    stack.enter_context(connessione.execute_wrapper(_wrapper_query))
+                response = self.get_response(request)
+        finally:
+            _misura.reset(token)
+        durata = time.perf_counter() - inizio
+
+        corrispondenza = getattr(request, 'resolver_match', None)
+        vista = (corrispondenza.view_name if corrispondenza else None) or VISTA_NON_RISOLTA
+        registro.registra(vista, request.method, response.status_code, {
+            'richiesta_durata_secondi': durata,
+            'richiesta_db_secondi': misura.db,
+            'richiesta_template_secondi': misura.template,
+            'richiesta_query': misura.query,
+        })
+        registro.salva()
+        return response
+
+
+def _autorizzato(request):
+    token = getattr(settings, 'METRICHE_TOKEN', '')
+    intestazione = request.headers.get('Authorization', '')
+    if token and intestazione.startswith('Bearer '):
+        return hmac.compare_digest(intestazione[len('Bearer '):].encode(), token.encode())
+    return da_request(request).is_staff_o_superuser
+
+
+def metriche(request):
+    """Metriche di tutti i worker in formato testo Prometheus"""
+    if not _autorizzato(request):
+        return HttpResponseForbidden('Accesso alle metriche non consentito')
+    return HttpResponse(
+        formato_prometheus(*aggrega()),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('home', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Scadenza',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('tipo', models.CharField(choices=[('revisione', 'Revisione automezzo'), ('patente', 'Scadenza patente'), ('carta_identita', 'Scadenza carta identità'), ('lotto', 'Scadenza lotto magazzino'), ('promemoria', 'Promemoria')], max_length=20, verbose_name='Tipo')),
+                ('data', models.DateField(verbose_name='Data scadenza')),
+                ('descrizione', models.CharField(max_length=255, verbose_name='Descrizione')),
+                ('ruolo', models.CharField(blank=True, max_length=30, verbose_name='Livello destinatario')),
+                ('notificata_il', models.DateTimeField(blank=True, null=True, verbose_name='Notificata il')),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype')),
+                ('destinatario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='scadenze', to=settings.AUTH_USER_MODEL, verbose_name='Destinatario')),
+            ],
+            options={
+                'verbose_name': 'Scadenza',
+                'verbose_name_plural': 'Scadenzario',
+                'ordering': ['data', 'pk'],
+                'indexes': [models.Index(fields=['data'], name='scadenza_data_idx'), models.Index(fields=['ruolo', 'data'], name='scadenza_ruolo_data_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='scadenza',
+            constraint=models.UniqueConstraint(fields=('content_type', 'object_id', 'tipo'), name='scadenza_unica_per_oggetto'),
+        ),
+    ]
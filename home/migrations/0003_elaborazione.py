@@ -0,0 +1,28 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0002_scadenza'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Elaborazione',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nome', models.CharField(max_length=100, unique=True, verbose_name='Nome file')),
+                ('stato', models.CharField(choices=[('in_corso', 'In corso'), ('pronto', 'Pronto'), ('errore', 'Errore')], default='in_corso', max_length=10, verbose_name='Stato')),
+                ('completati', models.PositiveIntegerField(default=0, verbose_name='Elementi completati')),
+                ('totale', models.PositiveIntegerField(default=0, verbose_name='Elementi totali')),
+                ('creata_il', models.DateTimeField(auto_now_add=True, verbose_name='Creata il')),
+                ('aggiornata_il', models.DateTimeField(auto_now=True, verbose_name='Aggiornata il')),
+            ],
+            options={
+                'verbose_name': 'Elaborazione in background',
+                'verbose_name_plural': 'Elaborazioni in background',
+                'ordering': ['-creata_il'],
+            },
+        ),
+    ]
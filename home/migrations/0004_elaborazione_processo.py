@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0003_elaborazione'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='elaborazione',
+            name='percorso',
+            field=models.CharField(blank=True, max_length=255, verbose_name='Percorso nello storage'),
+        ),
+        migrations.AddField(
+            model_name='elaborazione',
+            name='pid',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='PID del processo'),
+        ),
+        migrations.AddField(
+            model_name='elaborazione',
+            name='avviata_il',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Processo avviato il'),
+        ),
+    ]
@@ -1,8 +1,12 @@
 from django.db import models
 from django.conf import settings
+from django.contrib.contenttypes.fields import GenericForeignKey
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 import os
+from datetime import timedelta
 
 User = settings.AUTH_USER_MODEL
 
@@ -55,6 +59,26 @@ class Messaggio(models.Model):
     def __str__(self):
         return f"Da {self.mittente} a {self.destinatario} - {self.data_invio}"
     
+    # Conteggio dei non letti in cache per destinatario, invalidato dai
+    # segnali su Messaggio (vedi home/signals.py)
+    NON_LETTI_CACHE_KEY = 'home:messaggi_non_letti:{}'
+    NON_LETTI_CACHE_TIMEOUT = 300
+
+    @classmethod
+    def conta_non_letti(cls, user):
+        """Restituisce il numero di messaggi non letti dell'utente"""
+        key = cls.NON_LETTI_CACHE_KEY.format(user.pk)
+        count = cache.get(key)
+        if count is None:
+            count = cls.objects.filter(destinatario=user, letto=False).count()
+            cache.set(key, count, cls.NON_LETTI_CACHE_TIMEOUT)
+        return count
+
+    @classmethod
+    def invalida_non_letti(cls, user_id):
+        """Invalida il conteggio in cache dei non letti dell'utente"""
+        cache.delete(cls.NON_LETTI_CACHE_KEY.format(user_id))
+
     def marca_come_letto(self):
         """Marca il messaggio come letto se non lo è già"""
         if not self.letto:
@@ -141,4 +165,99 @@ class Promemoria(models.Model):
         """Verifica se il promemoria è scaduto"""
         if self.data_scadenza and not self.completato:
             return self.data_scadenza < timezone.localdate()
-        return False
\ No newline at end of file
+        return False
+
+class ScadenzaQuerySet(models.QuerySet):
+    def entro(self, giorni, oggi=None):
+        """Scadenze fino a oggi + `giorni`, comprese quelle già passate"""
+        oggi = oggi or timezone.localdate()
+        return self.filter(data__lte=oggi + timedelta(days=giorni))
+
+    def per_utente(self, user):
+        """Scadenze visibili all'utente: assegnate a lui o al suo livello (tutte per 'totale')"""
+        if user.is_superuser or getattr(user, 'livello', None) == 'totale':
+            return self
+        return self.filter(models.Q(destinatario=user) | models.Q(ruolo=getattr(user, 'livello', '')))
+
+
+class Scadenza(models.Model):
+    """
+    Scadenzario unico: una riga per ogni scadenza di automezzi, dipendenti,
+    lotti di magazzino e promemoria, mantenuta dai segnali dei modelli di
+    origine (vedi home/scadenzario.py)
+    """
+    class Tipo(models.TextChoices):
+        REVISIONE = 'revisione', _('Revisione automezzo')
+        PATENTE = 'patente', _('Scadenza patente')
+        CARTA_IDENTITA = 'carta_identita', _('Scadenza carta identità')
+        LOTTO = 'lotto', _('Scadenza lotto magazzino')
+        PROMEMORIA = 'promemoria', _('Promemoria')
+
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveBigIntegerField()
+    oggetto = GenericForeignKey('content_type', 'object_id')
+    tipo = models.CharField(_('Tipo'), max_length=20, choices=Tipo.choices)
+    data = models.DateField(_('Data scadenza'))
+    descrizione = models.CharField(_('Descrizione'), max_length=255)
+    destinatario = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='scadenze',
+        verbose_name=_('Destinatario')
+    )
+    ruolo = models.CharField(_('Livello destinatario'), max_length=30, blank=True)
+    notificata_il = models.DateTimeField(_('Notificata il'), null=True, blank=True)
+
+    objects = ScadenzaQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = _('Scadenza')
+        verbose_name_plural = _('Scadenzario')
+        ordering = ['data', 'pk']
+        constraints = [
+            models.UniqueConstraint(fields=['content_type', 'object_id', 'tipo'], name='scadenza_unica_per_oggetto'),
+        ]
+        indexes = [
+            models.Index(fields=['data'], name='scadenza_data_idx'),
+            models.Index(fields=['ruolo', 'data'], name='scadenza_ruolo_data_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.descrizione} - {self.data:%d/%m/%Y}"
+
+    @property
+    def is_scaduta(self):
+        return self.data < timezone.localdate()
+
+
+class Elaborazione(models.Model):
+    """
+    Stato di un report generato in background (vedi home/elaborazioni.py):
+    nel database perché lo leggano tutti i processi server, non solo quello
+    che ha avviato la generazione
+    """
+
+    class Stato(models.TextChoices):
+        IN_CORSO = 'in_corso', _('In corso')
+        PRONTO = 'pronto', _('Pronto')
+        ERRORE = 'errore', _('Errore')
+
+    nome = models.CharField(_('Nome file'), max_length=100, unique=True)
+    percorso = models.CharField(_('Percorso nello storage'), max_length=255, blank=True)
+    stato = models.CharField(_('Stato'), max_length=10, choices=Stato.choices, default=Stato.IN_CORSO)
+    completati = models.PositiveIntegerField(_('Elementi completati'), default=0)
+    totale = models.PositiveIntegerField(_('Elementi totali'), default=0)
+    pid = models.PositiveIntegerField(_('PID del processo'), null=True, blank=True)
+    avviata_il = models.DateTimeField(_('Processo avviato il'), null=True, blank=True)
+    creata_il = models.DateTimeField(_('Creata il'), auto_now_add=True)
+    aggiornata_il = models.DateTimeField(_('Aggiornata il'), auto_now=True)
+
+    class Meta:
+        verbose_name = _('Elaborazione in background')
+        verbose_name_plural = _('Elaborazioni in background')
+        ordering = ['-creata_il']
+
+    def __str__(self):
+        return f"{self.nome} ({self.get_stato_display()})"
@@ -0,0 +1,254 @@
+# home/profilatore.py
+"""
+Profilazione a campione delle richieste lente.
+
+ProfilatoreMiddleware profila con cProfile una frazione delle richieste
+(PROFILATORE_CAMPIONAMENTO, 0-1) e per quelle registra anche il log SQL
+(testo della query con i segnaposto, senza parametri, e durata). Se la
+richiesta supera PROFILATORE_SOGLIA secondi profilo e SQL sono salvati in
+PROFILATORE_DIR; le richieste non campionate non pagano nulla.
+
+La cartella è un buffer circolare: oltre PROFILATORE_MASSIMO profili i più
+vecchi vengono eliminati. Ogni profilo è una coppia di file con lo stesso
+identificativo: <id>.prof (dump di pstats) e <id>.json (vista, durata, SQL).
+
+Lo staff li consulta da /home/profili/ e li scarica come .prof (pstats,
+snakeviz) o in formato speedscope. Il formato speedscope è ricostruito dal
+grafo delle chiamate di cProfile, che non conserva gli stack completi: i
+tempi dei rami sono ripartiti in proporzione tra i chiamanti.
+"""
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import tempfile
+import time
+import uuid
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# Query conservate per profilo (le successive sono solo contate)
+MASSIMO_QUERY = 1000
+# Limiti della ricostruzione degli stack per speedscope
+PROFONDITA_MASSIMA = 100
+PESO_MINIMO = 1e-6
+
+
+def campionamento():
+    return getattr(settings, 'PROFILATORE_CAMPIONAMENTO', 0.0)
+
+
+def soglia():
+    return getattr(settings, 'PROFILATORE_SOGLIA', 2.0)
+
+
+def cartella():
+    return getattr(settings, 'PROFILATORE_DIR', os.path.join(tempfile.gettempdir(), 'amm-profili'))
+
+
+def massimo():
+    return getattr(settings, 'PROFILATORE_MASSIMO', 50)
+
+
+def percorso(identificativo, estensione):
+    """Path di un file del profilo, se l'identificativo è valido"""
+    if not re.fullmatch(r'\d{13}-[0-9a-f]{8}', identificativo or ''):
+        return None
+    return os.path.join(cartella(), f'{identificativo}.{estensione}')
+
+
+# ========== BUFFER SU DISCO ==========
+
+def salva(profilo, dati):
+    """Scrive profilo e metadati, poi elimina i profili oltre il massimo. Restituisce l'identificativo."""
+    identificativo = f'{int(time.time() * 1000):013d}-{uuid.uuid4().hex[:8]}'
+    os.makedirs(cartella(), exist_ok=True)
+    profilo.dump_stats(percorso(identificativo, 'prof'))
+    # Il .json è scritto per ultimo e in modo atomico: il profilo è visibile solo se completo
+    fd, temporaneo = tempfile.mkstemp(dir=cartella(), suffix='.tmp')
+    with os.fdopen(fd, 'w') as file:
+        json.dump({**dati, 'id': identificativo}, file)
+    os.replace(temporaneo, percorso(identificativo, 'json'))
+    _sfoltisci()
+    return identificativo
+
+
+def _sfoltisci():
+    for identificativo in [voce['id'] for voce in elenco()][massimo():]:
+        for estensione in ('json', 'prof'):
+            try:
+                os.remove(percorso(identificativo, estensione))
+            except FileNotFoundError:
+                # Già eliminato da un altro processo
+                pass
+
+
+def elenco():
+    """Metadati dei profili salvati, dal più recente"""
+    if not os.path.isdir(cartella()):
+        return []
+    profili = []
+    for nome in sorted(os.listdir(cartella()), reverse=True):
+        if nome.endswith('.json'):
+            dati = leggi(nome[:-len('.json')])
+            if dati is not None:
+                profili.append(dati)
+    return profili
+
+
+def leggi(identificativo):
+    """Metadati di un profilo o None"""
+    file = percorso(identificativo, 'json')
+    try:
+        with open(file) as origine:
+            return json.load(origine)
+    except (TypeError, OSError, ValueError):
+        return None
+
+
+def statistiche(identificativo, righe=40):
+    """Funzioni più costose per tempo cumulativo, come testo di pstats"""
+    buffer = io.StringIO()
+    stats = pstats.Stats(percorso(identificativo, 'prof'), stream=buffer)
+    stats.strip_dirs().sort_stats('cumulative').print_stats(righe)
+    return buffer.getvalue()
+
+
+# ========== FORMATO SPEEDSCOPE ==========
+
+def speedscope(identificativo):
+    """Profilo nel formato di speedscope.app (profilo 'sampled' con pesi in secondi)"""
+    stats = pstats.Stats(percorso(identificativo, 'prof')).stats
+    dati = leggi(identificativo) or {}
+
+    # figli[f] = {funzione chiamata: tempo cumulativo speso in essa quando chiamata da f}
+    figli = {}
+    for funzione, (_, _, _, _, chiamanti) in stats.items():
+        for chiamante, (_, _, _, cumulativo) in chiamanti.items():
+            if chiamante != funzione:
+                figli.setdefault(chiamante, {})[funzione] = cumulativo
+    # Radici: funzioni con chiamate dal livello più esterno, non attribuite a nessun chiamante.
+    # Non basta l'assenza di chiamanti: il gestore più esterno di Django è richiamato anche
+    # dai middleware annidati
+    radici = [
+        funzione for funzione, (_, chiamate, _, _, chiamanti) in stats.items()
+        if chiamate > sum(valori[1] for valori in chiamanti.values())
+    ]
+
+    frame = []
+    indici = {}
+    campioni = []
+    pesi = []
+
+    def indice(funzione):
+        if funzione not in indici:
+            file, riga, nome = funzione
+            indici[funzione] = len(frame)
+            frame.append({'name': nome, 'file': file, 'line': riga})
+        return indici[funzione]
+
+    def visita(funzione, tempo, stack):
+        _, _, proprio, cumulativo, _ = stats[funzione]
+        stack = stack + [indice(funzione)]
+        fattore = tempo / cumulativo if cumulativo else 0
+        if proprio * fattore > PESO_MINIMO:
+            campioni.append(stack)
+            pesi.append(proprio * fattore)
+        if len(stack) >= PROFONDITA_MASSIMA:
+            return
+        for figlio, tempo_figlio in figli.get(funzione, {}).items():
+            # Le ricorsioni sono già comprese nel tempo cumulativo del primo livello
+            if indici.get(figlio) in stack:
+                continue
+            if tempo_figlio * fattore > PESO_MINIMO:
+                visita(figlio, tempo_figlio * fattore, stack)
+
+    for radice in radici:
+        visita(radice, stats[radice][3], [])
+
+    nome = f"{dati.get('metodo', '')} {dati.get('path', identificativo)}".strip()
+    return {
+        '$schema': 'https://www.speedscope.app/file-format-schema.json',
+        'name': nome,
+        'exporter': 'amm',
+        'activeProfileIndex': 0,
+        'shared': {'frames': frame},
+        'profiles': [{
+            'type': 'sampled',
+            'name': nome,
+            'unit': 'seconds',
+            'startValue': 0,
+            'endValue': sum(pesi),
+            'samples': campioni,
+            'weights': pesi,
+        }],
+    }
+
+
+# ========== MIDDLEWARE ==========
+
+class ProfilatoreMiddleware:
+    """Profila le richieste campionate e salva quelle oltre la soglia"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        frazione = campionamento()
+        if not frazione or random.random() >= frazione:
+            return self.get_response(request)
+
+        query = []
+        conteggio = [0]
+
+        def registra_query(execute, sql, params, many, context):
+            inizio = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                conteggio[0] += 1
+                if len(query) < MASSIMO_QUERY:
+                    query.append({'sql': sql, 'durata': time.perf_counter() - inizio, 'many': many})
+
+        profilo = cProfile.Profile()
+        try:
+            profilo.enable()
+        except ValueError:
+            # Un altro profiler è già attivo nel processo
+            return self.get_response(request)
+        inizio = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connessione in connections.all():
+                    stack.enter_context(connessione.execute_wrapper(registra_query))
+                response = self.get_response(request)
+        finally:
+            profilo.disable()
+        durata = time.perf_counter() - inizio
+
+        if durata >= soglia():
+            corrispondenza = getattr(request, 'resolver_match', None)
+            try:
+                salva(profilo, {
+                    'creato': time.time(),
+                    'metodo': request.method,
+                    'path': request.get_full_path(),
+                    'vista': corrispondenza.view_name if corrispondenza else '',
+                    'stato': response.status_code,
+                    'utente': request.user.get_username() if getattr(request, 'user', None) else '',
+                    'durata': durata,
+                    'query_totali': conteggio[0],
+                    'durata_query': sum(voce['durata'] for voce in query),
+                    'query': query,
+                })
+            except OSError:
+                logger.exception('Salvataggio del profilo non riuscito')
+        return response
@@ -0,0 +1,179 @@
+# home/query_ripetute.py
+"""
+Rilevamento delle query N+1 e budget di query per vista nei test.
+
+RilevatoreQueryRipetute conta le query eseguite per "forma": l'SQL con
+letterali e liste IN normalizzati, quindi la stessa SELECT ripetuta per
+ogni riga di una lista conta come una forma sola. Quando una forma arriva
+alla soglia viene catturato lo stack (solo i frame del progetto): indica
+la riga che esegue la query in un ciclo.
+
+QueryRipetuteMiddleware lo applica a ogni richiesta se
+QUERY_RIPETUTE_SOGLIA > 0 e scrive un warning sul logger
+'home.query_ripetute' per ogni forma ripetuta, con vista e stack.
+
+BudgetQueryMixin, per i TestCase, verifica per ogni URL dichiarata in
+BUDGET_QUERY che la pagina resti entro il numero massimo di query, senza
+forme ripetute, e che il numero di query non cresca aggiungendo righe.
+"""
+import logging
+import re
+import traceback
+from collections import Counter
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# Frame dello stack mostrati per ogni forma ripetuta
+FRAME_STACK = 8
+
+_RE_IN = re.compile(r'\bIN\s*\((?:\s*%s\s*,?)+\)', re.IGNORECASE)
+_RE_STRINGA = re.compile(r"'(?:[^']|'')*'")
+_RE_NUMERO = re.compile(r'\b\d+(?:\.\d+)?\b')
+_RE_SPAZI = re.compile(r'\s+')
+_CARTELLA_PROGETTO = str(Path(settings.BASE_DIR))
+_QUESTO_FILE = str(Path(__file__))
+
+
+def forma(sql):
+    """SQL senza valori: query uguali a meno dei parametri hanno la stessa forma"""
+    sql = _RE_IN.sub('IN (...)', sql)
+    sql = _RE_STRINGA.sub('?', sql)
+    sql = _RE_NUMERO.sub('?', sql)
+    return _RE_SPAZI.sub(' ', sql).strip()
+
+
+def stack_progetto():
+    """Ultimi frame dello stack che appartengono al codice del progetto"""
+    frame = [
+        voce for voce in traceback.extract_stack()
+        if voce.filename.startswith(_CARTELLA_PROGETTO)
+        and 'site-packages' not in voce.filename
+        and voce.filename != _QUESTO_FILE
+    ]
+    return ''.join(traceback.format_list(frame[-FRAME_STACK:]))
+
+
+class RilevatoreQueryRipetute:
+    """
+    Conta le query per forma su tutte le connessioni finché è attivo:
+
+        with RilevatoreQueryRipetute(soglia=3) as rilevatore:
+            ...
+        rilevatore.ripetute()   # [(forma, volte, stack)]
+    """
+
+    def __init__(self, soglia=3):
+        self.soglia = soglia
+        self.conteggi = Counter()
+        self.stack = {}
+        self._uscita = None
+
+    def __call__(self, execute, sql, params, many, context):
+        chiave = forma(sql)
+        self.conteggi[chiave] += 1
+        if self.conteggi[chiave] == self.soglia:
+            self.stack[chiave] = stack_progetto()
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self._uscita = ExitStack()
+        for connessione in connections.all():
+            self._uscita.enter_context(connessione.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._uscita.close()
+
+    @property
+    def totale(self):
+        return sum(self.conteggi.values())
+
+    def ripetute(self):
+        """Forme eseguite almeno `soglia` volte, dalla più frequente"""
+        return [
+            (chiave, volte, self.stack.get(chiave, ''))
+            for chiave, volte in self.conteggi.most_common() if volte >= self.soglia
+        ]
+
+
+class QueryRipetuteMiddleware:
+    """Segnala nel log le query ripetute di ogni richiesta (QUERY_RIPETUTE_SOGLIA > 0)"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        soglia = getattr(settings, 'QUERY_RIPETUTE_SOGLIA', 0)
+        if not soglia:
+            return self.get_response(request)
+
+        with RilevatoreQueryRipetute(soglia) as rilevatore:
+            response = self.get_response(request)
+
+        corrispondenza = getattr(request, 'resolver_match', None)
+        vista = corrispondenza.view_name if corrispondenza else request.path
+        for chiave, volte, stack in rilevatore.ripetute():
+            logger.warning(
+                f'Query ripetuta {volte} volte in {vista} ({rilevatore.totale} query totali): '
+                f'{chiave}\n{stack}'
+            )
+        return response
+
+
+# ========== BUDGET PER I TEST ==========
+
+class BudgetQueryMixin:
+    """
+    Per i TestCase: BUDGET_QUERY = {'app:nome_url': massimo di query}.
+
+    assertBudgetQuery(nome_url, ...) richiede la pagina con il client di
+    test (già autenticato, dopo una richiesta di riscaldamento) e verifica
+    che resti nel budget e non ripeta la stessa forma di query
+    SOGLIA_RIPETUTE volte. Con `aggiungi_righe` (callable che crea altri
+    dati) ripete la richiesta e verifica che il numero di query non cambi:
+    il segno di un N+1.
+    """
+
+    BUDGET_QUERY = {}
+    SOGLIA_RIPETUTE = 3
+
+    def _misura_query(self, url, parametri):
+        with RilevatoreQueryRipetute(self.SOGLIA_RIPETUTE) as rilevatore:
+            response = self.client.get(url, parametri)
+        self.assertEqual(response.status_code, 200, f'{url}: risposta {response.status_code}')
+        return rilevatore
+
+    def assertBudgetQuery(self, nome_url, args=None, kwargs=None, parametri=None, aggiungi_righe=None):
+        from django.urls import reverse
+
+        budget = self.BUDGET_QUERY[nome_url]
+        url = reverse(nome_url, args=args, kwargs=kwargs)
+        # Prima richiesta a vuoto: si misura la pagina con le cache già calde
+        self.client.get(url, parametri or {})
+        rilevatore = self._misura_query(url, parametri or {})
+        elenco = '\n'.join(f'  {volte}x {chiave}' for chiave, volte in rilevatore.conteggi.most_common())
+
+        self.assertLessEqual(
+            rilevatore.totale, budget,
+            f'{nome_url}: {rilevatore.totale} query, budget {budget}\n{elenco}'
+        )
+        ripetute = rilevatore.ripetute()
+        self.assertFalse(ripetute, f'{nome_url}: query ripetute\n' + '\n'.join(
+            f'  {volte}x {chiave}\n{stack}' for chiave, volte, stack in ripetute
+        ))
+
+        if aggiungi_righe is not None:
+            aggiungi_righe()
+            # I nuovi dati invalidano le cache (es. messaggi non letti): di nuovo a vuoto
+            self.client.get(url, parametri or {})
+            dopo = self._misura_query(url, parametri or {})
+            self.assertEqual(
+                dopo.totale, rilevatore.totale,
+                f'{nome_url}: le query crescono con i dati ({rilevatore.totale} -> {dopo.totale})'
+            )
+        return rilevatore.totale
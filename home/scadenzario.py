@@ -0,0 +1,319 @@
+# home/scadenzario.py
+"""
+Scadenzario unico di automezzi, dipendenti, magazzino e promemoria.
+
+Ogni modello con una data di scadenza è descritto da una Sorgente: quali
+campi la influenzano, come si calcolano data, descrizione e destinatari.
+I segnali post_save/post_delete dei modelli (collegati in home/signals.py)
+tengono allineata la tabella Scadenza con una query di lettura e al più
+una scrittura per salvataggio; i salvataggi con update_fields che non
+toccano i campi della sorgente non costano nulla.
+
+Le scritture massive (bulk_create, update) non inviano segnali: il
+comando `scadenzario --ricostruisci` riallinea tutta la tabella.
+
+Le letture sono una sola query sull'indice per data:
+    Scadenza.objects.per_utente(user).entro(30)
+
+DigestScadenze raccoglie le scadenze non ancora notificate e invia una
+sola mail per utente con tutte quelle che lo riguardano.
+"""
+import logging
+from functools import lru_cache
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.mail import get_connection, send_mass_mail
+from django.db import transaction
+from django.utils import timezone
+
+from automezzi.models import INTERVALLO_REVISIONE
+
+from .models import Scadenza
+
+logger = logging.getLogger(__name__)
+
+# Giorni di preavviso del digest giornaliero
+GIORNI_PREAVVISO = 30
+BATCH_SIZE = 1000
+
+
+def _nome_dipendente(dipendente):
+    return f'{dipendente.first_name} {dipendente.last_name}'.strip() or dipendente.username
+
+
+class Sorgente:
+    """Come un modello alimenta lo scadenzario per un tipo di scadenza"""
+
+    def __init__(self, modello, tipo, campi, data, descrizione, ruolo='', destinatario=None, select_related=()):
+        self.modello = modello
+        self.tipo = tipo
+        self.campi = set(campi)
+        self.data = data
+        self.descrizione = descrizione
+        self.ruolo = ruolo
+        self.destinatario = destinatario
+        self.select_related = select_related
+
+    def valori(self, istanza):
+        """Campi della riga di scadenzario per l'istanza, None se non ha scadenza"""
+        data = self.data(istanza)
+        if data is None:
+            return None
+        return {
+            'data': data,
+            'descrizione': self.descrizione(istanza)[:255],
+            'ruolo': self.ruolo,
+            'destinatario_id': self.destinatario(istanza) if self.destinatario else None,
+        }
+
+
+SORGENTI = [
+    Sorgente(
+        'automezzi.Automezzo', Scadenza.Tipo.REVISIONE,
+        campi=('data_revisione', 'attivo', 'targa'),
+        data=lambda a: a.data_revisione + INTERVALLO_REVISIONE if a.attivo and a.data_revisione else None,
+        descrizione=lambda a: f'Revisione {a.targa}',
+        ruolo='operativo',
+    ),
+    Sorgente(
+        'dipendenti.Dipendente', Scadenza.Tipo.PATENTE,
+        campi=('data_scadenza_patente', 'is_active', 'first_name', 'last_name', 'username'),
+        data=lambda d: d.data_scadenza_patente if d.is_active else None,
+        descrizione=lambda d: f'Patente {_nome_dipendente(d)}',
+        destinatario=lambda d: d.pk,
+    ),
+    Sorgente(
+        'dipendenti.Dipendente', Scadenza.Tipo.CARTA_IDENTITA,
+        campi=('data_scadenza_ci', 'is_active', 'first_name', 'last_name', 'username'),
+        data=lambda d: d.data_scadenza_ci if d.is_active else None,
+        descrizione=lambda d: f'Carta identità {_nome_dipendente(d)}',
+        destinatario=lambda d: d.pk,
+    ),
+    Sorgente(
+        'ordini.Magazzino', Scadenza.Tipo.LOTTO,
+        campi=('data_scadenza', 'quantita_in_magazzino', 'numero_lotto', 'prodotto'),
+        data=lambda m: m.data_scadenza if m.quantita_in_magazzino > 0 else None,
+        descrizione=lambda m: f"{m.prodotto.nome_prodotto} lotto {m.numero_lotto or '-'}",
+        ruolo='operativo',
+        select_related=('prodotto',),
+    ),
+    Sorgente(
+        'home.Promemoria', Scadenza.Tipo.PROMEMORIA,
+        campi=('data_scadenza', 'completato', 'titolo', 'assegnato_a'),
+        data=lambda p: None if p.completato else p.data_scadenza,
+        descrizione=lambda p: p.titolo,
+        destinatario=lambda p: p.assegnato_a_id,
+    ),
+]
+
+
+@lru_cache(maxsize=None)
+def sorgenti_per_modello():
+    """{classe modello: [sorgenti]}, risolto una volta a registry pronto"""
+    risultato = {}
+    for sorgente in SORGENTI:
+        risultato.setdefault(apps.get_model(sorgente.modello), []).append(sorgente)
+    return risultato
+
+
+def sincronizza(istanza, update_fields=None):
+    """Allinea le righe di scadenzario di un'istanza appena salvata"""
+    sorgenti = sorgenti_per_modello().get(type(istanza), [])
+    if update_fields is not None:
+        sorgenti = [sorgente for sorgente in sorgenti if sorgente.campi & set(update_fields)]
+    if not sorgenti:
+        return
+
+    content_type = ContentType.objects.get_for_model(istanza)
+    esistenti = {
+        riga.tipo: riga
+        for riga in Scadenza.objects.filter(
+            content_type=content_type, object_id=istanza.pk, tipo__in=[sorgente.tipo for sorgente in sorgenti]
+        )
+    }
+    da_eliminare, da_creare = [], []
+    for sorgente in sorgenti:
+        valori = sorgente.valori(istanza)
+        riga = esistenti.get(sorgente.tipo)
+        if valori is None:
+            if riga is not None:
+                da_eliminare.append(riga.pk)
+        elif riga is None:
+            da_creare.append(Scadenza(content_type=content_type, object_id=istanza.pk, tipo=sorgente.tipo, **valori))
+        else:
+            modificati = {campo: valore for campo, valore in valori.items() if getattr(riga, campo) != valore}
+            if 'data' in modificati:
+                # Nuova data: la scadenza va notificata di nuovo
+                modificati['notificata_il'] = None
+            if modificati:
+                Scadenza.objects.filter(pk=riga.pk).update(**modificati)
+
+    if da_eliminare:
+        Scadenza.objects.filter(pk__in=da_eliminare).delete()
+    if da_creare:
+        Scadenza.objects.bulk_create(da_creare)
+
+
+def rimuovi(istanza):
+    """Elimina le scadenze di un'istanza cancellata"""
+    Scadenza.objects.filter(
+        content_type=ContentType.objects.get_for_model(istanza), object_id=istanza.pk
+    ).delete()
+
+
+def ricostruisci(tipi=None):
+    """
+    Ricalcola lo scadenzario (solo i `tipi` indicati, tutti se None) dai
+    modelli di origine, una sorgente alla volta; le righe con la stessa
+    data conservano lo stato di notifica. Restituisce le scadenze scritte.
+    """
+    totale = 0
+    for modello, sorgenti in sorgenti_per_modello().items():
+        content_type = ContentType.objects.get_for_model(modello)
+        for sorgente in sorgenti:
+            if tipi is not None and sorgente.tipo not in tipi:
+                continue
+            with transaction.atomic():
+                righe = Scadenza.objects.filter(content_type=content_type, tipo=sorgente.tipo)
+                notificate = {
+                    (object_id, data): notificata_il
+                    for object_id, data, notificata_il in righe.filter(
+                        notificata_il__isnull=False
+                    ).values_list('object_id', 'data', 'notificata_il')
+                }
+                righe.delete()
+
+                lotto = []
+                istanze = modello._default_manager.select_related(*sorgente.select_related).order_by('pk')
+                for istanza in istanze.iterator(chunk_size=BATCH_SIZE):
+                    valori = sorgente.valori(istanza)
+                    if valori is None:
+                        continue
+                    lotto.append(Scadenza(
+                        content_type=content_type, object_id=istanza.pk, tipo=sorgente.tipo,
+                        notificata_il=notificate.get((istanza.pk, valori['data'])), **valori,
+                    ))
+                    if len(lotto) >= BATCH_SIZE:
+                        Scadenza.objects.bulk_create(lotto)
+                        totale += len(lotto)
+                        lotto = []
+                Scadenza.objects.bulk_create(lotto)
+                totale += len(lotto)
+    return totale
+
+
+class DigestScadenze:
+    """
+    Notifica giornaliera delle scadenze entro `giorni` non ancora notificate:
+    una query per le scadenze, una per gli utenti, una mail per utente
+    (tutte sulla stessa connessione SMTP) e un UPDATE per segnare notificate
+    le scadenze le cui mail sono partite; gli errori di invio non vengono
+    ignorati, le scadenze coinvolte restano per il digest successivo. Le
+    scadenze senza alcun destinatario con email non sono segnate notificate
+    e finiscono nel log.
+
+    Uso:
+        digest = DigestScadenze(giorni=30).esegui()
+        digest.scadenze, digest.notificate, digest.inviate, digest.senza_destinatari
+    """
+
+    def __init__(self, giorni=GIORNI_PREAVVISO, oggi=None, dry_run=False):
+        self.giorni = giorni
+        self.oggi = oggi or timezone.localdate()
+        self.dry_run = dry_run
+        self.scadenze = 0
+        self.inviate = 0
+        self.notificate = 0
+        self.senza_destinatari = 0
+        self.messaggi = []
+
+    def esegui(self):
+        scadenze = list(
+            Scadenza.objects.entro(self.giorni, self.oggi).filter(notificata_il__isnull=True)
+            .values('pk', 'tipo', 'data', 'descrizione', 'destinatario_id', 'ruolo')
+        )
+        self.scadenze = len(scadenze)
+        if not scadenze:
+            return self
+
+        utenti = list(
+            get_user_model().objects.filter(is_active=True).exclude(email='')
+            .exclude(email__isnull=True).values('pk', 'email', 'livello', 'is_superuser')
+        )
+        amministratori = [u for u in utenti if u['is_superuser'] or u['livello'] == 'totale']
+        per_livello, per_pk = {}, {u['pk']: u for u in utenti}
+        for utente in utenti:
+            per_livello.setdefault(utente['livello'], []).append(utente)
+
+        per_utente, senza_destinatari = {}, []
+        for scadenza in scadenze:
+            destinatari = {u['pk'] for u in amministratori}
+            destinatari.update(u['pk'] for u in per_livello.get(scadenza['ruolo'], []) if scadenza['ruolo'])
+            if scadenza['destinatario_id'] in per_pk:
+                destinatari.add(scadenza['destinatario_id'])
+            if not destinatari:
+                # Nessun amministratore, ruolo o destinatario con email: resta da notificare
+                senza_destinatari.append(scadenza)
+            for pk in destinatari:
+                per_utente.setdefault(pk, []).append(scadenza)
+        self.senza_destinatari = len(senza_destinatari)
+        if senza_destinatari:
+            logger.warning(
+                f'Digest scadenze: {len(senza_destinatari)} scadenze senza destinatari: '
+                + ', '.join(f"{s['descrizione']} ({s['data']:%d/%m/%Y})" for s in senza_destinatari)
+            )
+
+        elenchi = [sorted(elenco, key=lambda s: s['data']) for elenco in per_utente.values()]
+        self.messaggi = [
+            self._messaggio(per_pk[pk]['email'], elenco) for pk, elenco in zip(per_utente, elenchi)
+        ]
+        if self.dry_run or not self.messaggi:
+            return self
+
+        # Una mail per volta sulla stessa connessione: una scadenza è segnata
+        # come notificata solo se tutte le mail che la contengono sono partite,
+        # le altre restano per il prossimo digest
+        non_inviate = set()
+        connessione = get_connection()
+        try:
+            connessione.open()
+        except Exception:
+            logger.exception('Digest scadenze: server di posta non raggiungibile, nessuna scadenza notificata')
+            return self
+        try:
+            for messaggio, elenco in zip(self.messaggi, elenchi):
+                try:
+                    self.inviate += send_mass_mail([messaggio], fail_silently=False, connection=connessione)
+                except Exception:
+                    logger.exception(f'Digest scadenze: invio a {", ".join(messaggio[3])} fallito')
+                    non_inviate.update(scadenza['pk'] for scadenza in elenco)
+        finally:
+            connessione.close()
+
+        escluse = non_inviate | {scadenza['pk'] for scadenza in senza_destinatari}
+        ids = [scadenza['pk'] for scadenza in scadenze if scadenza['pk'] not in escluse]
+        self.notificate = len(ids)
+        adesso = timezone.now()
+        for i in range(0, len(ids), BATCH_SIZE):
+            Scadenza.objects.filter(pk__in=ids[i:i + BATCH_SIZE]).update(notificata_il=adesso)
+        logger.info(
+            f'Digest scadenze: {self.scadenze} scadenze, {self.notificate} notificate, {self.inviate} mail inviate'
+        )
+        return self
+
+    def _messaggio(self, email, scadenze):
+        etichette = dict(Scadenza.Tipo.choices)
+        righe = [
+            f"- {s['data']:%d/%m/%Y} {etichette.get(s['tipo'], s['tipo'])}: {s['descrizione']}"
+            + (' (SCADUTA)' if s['data'] < self.oggi else '')
+            for s in scadenze
+        ]
+        return (
+            f'Scadenze nei prossimi {self.giorni} giorni: {len(scadenze)}',
+            'Le seguenti scadenze richiedono attenzione:\n\n' + '\n'.join(righe),
+            settings.DEFAULT_FROM_EMAIL,
+            [email],
+        )
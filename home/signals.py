@@ -0,0 +1,31 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from . import scadenzario
+from .models import Messaggio
+
+
+@receiver(post_save, sender=Messaggio)
+@receiver(post_delete, sender=Messaggio)
+def invalida_conteggio_non_letti(sender, instance, **kwargs):
+    """Invalida il conteggio dei non letti del destinatario"""
+    Messaggio.invalida_non_letti(instance.destinatario_id)
+
+
+# ========== SCADENZARIO ==========
+
+def aggiorna_scadenze(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Allinea lo scadenzario al salvataggio di un modello con scadenze"""
+    if raw:
+        return
+    scadenzario.sincronizza(instance, update_fields)
+
+
+def elimina_scadenze(sender, instance, **kwargs):
+    """Rimuove dallo scadenzario le scadenze di un oggetto eliminato"""
+    scadenzario.rimuovi(instance)
+
+
+for _modello in scadenzario.sorgenti_per_modello():
+    post_save.connect(aggiorna_scadenze, sender=_modello, dispatch_uid=f'scadenzario_save_{_modello._meta.label}')
+    post_delete.connect(elimina_scadenze, sender=_modello, dispatch_uid=f'scadenzario_delete_{_modello._meta.label}')
@@ -0,0 +1,606 @@
+# home/simulazione_turno.py
+"""
+Simulazione di carico concorrente di un turno di magazzino.
+
+I micro-benchmark di home.benchmark misurano una richiesta alla volta e
+non vedono la contesa. SimulazioneTurno avvia `operatori` in parallelo
+(thread o processi) che per `durata` secondi eseguono un mix pesato di
+operazioni realistico: ricezione merce in banchina, movimenti di
+magazzino su pochi lotti contesi, creazione ordini con numerazione
+automatica, dashboard, polling delle notifiche ed esportazioni.
+
+Le richieste passano dall'app WSGI con il client di test di Django
+(nessun server), oppure con `url` da un server locale già avviato (es.
+gunicorn sullo stesso database). La sessione di ogni operatore è creata
+prima del turno e passata come cookie.
+
+Il risultato, serializzabile in JSON, riporta throughput, percentili di
+latenza totali e per operazione, errori per tipo (eccezione o stato
+HTTP), errori di lock e, su PostgreSQL, le sessioni in attesa di lock
+campionate durante il turno. Al termine le verifiche di coerenza
+confrontano il database con quanto gli operatori hanno ottenuto:
+giacenze dei lotti contesi (aggiornamenti persi), ordini creati e numeri
+ordine (duplicati) e ricezioni registrate.
+
+Le operazioni scrivono davvero: va eseguita sul dataset di
+generate_dataset, da rigenerare con --svuota dopo la simulazione.
+"""
+import http.client
+import multiprocessing
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import timedelta
+from urllib.parse import urlencode, urlsplit
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.signals import got_request_exception
+from django.db import connection, connections
+from django.db.models import Count
+from django.middleware.csrf import CSRF_SECRET_LENGTH
+from django.test import Client
+from django.urls import NoReverseMatch, reverse
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+
+from .benchmark import ambiente_di_test, commit_corrente, dati_ricezione, percentile
+from .dataset import UTENTE_BENCHMARK
+
+# Peso di ogni operazione nel mix del turno
+MIX = {
+    'notifiche': 40,
+    'dashboard': 20,
+    'movimento': 15,
+    'ricezione': 10,
+    'nuovo_ordine': 10,
+    'esportazione': 5,
+}
+
+# URL di ogni operazione: con più URL l'operatore ne sceglie una a caso
+URL_OPERAZIONI = {
+    'notifiche': ['home:api_check_messages'],
+    'dashboard': ['home:index', 'ordini:dashboard', 'automezzi:dashboard'],
+    'movimento': ['ordini:movimento_magazzino'],
+    'ricezione': ['ordini:ricevi_ordine'],
+    'nuovo_ordine': ['ordini:nuovo_ordine'],
+    'esportazione': ['anagrafica:export_anagrafica', 'ordini:export_ordini'],
+}
+# Argomenti fittizi per verificare che le URL esistano prima del turno
+_KWARGS_PROVA = {
+    'ordini:movimento_magazzino': {'pk': 1},
+    'ordini:ricevi_ordine': {'ordine_id': 1},
+}
+_PARAMETRI_GET = {
+    'anagrafica:export_anagrafica': {'tipo': 'clienti'},
+}
+# Esportazioni da form: POST che risponde 200 con il file
+_DATI_POST = {
+    'ordini:export_ordini': {'formato': 'csv'},
+}
+
+# Frammenti dei messaggi di errore dei database dovuti ai lock
+_ERRORI_LOCK = (
+    'database is locked', 'database table is locked', 'deadlock', 'lock wait timeout',
+    'could not serialize', 'could not obtain lock', 'lock timeout',
+)
+
+# Ordini da ricevere assegnati a ogni operatore (ognuno riceve consegne diverse)
+ORDINI_PER_OPERATORE = 50
+# Prodotti e fornitori tra cui scegliere i nuovi ordini
+CANDIDATI_ORDINE = 200
+
+_eccezioni = threading.local()
+
+
+def _registra_eccezione(sender, **kwargs):
+    """
+    Eccezione della richiesta in corso, per thread: il client di test la
+    segnala a tutti i client attivi, quindi con più thread non è
+    attribuibile dal client stesso.
+    """
+    _eccezioni.ultima = sys.exc_info()[1]
+
+
+def errore_lock(messaggio):
+    """True se il messaggio di errore del database indica un lock o un deadlock"""
+    messaggio = messaggio.lower()
+    return any(frammento in messaggio for frammento in _ERRORI_LOCK)
+
+
+# ========== TRASPORTI ==========
+
+class _TrasportoClient:
+    """Richieste all'app WSGI nello stesso processo con il client di test"""
+
+    def __init__(self, cookie_sessione):
+        self.client = Client(raise_request_exception=False)
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = cookie_sessione
+
+    def richiesta(self, metodo, url, dati):
+        _eccezioni.ultima = None
+        if metodo == 'POST':
+            response = self.client.post(url, dati)
+        else:
+            response = self.client.get(url, dati)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        eccezione = _eccezioni.ultima
+        if eccezione is not None:
+            # Prima riga del messaggio: i valori nel resto renderebbero ogni errore diverso
+            messaggio = str(eccezione).splitlines()[0][:200] if str(eccezione) else ''
+            return response.status_code, f'{type(eccezione).__name__}: {messaggio}'
+        return response.status_code, None
+
+    def chiudi(self):
+        connection.close()
+
+
+class _TrasportoHttp:
+    """Richieste HTTP a un server avviato, con la sessione creata dal runner"""
+
+    def __init__(self, url, cookie_sessione):
+        parti = urlsplit(url)
+        self.prefisso = parti.path.rstrip('/')
+        self.classe = http.client.HTTPSConnection if parti.scheme == 'https' else http.client.HTTPConnection
+        self.host = parti.netloc
+        self.connessione = None
+        # Segreto CSRF scelto qui: cookie e intestazione coincidono
+        csrf = get_random_string(CSRF_SECRET_LENGTH)
+        self.intestazioni = {
+            'Cookie': f'{settings.SESSION_COOKIE_NAME}={cookie_sessione}; {settings.CSRF_COOKIE_NAME}={csrf}',
+            'X-CSRFToken': csrf,
+            'Referer': url,
+        }
+
+    def richiesta(self, metodo, url, dati):
+        corpo = None
+        intestazioni = dict(self.intestazioni)
+        if metodo == 'POST':
+            corpo = urlencode(dati or {}, doseq=True)
+            intestazioni['Content-Type'] = 'application/x-www-form-urlencoded'
+        elif dati:
+            url = f'{url}?{urlencode(dati, doseq=True)}'
+        try:
+            if self.connessione is None:
+                self.connessione = self.classe(self.host, timeout=60)
+            self.connessione.request(metodo, self.prefisso + url, body=corpo, headers=intestazioni)
+            response = self.connessione.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException) as e:
+            # Connessione da riaprire alla prossima richiesta
+            self.chiudi()
+            return 0, f'{type(e).__name__}: {e}'
+        return response.status, None
+
+    def chiudi(self):
+        if self.connessione is not None:
+            self.connessione.close()
+            self.connessione = None
+
+
+# ========== OPERATORE ==========
+
+class _Operatore:
+    """
+    Un operatore del turno: esegue operazioni del mix fino alla scadenza e
+    tiene i propri risultati (misure, movimenti riusciti, ordini creati e
+    ricevuti), uniti dal runner alla fine.
+    """
+
+    def __init__(self, piano):
+        self.piano = piano
+        self.casuale = random.Random(piano['seme'])
+        self.ordini_da_ricevere = list(piano['ordini'])
+        self.misure = []
+        self.movimenti = Counter()
+        self.ricevuti = []
+        self.ordini_creati = 0
+
+    def esegui(self):
+        if self.piano['url']:
+            trasporto = _TrasportoHttp(self.piano['url'], self.piano['sessione'])
+        else:
+            trasporto = _TrasportoClient(self.piano['sessione'])
+        nomi = list(self.piano['mix'])
+        pesi = [self.piano['mix'][nome] for nome in nomi]
+        fine = time.monotonic() + self.piano['durata']
+        try:
+            while time.monotonic() < fine:
+                nome = self.casuale.choices(nomi, pesi)[0]
+                richiesta = getattr(self, f'_{nome}')()
+                if richiesta is None:
+                    # Nulla da fare per questa operazione (es. consegne finite): si passa alla prossima
+                    continue
+                metodo, url, dati, esito = richiesta
+                inizio = time.perf_counter()
+                stato, errore = trasporto.richiesta(metodo, url, dati)
+                durata = time.perf_counter() - inizio
+                if errore is None:
+                    errore = self._errore_stato(nome, metodo, stato)
+                if errore is None:
+                    esito()
+                self.misure.append((nome, durata * 1000, errore))
+                if self.piano['pausa']:
+                    time.sleep(self.casuale.uniform(0, self.piano['pausa']))
+        finally:
+            trasporto.chiudi()
+        return {
+            'misure': self.misure,
+            'movimenti': dict(self.movimenti),
+            'ricevuti': self.ricevuti,
+            'ordini_creati': self.ordini_creati,
+        }
+
+    @staticmethod
+    def _errore_stato(nome, metodo, stato):
+        if metodo == 'POST' and nome != 'esportazione':
+            if stato == 200:
+                # Le viste rispondono 302 quando il form è valido, 200 se lo ripresentano con gli errori
+                return 'form non valido'
+            return f'HTTP {stato}' if stato >= 400 else None
+        # Un redirect su GET è quasi sempre il login: sessione non valida
+        return f'HTTP {stato}' if stato != 200 else None
+
+    def _url(self, nome):
+        return self.casuale.choice(self.piano['url_disponibili'][nome])
+
+    def _niente(self):
+        pass
+
+    def _notifiche(self):
+        return 'GET', reverse(self._url('notifiche')), {}, self._niente
+
+    def _dashboard(self):
+        return 'GET', reverse(self._url('dashboard')), {}, self._niente
+
+    def _esportazione(self):
+        nome_url = self._url('esportazione')
+        if nome_url in _DATI_POST:
+            return 'POST', reverse(nome_url), _DATI_POST[nome_url], self._niente
+        return 'GET', reverse(nome_url), _PARAMETRI_GET.get(nome_url, {}), self._niente
+
+    def _movimento(self):
+        if not self.piano['lotti']:
+            return None
+        lotto = self.casuale.choice(self.piano['lotti'])
+        tipo = self.casuale.choice(['carico', 'scarico'])
+        quantita = self.casuale.randint(1, 3)
+        dati = {'tipo_movimento': tipo, 'quantita': quantita, 'motivo': self.piano['marcatore']}
+
+        def esito():
+            self.movimenti[lotto] += quantita if tipo == 'carico' else -quantita
+
+        return 'POST', reverse(self._url('movimento'), kwargs={'pk': lotto}), dati, esito
+
+    def _ricezione(self):
+        if not self.ordini_da_ricevere:
+            return None
+        ordine = self.ordini_da_ricevere.pop()
+        dati = dati_ricezione(ordine, f'TURNO-{ordine.pk}')
+
+        def esito():
+            self.ricevuti.append(ordine.pk)
+
+        return 'POST', reverse(self._url('ricezione'), kwargs={'ordine_id': ordine.pk}), dati, esito
+
+    def _nuovo_ordine(self):
+        if not self.piano['candidati']:
+            return None
+        prodotto, fornitore = self.casuale.choice(self.piano['candidati'])
+        dati = {
+            'prodotto': prodotto,
+            'fornitore': fornitore,
+            'misura': 'pezzo',
+            'quantita_ordinata': self.casuale.randint(1, 50),
+            'prezzo_unitario_ordine': f'{self.casuale.uniform(1, 40):.2f}',
+            'sconto_percentuale': '0',
+            'data_arrivo_previsto': (timezone.localdate() + timedelta(days=7)).isoformat(),
+            'note_interne': self.piano['marcatore'],
+            'note_fornitore': '',
+        }
+
+        def esito():
+            self.ordini_creati += 1
+
+        return 'POST', reverse(self._url('nuovo_ordine')), dati, esito
+
+
+def _esegui_operatore(piano):
+    """Punto d'ingresso di thread e processi"""
+    return _Operatore(piano).esegui()
+
+
+# ========== ATTESE DI LOCK ==========
+
+class CampionatoreAttese(threading.Thread):
+    """
+    Su PostgreSQL conta ogni `intervallo` secondi le sessioni in attesa di
+    un lock (pg_stat_activity). Sugli altri database non campiona: restano
+    gli errori di lock delle richieste.
+    """
+
+    def __init__(self, intervallo=0.2):
+        super().__init__(name='simulazione-turno-lock', daemon=True)
+        self.intervallo = intervallo
+        self.campioni = []
+        self._ferma = threading.Event()
+
+    @property
+    def disponibile(self):
+        return connection.vendor == 'postgresql'
+
+    def run(self):
+        try:
+            with connection.cursor() as cursor:
+                while not self._ferma.wait(self.intervallo):
+                    cursor.execute(
+                        "SELECT count(*) FROM pg_stat_activity "
+                        "WHERE datname = current_database() AND wait_event_type = 'Lock'"
+                    )
+                    self.campioni.append(cursor.fetchone()[0])
+        finally:
+            connection.close()
+
+    def ferma(self):
+        self._ferma.set()
+        if self.is_alive():
+            self.join()
+
+    def riepilogo(self):
+        if not self.disponibile:
+            return {'campionamento': None}
+        return {
+            'campionamento': 'pg_stat_activity',
+            'campioni': len(self.campioni),
+            'massimo_in_attesa': max(self.campioni, default=0),
+            'media_in_attesa': round(sum(self.campioni) / len(self.campioni), 2) if self.campioni else 0,
+            # Tempo complessivo trascorso dalle sessioni in attesa, stimato dai campioni
+            'attesa_stimata_s': round(sum(self.campioni) * self.intervallo, 2),
+        }
+
+
+# ========== SIMULAZIONE ==========
+
+class SimulazioneTurno:
+    """
+    `operatori` in parallelo per `durata` secondi come `utente`, con il mix
+    di operazioni `mix` ({operazione: peso}, default MIX). `processi`
+    usa processi (fork) invece dei thread; `url` invia le richieste a un
+    server avviato invece che al client di test; `pausa` è il massimo di
+    secondi di attesa casuale tra due operazioni dello stesso operatore.
+    """
+
+    def __init__(self, operatori=8, durata=30, mix=None, utente=UTENTE_BENCHMARK, processi=False,
+                 url=None, pausa=0, lotti_contesi=5, seme=42):
+        self.operatori = operatori
+        self.durata = durata
+        self.mix = {nome: peso for nome, peso in (mix or MIX).items() if peso > 0}
+        self.utente = utente
+        self.processi = processi
+        self.url = url.rstrip('/') if url else None
+        self.pausa = pausa
+        self.lotti_contesi = lotti_contesi
+        self.seme = seme
+        self.marcatore = f'simula_turno {uuid.uuid4().hex[:12]}'
+
+    def esegui(self):
+        try:
+            utente = get_user_model().objects.get(username=self.utente)
+        except get_user_model().DoesNotExist:
+            raise ValueError(f'Utente "{self.utente}" non trovato: generare prima il dataset (generate_dataset)')
+
+        url_disponibili, escluse = self._url_disponibili()
+        mix = {nome: peso for nome, peso in self.mix.items() if nome in url_disponibili}
+        if not mix:
+            raise ValueError('Nessuna operazione del mix ha URL disponibili: ' + '; '.join(
+                f'{nome}: {", ".join(urls)}' for nome, urls in escluse.items()
+            ))
+
+        piani = self._piani(utente, mix, url_disponibili)
+        giacenze_iniziali = self._giacenze(piani[0]['lotti'])
+
+        campionatore = CampionatoreAttese()
+        got_request_exception.connect(_registra_eccezione, dispatch_uid='simulazione-turno')
+        with ambiente_di_test():
+            # I processi figli non devono ereditare le connessioni aperte
+            connections.close_all()
+            if self.processi:
+                pool = ProcessPoolExecutor(self.operatori, mp_context=multiprocessing.get_context('fork'))
+            else:
+                pool = ThreadPoolExecutor(self.operatori, thread_name_prefix='simulazione-turno')
+            if campionatore.disponibile:
+                campionatore.start()
+            inizio = time.monotonic()
+            try:
+                with pool:
+                    parziali = list(pool.map(_esegui_operatore, piani))
+            finally:
+                durata = time.monotonic() - inizio
+                campionatore.ferma()
+                got_request_exception.disconnect(dispatch_uid='simulazione-turno')
+
+        return self._risultato(parziali, durata, escluse, giacenze_iniziali, campionatore)
+
+    def _url_disponibili(self):
+        disponibili = {}
+        escluse = {}
+        for nome in self.mix:
+            for nome_url in URL_OPERAZIONI[nome]:
+                try:
+                    reverse(nome_url, kwargs=_KWARGS_PROVA.get(nome_url))
+                except NoReverseMatch:
+                    escluse.setdefault(nome, []).append(nome_url)
+                except Exception as e:
+                    # URLconf che non si importa (es. una vista mancante): ogni reverse fallisce
+                    escluse.setdefault(nome, []).append(f'{nome_url} ({type(e).__name__}: {e})')
+                else:
+                    disponibili.setdefault(nome, []).append(nome_url)
+        return disponibili, escluse
+
+    def _piani(self, utente, mix, url_disponibili):
+        lotti = self._lotti_contesi() if 'movimento' in mix else []
+        ordini = self._ordini_da_ricevere() if 'ricezione' in mix else []
+        candidati = self._candidati_ordine() if 'nuovo_ordine' in mix else []
+
+        piani = []
+        for indice in range(self.operatori):
+            # Sessioni create prima del turno: il login non entra nelle misure né nella contesa
+            client = Client()
+            client.force_login(utente)
+            piani.append({
+                'sessione': client.cookies[settings.SESSION_COOKIE_NAME].value,
+                'url': self.url,
+                'durata': self.durata,
+                'pausa': self.pausa,
+                'mix': mix,
+                'url_disponibili': url_disponibili,
+                'seme': self.seme + indice,
+                'marcatore': self.marcatore,
+                'lotti': lotti,
+                # Consegne diverse per ogni operatore
+                'ordini': ordini[indice::self.operatori],
+                'candidati': candidati,
+            })
+        return piani
+
+    # Letture del database di piani e verifiche, in metodi a parte per poterle sostituire nei test
+
+    def _lotti_contesi(self):
+        from ordini.models import Magazzino
+
+        # Pochi lotti con molta giacenza: gli operatori si contendono le stesse righe
+        return list(
+            Magazzino.objects.order_by('-quantita_in_magazzino', 'pk')
+            .values_list('pk', flat=True)[:self.lotti_contesi]
+        )
+
+    def _ordini_da_ricevere(self):
+        from ordini.models import Ordine
+
+        return list(
+            Ordine.objects.da_ricevere().filter(ricezione__isnull=True)
+            .order_by('pk')[:self.operatori * ORDINI_PER_OPERATORE]
+        )
+
+    def _candidati_ordine(self):
+        """Coppie (prodotto, fornitore) attivi per i nuovi ordini"""
+        from anagrafica.models import Fornitore
+        from ordini.models import Prodotto
+
+        prodotti = list(Prodotto.objects.filter(attivo=True).order_by('pk').values_list('pk', flat=True)[:CANDIDATI_ORDINE])
+        fornitori = list(Fornitore.objects.filter(attivo=True).order_by('pk').values_list('pk', flat=True)[:CANDIDATI_ORDINE])
+        return [(prodotto, fornitori[i % len(fornitori)]) for i, prodotto in enumerate(prodotti)] if fornitori else []
+
+    def _giacenze(self, lotti):
+        from ordini.models import Magazzino
+
+        return dict(Magazzino.objects.filter(pk__in=lotti).values_list('pk', 'quantita_in_magazzino'))
+
+    def _ordini_creati(self):
+        """Ordini con il marcatore del turno e numeri ordine duplicati in tutto il database"""
+        from ordini.models import Ordine
+
+        duplicati = list(
+            Ordine.objects.values('numero_ordine').annotate(volte=Count('pk'))
+            .filter(volte__gt=1).values_list('numero_ordine', flat=True)
+        )
+        return Ordine.objects.filter(note_interne=self.marcatore).count(), duplicati
+
+    def _ricezioni_registrate(self, ordini):
+        from ordini.models import Ricezione
+
+        return Ricezione.objects.filter(ordine_id__in=ordini).count()
+
+    def _risultato(self, parziali, durata, escluse, giacenze_iniziali, campionatore):
+        misure = [misura for parziale in parziali for misura in parziale['misure']]
+        errori = Counter(errore for _, _, errore in misure if errore)
+
+        operazioni = {}
+        for nome in self.mix:
+            durate = [ms for operazione, ms, _ in misure if operazione == nome]
+            if not durate:
+                continue
+            falliti = sum(1 for operazione, _, errore in misure if operazione == nome and errore)
+            operazioni[nome] = {
+                'richieste': len(durate),
+                'errori': falliti,
+                'tasso_errori': round(falliti / len(durate), 4),
+                **self._percentili(durate),
+            }
+
+        durate = [ms for _, ms, _ in misure]
+        return {
+            'commit': commit_corrente(),
+            'data': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'modalita': 'processi' if self.processi else 'thread',
+            'trasporto': self.url or 'client di test',
+            'operatori': self.operatori,
+            'durata_s': round(durata, 2),
+            'richieste': len(misure),
+            'throughput_rps': round(len(misure) / durata, 2) if durata else None,
+            'tasso_errori': round(sum(errori.values()) / len(misure), 4) if misure else None,
+            'latenza': self._percentili(durate),
+            'operazioni': operazioni,
+            'operazioni_escluse': escluse,
+            'errori': dict(errori.most_common()),
+            'lock': {
+                'errori': sum(volte for errore, volte in errori.items() if errore_lock(errore)),
+                **campionatore.riepilogo(),
+            },
+            'verifiche': self._verifiche(parziali, operazioni, giacenze_iniziali),
+        }
+
+    @staticmethod
+    def _percentili(durate):
+        if not durate:
+            return {}
+        return {
+            'p50_ms': round(percentile(durate, 0.5), 2),
+            'p95_ms': round(percentile(durate, 0.95), 2),
+            'p99_ms': round(percentile(durate, 0.99), 2),
+            'max_ms': round(max(durate), 2),
+        }
+
+    def _verifiche(self, parziali, operazioni, giacenze_iniziali):
+        """Confronti tra il database e quanto gli operatori hanno visto riuscire"""
+        verifiche = []
+        movimenti = Counter()
+        for parziale in parziali:
+            movimenti.update(parziale['movimenti'])
+        if movimenti:
+            finali = self._giacenze(list(movimenti))
+            differenze = {
+                lotto: {'attesa': giacenze_iniziali[lotto] + delta, 'trovata': finali.get(lotto)}
+                for lotto, delta in movimenti.items()
+                if finali.get(lotto) != giacenze_iniziali[lotto] + delta
+            }
+            verifiche.append({
+                'nome': 'giacenze_lotti_contesi',
+                'esito': not differenze,
+                'dettaglio': differenze or f'{len(movimenti)} lotti coerenti con i movimenti riusciti',
+            })
+
+        creati = sum(parziale['ordini_creati'] for parziale in parziali)
+        if 'nuovo_ordine' in operazioni:
+            trovati, duplicati = self._ordini_creati()
+            verifiche.append({
+                'nome': 'ordini_creati',
+                'esito': trovati == creati and not duplicati,
+                'dettaglio': {'riusciti': creati, 'nel_database': trovati, 'numeri_duplicati': duplicati},
+            })
+
+        ricevuti = [pk for parziale in parziali for pk in parziale['ricevuti']]
+        if ricevuti:
+            registrate = self._ricezioni_registrate(ricevuti)
+            verifiche.append({
+                'nome': 'ricezioni',
+                'esito': registrate == len(ricevuti),
+                'dettaglio': {'riuscite': len(ricevuti), 'nel_database': registrate},
+            })
+        return verifiche
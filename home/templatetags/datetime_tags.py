@@ -1,23 +1,16 @@
 from django import template
-from datetime import datetime
-import locale
+from django.utils import timezone
+
+from amm.context_processors import giorno_italiano, data_italiana
 
 register = template.Library()
 
 @register.inclusion_tag('current_datetime.html')
 def show_current_datetime():
-    try:
-        locale.setlocale(locale.LC_TIME, 'it_IT.UTF-8')
-    except:
-        try:
-            locale.setlocale(locale.LC_TIME, 'it_IT')
-        except:
-            pass
-    
-    now = datetime.now()
+    now = timezone.localtime()
     
     return {
-        'today_day': now.strftime('%A'),
-        'today_date': now.strftime('%d %B %Y'),
+        'today_day': giorno_italiano(now),
+        'today_date': data_italiana(now),
         'current_time': now.strftime('%H:%M:%S'),
-    }
\ No newline at end of file
+    }
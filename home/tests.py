@@ -1,3 +1,671 @@
-from django.test import TestCase
+from collections import Counter
+from contextlib import nullcontext
+from datetime import date, datetime, timedelta
+import json
+import os
+import shutil
+import smtplib
+import tempfile
+import threading
+import time
+from io import StringIO
+from unittest.mock import patch
 
-# Create your tests here.
+from django.test import TestCase, TransactionTestCase, RequestFactory, override_settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import call_command
+from django.db import transaction
+from django.http import HttpResponseRedirect
+from django.urls import include, path, reverse
+from django.utils import timezone
+
+from amm.context_processors import (
+    datetime_info, messages_processor, giorno_italiano, data_italiana
+)
+from automezzi.models import INTERVALLO_REVISIONE, Automezzo
+from home.query_ripetute import BudgetQueryMixin
+
+from . import metriche
+from .models import Elaborazione, Messaggio, Promemoria, Scadenza
+from .scadenzario import DigestScadenze, ricostruisci
+
+User = get_user_model()
+
+
+class ContextProcessorsTests(TestCase):
+    """Test per i context processor lazy"""
+
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.mittente = User.objects.create_user(username='mittente', password='testpass123')
+        self.destinatario = User.objects.create_user(username='destinatario', password='testpass123')
+
+    def _request(self, user):
+        request = self.factory.get('/')
+        request.user = user
+        return request
+
+    def test_nomi_italiani_senza_locale(self):
+        """Giorni e mesi in italiano senza toccare il locale di processo"""
+        data = datetime(2025, 4, 20)
+        self.assertEqual(giorno_italiano(data), 'domenica')
+        self.assertEqual(data_italiana(data), '20 aprile 2025')
+
+    def test_datetime_info_lazy(self):
+        """I valori data/ora sono stringhe calcolate solo all'uso"""
+        context = datetime_info(self._request(AnonymousUser()))
+        self.assertEqual(len(str(context['data_corrente'])), 10)
+        self.assertIn(str(context['today_day']), (
+            'lunedì', 'martedì', 'mercoledì', 'giovedì', 'venerdì', 'sabato', 'domenica'
+        ))
+
+    def test_messages_processor_nessuna_query_se_non_usato(self):
+        """Il context processor non esegue query se il template non usa i valori"""
+        with self.assertNumQueries(0):
+            messages_processor(self._request(self.destinatario))
+
+    def test_messages_processor_utente_anonimo(self):
+        context = messages_processor(self._request(AnonymousUser()))
+        self.assertEqual(context['messaggi_non_letti'], 0)
+        self.assertFalse(context['messaggi_recenti'])
+
+    def test_conteggio_non_letti_in_cache_e_invalidato(self):
+        """Il conteggio è in cache e viene invalidato dai segnali su Messaggio"""
+        Messaggio.objects.create(mittente=self.mittente, destinatario=self.destinatario, testo='Ciao')
+        self.assertEqual(Messaggio.conta_non_letti(self.destinatario), 1)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(Messaggio.conta_non_letti(self.destinatario), 1)
+
+        messaggio = Messaggio.objects.create(
+            mittente=self.mittente, destinatario=self.destinatario, testo='Secondo'
+        )
+        self.assertEqual(Messaggio.conta_non_letti(self.destinatario), 2)
+
+        messaggio.marca_come_letto()
+        self.assertEqual(Messaggio.conta_non_letti(self.destinatario), 1)
+
+        context = messages_processor(self._request(self.destinatario))
+        self.assertTrue(context['messaggi_non_letti'] > 0)
+        self.assertEqual(len(context['messaggi_recenti']), 2)
+
+
+class ScadenzarioTests(TestCase):
+    """Test per lo scadenzario unico alimentato dai segnali"""
+
+    def setUp(self):
+        self.oggi = timezone.localdate()
+        self.admin = User.objects.create_user(
+            username='admin', password='x', email='admin@example.com', livello='totale'
+        )
+        self.autista = User.objects.create_user(
+            username='autista', password='x', email='autista@example.com', livello='operativo',
+            data_scadenza_patente=self.oggi + timedelta(days=10),
+        )
+        self.contabile = User.objects.create_user(
+            username='contabile', password='x', email='contabile@example.com', livello='contabile',
+        )
+        self.furgone = Automezzo.objects.create(
+            targa='SC001AA', marca='Iveco', modello='Daily', anno_immatricolazione=2020,
+            data_revisione=self.oggi - INTERVALLO_REVISIONE + timedelta(days=20),
+        )
+
+    def _scadenze(self, **filtri):
+        return list(Scadenza.objects.filter(**filtri).values_list('tipo', 'data'))
+
+    def test_segnali_mantengono_lo_scadenzario(self):
+        self.assertEqual(self._scadenze(tipo='revisione'), [('revisione', self.oggi + timedelta(days=20))])
+        self.assertEqual(self._scadenze(destinatario=self.autista), [('patente', self.oggi + timedelta(days=10))])
+
+        Scadenza.objects.update(notificata_il=timezone.now())
+        self.furgone.data_revisione += timedelta(days=5)
+        self.furgone.save()
+        revisione = Scadenza.objects.get(tipo='revisione')
+        self.assertEqual(revisione.data, self.oggi + timedelta(days=25))
+        self.assertIsNone(revisione.notificata_il)
+
+        promemoria = Promemoria.objects.create(
+            titolo='Rinnovo HACCP', data_scadenza=self.oggi, creato_da=self.admin, assegnato_a=self.contabile,
+        )
+        # Salvataggi che non toccano i campi della sorgente: solo l'UPDATE del modello
+        with self.assertNumQueries(1):
+            promemoria.descrizione = 'Corso annuale'
+            promemoria.save(update_fields=['descrizione'])
+        promemoria.completato = True
+        promemoria.save()
+        self.assertFalse(Scadenza.objects.filter(tipo='promemoria').exists())
+
+        self.autista.is_active = False
+        self.autista.save()
+        self.assertFalse(Scadenza.objects.filter(tipo='patente').exists())
+        self.furgone.delete()
+        self.assertFalse(Scadenza.objects.filter(tipo='revisione').exists())
+
+    def test_range_per_utente_e_ruolo(self):
+        Promemoria.objects.create(
+            titolo='Bilancio', data_scadenza=self.oggi + timedelta(days=90), creato_da=self.admin, assegnato_a=self.contabile,
+        )
+        with self.assertNumQueries(1):
+            autista = list(Scadenza.objects.per_utente(self.autista).entro(30).values_list('tipo', flat=True))
+        self.assertEqual(autista, ['patente', 'revisione'])
+        self.assertEqual(list(Scadenza.objects.per_utente(self.contabile).entro(30)), [])
+        self.assertEqual(Scadenza.objects.per_utente(self.contabile).entro(90).count(), 1)
+        self.assertEqual(Scadenza.objects.per_utente(self.admin).entro(90).count(), 3)
+
+        self.client.force_login(self.autista)
+        risposta = self.client.get(reverse('home:scadenzario'), {'giorni': 30})
+        self.assertEqual(len(risposta.context['scadenze']), 2)
+        self.assertContains(risposta, 'Revisione SC001AA')
+
+    def test_digest_una_mail_per_utente(self):
+        digest = DigestScadenze(giorni=30).esegui()
+        self.assertEqual(digest.scadenze, 2)
+        destinatari = sorted(messaggio.to[0] for messaggio in mail.outbox)
+        self.assertEqual(destinatari, ['admin@example.com', 'autista@example.com'])
+        self.assertIn('Revisione SC001AA', next(m.body for m in mail.outbox if m.to == ['admin@example.com']))
+
+        # Le scadenze notificate non vengono ripetute, nemmeno dopo una ricostruzione
+        self.assertEqual(ricostruisci(['revisione', 'patente', 'carta_identita']), 2)
+        mail.outbox = []
+        self.assertEqual(DigestScadenze(giorni=30).esegui().scadenze, 0)
+        self.assertEqual(mail.outbox, [])
+
+        out = StringIO()
+        call_command('scadenzario', '--ricostruisci', '--tipo', 'revisione', '--tipo', 'patente', '--digest', '--dry-run', stdout=out)
+        self.assertIn('Scadenzario ricostruito: 2 scadenze', out.getvalue())
+
+
+    def test_digest_errori_di_invio_non_segnano_notificate(self):
+        invia = EmailBackend.send_messages
+
+        def rifiuta_autista(backend, messaggi):
+            if any(m.to == ['autista@example.com'] for m in messaggi):
+                raise smtplib.SMTPRecipientsRefused({'autista@example.com': (550, b'No such user')})
+            return invia(backend, messaggi)
+
+        with patch.object(EmailBackend, 'send_messages', rifiuta_autista), self.assertLogs('home.scadenzario', 'ERROR'):
+            digest = DigestScadenze(giorni=30).esegui()
+        # Entrambe le scadenze sono anche nella mail dell'autista: restano da notificare
+        self.assertEqual((digest.scadenze, digest.notificate, digest.inviate), (2, 0, 1))
+        self.assertFalse(Scadenza.objects.filter(notificata_il__isnull=False).exists())
+
+        with patch.object(EmailBackend, 'open', side_effect=smtplib.SMTPConnectError(421, 'down')), \
+                self.assertLogs('home.scadenzario', 'ERROR'):
+            self.assertEqual(DigestScadenze(giorni=30).esegui().notificate, 0)
+        mail.outbox = []
+        self.assertEqual(DigestScadenze(giorni=30).esegui().notificate, 2)
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), ['admin@example.com', 'autista@example.com'])
+
+    def test_digest_senza_destinatari_non_segna_notificate(self):
+        senza_email = User.objects.create_user(username='magazzino', password='x', livello='contabile')
+        Promemoria.objects.create(
+            titolo='Rinnovo HACCP', data_scadenza=self.oggi + timedelta(days=5),
+            creato_da=self.contabile, assegnato_a=senza_email,
+        )
+        # Nessun amministratore: la revisione va al livello operativo, il promemoria a nessuno
+        User.objects.filter(pk=self.admin.pk).update(livello='contabile')
+        with self.assertLogs('home.scadenzario', 'WARNING') as log:
+            digest = DigestScadenze(giorni=30).esegui()
+        self.assertEqual((digest.scadenze, digest.notificate, digest.senza_destinatari), (3, 2, 1))
+        self.assertIn('Rinnovo HACCP', log.output[0])
+        self.assertEqual(
+            list(Scadenza.objects.filter(notificata_il__isnull=True).values_list('tipo', flat=True)), ['promemoria']
+        )
+
+class MetricheTests(TestCase):
+    """Test per le metriche per vista e l'endpoint /metrics"""
+
+    def setUp(self):
+        self.cartella = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cartella, ignore_errors=True)
+        impostazioni = override_settings(METRICHE_DIR=self.cartella, METRICHE_TOKEN='segreto')
+        impostazioni.enable()
+        self.addCleanup(impostazioni.disable)
+        metriche.registro._azzera()
+        self.utente = User.objects.create_user(username='mrossi', password='x')
+
+    def _metriche(self):
+        response = self.client.get(reverse('metriche'), HTTP_AUTHORIZATION='Bearer segreto')
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_misure_per_vista(self):
+        self.client.force_login(self.utente)
+        self.client.get(reverse('home:api_check_messages'))
+        self.client.get(reverse('home:api_check_messages'))
+        self.client.get(reverse('home:index'))
+        testo = self._metriche()
+
+        self.assertIn('amm_richiesta_durata_secondi_count{vista="home:api_check_messages"} 2', testo)
+        self.assertIn('amm_richieste_totale{vista="home:api_check_messages",metodo="GET",stato="200"} 2', testo)
+        self.assertIn('amm_richiesta_query_count{vista="home:index"} 1', testo)
+        # Per ognuna delle due richieste: sessione, utente e le query dei messaggi
+        righe = dict(riga.rsplit(' ', 1) for riga in testo.splitlines() if not riga.startswith('#'))
+        self.assertGreaterEqual(float(righe['amm_richiesta_query_sum{vista="home:api_check_messages"}']), 8)
+        self.assertGreater(float(righe['amm_richiesta_template_secondi_sum{vista="home:index"}']), 0)
+        self.assertEqual(float(righe['amm_richiesta_template_secondi_sum{vista="home:api_check_messages"}']), 0)
+
+    def test_somma_dei_worker(self):
+        # Stato salvato da un altro processo gunicorn
+        with open(os.path.join(self.cartella, '99999-abcdef01.json'), 'w') as file:
+            json.dump({
+                'istogrammi': [['richiesta_query', 'ordini:dashboard', [0, 0, 1, 0, 0, 0, 0, 0, 0], 4, 1]],
+                'contatori': [['ordini:dashboard', 'GET', 200, 3]],
+            }, file)
+        metriche.registro.registra('ordini:dashboard', 'GET', 200, {'richiesta_query': 30})
+        testo = self._metriche()
+
+        self.assertIn('amm_richieste_totale{vista="ordini:dashboard",metodo="GET",stato="200"} 4', testo)
+        self.assertIn('amm_richiesta_query_bucket{vista="ordini:dashboard",le="5"} 1', testo)
+        self.assertIn('amm_richiesta_query_bucket{vista="ordini:dashboard",le="50"} 2', testo)
+        self.assertIn('amm_richiesta_query_sum{vista="ordini:dashboard"} 34', testo)
+
+    def test_accesso_protetto(self):
+        url = reverse('metriche')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer sbagliato').status_code, 403)
+        self.client.force_login(self.utente)
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.utente.is_staff = True
+        self.utente.save()
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class ProfilatoreTests(TestCase):
+    """Test per la profilazione a campione delle richieste lente"""
+
+    def setUp(self):
+        self.cartella = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cartella, ignore_errors=True)
+        impostazioni = override_settings(
+            PROFILATORE_DIR=self.cartella, PROFILATORE_CAMPIONAMENTO=1, PROFILATORE_SOGLIA=0, PROFILATORE_MASSIMO=2,
+        )
+        impostazioni.enable()
+        self.addCleanup(impostazioni.disable)
+        self.utente = User.objects.create_user(username='mrossi', password='x', is_staff=True)
+        self.client.force_login(self.utente)
+
+    def test_buffer_circolare_e_download(self):
+        import pstats
+        from . import profilatore
+
+        for _ in range(3):
+            self.client.get(reverse('home:api_check_messages'))
+        profili = profilatore.elenco()
+        self.assertEqual(len(profili), 2)
+        self.assertEqual(len(os.listdir(self.cartella)), 4)
+        profilo = profili[0]
+        self.assertEqual(profilo['vista'], 'home:api_check_messages')
+        self.assertEqual(profilo['query_totali'], len(profilo['query']))
+        self.assertTrue(any('home_messaggio' in query['sql'] for query in profilo['query']))
+
+        # Le richieste di consultazione non sono profilate, altrimenti sposterebbero i profili
+        with self.settings(PROFILATORE_CAMPIONAMENTO=0):
+            response = self.client.get(reverse('home:profili'))
+            self.assertContains(response, 'home:api_check_messages')
+            response = self.client.get(reverse('home:profilo_dettaglio', args=[profilo['id']]))
+            self.assertContains(response, 'home_messaggio')
+
+            response = self.client.get(reverse('home:profilo_scarica', args=[profilo['id'], 'pstats']))
+            percorso = os.path.join(self.cartella, 'scaricato.prof')
+            with open(percorso, 'wb') as file:
+                file.write(b''.join(response.streaming_content))
+            self.assertTrue(pstats.Stats(percorso).stats)
+
+            dati = self.client.get(reverse('home:profilo_scarica', args=[profilo['id'], 'speedscope'])).json()
+            speedscope = dati['profiles'][0]
+            self.assertEqual(len(speedscope['samples']), len(speedscope['weights']))
+            self.assertTrue(speedscope['samples'])
+            self.assertTrue(all(indice < len(dati['shared']['frames']) for stack in speedscope['samples'] for indice in stack))
+
+    def test_solo_richieste_campionate_oltre_la_soglia(self):
+        from . import profilatore
+
+        with self.settings(PROFILATORE_SOGLIA=60):
+            self.client.get(reverse('home:api_check_messages'))
+        with self.settings(PROFILATORE_CAMPIONAMENTO=0):
+            self.client.get(reverse('home:api_check_messages'))
+        self.assertEqual(profilatore.elenco(), [])
+
+    def test_accesso_solo_staff(self):
+        self.client.get(reverse('home:api_check_messages'))
+        self.utente.is_staff = False
+        self.utente.save()
+        self.assertEqual(self.client.get(reverse('home:profili')).status_code, 403)
+        self.assertEqual(self.client.get(reverse('home:profilo_dettaglio', args=['0000000000000-00000000'])).status_code, 403)
+
+
+class BudgetQueryTests(BudgetQueryMixin, TestCase):
+    """Numero massimo di query delle pagine comuni a tutti gli utenti"""
+
+    BUDGET_QUERY = {
+        'home:index': 9,
+        'home:api_check_messages': 5,
+        'home:promemoria_list': 6,
+        'home:scadenzario': 4,
+    }
+
+    def setUp(self):
+        self.utente = get_user_model().objects.create_user(username='budget', password='pw', livello='totale')
+        self.client.force_login(self.utente)
+        self.oggi = date.today()
+        self.creati = 0
+        self._righe()
+
+    def _righe(self, quanti=3):
+        for numero in range(self.creati, self.creati + quanti):
+            self.creati += 1
+            collega = get_user_model().objects.create_user(username=f'collega{numero}', password='pw', livello='operatore')
+            Messaggio.objects.create(mittente=collega, destinatario=self.utente, testo=f'Messaggio {numero}')
+            Promemoria.objects.create(
+                titolo=f'Promemoria {numero}', data_scadenza=self.oggi, creato_da=collega, assegnato_a=self.utente,
+            )
+            Automezzo.objects.create(
+                targa=f'HB{numero:03d}AA', marca='Iveco', modello='Daily', anno_immatricolazione=2020,
+                data_revisione=self.oggi - INTERVALLO_REVISIONE + timedelta(days=10), assegnato_a=collega,
+            )
+        ricostruisci(['revisione'])
+
+    def test_budget_pagine(self):
+        for nome_url in self.BUDGET_QUERY:
+            with self.subTest(nome_url):
+                self.assertBudgetQuery(nome_url, aggiungi_righe=self._righe)
+
+
+class ElaborazioniTests(TestCase):
+    """Test per lo stato condiviso dei report in background"""
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        impostazioni = override_settings(MEDIA_ROOT=self.media)
+        impostazioni.enable()
+        self.addCleanup(impostazioni.disable)
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+
+    def test_processo_morto_risulta_in_errore(self):
+        from . import elaborazioni
+
+        with patch('home.elaborazioni.subprocess.Popen') as popen:
+            popen.return_value.pid = 99
+            elaborazioni.avvia('prova.zip', 'report/prova.zip', 'report_ore_mensile')
+        self.assertEqual(Elaborazione.objects.get().pid, 99)
+        self.assertEqual(elaborazioni.stato('prova.zip')['stato'], 'in_corso')
+
+        # Nessun aggiornamento per più di TIMEOUT secondi: il processo non c'è più
+        dopo = timezone.now() + timedelta(seconds=elaborazioni.TIMEOUT + 1)
+        self.assertEqual(elaborazioni.stato('prova.zip', adesso=dopo)['stato'], 'errore')
+        elaborazioni.completa('prova.zip')
+        self.assertEqual(elaborazioni.stato('prova.zip', adesso=dopo)['stato'], 'pronto')
+
+        with patch('home.elaborazioni.subprocess.Popen', side_effect=OSError('fork')), \
+                self.assertLogs('home.elaborazioni', 'ERROR'), self.assertRaises(OSError):
+            elaborazioni.avvia('fallita.zip', '', 'report_ore_mensile')
+        self.assertEqual(elaborazioni.stato('fallita.zip')['stato'], 'errore')
+
+    def test_pulizia_righe_e_file(self):
+        from django.core.files.base import ContentFile
+        from django.core.files.storage import default_storage
+        from . import elaborazioni
+
+        for nome in ('vecchia.zip', 'recente.zip'):
+            elaborazioni.crea(nome, default_storage.save(f'report/{nome}', ContentFile(b'zip')))
+        elaborazioni.crea('senza_file.zip', 'report/senza_file.zip')
+        Elaborazione.objects.exclude(nome='recente.zip').update(creata_il=timezone.now() - timedelta(days=8))
+
+        out = StringIO()
+        call_command('pulisci_elaborazioni', stdout=out)
+        self.assertIn('Elaborazioni eliminate: 2', out.getvalue())
+        self.assertEqual(list(Elaborazione.objects.values_list('nome', flat=True)), ['recente.zip'])
+        self.assertFalse(default_storage.exists('report/vecchia.zip'))
+        self.assertTrue(default_storage.exists('report/recente.zip'))
+
+
+class DatasetTests(TestCase):
+    """Test per il generatore del dataset sintetico e il benchmark"""
+
+    VOLUMI = {
+        'dipendenti': 8, 'giorni': 3, 'messaggi': 30, 'fornitori': 3, 'clienti': 12,
+        'categorie': 0, 'prodotti': 0, 'ordini': 0, 'automezzi': 2, 'rifornimenti': 10, 'manutenzioni': 3,
+    }
+
+    def _genera(self):
+        from .dataset import GeneratoreDataset
+
+        return GeneratoreDataset(volumi=self.VOLUMI, seme=7, oggi=date(2024, 3, 15)).esegui()
+
+    def _istantanea(self):
+        from anagrafica.models import Cliente
+        from automezzi.models import Rifornimento
+        from dipendenti.models import Giornata
+
+        return (
+            list(get_user_model().objects.filter(username__startswith='ds_').order_by('username').values_list('username', 'livello', 'last_name')),
+            list(Cliente.objects.order_by('nome').values_list('nome', 'rappresentante__dipendente__username')),
+            list(Giornata.objects.order_by('operatore__username', 'data').values_list('operatore__username', 'data', 'minuti_lavorati')),
+            list(Rifornimento.objects.order_by('automezzo__targa', 'data', 'chilometri').values_list('automezzo__targa', 'data', 'chilometri', 'litri')),
+            list(Messaggio.objects.order_by('mittente__username', 'data_invio').values_list('mittente__username', 'destinatario__username', 'data_invio', 'letto')),
+        )
+
+    def test_generazione_deterministica_con_derivati(self):
+        from .dataset import UTENTE_BENCHMARK
+
+        # Prima generazione annullata: la seconda, con lo stesso seme, deve ricreare le stesse righe
+        with transaction.atomic():
+            generatore = self._genera()
+            prima = self._istantanea()
+            transaction.set_rollback(True)
+        self.assertEqual(generatore.creati['dipendenti.Dipendente'], 8)
+        self.assertEqual(generatore.creati['anagrafica.Cliente'], 12)
+        self.assertFalse(get_user_model().objects.filter(username__startswith='ds_').exists())
+
+        self._genera()
+        self.assertEqual(self._istantanea(), prima)
+
+        # Valori che save() e segnali avrebbero mantenuto, ricalcolati dopo i bulk_create
+        admin = get_user_model().objects.get(username=UTENTE_BENCHMARK)
+        self.assertEqual(list(admin.groups.values_list('name', flat=True)), ['Totale'])
+        for automezzo in Automezzo.objects.filter(targa__startswith='DS', rifornimenti__isnull=False).distinct():
+            ultimo = automezzo.rifornimenti.order_by('-chilometri').values_list('chilometri', flat=True).first()
+            self.assertEqual(automezzo.chilometri_attuali, ultimo)
+        self.assertTrue(Scadenza.objects.filter(tipo='revisione').exists())
+
+    def test_stesse_righe_a_ogni_ora(self):
+        istanti = [timezone.make_aware(datetime(2024, 3, 15, 8)), timezone.make_aware(datetime(2024, 3, 17, 23))]
+        istantanee = []
+        for adesso in istanti:
+            with transaction.atomic(), patch('django.utils.timezone.now', return_value=adesso):
+                self._genera()
+                istantanee.append(self._istantanea())
+                transaction.set_rollback(True)
+        self.assertEqual(istantanee[0], istantanee[1])
+
+    def test_benchmark_json_e_confronto(self):
+        from .benchmark import Benchmark, confronta
+
+        self._genera()
+        risultato = Benchmark(
+            scenari=['home.dashboard', 'anagrafica.clienti', 'anagrafica.export_clienti'], iterazioni=2, riscaldamento=1,
+        ).esegui()
+        risultato = json.loads(json.dumps(risultato))
+
+        self.assertEqual(risultato['dataset']['anagrafica.Cliente'], 12)
+        scenari = {voce['nome']: voce for voce in risultato['scenari']}
+        self.assertEqual(scenari['home.dashboard']['stato'], [200])
+        self.assertGreater(scenari['anagrafica.clienti']['query'], 0)
+        self.assertLessEqual(scenari['anagrafica.export_clienti']['min_ms'], scenari['anagrafica.export_clienti']['p95_ms'])
+
+        righe = confronta(risultato, risultato)
+        self.assertEqual({riga['variazione'] for riga in righe}, {0.0})
+
+    @override_settings(ROOT_URLCONF='amm.urls')
+    def test_benchmark_con_urlconf_del_progetto(self):
+        from .benchmark import SCENARI, Benchmark
+
+        self._genera()
+        risultato = Benchmark(iterazioni=1, riscaldamento=0).esegui()
+
+        self.assertEqual([voce['nome'] for voce in risultato['scenari']], [scenario.nome for scenario in SCENARI])
+        for voce in risultato['scenari']:
+            with self.subTest(voce['nome']):
+                self.assertTrue('errore' in voce or voce['mediana_ms'] is not None)
+
+
+class _MagazzinoFinto:
+    """
+    Giacenze, ordini e ricezioni in memoria per le operazioni di scrittura
+    della simulazione. Con corretto=False ripete gli errori che le verifiche
+    devono trovare: giacenza e numero ordine letti e riscritti senza lock
+    (aggiornamenti persi, numeri duplicati) e ricezioni non salvate.
+    """
+
+    attivo = None
+
+    def __init__(self, corretto):
+        self.corretto = corretto
+        self.lock = threading.Lock()
+        self.giacenze = {1: 500, 2: 500}
+        self.ordini = []
+        self.ricezioni = set()
+
+    def _sezione(self):
+        return self.lock if self.corretto else nullcontext()
+
+    def movimento(self, pk, delta):
+        with self._sezione():
+            giacenza = self.giacenze[pk]
+            time.sleep(0.002)
+            self.giacenze[pk] = giacenza + delta
+
+    def nuovo_ordine(self, note):
+        with self._sezione():
+            numero = f'ORD{len(self.ordini) + 1:04d}'
+            time.sleep(0.002)
+            self.ordini.append((numero, note))
+
+    def ricevi(self, ordine_id):
+        if self.corretto:
+            self.ricezioni.add(ordine_id)
+
+
+def _movimento_finto(request, pk):
+    quantita = int(request.POST['quantita'])
+    _MagazzinoFinto.attivo.movimento(pk, quantita if request.POST['tipo_movimento'] == 'carico' else -quantita)
+    return HttpResponseRedirect('/')
+
+
+def _ricezione_finta(request, ordine_id):
+    _MagazzinoFinto.attivo.ricevi(ordine_id)
+    return HttpResponseRedirect('/')
+
+
+def _nuovo_ordine_finto(request):
+    _MagazzinoFinto.attivo.nuovo_ordine(request.POST['note_interne'])
+    return HttpResponseRedirect('/')
+
+
+# URLconf delle operazioni di scrittura della simulazione (ROOT_URLCONF='home.tests')
+urlpatterns = [
+    path('ordini/', include(([
+        path('magazzino/<int:pk>/movimento/', _movimento_finto, name='movimento_magazzino'),
+        path('ricevi/<int:ordine_id>/', _ricezione_finta, name='ricevi_ordine'),
+        path('nuovo/', _nuovo_ordine_finto, name='nuovo_ordine'),
+    ], 'ordini'))),
+]
+
+
+class SimulazioneTurnoTests(TransactionTestCase):
+    """Test della simulazione di carico concorrente: thread veri, quindi senza transazione del test"""
+
+    def _turno_di_scrittura(self, magazzino):
+        from ordini.models import Ordine
+        from .dataset import UTENTE_BENCHMARK
+        from .simulazione_turno import SimulazioneTurno
+
+        class SimulazioneFinta(SimulazioneTurno):
+            def _lotti_contesi(self):
+                return list(magazzino.giacenze)
+
+            def _ordini_da_ricevere(self):
+                return [Ordine(pk=pk, quantita_ordinata=10) for pk in range(1, 201)]
+
+            def _candidati_ordine(self):
+                return [(1, 1)]
+
+            def _giacenze(self, lotti):
+                return {pk: magazzino.giacenze[pk] for pk in lotti}
+
+            def _ordini_creati(self):
+                numeri = Counter(numero for numero, _ in magazzino.ordini)
+                trovati = sum(1 for _, note in magazzino.ordini if note == self.marcatore)
+                return trovati, [numero for numero, volte in numeri.items() if volte > 1]
+
+            def _ricezioni_registrate(self, ordini):
+                return len(magazzino.ricezioni.intersection(ordini))
+
+        get_user_model().objects.get_or_create(username=UTENTE_BENCHMARK)
+        _MagazzinoFinto.attivo = magazzino
+        try:
+            with override_settings(ROOT_URLCONF='home.tests'):
+                risultato = SimulazioneFinta(
+                    operatori=4, durata=1, mix={'movimento': 1, 'ricezione': 1, 'nuovo_ordine': 1},
+                ).esegui()
+        finally:
+            _MagazzinoFinto.attivo = None
+        self.assertEqual(risultato['errori'], {})
+        self.assertEqual(risultato['operazioni_escluse'], {})
+        return {verifica['nome']: verifica for verifica in risultato['verifiche']}
+
+    def test_turno_di_scrittura_coerente(self):
+        verifiche = self._turno_di_scrittura(_MagazzinoFinto(corretto=True))
+
+        self.assertEqual(set(verifiche), {'giacenze_lotti_contesi', 'ordini_creati', 'ricezioni'})
+        for nome, verifica in verifiche.items():
+            with self.subTest(nome):
+                self.assertTrue(verifica['esito'], verifica['dettaglio'])
+
+    def test_turno_di_scrittura_trova_aggiornamenti_persi_e_duplicati(self):
+        verifiche = self._turno_di_scrittura(_MagazzinoFinto(corretto=False))
+
+        self.assertFalse(verifiche['giacenze_lotti_contesi']['esito'])
+        self.assertFalse(verifiche['ordini_creati']['esito'])
+        self.assertTrue(verifiche['ordini_creati']['dettaglio']['numeri_duplicati'])
+        self.assertFalse(verifiche['ricezioni']['esito'])
+        self.assertEqual(verifiche['ricezioni']['dettaglio']['nel_database'], 0)
+
+    @override_settings(ROOT_URLCONF='amm.urls')
+    def test_url_con_urlconf_del_progetto(self):
+        from .simulazione_turno import MIX, SimulazioneTurno
+
+        disponibili, escluse = SimulazioneTurno()._url_disponibili()
+        self.assertEqual(set(disponibili) | set(escluse), set(MIX))
+
+    def test_turno_concorrente_riporta_latenze_e_verifiche(self):
+        from .dataset import GeneratoreDataset
+        from .simulazione_turno import SimulazioneTurno
+
+        GeneratoreDataset(volumi=DatasetTests.VOLUMI, seme=7, oggi=date(2024, 3, 15)).esegui()
+
+        risultato = SimulazioneTurno(
+            operatori=3, durata=0.5, mix={'notifiche': 3, 'dashboard': 1, 'esportazione': 1},
+        ).esegui()
+        risultato = json.loads(json.dumps(risultato))
+
+        self.assertEqual(risultato['modalita'], 'thread')
+        self.assertEqual(risultato['operatori'], 3)
+        self.assertGreater(risultato['richieste'], 3)
+        self.assertGreater(risultato['throughput_rps'], 0)
+        self.assertEqual(risultato['errori'], {})
+        self.assertEqual(risultato['lock']['errori'], 0)
+        self.assertEqual(
+            sum(voce['richieste'] for voce in risultato['operazioni'].values()), risultato['richieste']
+        )
+        notifiche = risultato['operazioni']['notifiche']
+        self.assertLessEqual(notifiche['p50_ms'], notifiche['p95_ms'])
+        self.assertLessEqual(notifiche['p95_ms'], notifiche['max_ms'])
+        # Solo letture: nessuna verifica di coerenza da fare
+        self.assertEqual(risultato['verifiche'], [])
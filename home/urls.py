@@ -13,6 +13,10 @@ urlpatterns = [
     path('promemoria/<int:pk>/modifica/', views.promemoria_update, name='promemoria_update'),
     path('promemoria/<int:pk>/toggle/', views.promemoria_toggle, name='promemoria_toggle'),
     path('promemoria/<int:pk>/elimina/', views.promemoria_delete, name='promemoria_delete'),
+    path('scadenzario/', views.scadenzario, name='scadenzario'),
+    path('profili/', views.profili, name='profili'),
+    path('profili/<str:identificativo>/', views.profilo_dettaglio, name='profilo_dettaglio'),
+    path('profili/<str:identificativo>/<str:formato>/', views.profilo_scarica, name='profilo_scarica'),
      # API endpoints (opzionali)
     path('api/check-messages/', api_views.check_messages, name='api_check_messages'),
     path('api/mark-read/<int:message_id>/', api_views.mark_message_read, name='api_mark_read'),
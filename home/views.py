@@ -4,9 +4,17 @@ from django.contrib import messages
 from django.db.models import Q
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
+from django.http import FileResponse, Http404, HttpResponseForbidden, JsonResponse
+from datetime import datetime, timezone as dt_timezone
+from dipendenti import presenza
+from dipendenti.autorizzazioni import da_request
 from dipendenti.models import Dipendente
-from .models import Messaggio, Promemoria  # Importa dai modelli dell'app home
+from .models import Messaggio, Promemoria, Scadenza  # Importa dai modelli dell'app home
 from .forms import MessaggioForm, PromemoriaForm  # Importa dai form dell'app home
+from . import profilatore
+
+GIORNI_SCADENZE_DASHBOARD = 30
+
 
 @login_required
 def index(request):
@@ -16,13 +24,13 @@ def index(request):
     user = request.user
     
     # Ottieni i messaggi recenti
-    messaggi_ricevuti = Messaggio.objects.filter(destinatario=user).order_by('-data_invio')[:5]
+    messaggi_ricevuti = Messaggio.objects.filter(destinatario=user).select_related('mittente').order_by('-data_invio')[:5]
     
     # Ottieni i promemoria dell'utente
     promemoria = Promemoria.objects.filter(
         Q(assegnato_a=user) & 
         (Q(completato=False) | Q(data_completamento__gte=timezone.now() - timezone.timedelta(days=7)))
-    ).order_by('completato', 'data_scadenza')[:5]
+    ).select_related('assegnato_a').order_by('completato', 'data_scadenza')[:5]
     
     # Calcola promemoria attivi e scaduti per la dashboard
     promemoria_attivi = Promemoria.objects.filter(assegnato_a=user, completato=False).count()
@@ -32,11 +40,16 @@ def index(request):
         data_scadenza__lt=timezone.now().date()
     ).count()
     
-    # Ottieni i dipendenti online
-    dipendenti_online = Dipendente.objects.filter(is_active=True, is_online=True).exclude(id=user.id)
+    # Dipendenti online: una query per i colleghi attivi e una get_many delle loro presenze in cache
+    colleghi = list(Dipendente.objects.filter(is_active=True).exclude(id=user.id))
+    pk_online = presenza.online(presenza.leggi(collega.pk for collega in colleghi))
+    dipendenti_online = [collega for collega in colleghi if collega.pk in pk_online]
     
     # Numero di messaggi non letti
-    messaggi_non_letti = Messaggio.objects.filter(destinatario=user, letto=False).count()
+    messaggi_non_letti = Messaggio.conta_non_letti(user)
+
+    # Scadenze imminenti di competenza dell'utente (scadenzario unico)
+    scadenze = Scadenza.objects.per_utente(user).entro(GIORNI_SCADENZE_DASHBOARD)[:5]
     
     context = {
         'page_title': 'Dashboard',
@@ -46,10 +59,95 @@ def index(request):
         'promemoria_scaduti': promemoria_scaduti,
         'dipendenti_online': dipendenti_online,
         'messaggi_non_letti': messaggi_non_letti,
+        'scadenze': scadenze,
+        'giorni_scadenze': GIORNI_SCADENZE_DASHBOARD,
     }
     
     return render(request, 'home/dashboard.html', context)
 
+@login_required
+def scadenzario(request):
+    """Scadenze di competenza dell'utente entro ?giorni= (default 60), comprese le scadute"""
+    try:
+        giorni = max(0, min(int(request.GET.get('giorni', 60)), 3650))
+    except ValueError:
+        giorni = 60
+    scadenze = Scadenza.objects.per_utente(request.user).entro(giorni).select_related('destinatario')
+    tipo = request.GET.get('tipo')
+    if tipo in Scadenza.Tipo.values:
+        scadenze = scadenze.filter(tipo=tipo)
+
+    context = {
+        'page_title': 'Scadenzario',
+        'scadenze': scadenze,
+        'giorni': giorni,
+        'tipo': tipo,
+        'tipi': Scadenza.Tipo.choices,
+    }
+    return render(request, 'home/scadenzario.html', context)
+
+# ========== PROFILI DELLE RICHIESTE LENTE ==========
+
+def _solo_staff(request):
+    if not da_request(request).is_staff_o_superuser:
+        return HttpResponseForbidden("Non hai i permessi per accedere a questa pagina.")
+    return None
+
+
+@login_required
+def profili(request):
+    """Profili delle richieste lente salvati da ProfilatoreMiddleware"""
+    negato = _solo_staff(request)
+    if negato:
+        return negato
+    profili = profilatore.elenco()
+    for profilo in profili:
+        profilo['creato'] = datetime.fromtimestamp(profilo['creato'], tz=dt_timezone.utc)
+    context = {
+        'page_title': 'Profili richieste lente',
+        'profili': profili,
+        'campionamento': profilatore.campionamento(),
+        'soglia': profilatore.soglia(),
+        'massimo': profilatore.massimo(),
+    }
+    return render(request, 'home/profili.html', context)
+
+
+@login_required
+def profilo_dettaglio(request, identificativo):
+    """Funzioni più costose e log SQL di un profilo"""
+    negato = _solo_staff(request)
+    if negato:
+        return negato
+    profilo = profilatore.leggi(identificativo)
+    if profilo is None:
+        raise Http404('Profilo non trovato')
+    context = {
+        'page_title': f"Profilo {profilo['vista'] or profilo['path']}",
+        'profilo': profilo,
+        'statistiche': profilatore.statistiche(identificativo),
+    }
+    return render(request, 'home/profilo.html', context)
+
+
+@login_required
+def profilo_scarica(request, identificativo, formato):
+    """Download del profilo in formato pstats (.prof) o speedscope (.json)"""
+    negato = _solo_staff(request)
+    if negato:
+        return negato
+    if formato not in ('pstats', 'speedscope') or profilatore.leggi(identificativo) is None:
+        raise Http404('Profilo non trovato')
+    if formato == 'pstats':
+        return FileResponse(
+            open(profilatore.percorso(identificativo, 'prof'), 'rb'),
+            as_attachment=True, filename=f'{identificativo}.prof',
+            content_type='application/octet-stream',
+        )
+    response = JsonResponse(profilatore.speedscope(identificativo))
+    response['Content-Disposition'] = f'attachment; filename="{identificativo}.speedscope.json"'
+    return response
+
 def landing_page(request):
     """
     Vista per la pagina di landing
@@ -117,7 +215,9 @@ def chat(request):
                 mittente=contatto_selezionato,
                 letto=False
             )
-            messaggi_non_letti.update(letto=True)
+            if messaggi_non_letti.update(letto=True):
+                # update() non invia post_save: invalida a mano la cache
+                Messaggio.invalida_non_letti(user.id)
         except (Dipendente.DoesNotExist, ValueError):
             pass
     
@@ -157,7 +257,7 @@ def promemoria_list(request):
     promemoria_completati = promemoria.filter(completato=True).count()
     
     # Ordina i promemoria
-    promemoria = promemoria.order_by('completato', 'data_scadenza')
+    promemoria = promemoria.select_related('assegnato_a').order_by('completato', 'data_scadenza')
     
     context = {
         'promemoria': promemoria,
@@ -402,7 +402,12 @@ logger = logging.getLogger(__name__)
 @receiver(post_save, sender=Ordine)
 def log_ordine_changes(sender, instance, created, **kwargs):
     if created:
-        logger.info(f"Nuovo ordine creato: {instance.numero_ordine} - {instance.prodotto.nome_prodotto}")
+        # Il nome solo se il prodotto è già caricato: nelle creazioni in serie niente query per il log
+        if Ordine.prodotto.is_cached(instance):
+            prodotto = instance.prodotto.nome_prodotto
+        else:
+            prodotto = f"prodotto {instance.prodotto_id}"
+        logger.info(f"Nuovo ordine creato: {instance.numero_ordine} - {prodotto}")
     else:
         logger.info(f"Ordine modificato: {instance.numero_ordine} - Status: {instance.status}")
 
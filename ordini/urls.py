@@ -25,6 +25,11 @@ urlpatterns = [
 
     # URL per Magazzino
     path('magazzino/', views.visualizza_magazzino, name='visualizza_magazzino'),
+    path('magazzino/<int:pk>/', views.MagazzinoDetailView.as_view(), name='dettaglio_magazzino'),
+    path('magazzino/<int:pk>/movimento/', views.MovimentoMagazzinoView.as_view(), name='movimento_magazzino'),
+
+    # URL per Export
+    path('export/', views.ExportOrdiniView.as_view(), name='export_ordini'),
     
 
 ]
\ No newline at end of file
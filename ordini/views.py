@@ -29,24 +29,25 @@ from .forms import (
 )
 from anagrafica.models import Fornitore
 from dipendenti.models import Dipendente
+from dipendenti.autorizzazioni import AutorizzazioniMixin
 
 
 # ====================== MIXINS ======================
 
-class StaffRequiredMixin(UserPassesTestMixin):
+class StaffRequiredMixin(AutorizzazioniMixin, UserPassesTestMixin):
     """Mixin per verificare che l'utente sia staff"""
     def test_func(self):
-        return self.request.user.is_staff or self.request.user.is_superuser
+        return self.autorizzazioni.is_staff_o_superuser
 
     def handle_no_permission(self):
         messages.error(self.request, "Non hai i permessi per accedere a questa sezione")
         return redirect('home:index')
 
 
-class OrdineAccessMixin(UserPassesTestMixin):
+class OrdineAccessMixin(AutorizzazioniMixin, UserPassesTestMixin):
     """Mixin per verificare che l'utente possa accedere all'ordine"""
     def test_func(self):
-        if self.request.user.is_staff or self.request.user.is_superuser:
+        if self.autorizzazioni.is_staff_o_superuser:
             return True
         # Altri controlli di accesso se necessario
         return True
@@ -420,7 +421,7 @@ class OrdineDetailView(LoginRequiredMixin, OrdineAccessMixin, DetailView):
         # Informazioni ricezione se presente
         if hasattr(self.object, 'ricezione'):
             context['ricezione'] = self.object.ricezione
-            context['prodotti_ricevuti'] = self.object.ricezione.prodotti_ricevuti.all()
+            context['prodotti_ricevuti'] = self.object.ricezione.prodotti_ricevuti.select_related('prodotto')
         
         # Cronologia status (da implementare se necessario)
         context['può_modificare'] = (
@@ -666,6 +667,8 @@ class RicezioneDetailView(LoginRequiredMixin, DetailView):
     model = Ricezione
     template_name = 'ordini/ricezioni/dettaglio.html'
     context_object_name = 'ricezione'
+    # ProdottoRicevuto.__str__ risale a ricezione.ordine
+    queryset = Ricezione.objects.select_related('ordine')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -1237,19 +1240,19 @@ class ApiSearchProdottiView(LoginRequiredMixin, View):
        if len(q) < 2:
            return JsonResponse({'results': []})
        
+       # Giacenza e categoria nella stessa query, non una query per prodotto
        prodotti = Prodotto.objects.filter(
            Q(nome_prodotto__icontains=q) |
            Q(ean__icontains=q) |
            Q(codice_interno__icontains=q),
            attivo=True
-       )[:20]
+       ).select_related('categoria').annotate(
+           quantita_totale=Sum('magazzino__quantita_in_magazzino')
+       ).order_by('nome_prodotto')[:20]
        
        results = []
        for prodotto in prodotti:
-           # Quantità in magazzino
-           quantita_magazzino = Magazzino.objects.filter(
-               prodotto=prodotto
-           ).aggregate(totale=Sum('quantita_in_magazzino'))['totale'] or 0
+           quantita_magazzino = prodotto.quantita_totale or 0
            
            results.append({
                'id': prodotto.id,